@@ -5,12 +5,15 @@
 @Time: 2025/10/23 11:19
 """
 from typing import Optional, Dict, Any, List
+import json
 import uuid
 
 from fastapi import APIRouter
 from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from hengline.agent.progressive_refinement import get_refinement_job
 from hengline.generate_agent import generate_storyboard
 from hengline.logger import info, error, log_with_context
 
@@ -26,6 +29,15 @@ class StoryboardRequest(BaseModel):
     style: str = "realistic"
     duration_per_shot: int = 5
     prev_continuity_state: Optional[Dict[str, Any]] = None
+    # 剧本格式：auto自动识别，screenplay（INT./EXT.标准剧本）/ chinese（中文自然语言剧本）强制指定解析器
+    script_format: str = "auto"
+    # 长剧本模式：服务端按分集/场景边界切分剧本，分块生成后合并为全局编号的分镜
+    long_script: bool = False
+    # 生成模式：full完整流程；draft纯规则草稿（不调用LLM和嵌入模型），用于编辑器即时预览；
+    # progressive立即返回草稿，后台用LLM原位升级分镜，通过 /storyboard_jobs/{job_id} 查询或订阅更新
+    mode: str = "full"
+    # 渐进式精修优先级：order按分镜顺序，qa按规则审查结果从差到好
+    refine_priority: str = "order"
     # 唯一请求ID，默认生成UUID
     task_id: str = str(uuid.uuid4())
 
@@ -80,7 +92,11 @@ def generate_storyboard_api(request: StoryboardRequest):
             {
                 "style": request.style,
                 "duration": request.duration_per_shot,
-                "has_prev_state": request.prev_continuity_state is not None
+                "has_prev_state": request.prev_continuity_state is not None,
+                "script_format": request.script_format,
+                "long_script": request.long_script,
+                "mode": request.mode,
+                "refine_priority": request.refine_priority
             }
         )
 
@@ -90,7 +106,11 @@ def generate_storyboard_api(request: StoryboardRequest):
             style=request.style,
             duration_per_shot=request.duration_per_shot,
             prev_continuity_state=request.prev_continuity_state,
-            task_id=request.task_id
+            task_id=request.task_id,
+            script_format=request.script_format,
+            long_script=request.long_script,
+            mode=request.mode,
+            refine_priority=request.refine_priority
         )
 
         # 确保结果包含必要字段
@@ -98,16 +118,7 @@ def generate_storyboard_api(request: StoryboardRequest):
             raise ValueError("分镜生成结果缺少shots字段")
 
         # 转换为响应格式
-        response = StoryboardResponse(
-            total_shots=result.get("total_shots", len(result["shots"])),
-            storyboard_title=result.get("storyboard_title", "未命名剧本"),
-            shots=result["shots"],
-            final_continuity_state=result.get("final_continuity_state"),
-            total_duration=result.get("total_duration", sum(shot.get("duration", 5) for shot in result["shots"])),
-            status=result.get("status", "success"),
-            warnings=result.get("warnings", []),
-            metadata=result.get("metadata")
-        )
+        response = _to_response(result)
 
         info(f"分镜生成成功，共生成 {response.total_shots} 个分镜")
         return response
@@ -118,3 +129,54 @@ def generate_storyboard_api(request: StoryboardRequest):
     except Exception as e:
         error(f"分镜生成失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"内部服务器错误: {str(e)}")
+
+
+@app.get("/storyboard_jobs/{job_id}", response_model=StoryboardResponse)
+def get_storyboard_job_api(job_id: str):
+    """
+    查询渐进式精修任务的当前分镜（已精修的分镜为LLM版本，其余为草稿）
+
+    Args:
+        job_id: 精修任务ID（mode=progressive 时返回的 metadata.refinement.job_id）
+
+    Returns:
+        StoryboardResponse: 当前完整的分镜结果
+    """
+    job = get_refinement_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"精修任务不存在: {job_id}")
+    return _to_response(job.snapshot())
+
+
+@app.get("/storyboard_jobs/{job_id}/events")
+def stream_storyboard_job_api(job_id: str, start: int = 0):
+    """
+    以NDJSON流推送渐进式精修事件，每行一个事件：
+    shot_upgraded 包含以相同shot_id替换的完整分镜，最后一行为 completed / failed
+
+    Args:
+        job_id: 精修任务ID
+        start: 起始事件序号，断线重连时传入已收到的最后一个事件的 seq + 1
+
+    Returns:
+        StreamingResponse: application/x-ndjson 事件流
+    """
+    job = get_refinement_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"精修任务不存在: {job_id}")
+    events = (json.dumps(event, ensure_ascii=False) + "\n" for event in job.iter_updates(start))
+    return StreamingResponse(events, media_type="application/x-ndjson")
+
+
+def _to_response(result: Dict[str, Any]) -> StoryboardResponse:
+    """将分镜结果转换为响应模型"""
+    return StoryboardResponse(
+        total_shots=result.get("total_shots", len(result["shots"])),
+        storyboard_title=result.get("storyboard_title", "未命名剧本"),
+        shots=result["shots"],
+        final_continuity_state=result.get("final_continuity_state"),
+        total_duration=result.get("total_duration", sum(shot.get("duration", 5) for shot in result["shots"])),
+        status=result.get("status", "success"),
+        warnings=result.get("warnings", []),
+        metadata=result.get("metadata")
+    )
@@ -37,14 +37,33 @@ DEFAULT_CONFIG = {
         "fallback_model": "",
         "temperature": 0.7,
         "max_tokens": 2000,
-        "retry_count": 3
+        "retry_count": 3,
+        "max_concurrency": 4
     },
     "storyboard": {
         "default_duration_per_shot": 5,
         "max_duration_deviation": 0.5,
         "max_retries": 2,
         "default_style": "realistic",
-        "supported_styles": ["realistic", "anime", "cinematic", "cartoon"]
+        "supported_styles": ["realistic", "anime", "cinematic", "cartoon"],
+        "checkpoint_durability": "shot",
+        "llm_review": {
+            "confidence_threshold": 0.8,
+            "audit_sample_rate": 0.05,
+            "batch_size": 1,
+            "batch_token_budget": 6000,
+            "batch_max_wait_ms": 30
+        },
+        "qa_rules": {
+            "disabled": [],
+            "timing": True
+        },
+        "continuity_prompt": {
+            "mode": "full"
+        },
+        "long_script": {
+            "speculation": "off"
+        }
     },
     "logging": {
         "level": "INFO",
@@ -193,6 +212,13 @@ def _update_ai_config_from_env(config: Dict[str, Any]) -> None:
         except ValueError:
             warning("Invalid AI_RETRY_COUNT value, using default")
 
+    # 加载LLM全局最大并发数
+    if os.environ.get("AI_MAX_CONCURRENCY"):
+        try:
+            ai_config["max_concurrency"] = int(os.environ["AI_MAX_CONCURRENCY"])
+        except ValueError:
+            warning("Invalid AI_MAX_CONCURRENCY value, using default")
+
 
 def _update_embedding_config_from_env(config: Dict[str, Any]) -> None:
     """
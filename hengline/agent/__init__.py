@@ -12,6 +12,9 @@ from .continuity_guardian_agent import ContinuityGuardianAgent
 from .shot_generator_agent import ShotGeneratorAgent
 from .qa_agent import QAAgent
 from .multi_agent_pipeline import MultiAgentPipeline
+from .long_script_pipeline import LongScriptPipeline
+from .draft_pipeline import DraftPipeline, get_draft_pipeline
+from .progressive_refinement import RefinementJob, start_refinement_job, get_refinement_job
 
 __all__ = [
     "ScriptParserAgent",
@@ -20,4 +23,10 @@ __all__ = [
     "ShotGeneratorAgent",
     "QAAgent",
     "MultiAgentPipeline",
+    "LongScriptPipeline",
+    "DraftPipeline",
+    "get_draft_pipeline",
+    "RefinementJob",
+    "start_refinement_job",
+    "get_refinement_job",
 ]
\ No newline at end of file
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+@FileName: batched_review.py
+@Description: 批量LLM分镜审查：并发提交的审查请求（同一任务的并发分段、同一进程内的多个任务）在短时间窗口内合并，
+              在token预算内把多个分镜及其分段放进一次调用，再按编号拆分出每个分镜的审查结论
+@Author: HengLine
+@Time: 2025/11
+"""
+import json
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from hengline.client.llm_limiter import invoke_llm
+from hengline.logger import debug, warning
+from hengline.prompts.prompts_manager import PromptManager
+
+# 默认每批最多分镜数、每批输入token预算、等待凑批的最长时间（秒）
+# 默认逐个审查：只有同时提交审查的请求足够多（并发的精修、修复、长剧本分块或多任务）时合并才有收益，
+# 否则每次审查都要多等待max_wait，需要时在配置项 storyboard.llm_review.batch_size 中开启
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_BATCH_TOKEN_BUDGET = 6000
+DEFAULT_BATCH_MAX_WAIT = 0.03
+
+# 没有新请求时，凑批线程空闲多久后退出（秒）
+DISPATCHER_IDLE_TIMEOUT = 1.0
+
+# 区分LLM客户端配置的属性：配置重新加载后模型、服务地址或生成参数变化时使用新的审查器
+CLIENT_CONFIG_ATTRS = ("model_name", "model", "openai_api_base", "base_url", "api_base",
+                       "temperature", "max_tokens", "top_p", "request_timeout", "timeout")
+
+_reviewers_lock = threading.Lock()
+_reviewers: Dict[tuple, "BatchedShotReviewer"] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数：中日韩字符约1个token，其余字符约4个字符1个token
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的token数
+    """
+    cjk = sum(1 for char in text if '一' <= char <= '鿿')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class _PendingReview:
+    """等待合并的单个审查请求"""
+
+    __slots__ = ("text", "tokens", "llm", "future", "submitted_at")
+
+    def __init__(self, text: str, tokens: int, llm: Any):
+        self.text = text
+        self.tokens = tokens
+        self.llm = llm
+        self.future: Future = Future()
+        self.submitted_at = time.monotonic()
+
+
+class BatchedShotReviewer:
+    """
+    批量分镜审查器
+    审查请求先进入等待队列，凑批线程在分镜数或token预算达到上限、或最早的请求等待超过max_wait时取出一批，
+    在新线程中用提交者传入的LLM实例调用（经过全局并发限制器），因此多批审查可以同时进行。
+    LLM响应中缺少某个分镜的结论或调用失败时，该分镜的结果为None，由调用方改为单独审查
+    """
+
+    def __init__(self, llm: Any, batch_size: int = DEFAULT_BATCH_SIZE,
+                 token_budget: int = DEFAULT_BATCH_TOKEN_BUDGET, max_wait: float = DEFAULT_BATCH_MAX_WAIT):
+        """
+        初始化批量审查器
+
+        Args:
+            llm: 语言模型实例，提交审查时未传入LLM实例时使用
+            batch_size: 每批最多分镜数
+            token_budget: 每批分镜信息的token预算（不含提示词模板），单个分镜超出预算时单独成批
+            max_wait: 等待凑批的最长时间（秒）
+        """
+        self.llm = llm
+        self.batch_size = max(1, batch_size)
+        self.token_budget = token_budget
+        self.max_wait = max_wait
+        self.template = PromptManager(prompt_dir=Path(__file__).parent.parent).get_prompt("qa_review_batch")
+        self.stats = {"reviews": 0, "batches": 0, "missing": 0}
+        self._pending: List[_PendingReview] = []
+        self._condition = threading.Condition()
+        self._dispatcher: Optional[threading.Thread] = None
+
+    def review(self, shot: Dict[str, Any], segment: Dict[str, Any], llm: Any = None) -> Optional[Dict[str, Any]]:
+        """
+        提交审查并等待结果
+
+        Args:
+            shot: 分镜对象
+            segment: 对应的分段信息
+            llm: 调用方的语言模型实例，默认使用创建审查器时的实例
+
+        Returns:
+            LLM对该分镜的审查结论；批量审查未得到结论时返回None
+        """
+        return self.submit(shot, segment, llm).result()
+
+    def submit(self, shot: Dict[str, Any], segment: Dict[str, Any], llm: Any = None) -> Future:
+        """
+        提交审查，不等待结果
+
+        Returns:
+            审查结论的Future（结果同review）
+        """
+        text = json.dumps({"shot": shot, "segment": segment}, ensure_ascii=False)
+        pending = _PendingReview(text, estimate_tokens(text), llm if llm is not None else self.llm)
+        with self._condition:
+            self._pending.append(pending)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name="qa-batch", daemon=True)
+                self._dispatcher.start()
+            self._condition.notify_all()
+        return pending.future
+
+    def _batch_ready(self) -> bool:
+        return len(self._pending) >= self.batch_size or sum(p.tokens for p in self._pending) >= self.token_budget
+
+    def _take_batch(self) -> List[_PendingReview]:
+        """按分镜数和token预算取出一批（至少一个）"""
+        batch = [self._pending[0]]
+        tokens = self._pending[0].tokens
+        for pending in self._pending[1:]:
+            if len(batch) >= self.batch_size or tokens + pending.tokens > self.token_budget:
+                break
+            batch.append(pending)
+            tokens += pending.tokens
+        del self._pending[:len(batch)]
+        return batch
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._condition:
+                if not self._pending and not self._condition.wait_for(lambda: self._pending,
+                                                                      DISPATCHER_IDLE_TIMEOUT):
+                    self._dispatcher = None
+                    return
+                # 凑满一批或最早的请求等待超时
+                deadline = self._pending[0].submitted_at + self.max_wait
+                while not self._batch_ready():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._take_batch()
+            threading.Thread(target=self._run_batch, args=(batch,), name="qa-batch-call", daemon=True).start()
+
+    def _run_batch(self, batch: List[_PendingReview]) -> None:
+        verdicts = {}
+        try:
+            prompt = self.template.format(
+                count=len(batch),
+                reviews="\n".join(f"[r{index}] {pending.text}" for index, pending in enumerate(batch, 1))
+            )
+            # 同一审查器的请求客户端配置相同，使用批中最早提交者的LLM实例
+            response = invoke_llm(batch[0].llm, prompt)
+            verdicts = self._parse_verdicts(response.content if hasattr(response, 'content') else response)
+        except Exception as e:
+            warning(f"批量分镜审查失败，{len(batch)} 个分镜改为单独审查: {str(e)}")
+
+        missing = 0
+        for index, pending in enumerate(batch, 1):
+            verdict = verdicts.get(f"r{index}")
+            missing += verdict is None
+            pending.future.set_result(verdict)
+        with self._condition:
+            self.stats["reviews"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["missing"] += missing
+        debug(f"批量审查 {len(batch)} 个分镜，缺少结论 {missing} 个")
+
+    @staticmethod
+    def _parse_verdicts(response_text: Any) -> Dict[str, Dict[str, Any]]:
+        """解析批量审查响应，按编号返回每个分镜的结论"""
+        response_text = str(response_text or "").strip()
+        if '{' not in response_text or '}' not in response_text:
+            warning("批量分镜审查响应中没有JSON")
+            return {}
+        result = json.loads(response_text[response_text.find('{'):response_text.rfind('}') + 1])
+        reviews = result.get("reviews", []) if isinstance(result, dict) else []
+        return {str(review.get("id", "")).strip("[] "): review for review in reviews if isinstance(review, dict)}
+
+
+def get_batched_reviewer(llm: Any, batch_size: int = DEFAULT_BATCH_SIZE,
+                         token_budget: int = DEFAULT_BATCH_TOKEN_BUDGET,
+                         max_wait: float = DEFAULT_BATCH_MAX_WAIT) -> Optional[BatchedShotReviewer]:
+    """
+    获取进程内共享的批量审查器
+    每个请求都会新建LLM实例，因此按LLM类型、客户端配置和批量参数共享审查器，使同一进程内的多个任务可以合并审查；
+    配置重新加载后客户端配置或批量参数变化时使用新的审查器，批量调用使用提交者传入的LLM实例
+
+    Args:
+        llm: 语言模型实例
+        batch_size: 每批最多分镜数
+        token_budget: 每批分镜信息的token预算
+        max_wait: 等待凑批的最长时间（秒）
+
+    Returns:
+        批量审查器；无法识别模型名时返回None（由调用方按LLM实例自行创建）
+    """
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+    if not isinstance(model, str) or not model:
+        return None
+
+    client_config = tuple((attr, repr(getattr(llm, attr, None))) for attr in CLIENT_CONFIG_ATTRS)
+    key = (type(llm).__name__, client_config, batch_size, token_budget, max_wait)
+    with _reviewers_lock:
+        reviewer = _reviewers.get(key)
+        if reviewer is None:
+            reviewer = _reviewers[key] = BatchedShotReviewer(llm, batch_size, token_budget, max_wait)
+        return reviewer
@@ -5,19 +5,28 @@
 @Author: HengLine
 @Time: 2025/10 - 2025/11
 """
-from typing import Dict, List, Any, Optional
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Union
 
 from hengline.logger import debug, warning, info
+from hengline.tools.emotion_transition_tool import get_emotion_transition_matrix
+from .continuity_state import AnchorMap, CharacterState, index_states, to_anchor_map
+
+
+@dataclass
+class ContinuityContext:
+    """单个请求的角色状态记忆，由调用方（工作流状态）持有并在分段之间传递；角色状态不可变，浅拷贝即可复制记忆"""
+    character_states: Dict[str, CharacterState] = field(default_factory=dict)
 
 
 class ContinuityGuardianAgent:
-    """连续性守护智能体"""
+    """
+    连续性守护智能体
+    不在实例上保存角色状态，角色状态记忆通过ContinuityContext传递，可被多个请求并发共享
+    """
 
     def __init__(self):
         """初始化连续性守护智能体"""
-        # 角色状态记忆
-        self.character_states = {}
-
         # 默认角色外观
         self.default_appearances = {
             "pose": "standing",
@@ -26,23 +35,29 @@ class ContinuityGuardianAgent:
             "gaze_direction": "forward",
             "holding": "nothing"
         }
+        # 与分镜审查共用的情绪过渡矩阵（hengline/config/emotion_transition_config.yaml）
+        self.emotion_transitions = get_emotion_transition_matrix()
 
     def generate_continuity_constraints(self,
                                         segment: Dict[str, Any],
-                                        prev_continuity_state: Optional[Dict[str, Any]] = None,
-                                        scene_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+                                        prev_continuity_state: Optional[Union[AnchorMap, List[Dict[str, Any]], Dict[str, Any]]] = None,
+                                        scene_context: Optional[Dict[str, Any]] = None,
+                                        context: Optional[ContinuityContext] = None) -> Dict[str, Any]:
         """
         Generate continuity constraints
         
         Args:
             segment: Current segment
-            prev_continuity_state: Previous segment's continuity state
+            prev_continuity_state: Previous segment's continuity state, either an anchor map,
+                a list of anchors or a dict keyed by character name
             scene_context: Scene context
+            context: Per-request character state memory, updated in place; a fresh one is used if omitted
             
         Returns:
             Continuity constraints
         """
         info(f"Generating continuity constraints, segment ID: {segment.get('id')}")
+        context = context if context is not None else ContinuityContext()
 
         # 初始化结果
         continuity_constraints = {
@@ -64,13 +79,14 @@ class ContinuityGuardianAgent:
                 else:
                     character_names.add(character_name)
 
-        # 如果有上一段的状态，加载它
-        if prev_continuity_state:
-            self._load_prev_state(prev_continuity_state)
+        # 如果有上一段的状态，统一为按角色名索引后加载它
+        prev_states = self._normalize_prev_state(prev_continuity_state)
+        if prev_states:
+            self._load_prev_state(prev_states, context)
 
         # 如果有上一段状态，使用它作为约束
-        if prev_continuity_state:
-            for character_name, state in prev_continuity_state.items():
+        if prev_states:
+            for character_name, state in prev_states.items():
                 # 确保这个角色在当前分段中
                 if character_name in character_names:
                     constraints = self._generate_character_constraints(character_name, state)
@@ -80,14 +96,14 @@ class ContinuityGuardianAgent:
             for character_name in character_names:
                 # 从第一个动作中提取初始状态
                 initial_action = next((a for a in actions if a.get("character") == character_name), None)
-                initial_state = self._get_character_state(character_name)  # 使用默认状态
+                initial_state = self._get_character_state(character_name, context)  # 使用默认状态
                 
                 # 生成约束
                 constraints = self._generate_character_constraints(character_name, initial_state)
                 continuity_constraints["characters"][character_name] = constraints
 
                 # 保存初始状态到记忆
-                self.character_states[character_name] = initial_state
+                context.character_states[character_name] = initial_state
 
         # 更新每个角色的状态
         for character_name in character_names:
@@ -95,19 +111,19 @@ class ContinuityGuardianAgent:
             character_actions = [a for a in actions if a.get("character") == character_name]
             
             # 如果角色已经有状态，更新它
-            if character_name in self.character_states:
-                character_state = self.character_states[character_name]
+            if character_name in context.character_states:
+                character_state = self._get_character_state(character_name, context)
                 updated_state = self._update_character_state(character_state, character_actions)
             else:
                 # 如果没有状态，使用默认状态
-                updated_state = self._get_character_state(character_name)
+                updated_state = self._get_character_state(character_name, context)
 
             # 生成约束
             constraints = self._generate_character_constraints(character_name, updated_state)
             continuity_constraints["characters"][character_name] = constraints
 
             # 更新记忆中的状态
-            self.character_states[character_name] = updated_state
+            context.character_states[character_name] = updated_state
         
         # 为电话那头的角色添加特殊约束
         for phone_character in phone_characters:
@@ -129,7 +145,7 @@ class ContinuityGuardianAgent:
 
     def extract_continuity_anchor(self,
                                   segment: Dict[str, Any],
-                                  generated_shot: Dict[str, Any]) -> List[Dict[str, Any]]:
+                                  generated_shot: Dict[str, Any]) -> AnchorMap:
         """
         Extract continuity anchors from generated shot
         
@@ -138,100 +154,60 @@ class ContinuityGuardianAgent:
             generated_shot: Generated shot
             
         Returns:
-            List of continuity anchors
+            Continuity anchors keyed by character name
         """
         debug(f"Extracting continuity anchors, shot ID: {generated_shot.get('shot_id')}")
 
-        anchors = []
+        has_final_state = "final_state" in generated_shot
+        has_initial_state = "initial_state" in generated_shot
+        final_states = index_states(generated_shot["final_state"]) if has_final_state else {}
+        initial_states = index_states(generated_shot["initial_state"]) if has_initial_state else {}
 
-        # 获取所有角色（包括final_state中的）
-        all_characters = set()
-        if "final_state" in generated_shot:
-            for state in generated_shot["final_state"]:
-                if state.get("character_name"):
-                    all_characters.add(state.get("character_name"))
-        
-        # 如果没有从final_state获取到角色，尝试从initial_state获取
-        if not all_characters and "initial_state" in generated_shot:
-            for state in generated_shot["initial_state"]:
-                if state.get("character_name"):
-                    all_characters.add(state.get("character_name"))
-        
-        # 如果还是没有，使用characters_in_frame
-        if not all_characters:
-            all_characters = set(generated_shot.get("characters_in_frame", []))
+        # 获取所有角色（优先final_state，其次initial_state，最后characters_in_frame）
+        all_characters = final_states or initial_states or dict.fromkeys(generated_shot.get("characters_in_frame", []))
 
+        anchors = {}
         for character_name in all_characters:
-            # 构建锚点
-            anchor = {
-                "character_name": character_name,
-                "pose": "unknown",
-                "position": "unknown",
-                "gaze_direction": "unknown",
-                "emotion": "unknown",
-                "holding": "unknown"
-            }
+            anchor = CharacterState(character_name)
 
             # 从final_state提取信息
-            if "final_state" in generated_shot:
-                for state in generated_shot["final_state"]:
-                    if state.get("character_name") == character_name:
-                        # For phone caller character, ensure position is off-screen
-                        position = state.get("position", "unknown")
-                        if "phone caller" in character_name.lower() or "off-screen" in character_name:
-                            position = "off-screen"
-                        
-                        anchor.update({
-                            "pose": state.get("pose", "unknown"),
-                            "position": position,
-                            "gaze_direction": state.get("gaze_direction", "unknown"),
-                            "emotion": state.get("emotion", "unknown"),
-                            "holding": state.get("holding", "unknown")
-                        })
-                        break
+            if has_final_state:
+                state = final_states.get(character_name)
+                if state is not None:
+                    anchor = CharacterState.from_dict(state, character_name)
 
             # 如果没有final_state，尝试从continuity_anchor提取
             elif "continuity_anchor" in generated_shot:
-                for existing_anchor in generated_shot["continuity_anchor"]:
-                    if existing_anchor.get("character_name") == character_name:
-                        anchor.update(existing_anchor)
-                        break
+                state = index_states(generated_shot["continuity_anchor"]).get(character_name)
+                if state is not None:
+                    anchor = CharacterState.from_dict(state, character_name)
+
             # 从initial_state提取（如果final_state中没有）
-            if anchor["pose"] == "unknown" and "initial_state" in generated_shot:
-                for state in generated_shot["initial_state"]:
-                    if state.get("character_name") == character_name:
-                        # 对于电话那头的角色，确保位置是off-screen
-                        position = state.get("position", "unknown")
-                        if "电话那头" in character_name or "off-screen" in character_name:
-                            position = "off-screen"
-                        
-                        anchor.update({
-                            "pose": state.get("pose", "unknown"),
-                            "position": position,
-                            "gaze_direction": state.get("gaze_direction", "unknown"),
-                            "emotion": state.get("emotion", "unknown"),
-                            "holding": state.get("holding", "unknown")
-                        })
-                        break
+            if anchor.pose == "unknown" and has_initial_state:
+                state = initial_states.get(character_name)
+                if state is not None:
+                    anchor = CharacterState.from_dict(state, character_name)
+                    # 对于电话那头的角色，确保位置是off-screen
+                    if "电话那头" in character_name or "off-screen" in character_name:
+                        anchor = anchor.replace(position="off-screen")
 
             # Special handling for phone caller character
             if "phone caller" in character_name.lower() or "off-screen" in character_name:
-                anchor["position"] = "off-screen"
-                anchor["pose"] = "off-screen"
+                anchor = anchor.off_screen()
 
-            anchors.append(anchor)
+            anchors[character_name] = anchor
 
         debug(f"Continuity anchors extracted: {anchors}")
         return anchors
 
     def verify_continuity(self,
-                          prev_anchor: List[Dict[str, Any]],
+                          prev_anchor: Union[AnchorMap, List[Dict[str, Any]]],
                           current_constraints: Dict[str, Any]) -> Dict[str, Any]:
         """
         Verify continuity and check for inconsistencies
         
         Args:
-            prev_anchor: Previous segment's continuity anchors
+            prev_anchor: Previous segment's continuity anchors (anchor map or list of anchors)
             current_constraints: Current segment's continuity constraints
             
         Returns:
@@ -243,7 +219,7 @@ class ContinuityGuardianAgent:
         suggestions = []
 
         # 创建角色锚点映射
-        prev_anchor_map = {a["character_name"]: a for a in prev_anchor}
+        prev_anchor_map = to_anchor_map(prev_anchor)
 
         # 检查每个角色的连续性
         for character_name, constraints in current_constraints["characters"].items():
@@ -251,19 +227,19 @@ class ContinuityGuardianAgent:
                 prev_state = prev_anchor_map[character_name]
 
                 # 检查姿势连续性
-                if prev_state.get("pose") != constraints.get("must_start_with_pose"):
+                if prev_state.pose != constraints.get("must_start_with_pose"):
                     issues.append(f"Character {character_name} pose discontinuity")
-                    suggestions.append(f"Correct {character_name}'s initial pose to: {prev_state.get('pose')}")
+                    suggestions.append(f"Correct {character_name}'s initial pose to: {prev_state.pose}")
 
                 # 检查位置连续性
-                if prev_state.get("position") != constraints.get("must_start_with_position"):
+                if prev_state.position != constraints.get("must_start_with_position"):
                     issues.append(f"Character {character_name} position discontinuity")
-                    suggestions.append(f"Correct {character_name}'s initial position to: {prev_state.get('position')}")
+                    suggestions.append(f"Correct {character_name}'s initial position to: {prev_state.position}")
 
                 # 检查情绪连续性
-                if prev_state.get("emotion") != constraints.get("must_start_with_emotion"):
+                if prev_state.emotion != constraints.get("must_start_with_emotion"):
                     # 情绪可以有变化，但应该是合理的过渡
-                    if not self._is_emotion_transition_valid(prev_state.get("emotion"), constraints.get("must_start_with_emotion")):
+                    if not self._is_emotion_transition_valid(prev_state.emotion, constraints.get("must_start_with_emotion")):
                         issues.append(f"Character {character_name} emotion transition unreasonable")
                     suggestions.append(f"Suggest adding emotion transition")
 
@@ -280,12 +256,14 @@ class ContinuityGuardianAgent:
 
         return result
 
-    def _load_prev_state(self, prev_continuity_state: List[Dict[str, Any]]):
+    def _normalize_prev_state(self, prev_continuity_state: Optional[Union[AnchorMap, List[Dict[str, Any]], Dict[str, Any]]]) \
+            -> AnchorMap:
+        """Normalize previous state (anchor map, anchor list or name-keyed dict) into an anchor map"""
+        return to_anchor_map(prev_continuity_state)
+
+    def _load_prev_state(self, prev_states: AnchorMap, context: ContinuityContext):
         """Load previous segment's continuity state"""
-        for state in prev_continuity_state:
-            character_name = state.get("character_name")
-            if character_name:
-                self.character_states[character_name] = state
+        context.character_states.update(prev_states)
 
     def _extract_characters(self, segment: Dict[str, Any]) -> List[str]:
         """Extract all characters from segment"""
@@ -295,20 +273,19 @@ class ContinuityGuardianAgent:
                 characters.add(action["character"])
         return list(characters)
 
-    def _get_character_state(self, character_name: str) -> Dict[str, Any]:
+    def _get_character_state(self, character_name: str, context: ContinuityContext) -> CharacterState:
         """Get current state of character"""
-        if character_name in self.character_states:
-            return self.character_states[character_name].copy()
+        if character_name in context.character_states:
+            state = context.character_states[character_name]
+            # 兼容旧检查点中的字典状态
+            return state if isinstance(state, CharacterState) else CharacterState.from_dict(state, character_name)
         else:
             # 返回默认状态
-            return {
-                "character_name": character_name,
-                **self.default_appearances
-            }
+            return CharacterState.from_dict(self.default_appearances, character_name)
 
-    def _update_character_state(self, state: Dict[str, Any], actions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def _update_character_state(self, state: CharacterState, actions: List[Dict[str, Any]]) -> CharacterState:
         """Update character state based on actions"""
-        updated_state = state.copy()
+        changes = {}
 
         for action in actions:
             # 更新动作相关状态
@@ -317,54 +294,54 @@ class ContinuityGuardianAgent:
 
                 # 更新姿势
                 if "sitting" in action_text:
-                    updated_state["pose"] = "sitting"
+                    changes["pose"] = "sitting"
                 elif "standing" in action_text:
-                    updated_state["pose"] = "standing"
+                    changes["pose"] = "standing"
                 elif "lying" in action_text:
-                    updated_state["pose"] = "lying"
+                    changes["pose"] = "lying"
                 elif "look down" in action_text:
-                    updated_state["gaze_direction"] = "downward"
+                    changes["gaze_direction"] = "downward"
                 elif "look up" in action_text:
-                    updated_state["gaze_direction"] = "upward"
+                    changes["gaze_direction"] = "upward"
                 elif "look at" in action_text or "see" in action_text:
-                    updated_state["gaze_direction"] = "toward object"
+                    changes["gaze_direction"] = "toward object"
 
                 # 更新位置
                 if "window" in action_text:
-                    updated_state["position"] = "by window"
+                    changes["position"] = "by window"
                 elif "door" in action_text:
-                    updated_state["position"] = "near entrance"
+                    changes["position"] = "near entrance"
                 elif "table" in action_text:
-                    updated_state["position"] = "at table"
+                    changes["position"] = "at table"
 
                 # 更新手持物品
                 if "phone" in action_text or "mobile" in action_text:
-                    updated_state["holding"] = "smartphone"
+                    changes["holding"] = "smartphone"
                 elif "coffee" in action_text:
-                    updated_state["holding"] = "coffee cup"
+                    changes["holding"] = "coffee cup"
 
             # 更新情绪
             if "emotion" in action:
-                updated_state["emotion"] = action["emotion"]
+                changes["emotion"] = action["emotion"]
 
-        return updated_state
+        return state.replace(**changes)
 
-    def _generate_character_constraints(self, character_name: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    def _generate_character_constraints(self, character_name: str, state: CharacterState) -> Dict[str, Any]:
         """Generate continuity constraints for character"""
         return {
-            "must_start_with_pose": state.get("pose", "unknown"),
-            "must_start_with_position": state.get("position", "unknown"),
-            "must_start_with_emotion": state.get("emotion", "unknown"),
-            "must_start_with_gaze": state.get("gaze_direction", "unknown"),
-            "must_start_with_holding": state.get("holding", "unknown"),
+            "must_start_with_pose": state.pose,
+            "must_start_with_position": state.position,
+            "must_start_with_emotion": state.emotion,
+            "must_start_with_gaze": state.gaze_direction,
+            "must_start_with_holding": state.holding,
             "character_description": self._generate_character_description(character_name, state)
         }
 
-    def _generate_character_description(self, character_name: str, state: Dict[str, Any]) -> str:
+    def _generate_character_description(self, character_name: str, state: CharacterState) -> str:
         """Generate character description"""
         # Can generate more detailed character description as needed
         # Temporarily using simple description template
-        return f"{character_name}, {state.get('pose')}, {state.get('emotion')}"
+        return f"{character_name}, {state.pose}, {state.emotion}"
 
     def _generate_camera_constraints(self, segment: Dict[str, Any]) -> Dict[str, Any]:
         """Generate camera constraints"""
@@ -386,20 +363,5 @@ class ContinuityGuardianAgent:
 
     def _is_emotion_transition_valid(self, prev_emotion: str, current_emotion: str) -> bool:
         """Check if emotion transition is valid"""
-        # Define valid emotion transition pairs
-        valid_transitions = {
-            "calm": ["surprised", "attentive", "thinking", "smiling"],
-            "surprised": ["shocked", "fearful", "confused", "calm"],
-            "shocked": ["fearful", "sad", "angry", "calm"],
-            "angry": ["aggressive", "calm", "sad"],
-            "sad": ["crying", "calm", "accepting"],
-            "happy": ["laughing", "calm", "excited"],
-            "nervous": ["anxious", "fearful", "calm"],
-            "fearful": ["running", "shocked", "calm"],
-        }
-
-        # 如果当前情绪在合理过渡列表中，或者没有定义过渡规则，则认为有效
-        if prev_emotion in valid_transitions:
-            return current_emotion in valid_transitions[prev_emotion]
-
-        return True
+        # 查表判断：过渡代价不超过配置的阈值，或者没有定义过渡规则，则认为有效
+        return self.emotion_transitions.is_valid(prev_emotion, current_emotion)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+@FileName: continuity_state.py
+@Description: 紧凑的角色连续性状态：角色名、姿势、位置、情绪、视线、手持物品驻留为共享的字符串对象，
+              每个角色状态是一个不可变的值元组；连续性锚点为按角色名索引的状态映射，只在API边界转换为JSON
+@Author: HengLine
+@Time: 2025/11
+"""
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+UNKNOWN = "unknown"
+OFF_SCREEN = "off-screen"
+
+# 状态字段，顺序即值元组中的位置
+STATE_FIELDS = ("character_name", "pose", "position", "gaze_direction", "emotion", "holding")
+_FIELD_INDEX = {name: index for index, name in enumerate(STATE_FIELDS)}
+
+
+def intern_value(value: Any) -> Optional[str]:
+    """
+    驻留状态值：相同的值共享同一个字符串对象，比较时先比较对象身份
+    不维护自己的词表，不再被任何状态引用的值随之释放，长时间运行的进程中内存只随在用的状态增长
+
+    Args:
+        value: 状态值（字符串或None，其他类型按字符串处理）
+
+    Returns:
+        驻留后的字符串，None原样返回
+    """
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = str(value)
+    return sys.intern(value)
+
+
+# 画外角色的姿势和位置
+_OFF_SCREEN = intern_value(OFF_SCREEN)
+
+
+class CharacterState:
+    """
+    单个角色的连续性状态
+    不可变，修改通过replace返回新状态，因此角色状态记忆只需浅拷贝即可在分段、请求之间共享；
+    状态值都已驻留，比较、求差基本只比较对象身份
+    """
+    __slots__ = ("_values",)
+
+    def __init__(self, character_name: Any, pose: Any = UNKNOWN, position: Any = UNKNOWN,
+                 gaze_direction: Any = UNKNOWN, emotion: Any = UNKNOWN, holding: Any = UNKNOWN):
+        self._values = (intern_value(character_name), intern_value(pose), intern_value(position),
+                        intern_value(gaze_direction), intern_value(emotion), intern_value(holding))
+
+    @classmethod
+    def _from_values(cls, values: tuple) -> "CharacterState":
+        state = cls.__new__(cls)
+        state._values = values
+        return state
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], character_name: Any = None,
+                  defaults: Optional[Dict[str, Any]] = None) -> "CharacterState":
+        """
+        从状态字典创建（只保留连续性字段）
+
+        Args:
+            data: 状态字典（initial_state / final_state / continuity_anchor 中的一项）
+            character_name: 角色名，默认取 data["character_name"]
+            defaults: 缺少字段时的默认值，默认为 unknown
+        """
+        defaults = defaults or {}
+        return cls(
+            character_name if character_name is not None else data.get("character_name"),
+            *(data.get(field, defaults.get(field, UNKNOWN)) for field in STATE_FIELDS[1:])
+        )
+
+    @property
+    def character_name(self) -> Any:
+        return self._values[0]
+
+    @property
+    def pose(self) -> Any:
+        return self._values[1]
+
+    @property
+    def position(self) -> Any:
+        return self._values[2]
+
+    @property
+    def gaze_direction(self) -> Any:
+        return self._values[3]
+
+    @property
+    def emotion(self) -> Any:
+        return self._values[4]
+
+    @property
+    def holding(self) -> Any:
+        return self._values[5]
+
+    def replace(self, **changes: Any) -> "CharacterState":
+        """
+        返回修改了部分字段的新状态，没有变化时返回自身
+
+        Args:
+            changes: 字段名 → 新值
+        """
+        values = None
+        for field, value in changes.items():
+            index = _FIELD_INDEX[field]
+            value = intern_value(value)
+            if value != self._values[index]:
+                if values is None:
+                    values = list(self._values)
+                values[index] = value
+        return self if values is None else self._from_values(tuple(values))
+
+    def off_screen(self) -> "CharacterState":
+        """电话那头等画外角色：位置和姿势都为off-screen"""
+        if self._values[1] == self._values[2] == _OFF_SCREEN:
+            return self
+        return self._from_values((self._values[0], _OFF_SCREEN, _OFF_SCREEN) + self._values[3:])
+
+    def diff(self, other: Optional["CharacterState"]) -> List[str]:
+        """
+        与另一状态相比发生变化的字段（不含角色名）
+
+        Args:
+            other: 另一状态，None时所有字段都视为变化
+        """
+        if other is None:
+            return list(STATE_FIELDS[1:])
+        mine, theirs = self._values, other._values
+        # 大多数角色在相邻分镜之间没有变化，整体比较值元组即可
+        if mine == theirs:
+            return []
+        return [field for field, my_value, their_value in zip(STATE_FIELDS[1:], mine[1:], theirs[1:])
+                if my_value != their_value]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为JSON可序列化的状态字典（API边界使用）"""
+        return dict(zip(STATE_FIELDS, self._values))
+
+    # 工作流检查点按字段名序列化并用构造函数还原
+    _asdict = to_dict
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, CharacterState) and self._values == other._values
+
+    def __hash__(self) -> int:
+        return hash(self._values)
+
+    def __repr__(self) -> str:
+        return f"CharacterState({', '.join(f'{k}={v!r}' for k, v in self.to_dict().items())})"
+
+
+# 连续性锚点：角色名 → 角色状态
+AnchorMap = Dict[str, CharacterState]
+
+
+def index_states(states: Optional[Iterable[Any]]) -> Dict[Any, Dict[str, Any]]:
+    """
+    按角色名索引状态字典列表，同名时保留第一个
+
+    Args:
+        states: initial_state / final_state / continuity_anchor 列表
+
+    Returns:
+        角色名 → 状态字典
+    """
+    indexed = {}
+    for state in states or []:
+        if isinstance(state, dict) and state.get("character_name") and state["character_name"] not in indexed:
+            indexed[state["character_name"]] = state
+    return indexed
+
+
+def to_anchor_map(continuity_state: Optional[Union[AnchorMap, List[Dict[str, Any]], Dict[str, Any]]],
+                  defaults: Optional[Dict[str, Any]] = None) -> AnchorMap:
+    """
+    将外部传入的连续性状态统一为锚点映射
+
+    Args:
+        continuity_state: 锚点映射、锚点列表，或按角色名索引的状态字典（API传入的 prev_continuity_state）
+        defaults: 状态字典缺少字段时的默认值
+
+    Returns:
+        角色名 → CharacterState
+    """
+    if not continuity_state:
+        return {}
+    if isinstance(continuity_state, dict):
+        anchor_map = {}
+        for name, state in continuity_state.items():
+            if isinstance(state, CharacterState):
+                anchor_map[name] = state
+            elif isinstance(state, dict):
+                anchor_map[name] = CharacterState.from_dict(state, name, defaults)
+        return anchor_map
+    return {name: CharacterState.from_dict(state, name, defaults)
+            for name, state in index_states(continuity_state).items()}
+
+
+def continuity_state_to_json(continuity_state: Any) -> Any:
+    """
+    将锚点映射转换为按角色名索引的状态字典（API边界使用），其他值原样返回
+
+    Args:
+        continuity_state: 连续性状态
+
+    Returns:
+        JSON可序列化的连续性状态
+    """
+    if isinstance(continuity_state, dict) and any(isinstance(state, CharacterState)
+                                                  for state in continuity_state.values()):
+        return {name: state.to_dict() if isinstance(state, CharacterState) else state
+                for name, state in continuity_state.items()}
+    return continuity_state
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+@FileName: draft_pipeline.py
+@Description: 草稿模式，纯规则的分镜生成：解析 → 规划 → 规则生成分镜 → 规则审查在进程内直接循环执行，
+              不经过LangGraph和检查点，不调用LLM和嵌入模型，用于编辑器即时预览
+@Author: HengLine
+@Time: 2025/11
+"""
+import threading
+from typing import Dict, Any, Optional
+
+from hengline.logger import debug, info, error
+from .continuity_guardian_agent import ContinuityGuardianAgent
+from .qa_agent import QAAgent
+from .script_parser_agent import ScriptParserAgent
+from .shot_generator_agent import ShotGeneratorAgent
+from .temporal_planner_agent import TemporalPlannerAgent
+from .workflow_nodes import WorkflowNodes
+from .workflow_states import apply_state_update
+
+# 进程内共享的草稿流水线（各智能体不保存请求状态，可被并发请求共享）
+_draft_pipeline_lock = threading.Lock()
+_draft_pipeline: Optional["DraftPipeline"] = None
+
+
+def get_draft_pipeline() -> "DraftPipeline":
+    """
+    获取进程内共享的草稿流水线，首次调用时初始化
+
+    Returns:
+        共享的DraftPipeline实例
+    """
+    global _draft_pipeline
+    if _draft_pipeline is None:
+        with _draft_pipeline_lock:
+            if _draft_pipeline is None:
+                _draft_pipeline = DraftPipeline()
+    return _draft_pipeline
+
+
+class DraftPipeline:
+    """
+    草稿模式流水线
+    复用工作流节点的实现，保证输出格式与完整流程一致；
+    规则生成是确定性的，重试只会得到相同的分镜，因此审查结果只记录不重试
+    """
+
+    def __init__(self):
+        """初始化草稿流水线（只使用规则能力）"""
+        debug("初始化草稿模式流水线")
+        self.script_parser = ScriptParserAgent.create_rule_parser()
+        self.temporal_planner = TemporalPlannerAgent()
+        self.continuity_guardian = ContinuityGuardianAgent()
+        self.shot_generator = ShotGeneratorAgent(llm=None)
+        self.qa_agent = QAAgent(llm=None)
+        self.workflow_nodes = WorkflowNodes(
+            script_parser=self.script_parser,
+            temporal_planner=self.temporal_planner,
+            continuity_guardian=self.continuity_guardian,
+            shot_generator=self.shot_generator,
+            qa_agent=self.qa_agent,
+            llm=None
+        )
+
+    def run(self,
+            script_text: str,
+            style: str = "realistic",
+            duration_per_shot: int = 5,
+            task_id: Optional[str] = None,
+            prev_continuity_state: Optional[Any] = None,
+            script_format: str = "auto") -> Dict[str, Any]:
+        """
+        生成草稿分镜
+
+        Args:
+            script_text: 原始剧本文本
+            style: 视频风格
+            duration_per_shot: 每段时长
+            task_id: 请求的唯一标识符（草稿模式不保存解析结果）
+            prev_continuity_state: 上一段的连续性状态
+            script_format: 剧本格式（auto / screenplay / chinese）
+
+        Returns:
+            完整的分镜结果，metadata.mode 为 draft
+        """
+        try:
+            state = self.generate_state(script_text, style, duration_per_shot, task_id,
+                                        prev_continuity_state, script_format)
+            result = state["result"]
+            info(f"草稿分镜生成完成，分镜数: {result['total_shots']}")
+            return result
+        except Exception as e:
+            error(f"草稿分镜生成失败: {str(e)}")
+            return {
+                "error": str(e),
+                "status": "failed",
+                "shots": [],
+                "final_continuity_state": prev_continuity_state,
+                "total_duration": 0
+            }
+
+    def generate_state(self,
+                       script_text: str,
+                       style: str = "realistic",
+                       duration_per_shot: int = 5,
+                       task_id: Optional[str] = None,
+                       prev_continuity_state: Optional[Any] = None,
+                       script_format: str = "auto") -> Dict[str, Any]:
+        """
+        执行草稿流程并返回最终状态，失败时抛出异常
+        除最终结果外，shot_contexts 按分镜顺序记录生成每个分镜时的分段、上一分镜的连续性锚点、角色状态记忆和审查结果，
+        供渐进式精修在不重放整个流程的情况下重新生成任意分镜
+
+        Args:
+            script_text: 原始剧本文本
+            style: 视频风格
+            duration_per_shot: 每段时长
+            task_id: 请求的唯一标识符
+            prev_continuity_state: 上一段的连续性状态
+            script_format: 剧本格式
+
+        Returns:
+            工作流状态字典（result、structured_script、shot_contexts 等）
+        """
+        nodes = self.workflow_nodes
+        structured_script = self.script_parser.parse_script(script_text, task_id, script_format, save_result=False)
+        state = {
+            "script_text": script_text,
+            "style": style,
+            "task_id": task_id,
+            "duration_per_shot": duration_per_shot,
+            "structured_script": structured_script,
+            "shots": [],
+            "current_continuity_state": prev_continuity_state,
+            "character_states": {},
+            "character_sheet": {},
+            "retry_count": 0,
+            "qa_results": [],
+            "sequence_qa": None,
+            "sequence_review": None,
+            "sequence_issues": [],
+            "llm_review_metrics": {},
+            "shot_contexts": []
+        }
+        apply_state_update(state, nodes.plan_timeline_node(state))
+        if state.get("error"):
+            raise RuntimeError(state["error"])
+
+        # 逐个分段：生成 → 审查 → 提取连续性（与完整流程的节点顺序一致）
+        for _ in range(max(1, len(state["segments"]))):
+            shot_context = {
+                "prev_continuity_state": state["current_continuity_state"],
+                "character_states": dict(state["character_states"])
+            }
+            apply_state_update(state, nodes.generate_shot_node(state))
+            shot_context["segment"] = state["current_segment"]
+            state["shot_contexts"].append(shot_context)
+            apply_state_update(state, nodes.review_shot_node(state))
+            shot_context["qa_result"] = state["qa_results"][-1]
+            apply_state_update(state, nodes.extract_continuity_node(state))
+            if state.get("error"):
+                raise RuntimeError(state["error"])
+
+        apply_state_update(state, nodes.review_sequence_node(state))
+        if state["sequence_qa"].get("has_continuity_issues"):
+            apply_state_update(state, nodes.fix_continuity_node(state))
+        apply_state_update(state, nodes.generate_result_node(state))
+        if not state.get("result"):
+            raise RuntimeError(state.get("error") or "未生成有效结果")
+
+        state["result"]["metadata"]["mode"] = "draft"
+        return state
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+@FileName: long_script_pipeline.py
+@Description: 长剧本模式，按分集/场景边界切分剧本，提前并行完成各分块的解析和时序规划，
+              分块之间衔接连续性状态，并对每个分块的首个分镜做推测生成，最终合并为全局编号的分镜结果
+@Author: HengLine
+@Time: 2025/11
+"""
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
+
+from config.config import get_storyboard_config
+from hengline.client.llm_limiter import get_max_concurrency, map_llm_tasks
+from hengline.logger import debug, info, warning, error
+from .continuity_guardian_agent import ContinuityContext
+from .continuity_state import CharacterState
+from .workflow_states import apply_state_update, sum_counts
+
+# 首分镜推测生成的开关（实验性功能，默认关闭）
+SPECULATION_ON = "on"
+SPECULATION_OFF = "off"
+
+
+class LongScriptPipeline:
+    """
+    长剧本分块流水线
+    与MultiAgentPipeline共享智能体、工作流节点和分镜生成工作流：
+    1. 切分分块后，所有分块的解析和时序规划并行完成
+    2. （实验性，默认关闭）除第一个分块外，每个分块的首个分镜按规则推演出的上一分块结束状态推测生成（与前面的分块并行）
+    3. 分块按顺序生成分镜，上一分块的结束锚点一确定，就校验下一分块的推测分镜：
+       连续性约束与实际状态下完全一致时直接采用，否则丢弃重新生成
+    4. 合并所有分块的分镜并重新编号，统一做序列审查
+    推测的收益与代价都不理想：规则模式下生成分镜与推演一样廉价，提前推演全部分块只会加倍CPU开销并推迟第一个分块；
+    LLM模式下生成的结束状态措辞与规则推演常有差异，命中率随措辞差异迅速下降。
+    因此推测只作为实验，需在配置项 storyboard.long_script.speculation 中设为 on 开启
+    """
+
+    def __init__(self, pipeline, speculation: Optional[str] = None):
+        """
+        初始化长剧本流水线
+
+        Args:
+            pipeline: MultiAgentPipeline实例
+            speculation: 首分镜推测生成的开关（on / off），默认读取配置项 storyboard.long_script.speculation
+        """
+        self.pipeline = pipeline
+        self.nodes = pipeline.workflow_nodes
+        self.script_parser = pipeline.script_parser
+        self.continuity_guardian = pipeline.continuity_guardian
+        self.shot_generator = pipeline.shot_generator
+        self.speculation = speculation or \
+            get_storyboard_config().get("long_script", {}).get("speculation", SPECULATION_OFF)
+
+    def _speculation_enabled(self) -> bool:
+        """是否对分块的首个分镜做推测生成"""
+        return self.speculation == SPECULATION_ON
+
+    def run(self,
+            script_text: str,
+            style: str = "realistic",
+            duration_per_shot: int = 5,
+            task_id: Optional[str] = None,
+            prev_continuity_state: Optional[Any] = None,
+            script_format: str = "auto") -> Dict[str, Any]:
+        """
+        运行长剧本分镜生成
+
+        Args:
+            script_text: 原始剧本文本
+            style: 视频风格
+            duration_per_shot: 每段时长
+            task_id: 请求的唯一标识符，各分块的解析结果按 <task_id>_chunk<序号> 保存
+            prev_continuity_state: 上一段的连续性状态
+            script_format: 剧本格式（auto / screenplay / chinese）
+
+        Returns:
+            合并后的完整分镜结果
+        """
+        chunks = self.script_parser.split_script_chunks(script_text, script_format)
+        if len(chunks) <= 1:
+            debug("剧本只有一个分块，按普通模式生成")
+            return self.pipeline.run_pipeline(script_text, style, duration_per_shot, task_id,
+                                              prev_continuity_state, script_format)
+
+        info(f"开始长剧本分镜生成，分块数: {len(chunks)}")
+        try:
+            # 1. 所有分块的解析和时序规划提前并行完成
+            prepared = map_llm_tasks(
+                lambda chunk: self._prepare_chunk(chunk, task_id, duration_per_shot), chunks)
+
+            # 2. 按规则推演各分块开始时的连续性状态，作为推测生成的输入
+            speculation_enabled = self._speculation_enabled()
+            predictions = self._predict_chunk_states(prepared, prev_continuity_state, style) \
+                if speculation_enabled else []
+
+            chunk_results = []
+            speculation_hits = 0
+            with ThreadPoolExecutor(max_workers=get_max_concurrency(), thread_name_prefix="speculate") as executor:
+                # 3. 推测生成第2个及之后分块的首个分镜，与前面分块的生成并行
+                speculative = {
+                    chunk["index"]: executor.submit(self._speculate_first_shot, chunk, *predictions[chunk["index"]], style)
+                    for chunk in prepared[1:] if chunk["segments"]
+                } if speculation_enabled else {}
+
+                # 4. 按顺序生成各分块，上一分块的结束状态确定后立即开始下一分块
+                anchor, character_states = prev_continuity_state, {}
+                for chunk in prepared:
+                    seed = None
+                    if chunk["index"] in speculative:
+                        seed = self._accept_speculation(speculative[chunk["index"]].result(), anchor, character_states)
+                        speculation_hits += seed is not None
+                    chunk_state = self._generate_chunk(chunk, anchor, character_states, seed,
+                                                       style, duration_per_shot, task_id)
+                    chunk_results.append(chunk_state)
+                    anchor = chunk_state.get("current_continuity_state", anchor)
+                    character_states = chunk_state.get("character_states") or character_states
+
+            # 5. 合并分镜并统一做序列审查
+            return self._merge_chunks(script_text, prepared, chunk_results, style, duration_per_shot,
+                                      speculation_hits, len(speculative))
+        except Exception as e:
+            error(f"长剧本分镜生成失败: {str(e)}")
+            return {
+                "error": str(e),
+                "status": "failed",
+                "shots": [],
+                "final_continuity_state": prev_continuity_state,
+                "total_duration": 0
+            }
+
+    def _prepare_chunk(self, chunk: Dict[str, Any], task_id: Optional[str], duration_per_shot: int) -> Dict[str, Any]:
+        """解析分块并规划时间线"""
+        state = {
+            "script_text": chunk["text"],
+            "task_id": f"{task_id}_chunk{chunk['index']:03d}" if task_id else None,
+            "script_format": chunk["script_format"],
+            "duration_per_shot": duration_per_shot
+        }
+        state.update(self.nodes.parse_script_node(state))
+        if state.get("error"):
+            raise RuntimeError(f"分块 {chunk['index']} 解析失败: {state['error']}")
+        state.update(self.nodes.plan_timeline_node(state))
+        if state.get("error"):
+            raise RuntimeError(f"分块 {chunk['index']} 时序规划失败: {state['error']}")
+        debug(f"分块 {chunk['index']} 准备完成，分段数: {len(state['segments'])}")
+        return {**chunk, "structured_script": state["structured_script"], "segments": state["segments"]}
+
+    def _scene_context(self, chunk: Dict[str, Any], segment: Dict[str, Any]) -> Dict[str, Any]:
+        """获取分段所属场景（与generate_shot_node一致）"""
+        scene_id = segment.get("scene_id", 0)
+        scenes = chunk["structured_script"].get("scenes", [])
+        return scenes[scene_id] if scene_id < len(scenes) else {}
+
+    def _predict_chunk_states(self, prepared: List[Dict[str, Any]], prev_continuity_state: Optional[Any],
+                              style: str) -> List[Tuple[Any, Dict[str, Dict[str, Any]]]]:
+        """
+        按规则生成器推演每个分块开始时的连续性锚点和角色状态记忆
+        不调用LLM；规则模式下推演结果与实际生成完全一致
+
+        Returns:
+            与prepared等长的 (锚点, 角色状态) 列表
+        """
+        anchor, character_states = prev_continuity_state, {}
+        predictions = []
+        for chunk in prepared:
+            predictions.append((anchor, dict(character_states)))
+            for index, segment in enumerate(chunk["segments"]):
+                scene_context = self._scene_context(chunk, segment)
+                context = ContinuityContext(character_states=dict(character_states))
+                constraints = self.continuity_guardian.generate_continuity_constraints(
+                    segment, anchor, scene_context, context)
+                shot_data = self.shot_generator._generate_shot_with_rules(
+                    segment, constraints, scene_context, style, index + 1)
+                anchor = self.continuity_guardian.extract_continuity_anchor(segment, shot_data)
+                character_states = context.character_states
+        return predictions
+
+    def _speculate_first_shot(self, chunk: Dict[str, Any], anchor: Any, character_states: Dict[str, CharacterState],
+                              style: str) -> Dict[str, Any]:
+        """
+        按推演的开始状态生成并审查分块的首个分镜
+
+        Returns:
+            推测结果，包含所用的连续性约束、分镜及其审查结果
+        """
+        segment = chunk["segments"][0]
+        scene_context = self._scene_context(chunk, segment)
+        constraints = self.continuity_guardian.generate_continuity_constraints(
+            segment, anchor, scene_context, ContinuityContext(character_states=dict(character_states)))
+
+        state = {
+            "segments": chunk["segments"],
+            "current_segment_index": 0,
+            "structured_script": chunk["structured_script"],
+            "style": style,
+            "shots": [],
+            "current_continuity_state": anchor,
+            "character_states": character_states,
+            "retry_count": 0,
+            "qa_results": []
+        }
+        apply_state_update(state, self.nodes.generate_shot_node(state))
+        apply_state_update(state, self.nodes.review_shot_node(state))
+        return {
+            "chunk": chunk,
+            "segment": segment,
+            "scene_context": scene_context,
+            "constraints": constraints,
+            "shot": state["current_shot"],
+            "qa_result": state["qa_results"][-1],
+            "character_sheet": state.get("character_sheet", {})
+        }
+
+    def _accept_speculation(self, speculation: Dict[str, Any], anchor: Any,
+                            character_states: Dict[str, CharacterState]) -> Optional[Dict[str, Any]]:
+        """
+        用实际的开始状态校验推测分镜
+        实际状态下的连续性约束与推测时完全一致且审查通过时采用，返回分块生成的起始状态；否则返回None
+        """
+        segment = speculation["segment"]
+        context = ContinuityContext(character_states=dict(character_states))
+        constraints = self.continuity_guardian.generate_continuity_constraints(
+            segment, anchor, speculation["scene_context"], context)
+        chunk_index = speculation["chunk"]["index"]
+        if constraints != speculation["constraints"] or not speculation["qa_result"].get("is_valid", False):
+            debug(f"分块 {chunk_index} 的推测分镜未命中，重新生成")
+            return None
+
+        debug(f"分块 {chunk_index} 的推测分镜命中")
+        shot = speculation["shot"]
+        qa_agent = self.nodes.qa_agent
+        sequence_review, sequence_issues = qa_agent.accept_sequence_shot(qa_agent.create_sequence_review(), shot)
+        return {
+            "shots": [shot],
+            "qa_results": [speculation["qa_result"]],
+            "sequence_review": sequence_review,
+            "sequence_issues": sequence_issues,
+            "llm_review_metrics": qa_agent.llm_review_counts(speculation["qa_result"].get("llm_review")),
+            "current_continuity_state": self.continuity_guardian.extract_continuity_anchor(segment, shot),
+            "character_states": context.character_states,
+            "character_sheet": speculation["character_sheet"],
+            "current_segment_index": 1
+        }
+
+    def _generate_chunk(self, chunk: Dict[str, Any], anchor: Any, character_states: Dict[str, CharacterState],
+                        seed: Optional[Dict[str, Any]], style: str, duration_per_shot: int,
+                        task_id: Optional[str]) -> Dict[str, Any]:
+        """运行分镜生成工作流生成分块的全部分镜，seed为已采用的推测结果"""
+        state = {
+            "script_text": chunk["text"],
+            "style": style,
+            "task_id": task_id,
+            "duration_per_shot": duration_per_shot,
+            "prev_continuity_state": anchor,
+            "script_format": chunk["script_format"],
+            "structured_script": chunk["structured_script"],
+            "segments": chunk["segments"],
+            "shots": [],
+            "current_continuity_state": anchor,
+            "character_states": dict(character_states),
+            "character_sheet": {},
+            "current_segment_index": 0,
+            "retry_count": 0,
+            "max_retries": 2,
+            "qa_results": [],
+            "sequence_qa": None,
+            "sequence_review": None,
+            "sequence_issues": [],
+            "llm_review_metrics": {},
+            "result": None,
+            "error": None
+        }
+        if seed:
+            state.update(seed)
+        if state["current_segment_index"] >= len(state["segments"]):
+            return state
+
+        # 每个分段最多 (max_retries + 1) 次生成，每次生成 + 审查 + 重试检查共3步，最后再提取连续性1步
+        steps = len(state["segments"]) * ((state["max_retries"] + 1) * 3 + 1)
+        thread_id = str(uuid.uuid4())
+        config = {"configurable": {"thread_id": thread_id}, "recursion_limit": steps + 10}
+        try:
+            return self.pipeline.generation_workflow.invoke(state, config)
+        finally:
+            # 分块结果已取回，释放该分块线程的检查点
+            self.pipeline.memory.delete_thread(thread_id)
+
+    def _merge_chunks(self, script_text: str, prepared: List[Dict[str, Any]], chunk_results: List[Dict[str, Any]],
+                      style: str, duration_per_shot: int, speculation_hits: int, speculation_count: int) -> Dict[str, Any]:
+        """合并各分块的分镜，重新全局编号后做序列审查并生成最终结果"""
+        shots = []
+        segments = []
+        chunk_summaries = []
+        scene_offset = 0
+        llm_review_metrics = {}
+        for chunk, chunk_state in zip(prepared, chunk_results):
+            if chunk_state.get("error"):
+                warning(f"分块 {chunk['index']} 生成出错: {chunk_state['error']}")
+            chunk_shots = chunk_state.get("shots", [])
+            for shot in chunk_shots:
+                shot_id = len(shots) + 1
+                shot = dict(shot)
+                shot["shot_id"] = str(shot_id)
+                shot["time_range_sec"] = [(shot_id - 1) * 5, shot_id * 5]
+                shot["start_time"], shot["end_time"] = shot["time_range_sec"]
+                shot["chunk_index"] = chunk["index"]
+                shots.append(shot)
+            # 分段的场景下标改为合并后场景列表中的下标，供修复分镜时查找场景
+            segments.extend({**segment, "scene_id": segment.get("scene_id", 0) + scene_offset}
+                            for segment in chunk["segments"])
+            scene_offset += len(chunk["structured_script"].get("scenes", []))
+            llm_review_metrics = sum_counts(llm_review_metrics, chunk_state.get("llm_review_metrics"))
+            chunk_summaries.append({
+                "index": chunk["index"],
+                "episode": chunk["episode"],
+                "scene_count": len(chunk["structured_script"].get("scenes", [])),
+                "shot_count": len(chunk_shots)
+            })
+
+        first_script = prepared[0]["structured_script"]
+        state = {
+            "script_text": script_text,
+            "style": style,
+            "duration_per_shot": duration_per_shot,
+            "shots": shots,
+            "segments": segments,
+            "llm_review_metrics": llm_review_metrics,
+            "structured_script": {
+                "scenes": [scene for chunk in prepared for scene in chunk["structured_script"].get("scenes", [])],
+                "metadata": first_script.get("metadata")
+            }
+        }
+        # 分块内的增量审查不覆盖分块之间的衔接，合并后对全局编号的分镜整体审查
+        apply_state_update(state, self.nodes.review_sequence_node(state))
+        if state["sequence_qa"].get("has_continuity_issues"):
+            apply_state_update(state, self.nodes.fix_continuity_node(state))
+        apply_state_update(state, self.nodes.generate_result_node(state))
+        if not state.get("result"):
+            raise RuntimeError(state.get("error") or "未生成有效结果")
+
+        result = state["result"]
+        result["metadata"]["long_script"] = {
+            "chunks": chunk_summaries,
+            "speculative_first_shots": speculation_count,
+            "speculation_hits": speculation_hits
+        }
+        info(f"长剧本分镜生成完成，分块数: {len(prepared)}，分镜数: {len(shots)}，"
+             f"推测命中: {speculation_hits}/{speculation_count}")
+        return result
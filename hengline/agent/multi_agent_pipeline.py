@@ -8,34 +8,47 @@
 import uuid
 from typing import Dict, List, Any, Optional
 
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import StateGraph
+from langgraph.graph import StateGraph, END
 
+from config.config import get_storyboard_config
 from hengline.logger import debug, info, error
 from .continuity_guardian_agent import ContinuityGuardianAgent
+from .continuity_state import continuity_state_to_json
+from .long_script_pipeline import LongScriptPipeline
 from .qa_agent import QAAgent
 from .script_parser_agent import ScriptParserAgent
 from .shot_generator_agent import ShotGeneratorAgent
 from .temporal_planner_agent import TemporalPlannerAgent
+from .workflow_checkpoint import create_checkpoint_saver, CHECKPOINT_DURABILITY_SHOT
 from .workflow_nodes import WorkflowNodes
 from .workflow_states import StoryboardWorkflowState
 
+# 工作流最大执行步数（LangGraph默认25步，每个分镜至少需要3步，长剧本很快就会超限）
+WORKFLOW_RECURSION_LIMIT = 10000
+
 
 class MultiAgentPipeline:
     """多智能体协作流程"""
 
-    def __init__(self, llm=None):
+    def __init__(self, llm=None, checkpoint_durability: Optional[str] = None):
         """
         初始化多智能体流程
         
         Args:
             llm: 语言模型实例
+            checkpoint_durability: 检查点保存时机，step每个节点后保存，shot只在分镜边界保存；
+                                   默认读取配置项 storyboard.checkpoint_durability
         """
         self.llm = llm
+        if checkpoint_durability is None:
+            checkpoint_durability = get_storyboard_config().get("checkpoint_durability", CHECKPOINT_DURABILITY_SHOT)
         # 先初始化memory，确保在_init_workflow中可以使用
-        self.memory = MemorySaver()
+        self.memory = create_checkpoint_saver(checkpoint_durability)
         self._init_agents()
         self.workflow = self._init_workflow()
+        # 只包含分镜生成循环的工作流（长剧本模式按分块调用）
+        self.generation_workflow = self._init_generation_workflow()
+        self._long_script_pipeline = None
 
     def _init_agents(self):
         """初始化各个智能体"""
@@ -67,9 +80,6 @@ class MultiAgentPipeline:
         # 定义工作流节点
         workflow.add_node("parse_script", self.workflow_nodes.parse_script_node)
         workflow.add_node("plan_timeline", self.workflow_nodes.plan_timeline_node)
-        workflow.add_node("generate_shot", self.workflow_nodes.generate_shot_node)
-        workflow.add_node("review_shot", self.workflow_nodes.review_shot_node)
-        workflow.add_node("extract_continuity", self.workflow_nodes.extract_continuity_node)
         workflow.add_node("review_sequence", self.workflow_nodes.review_sequence_node)
         workflow.add_node("fix_continuity", self.workflow_nodes.fix_continuity_node)
         workflow.add_node("generate_result", self.workflow_nodes.generate_result_node)
@@ -87,6 +97,46 @@ class MultiAgentPipeline:
             {"continue": "generate_shot"}
         )
 
+        # 分镜生成循环，所有分段生成完后进入序列审查
+        self._add_shot_generation_loop(workflow, "review_sequence")
+
+        workflow.add_conditional_edges(
+            "review_sequence",
+            lambda state: "fix" if state["sequence_qa"]["has_continuity_issues"] else "done",
+            {"fix": "fix_continuity", "done": "generate_result"}
+        )
+
+        workflow.add_conditional_edges(
+            "fix_continuity",
+            lambda state: "continue",
+            {"continue": "generate_result"}
+        )
+
+        # 设置入口点
+        workflow.set_entry_point("parse_script")
+
+        # 编译工作流
+        return workflow.compile(checkpointer=self.memory)
+
+    def _init_generation_workflow(self):
+        """初始化只包含分镜生成循环的工作流，入口为generate_shot，所有分段生成完后结束"""
+        workflow = StateGraph(StoryboardWorkflowState)
+        self._add_shot_generation_loop(workflow, END)
+        workflow.set_entry_point("generate_shot")
+        return workflow.compile(checkpointer=self.memory)
+
+    def _add_shot_generation_loop(self, workflow: StateGraph, done: str):
+        """
+        添加分镜生成循环：生成 → 审查 →（重试）→ 提取连续性 → 下一个分段
+        
+        Args:
+            workflow: 状态图
+            done: 所有分段生成完后进入的节点
+        """
+        workflow.add_node("generate_shot", self.workflow_nodes.generate_shot_node)
+        workflow.add_node("review_shot", self.workflow_nodes.review_shot_node)
+        workflow.add_node("extract_continuity", self.workflow_nodes.extract_continuity_node)
+
         workflow.add_conditional_edges(
             "generate_shot",
             lambda state: "continue",
@@ -99,11 +149,11 @@ class MultiAgentPipeline:
             {"valid": "extract_continuity", "invalid": "check_retry"}
         )
 
-        # 添加检查重试逻辑的条件边
+        # extract_continuity已将索引移到下一个分段，索引越界说明所有分段都已生成
         workflow.add_conditional_edges(
             "extract_continuity",
-            lambda state: "next_segment" if state["current_segment_index"] < len(state["segments"]) - 1 else "review_sequence",
-            {"next_segment": "generate_shot", "review_sequence": "review_sequence"}
+            lambda state: "next_segment" if state["current_segment_index"] < len(state["segments"] or []) else "done",
+            {"next_segment": "generate_shot", "done": done}
         )
 
         # 添加自定义检查重试节点
@@ -114,30 +164,13 @@ class MultiAgentPipeline:
             {"retry": "generate_shot", "use_current": "extract_continuity"}
         )
 
-        workflow.add_conditional_edges(
-            "review_sequence",
-            lambda state: "fix" if state["sequence_qa"]["has_continuity_issues"] else "done",
-            {"fix": "fix_continuity", "done": "generate_result"}
-        )
-
-        workflow.add_conditional_edges(
-            "fix_continuity",
-            lambda state: "continue",
-            {"continue": "generate_result"}
-        )
-
-        # 设置入口点
-        workflow.set_entry_point("parse_script")
-
-        # 编译工作流
-        return workflow.compile(checkpointer=self.memory)
-
     def run_pipeline(self,
                      script_text: str,
                      style: str = "realistic",
                      duration_per_shot: int = 5,
                      task_id: Optional[str] = None,
-                     prev_continuity_state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+                     prev_continuity_state: Optional[Dict[str, Any]] = None,
+                     script_format: str = "auto") -> Dict[str, Any]:
         """
         运行完整的分镜生成流程
         
@@ -146,6 +179,7 @@ class MultiAgentPipeline:
             style: 视频风格
             duration_per_shot: 每段时长
             prev_continuity_state: 上一段的连续性状态
+            script_format: 剧本格式（auto / screenplay / chinese），auto为自动识别
             
         Returns:
             完整的分镜结果
@@ -160,22 +194,33 @@ class MultiAgentPipeline:
                 "task_id": task_id,
                 "duration_per_shot": duration_per_shot,
                 "prev_continuity_state": prev_continuity_state,
+                "script_format": script_format,
                 "structured_script": None,
                 "segments": None,
                 "shots": [],
                 "current_continuity_state": prev_continuity_state,
+                "character_states": {},
+                "character_sheet": {},
                 "current_segment_index": 0,
                 "retry_count": 0,
                 "max_retries": 2,
                 "qa_results": [],
                 "sequence_qa": None,
+                "sequence_review": None,
+                "sequence_issues": [],
+                "llm_review_metrics": {},
                 "result": None,
                 "error": None
             }
 
             # 使用LangGraph运行工作流
-            config = {"configurable": {"thread_id": str(uuid.uuid4())}}
-            result = self.workflow.invoke(initial_state, config)
+            thread_id = str(uuid.uuid4())
+            config = {"configurable": {"thread_id": thread_id}, "recursion_limit": WORKFLOW_RECURSION_LIMIT}
+            try:
+                result = self.workflow.invoke(initial_state, config)
+            finally:
+                # 线程ID不对外暴露，运行结束后检查点不会再被读取，及时释放
+                self.memory.delete_thread(thread_id)
 
             # 返回最终结果
             if result.get("result"):
@@ -187,7 +232,8 @@ class MultiAgentPipeline:
                     "error": result.get("error", "未知错误"),
                     "status": "failed",
                     "shots": result.get("shots", []),
-                    "final_continuity_state": result.get("current_continuity_state", prev_continuity_state),
+                    "final_continuity_state": continuity_state_to_json(
+                        result.get("current_continuity_state", prev_continuity_state)),
                     "total_duration": len(result.get("shots", [])) * duration_per_shot
                 }
 
@@ -202,6 +248,31 @@ class MultiAgentPipeline:
                 "total_duration": 0
             }
 
+    def run_long_script(self,
+                        script_text: str,
+                        style: str = "realistic",
+                        duration_per_shot: int = 5,
+                        task_id: Optional[str] = None,
+                        prev_continuity_state: Optional[Dict[str, Any]] = None,
+                        script_format: str = "auto") -> Dict[str, Any]:
+        """
+        长剧本模式：按分集/场景边界切分后分块生成，分块之间衔接连续性状态，合并为全局编号的分镜结果
+        
+        Args:
+            script_text: 原始剧本文本
+            style: 视频风格
+            duration_per_shot: 每段时长
+            prev_continuity_state: 上一段的连续性状态
+            script_format: 剧本格式（auto / screenplay / chinese），auto为自动识别
+            
+        Returns:
+            完整的分镜结果
+        """
+        if self._long_script_pipeline is None:
+            self._long_script_pipeline = LongScriptPipeline(self)
+        return self._long_script_pipeline.run(script_text, style, duration_per_shot, task_id,
+                                              prev_continuity_state, script_format)
+
     def _fix_continuity_issues(self, shots: List[Dict[str, Any]], qa_result: Dict[str, Any]) -> List[Dict[str, Any]]:
         """修复连续性问题"""
         # 委托给workflow_nodes处理
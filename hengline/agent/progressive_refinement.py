@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+@FileName: progressive_refinement.py
+@Description: 渐进式精修任务：先立即返回完整的规则草稿分镜，再在后台按优先级用LLM逐个重新生成分镜，
+              以相同的shot_id原位替换并推送更新，客户端始终可以展示完整分镜，质量随时间逐步提升
+@Author: HengLine
+@Time: 2025/11
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Iterator, List, Optional
+
+from hengline.client.llm_limiter import get_max_concurrency
+from hengline.logger import debug, info, warning, error
+from .continuity_guardian_agent import ContinuityContext
+from .draft_pipeline import get_draft_pipeline
+from .qa_agent import QAAgent
+from .shot_generator_agent import ShotGeneratorAgent, GENERATED_BY_LLM
+
+# 精修优先级：order按分镜顺序（先精修开头的分镜），qa按规则审查结果从差到好
+PRIORITY_ORDER = "order"
+PRIORITY_QA = "qa"
+
+# 进程内保留的已结束任务数量，超出后淘汰最早结束的任务
+MAX_FINISHED_JOBS = 100
+
+_jobs_lock = threading.Lock()
+_jobs: "OrderedDict[str, RefinementJob]" = OrderedDict()
+
+
+def refinement_order(qa_results: List[Dict[str, Any]], priority: str = PRIORITY_ORDER) -> List[int]:
+    """
+    计算分镜的精修顺序
+
+    Args:
+        qa_results: 草稿阶段每个分镜的规则审查结果（与分镜顺序一致）
+        priority: 精修优先级（order / qa）
+
+    Returns:
+        分镜下标列表
+    """
+    indices = list(range(len(qa_results)))
+    if priority == PRIORITY_QA:
+        # 未通过审查的优先，其次关键问题和警告越多越优先，同等情况下按分镜顺序
+        indices.sort(key=lambda i: (qa_results[i].get("is_valid", False),
+                                    -len(qa_results[i].get("critical_issues", [])),
+                                    -len(qa_results[i].get("warnings", [])),
+                                    i))
+    elif priority != PRIORITY_ORDER:
+        warning(f"不支持的精修优先级: {priority}，按分镜顺序精修")
+    return indices
+
+
+class RefinementJob:
+    """
+    渐进式精修任务
+    升级后的分镜沿用草稿阶段的开始约束，但LLM版本的结束状态可能与草稿不同，
+    因此替换前与当前的前后分镜做相邻审查，引入新的关键连续性问题时保留草稿，任意时刻的分镜序列都不会比草稿更不连续；
+    LLM生成失败（回退为规则结果）或LLM审查未通过的分镜也保留草稿版本
+    """
+
+    def __init__(self,
+                 job_id: str,
+                 draft_state: Dict[str, Any],
+                 shot_generator: ShotGeneratorAgent,
+                 qa_agent: QAAgent,
+                 priority: str = PRIORITY_ORDER):
+        """
+        初始化精修任务
+
+        Args:
+            job_id: 任务ID（与草稿结果的job_id相同）
+            draft_state: DraftPipeline.generate_state 返回的草稿状态
+            shot_generator: 使用LLM的分镜生成智能体
+            qa_agent: 使用LLM的质量审查智能体
+            priority: 精修优先级（order / qa）
+        """
+        self.job_id = job_id
+        self.priority = priority
+        self.status = "running"
+        self.shot_generator = shot_generator
+        self.qa_agent = qa_agent
+        self.continuity_guardian = get_draft_pipeline().continuity_guardian
+
+        self._draft_state = draft_state
+        self._result = draft_state["result"]
+        self._shots = list(self._result["shots"])
+        self._order = refinement_order([context["qa_result"] for context in draft_state["shot_contexts"]], priority)
+        self._upgraded: List[str] = []
+        self._kept_draft: List[str] = []
+        self._events: List[Dict[str, Any]] = []
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "RefinementJob":
+        """在后台线程中开始精修"""
+        self._thread = threading.Thread(target=self._run, name=f"refine-{self.job_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取当前完整的分镜结果（已精修的分镜替换为LLM版本）
+
+        Returns:
+            与草稿结果格式一致的分镜结果，metadata.refinement 记录精修进度
+        """
+        with self._condition:
+            result = dict(self._result)
+            result["shots"] = list(self._shots)
+            result["final_continuity_state"] = self._final_continuity_state()
+            result["metadata"] = {**self._result["metadata"], "refinement": self._progress()}
+            return result
+
+    def iter_updates(self, start: int = 0, timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        按发生顺序迭代精修事件，任务结束后返回
+
+        Args:
+            start: 起始事件序号（断线重连时跳过已收到的事件）
+            timeout: 等待单个事件的最长秒数，超时后结束迭代
+
+        Returns:
+            事件迭代器：shot_upgraded 事件包含替换后的完整分镜，最后一个事件为 completed / failed
+        """
+        index = start
+        while True:
+            with self._condition:
+                if index >= len(self._events) and self.status == "running":
+                    self._condition.wait(timeout)
+                pending = self._events[index:]
+            # 没有新事件：任务已结束（结束事件已发送）或等待超时
+            if not pending:
+                return
+            yield from pending
+            index += len(pending)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待任务结束
+
+        Args:
+            timeout: 最长等待秒数
+
+        Returns:
+            任务是否已结束
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.status != "running", timeout)
+
+    def _progress(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "priority": self.priority,
+            "total": len(self._shots),
+            "upgraded": len(self._upgraded),
+            "kept_draft": len(self._kept_draft),
+            "upgraded_shot_ids": list(self._upgraded)
+        }
+
+    def _final_continuity_state(self) -> Dict[str, Any]:
+        """最后一个分镜被精修后，续生成应从LLM版本的结束状态衔接"""
+        if not self._shots or not self._upgraded or self._shots[-1]["shot_id"] not in self._upgraded:
+            return self._result.get("final_continuity_state", {})
+        return {anchor["character_name"]: anchor for anchor in self._shots[-1].get("continuity_anchor", [])
+                if isinstance(anchor, dict) and "character_name" in anchor}
+
+    def _refine_shot(self, index: int) -> Optional[Dict[str, Any]]:
+        """
+        用LLM重新生成并审查单个分镜
+
+        Args:
+            index: 分镜下标
+
+        Returns:
+            通过审查的新分镜；生成回退为规则结果或审查未通过时返回None
+        """
+        draft_shot = self._shots[index]
+        shot_context = self._draft_state["shot_contexts"][index]
+        segment = shot_context["segment"]
+        scenes = self._draft_state["structured_script"].get("scenes", [])
+        scene_id = segment.get("scene_id", 0)
+        scene_context = scenes[scene_id] if scene_id < len(scenes) else {}
+
+        # 按草稿生成该分镜时的状态重建连续性约束（规则推导，结果与草稿阶段一致）
+        continuity_constraints = self.continuity_guardian.generate_continuity_constraints(
+            segment,
+            shot_context["prev_continuity_state"],
+            scene_context,
+            ContinuityContext(character_states=dict(shot_context["character_states"]))
+        )
+        shot = self.shot_generator.generate_shot(segment, continuity_constraints, scene_context,
+                                                 self._draft_state["style"], index + 1)
+        if shot.get("meta_data", {}).get("generated_by") != GENERATED_BY_LLM:
+            debug(f"分镜 {draft_shot['shot_id']} 的LLM生成回退为规则结果，保留草稿")
+            return None
+
+        qa_result = self.qa_agent.review_single_shot(shot, segment)
+        if not qa_result.get("is_valid", False):
+            info(f"分镜 {draft_shot['shot_id']} 的LLM版本未通过审查，保留草稿: {qa_result.get('critical_issues')}")
+            return None
+        shot["shot_id"] = draft_shot["shot_id"]
+        return shot
+
+    def _run(self) -> None:
+        start = time.perf_counter()
+        status = "completed"
+        try:
+            workers = min(len(self._order), get_max_concurrency()) or 1
+            # 按优先级提交，线程池按提交顺序取任务，完成即推送
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="refine") as executor:
+                futures = {executor.submit(self._refine_shot, index): index for index in self._order}
+                for future in as_completed(futures):
+                    self._apply(futures[future], future)
+            info(f"精修任务 {self.job_id} 完成，升级 {len(self._upgraded)}/{len(self._shots)} 个分镜，"
+                 f"耗时 {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            error(f"精修任务 {self.job_id} 失败: {str(e)}")
+            status = "failed"
+        finally:
+            self._finish(status)
+
+    def _finish(self, status: str) -> None:
+        """结束任务：状态与结束事件一起更新，保证读取方看到任务结束时结束事件已可读"""
+        with self._condition:
+            self.status = status
+            self._events.append({"event": status, "seq": len(self._events), **self._progress()})
+            self._condition.notify_all()
+        _evict_finished_jobs()
+
+    def _critical_pair_issues(self, prev_shot: Dict[str, Any], shot: Dict[str, Any]) -> int:
+        return sum(1 for issue in self.qa_agent.review_shot_pair(prev_shot, shot) if issue["severity"] == "critical")
+
+    def _breaks_neighbours(self, index: int, shot: Dict[str, Any]) -> bool:
+        """
+        替换后是否与当前的前后分镜产生新的关键连续性问题（草稿中已存在的问题不计）
+        调用方持有锁，相邻分镜不会在检查期间被替换
+        """
+        for left, right in ((index - 1, index), (index, index + 1)):
+            if left < 0 or right >= len(self._shots):
+                continue
+            before = self._critical_pair_issues(self._shots[left], self._shots[right])
+            after = self._critical_pair_issues(shot if left == index else self._shots[left],
+                                               shot if right == index else self._shots[right])
+            if after > before:
+                return True
+        return False
+
+    def _apply(self, index: int, future) -> None:
+        """记录单个分镜的精修结果，通过审查且与相邻分镜连续的分镜原位替换并推送"""
+        shot_id = self._shots[index]["shot_id"]
+        try:
+            shot = future.result()
+        except Exception as e:
+            warning(f"分镜 {shot_id} 精修失败，保留草稿: {str(e)}")
+            shot = None
+        with self._condition:
+            if shot is not None and self._breaks_neighbours(index, shot):
+                info(f"分镜 {shot_id} 的LLM版本与相邻分镜不连续，保留草稿")
+                shot = None
+            if shot is None:
+                self._kept_draft.append(shot_id)
+                return
+            self._shots[index] = shot
+            self._upgraded.append(shot_id)
+            self._events.append({"event": "shot_upgraded", "seq": len(self._events),
+                                 "shot_id": shot_id, "index": index, "shot": shot})
+            self._condition.notify_all()
+
+
+def start_refinement_job(llm: Any,
+                         script_text: str,
+                         style: str = "realistic",
+                         duration_per_shot: int = 5,
+                         task_id: Optional[str] = None,
+                         prev_continuity_state: Optional[Any] = None,
+                         script_format: str = "auto",
+                         priority: str = PRIORITY_ORDER) -> RefinementJob:
+    """
+    生成规则草稿并启动后台LLM精修
+
+    Args:
+        llm: 语言模型实例
+        script_text: 原始剧本文本
+        style: 视频风格
+        duration_per_shot: 每段时长
+        task_id: 请求的唯一标识符
+        prev_continuity_state: 上一段的连续性状态
+        script_format: 剧本格式（auto / screenplay / chinese）
+        priority: 精修优先级（order / qa）
+
+    Returns:
+        已启动的精修任务，snapshot() 可立即得到完整的草稿分镜；未提供LLM时直接返回已完成的草稿任务
+    """
+    draft_state = get_draft_pipeline().generate_state(script_text, style, duration_per_shot, task_id,
+                                                      prev_continuity_state, script_format)
+    job_id = draft_state["result"]["job_id"]
+    job = RefinementJob(job_id, draft_state, ShotGeneratorAgent(llm=llm), QAAgent(llm=llm), priority)
+    with _jobs_lock:
+        _jobs[job_id] = job
+    if llm is None:
+        # 没有LLM时精修只会重新得到规则结果，草稿即最终结果
+        info(f"草稿分镜已生成，未提供LLM，不启动精修，任务 {job_id} 直接完成")
+        job._finish("completed")
+        return job
+    info(f"草稿分镜已生成，启动精修任务 {job_id}，共 {len(job._shots)} 个分镜")
+    return job.start()
+
+
+def get_refinement_job(job_id: str) -> Optional[RefinementJob]:
+    """
+    查询精修任务
+
+    Args:
+        job_id: 任务ID
+
+    Returns:
+        精修任务，不存在或已被淘汰时返回None
+    """
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def _evict_finished_jobs() -> None:
+    with _jobs_lock:
+        finished = [job_id for job_id, job in _jobs.items() if job.status != "running"]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del _jobs[job_id]
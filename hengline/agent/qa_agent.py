@@ -6,25 +6,69 @@
 @Time: 2025/10 - 2025/11
 """
 import json
+import random
+import threading
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 
+from config.config import get_storyboard_config
+from hengline.client.llm_limiter import invoke_llm
 from hengline.logger import debug, warning
 from hengline.prompts.prompts_manager import PromptManager
+from .batched_review import BatchedShotReviewer, DEFAULT_BATCH_SIZE, DEFAULT_BATCH_TOKEN_BUDGET, \
+    DEFAULT_BATCH_MAX_WAIT, get_batched_reviewer
+from .qa_rules import QARuleEngine, has_phone_action, make_sequence_issue
+
+# LLM高级审查只在规则审查置信度低于阈值时执行，其余分镜按抽样比例随机审查，用于评估跳过的准确性
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+DEFAULT_AUDIT_SAMPLE_RATE = 0.05
+
+# 规则审查置信度模型：从1开始，每条警告/建议按来源检查扣减，规则已发现关键问题时结论确定，不再调用LLM
+RULE_CONFIDENCE_PENALTIES = {
+    "basic_fields": {"warnings": 0.2, "suggestions": 0.0},
+    "duration": {"warnings": 0.1, "suggestions": 0.0},
+    "character_states": {"warnings": 0.15, "suggestions": 0.0},
+    "prompt_quality": {"warnings": 0.2, "suggestions": 0.05}
+}
+
+# LLM审查决定：rule_rejected规则已判定不通过，low_confidence置信度低，audit抽样审查，skipped跳过
+LLM_REVIEW_RULE_REJECTED = "rule_rejected"
+LLM_REVIEW_LOW_CONFIDENCE = "low_confidence"
+LLM_REVIEW_AUDIT = "audit"
+LLM_REVIEW_SKIPPED = "skipped"
 
 
 class QAAgent:
     """质量审查智能体"""
 
-    def __init__(self, llm=None):
+    def __init__(self, llm=None, confidence_threshold: Optional[float] = None,
+                 audit_sample_rate: Optional[float] = None):
         """
         初始化质量审查智能体
         
         Args:
             llm: 语言模型实例（可选，用于高级审查）
+            confidence_threshold: 规则审查置信度低于该值时调用LLM审查，默认读取配置项 storyboard.llm_review
+            audit_sample_rate: 置信度足够的分镜中抽样调用LLM审查的比例，默认读取配置项 storyboard.llm_review
         """
         self.llm = llm
         self.max_shot_duration = 5.5  # 最大允许时长（秒）
+        storyboard_config = get_storyboard_config()
+        # 规则审查：声明式规则编译为每个分镜一遍、每对相邻分镜一遍，可在配置项 storyboard.qa_rules 中关闭规则
+        qa_rules_config = storyboard_config.get("qa_rules", {})
+        self.rule_engine = QARuleEngine(self.max_shot_duration, qa_rules_config.get("disabled", []),
+                                        qa_rules_config.get("timing", True))
+        llm_review_config = storyboard_config.get("llm_review", {})
+        self.confidence_threshold = confidence_threshold if confidence_threshold is not None else \
+            llm_review_config.get("confidence_threshold", DEFAULT_CONFIDENCE_THRESHOLD)
+        self.audit_sample_rate = audit_sample_rate if audit_sample_rate is not None else \
+            llm_review_config.get("audit_sample_rate", DEFAULT_AUDIT_SAMPLE_RATE)
+        # 批量审查：并发的LLM审查合并为一次调用，batch_size为1（默认）时逐个审查
+        self.batch_size = llm_review_config.get("batch_size", DEFAULT_BATCH_SIZE)
+        self.batch_token_budget = llm_review_config.get("batch_token_budget", DEFAULT_BATCH_TOKEN_BUDGET)
+        self.batch_max_wait = llm_review_config.get("batch_max_wait_ms", DEFAULT_BATCH_MAX_WAIT * 1000) / 1000
+        self._batched_reviewer: Optional[BatchedShotReviewer] = None
+        self._batched_reviewer_lock = threading.Lock()
 
     def review_single_shot(self, shot: Dict[str, Any], segment: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -39,40 +83,23 @@ class QAAgent:
         """
         debug(f"审查分镜，ID: {shot.get('shot_id')}")
 
-        critical_issues = []  # 关键错误，需要修正
-        warnings = []         # 警告，不阻止继续处理
-        suggestions = []
-
-        # 检查基本字段
-        basic_check = self._check_basic_fields(shot)
-        critical_issues.extend(basic_check["critical_issues"])
-        warnings.extend(basic_check["warnings"])
-        suggestions.extend(basic_check["suggestions"])
-
-        # 检查时长
-        duration_check = self._check_duration(shot)
-        critical_issues.extend(duration_check["critical_issues"])
-        warnings.extend(duration_check["warnings"])
-        suggestions.extend(duration_check["suggestions"])
-
-        # 检查角色状态
-        character_check = self._check_character_states(shot)
-        critical_issues.extend(character_check["critical_issues"])
-        warnings.extend(character_check["warnings"])
-        suggestions.extend(character_check["suggestions"])
-
-        # 检查提示词质量
-        prompt_check = self._check_prompt_quality(shot)
-        critical_issues.extend(prompt_check["critical_issues"])
-        warnings.extend(prompt_check["warnings"])
-        suggestions.extend(prompt_check["suggestions"])
-
-        # 如果有LLM，进行高级审查
+        # 一遍执行基本字段、时长、角色状态、提示词质量等单分镜规则
+        findings, check_counts = self.rule_engine.run_shot(shot)
+        critical_issues = findings.critical_issues  # 关键错误，需要修正
+        warnings = findings.warnings                # 警告，不阻止继续处理
+        suggestions = findings.suggestions
+
+        # 如果有LLM，按规则审查的置信度决定是否进行高级审查
+        llm_review = None
         if self.llm:
-            advanced_check = self._advanced_review_with_llm(shot, segment)
-            critical_issues.extend(advanced_check.get("critical_issues", []))
-            warnings.extend(advanced_check.get("warnings", []))
-            suggestions.extend(advanced_check.get("suggestions", []))
+            llm_review = self._llm_review_decision(critical_issues, check_counts)
+            if llm_review["reviewed"]:
+                advanced_check = self._advanced_review(shot, segment)
+                llm_critical_issues = advanced_check.get("critical_issues", [])
+                critical_issues.extend(llm_critical_issues)
+                warnings.extend(advanced_check.get("warnings", []))
+                suggestions.extend(advanced_check.get("suggestions", []))
+                llm_review["passed"] = len(llm_critical_issues) == 0
 
         result = {
             "shot_id": shot.get("shot_id"),
@@ -81,6 +108,8 @@ class QAAgent:
             "warnings": warnings,
             "suggestions": suggestions
         }
+        if llm_review is not None:
+            result["llm_review"] = llm_review
 
         if critical_issues:
             warning(f"分镜 {shot.get('shot_id')} 审查发现关键问题: {critical_issues}")
@@ -91,9 +120,107 @@ class QAAgent:
 
         return result
 
+    def rule_confidence(self, check_counts: Dict[str, Tuple[int, int]]) -> float:
+        """
+        计算规则审查结论（通过）的置信度
+
+        Args:
+            check_counts: 各项规则检查的 (警告数, 建议数)，按规则名索引
+
+        Returns:
+            0~1之间的置信度
+        """
+        confidence = 1.0
+        for name, (n_warnings, n_suggestions) in check_counts.items():
+            penalties = RULE_CONFIDENCE_PENALTIES.get(name, {})
+            confidence -= n_warnings * penalties.get("warnings", 0.0)
+            confidence -= n_suggestions * penalties.get("suggestions", 0.0)
+        return max(0.0, round(confidence, 4))
+
+    def _llm_review_decision(self, critical_issues: List[str],
+                             check_counts: Dict[str, Tuple[int, int]]) -> Dict[str, Any]:
+        """决定是否调用LLM高级审查"""
+        if critical_issues:
+            return {"decision": LLM_REVIEW_RULE_REJECTED, "confidence": 0.0, "reviewed": False}
+        confidence = self.rule_confidence(check_counts)
+        if confidence < self.confidence_threshold:
+            decision = LLM_REVIEW_LOW_CONFIDENCE
+        elif random.random() < self.audit_sample_rate:
+            decision = LLM_REVIEW_AUDIT
+        else:
+            decision = LLM_REVIEW_SKIPPED
+        return {"decision": decision, "confidence": confidence,
+                "reviewed": decision in (LLM_REVIEW_LOW_CONFIDENCE, LLM_REVIEW_AUDIT)}
+
+    @staticmethod
+    def llm_review_counts(llm_review: Optional[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        将单次审查的LLM审查决定转换为计数，供工作流按任务累加
+
+        Args:
+            llm_review: 审查结果中的 llm_review 字段
+
+        Returns:
+            计数字典（未配置LLM时为空）
+        """
+        if not llm_review:
+            return {}
+        counts = {"reviews": 1, llm_review["decision"]: 1}
+        if llm_review["reviewed"]:
+            counts["llm_reviews"] = 1
+            outcome = "passed" if llm_review.get("passed", True) else "failed"
+            counts[f"{llm_review['decision']}_{outcome}"] = 1
+        return counts
+
+    @staticmethod
+    def summarize_llm_review(counts: Dict[str, int]) -> Dict[str, Any]:
+        """
+        汇总任务的LLM审查指标
+
+        Args:
+            counts: 累加后的计数
+
+        Returns:
+            审查次数、LLM审查次数、跳过次数及比例、各类决定的次数，以及抽样审查的通过/未通过次数
+        """
+        reviews = counts.get("reviews", 0)
+        llm_reviews = counts.get("llm_reviews", 0)
+        audits = counts.get(LLM_REVIEW_AUDIT, 0)
+        return {
+            "reviews": reviews,
+            "llm_reviews": llm_reviews,
+            "llm_reviews_skipped": reviews - llm_reviews,
+            "skip_rate": round((reviews - llm_reviews) / reviews, 4) if reviews else 0.0,
+            "rule_rejected": counts.get(LLM_REVIEW_RULE_REJECTED, 0),
+            "low_confidence": counts.get(LLM_REVIEW_LOW_CONFIDENCE, 0),
+            "low_confidence_failed": counts.get(f"{LLM_REVIEW_LOW_CONFIDENCE}_failed", 0),
+            "audits": audits,
+            "audits_passed": counts.get(f"{LLM_REVIEW_AUDIT}_passed", 0),
+            "audits_failed": counts.get(f"{LLM_REVIEW_AUDIT}_failed", 0)
+        }
+
+    def set_rule_enabled(self, name: str, enabled: bool):
+        """
+        开启或关闭审查规则
+
+        Args:
+            name: 规则名（见 qa_rules 中注册的规则）
+            enabled: 是否启用
+        """
+        self.rule_engine.set_rule_enabled(name, enabled)
+
+    def rule_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取每条审查规则的执行次数和耗时
+
+        Returns:
+            按规则名索引的统计信息
+        """
+        return self.rule_engine.rule_stats()
+
     def review_shot_sequence(self, shots: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
-        审查分镜序列的连续性
+        审查分镜序列的连续性（一次性审查整个序列，逐个分镜累积增量审查状态）
         
         Args:
             shots: 分镜列表
@@ -103,41 +230,136 @@ class QAAgent:
         """
         debug(f"审查分镜序列，共 {len(shots)} 个分镜")
 
-        continuity_issues = []
-        continuity_suggestions = []
+        review = self.create_sequence_review()
+        issues = []
+        for shot in shots:
+            issues.extend(self.review_sequence_step(review, shot))
+            review, accepted_issues = self.accept_sequence_shot(review, shot)
+            issues.extend(accepted_issues)
+        return self.finish_sequence_review(review, issues)
 
-        # 检查分镜之间的连续性
-        for i in range(1, len(shots)):
-            prev_shot = shots[i - 1]
-            current_shot = shots[i]
+    def create_sequence_review(self) -> Dict[str, Any]:
+        """
+        创建增量序列审查状态
+        只保存上一个已接受分镜的摘要、各角色出现次数和尚未确定的角色消失记录。
+        状态不可变，接受分镜时复制角色计数（消失记录只在变化时复制），每个分镜的开销为
+        O(已出现角色数)，与分镜总数无关；工作流检查点中每次也会完整保存这两个字典
 
-            # 检查时间连续性
-            time_continuity = self._check_time_continuity(prev_shot, current_shot)
-            if not time_continuity["is_continuous"]:
-                continuity_issues.append(f"分镜 {prev_shot.get('shot_id')} 和 {current_shot.get('shot_id')} 时间不连续")
-                continuity_suggestions.extend(time_continuity["suggestions"])
+        Returns:
+            增量审查状态（可序列化的字典）
+        """
+        return {
+            "total_shots": 0,
+            "prev_shot": None,
+            "character_counts": {},
+            "pending_disappearances": {},
+            "duration_exceeded": False
+        }
+
+    def review_sequence_step(self, review: Dict[str, Any], shot: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        审查候选分镜与上一个已接受分镜之间的连续性，不修改审查状态
 
-            # 检查角色连续性
-            character_continuity = self._check_character_continuity(prev_shot, current_shot)
-            continuity_issues.extend(character_continuity["issues"])
-            continuity_suggestions.extend(character_continuity["suggestions"])
+        Args:
+            review: 增量审查状态
+            shot: 候选分镜
+
+        Returns:
+            问题列表，每项包含 type / severity（critical / warning）/ shot_ids / characters / message / suggestions
+        """
+        prev_shot = review.get("prev_shot")
+        if not prev_shot:
+            return []
 
-            # 检查场景连续性
-            scene_continuity = self._check_scene_continuity(prev_shot, current_shot)
-            if not scene_continuity["is_continuous"]:
-                continuity_issues.append(f"分镜 {prev_shot.get('shot_id')} 和 {current_shot.get('shot_id')} 场景不连续")
-                continuity_suggestions.extend(scene_continuity["suggestions"])
+        # 一遍执行时间、场景、角色连续性等相邻分镜规则
+        return self.rule_engine.run_pair(prev_shot, shot)
 
-        # 检查整体叙事连贯性
-        narrative_check = self._check_narrative_coherence(shots)
-        continuity_issues.extend(narrative_check["issues"])
-        continuity_suggestions.extend(narrative_check["suggestions"])
+    def accept_sequence_shot(self, review: Dict[str, Any],
+                             shot: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        将分镜加入已接受序列，更新角色出现次数和消失记录
+
+        Args:
+            review: 增量审查状态（不会被修改）
+            shot: 已接受的分镜
+
+        Returns:
+            (新的审查状态, 本次确定的叙事问题)
+        """
+        issues = []
+        character_counts = review["character_counts"]
+        pending = review["pending_disappearances"]
+        prev_shot = review.get("prev_shot")
+        current_characters = list(dict.fromkeys(shot.get("characters_in_frame", [])))
+
+        # 写时复制：只有确实要修改时才复制字典，不修改传入的审查状态
+        if current_characters:
+            character_counts = dict(character_counts)
+        pending_copied = False
+        for character in current_characters:
+            character_counts[character] = character_counts.get(character, 0) + 1
+            # 角色出现超过2次后，此前记录的消失都属于叙事问题
+            if character_counts[character] > 2 and character in pending:
+                if not pending_copied:
+                    pending, pending_copied = dict(pending), True
+                issues.extend(self._disappearance_issue(character, shot_ids) for shot_ids in pending.pop(character))
+
+        # 检查是否有角色突然消失（出现次数是否超过2次可能要到后面才能确定）
+        if prev_shot:
+            shot_ids = [prev_shot.get("shot_id"), shot.get("shot_id")]
+            for character in prev_shot.get("characters_in_frame", []):
+                if character in current_characters:
+                    continue
+                if character_counts.get(character, 0) > 2:
+                    issues.append(self._disappearance_issue(character, shot_ids))
+                else:
+                    if not pending_copied:
+                        pending, pending_copied = dict(pending), True
+                    pending[character] = pending.get(character, []) + [shot_ids]
+
+        total_shots = review["total_shots"] + 1
+        duration_exceeded = review["duration_exceeded"]
+        # 视频总时长超过5分钟
+        if not duration_exceeded and total_shots * 5 > 300:
+            duration_exceeded = True
+            issues.append(make_sequence_issue("narrative", "warning", [shot.get("shot_id")], [],
+                                              "视频总时长过长，可能影响叙事连贯性", ["考虑精简内容或分章节制作"]))
+
+        new_review = {
+            "total_shots": total_shots,
+            "prev_shot": self._shot_summary(shot),
+            "character_counts": character_counts,
+            "pending_disappearances": pending,
+            "duration_exceeded": duration_exceeded
+        }
+        return new_review, issues
+
+    def finish_sequence_review(self, review: Dict[str, Any], issues: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        汇总增量审查的问题，生成序列审查结果
+
+        Args:
+            review: 增量审查状态
+            issues: 审查过程中累积的问题
+
+        Returns:
+            审查结果：critical_issues / warnings 为问题描述，issues 为结构化问题（含分镜ID和角色），
+            repair_targets 为需要重新生成的分镜
+        """
+        critical_issues = [issue["message"] for issue in issues if issue["severity"] == "critical"]
+        warnings = [issue["message"] for issue in issues if issue["severity"] != "critical"]
+        continuity_issues = [issue["message"] for issue in issues]
+        continuity_suggestions = [suggestion for issue in issues for suggestion in issue["suggestions"]]
 
         result = {
-            "total_shots": len(shots),
+            "total_shots": review["total_shots"],
             "has_continuity_issues": len(continuity_issues) > 0,
             "continuity_issues": continuity_issues,
             "continuity_suggestions": continuity_suggestions,
+            "critical_issues": critical_issues,
+            "warnings": warnings,
+            "issues": list(issues),
+            "repair_targets": self.repair_targets(issues),
             "overall_assessment": "通过" if len(continuity_issues) == 0 else "需要修正"
         }
 
@@ -148,133 +370,106 @@ class QAAgent:
 
         return result
 
-    def _check_basic_fields(self, shot: Dict[str, Any]) -> Dict[str, Any]:
-        """检查基本字段是否完整"""
-        critical_issues = []
-        warnings = []
-        suggestions = []
-
-        # 核心必填字段（缺少会导致功能错误）
-        core_required_fields = ["shot_id", "chinese_description"]
-        # 推荐字段（缺少会影响质量但不阻止继续）
-        recommended_fields = ["ai_prompt", "camera", "characters_in_frame"]
-
-        for field in core_required_fields:
-            if field not in shot or (isinstance(shot[field], (str, list)) and not shot[field]):
-                critical_issues.append(f"缺少必要字段: {field}")
-                suggestions.append(f"请添加 {field}")
-
-        for field in recommended_fields:
-            if field not in shot or (isinstance(shot[field], (str, list)) and not shot[field]):
-                warnings.append(f"缺少推荐字段: {field}")
-                suggestions.append(f"建议添加 {field}")
-
-        return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
-
-    def _check_duration(self, shot: Dict[str, Any]) -> Dict[str, Any]:
-        """检查分镜时长"""
-        critical_issues = []
-        warnings = []
-        suggestions = []
-
-        time_range = shot.get("time_range_sec", [0, 5])
-        if not isinstance(time_range, list) or len(time_range) != 2:
-            critical_issues.append("时间范围格式错误")
-            suggestions.append("请设置正确的时间范围格式 [开始时间, 结束时间]")
-            return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
-
-        duration = time_range[1] - time_range[0]
-
-        # 允许一定的容忍度，轻微超出范围只作为警告
-        if duration > self.max_shot_duration + 0.5:
-            critical_issues.append(f"分镜时长长于允许的最大值 {self.max_shot_duration} 秒")
-            suggestions.append("请缩短分镜时长或拆分为多个分镜")
-        elif duration > self.max_shot_duration:
-            warnings.append(f"分镜时长略长于推荐值 {self.max_shot_duration} 秒")
-            suggestions.append("建议适当缩短分镜时长")
-
-        return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
-
-    def _check_character_states(self, shot: Dict[str, Any]) -> Dict[str, Any]:
-        """检查角色状态是否合理"""
-        critical_issues = []
-        warnings = []
-        suggestions = []
-
-        # 检查初始状态和结束状态
-        initial_state = shot.get("initial_state", [])
-        final_state = shot.get("final_state", [])
-        characters_in_frame = shot.get("characters_in_frame", [])
-
-        # 特殊处理电话角色（标记为off-screen）
-        is_phone_scene = any("电话" in action.get("action", "") for action in shot.get("actions", []))
-        phone_characters = []
-        if is_phone_scene:
-            for character in characters_in_frame:
-                if "电话" in character or "对面" in character:
-                    phone_characters.append(character)
-
-        # 构建角色状态映射
-        initial_char_map = {s.get("character_name"): s for s in initial_state}
-        final_char_map = {s.get("character_name"): s for s in final_state}
-        all_state_characters = set(initial_char_map.keys()) | set(final_char_map.keys())
-
-        # 检查画面内角色是否都有状态信息
-        for character in characters_in_frame:
-            if character not in phone_characters and character not in all_state_characters:
-                warnings.append(f"角色 {character} 缺少状态信息")
-                suggestions.append(f"建议添加 {character} 的状态信息")
-
-        # 检查角色状态的合理性
-        for character_name, state in {**initial_char_map, **final_char_map}.items():
-            # 电话角色的特殊规则
-            if character_name in phone_characters:
-                if state.get("position") != "off-screen":
-                    warnings.append(f"电话角色 {character_name} 位置应为 'off-screen'")
-                    suggestions.append(f"设置 {character_name} 的位置为 'off-screen'")
-            else:
-                # 普通角色的状态检查
-                if "position" not in state:
-                    critical_issues.append(f"角色 {character_name} 缺少位置信息")
-                    suggestions.append(f"请添加 {character_name} 的位置信息")
-                # 姿势和情绪信息降级为警告
-                if "pose" not in state:
-                    warnings.append(f"角色 {character_name} 缺少姿势信息")
-                    suggestions.append(f"建议添加 {character_name} 的姿势信息")
-                if "emotion" not in state:
-                    warnings.append(f"角色 {character_name} 缺少情绪信息")
-                    suggestions.append(f"建议添加 {character_name} 的情绪信息")
-
-        return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
-
-    def _check_prompt_quality(self, shot: Dict[str, Any]) -> Dict[str, Any]:
-        """检查提示词质量"""
-        critical_issues = []
-        warnings = []
-        suggestions = []
-
-        ai_prompt = shot.get("ai_prompt", "")
-
-        # 提示词为空是警告级别
-        if not ai_prompt:
-            warnings.append("AI提示词为空")
-            suggestions.append("请添加AI提示词以提高生成质量")
+    def review_shot_pair(self, prev_shot: Dict[str, Any], shot: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        审查两个相邻分镜之间的连续性（修复分镜后只重新校验相邻分镜时使用）
+
+        Args:
+            prev_shot: 前一个分镜
+            shot: 当前分镜
+
+        Returns:
+            问题列表，格式同 review_sequence_step
+        """
+        review = self.create_sequence_review()
+        review["prev_shot"] = self._shot_summary(prev_shot)
+        return self.review_sequence_step(review, shot)
+
+    @staticmethod
+    def repair_targets(issues: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        按关键问题汇总需要重新生成的分镜（每对相邻分镜中的后一个）
+
+        Args:
+            issues: 结构化的序列问题
+
+        Returns:
+            按分镜顺序排列的修复目标，每项包含 shot_id、涉及的角色 characters 和关键问题 issues
+        """
+        targets = {}
+        for issue in issues:
+            if issue["severity"] != "critical" or not issue["shot_ids"]:
+                continue
+            target = targets.setdefault(issue["shot_ids"][-1], {"shot_id": issue["shot_ids"][-1],
+                                                                "characters": [], "issues": []})
+            target["characters"].extend(c for c in issue["characters"] if c not in target["characters"])
+            target["issues"].append(issue)
+        return list(targets.values())
+
+    @staticmethod
+    def _shot_summary(shot: Dict[str, Any]) -> Dict[str, Any]:
+        """增量审查只需要的上一分镜字段"""
+        scene_context = shot.get("scene_context") or {}
+        return {
+            "shot_id": shot.get("shot_id"),
+            "time_range_sec": shot.get("time_range_sec", [0, 5]),
+            "scene_context": {"location": scene_context.get("location"), "time": scene_context.get("time")},
+            "characters_in_frame": list(shot.get("characters_in_frame", [])),
+            "final_state": list(shot.get("final_state", [])),
+            "actions": [{"action": "电话"}] if has_phone_action(shot) else []
+        }
+
+    @staticmethod
+    def _disappearance_issue(character: str, shot_ids: List[Any]) -> Dict[str, Any]:
+        return make_sequence_issue("narrative", "warning", shot_ids, [character],
+                                   f"角色 {character} 突然消失", [f"请添加 {character} 的离开场景"])
+
+    def _advanced_review(self, shot: Dict[str, Any], segment: Dict[str, Any]) -> Dict[str, Any]:
+        """LLM高级审查，启用批量审查时与其他并发的审查合并调用，未得到结论时单独审查"""
+        if self.batch_size > 1:
+            verdict = self._get_batched_reviewer().review(shot, segment, self.llm)
+            if verdict is not None:
+                return self._normalize_llm_verdict(verdict)
+            debug(f"分镜 {shot.get('shot_id')} 未得到批量审查结论，单独审查")
+        return self._normalize_llm_verdict(self._advanced_review_with_llm(shot, segment))
+
+    @staticmethod
+    def _normalize_llm_verdict(verdict: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        统一LLM审查结论的格式
+        单独审查（qa_review）返回 is_valid / issues，批量审查（qa_review_batch）返回 is_valid / critical_issues / warnings；
+        统一为 critical_issues / warnings / suggestions：判定不通过时 issues 为关键问题，否则为警告
+
+        Args:
+            verdict: LLM返回的审查结论
+
+        Returns:
+            统一格式的审查结论
+        """
+        critical_issues = list(verdict.get("critical_issues") or [])
+        warnings = list(verdict.get("warnings") or [])
+        issues = list(verdict.get("issues") or [])
+        is_valid = verdict.get("is_valid", True) is not False
+        if is_valid:
+            warnings.extend(issues)
         else:
-            # 检查提示词长度，轻微过短只作为警告
-            if len(ai_prompt) < 10:
-                critical_issues.append("AI提示词过短")
-                suggestions.append("请添加更多细节到提示词")
-            elif len(ai_prompt) < 20:
-                warnings.append("AI提示词较短")
-                suggestions.append("建议添加更多细节到提示词")
-
-            # 检查是否包含必要元素
-            essential_elements = ["shot", "lighting", "style"]
-            for element in essential_elements:
-                if element not in ai_prompt.lower():
-                    suggestions.append(f"建议在提示词中添加 {element} 相关描述")
-
-        return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
+            critical_issues.extend(issues)
+            if not critical_issues:
+                critical_issues.append("LLM审查判定分镜不合格")
+        return {
+            "critical_issues": critical_issues,
+            "warnings": warnings,
+            "suggestions": list(verdict.get("suggestions") or [])
+        }
+
+    def _get_batched_reviewer(self) -> BatchedShotReviewer:
+        if self._batched_reviewer is None:
+            with self._batched_reviewer_lock:
+                if self._batched_reviewer is None:
+                    self._batched_reviewer = get_batched_reviewer(
+                        self.llm, self.batch_size, self.batch_token_budget, self.batch_max_wait) or \
+                        BatchedShotReviewer(self.llm, self.batch_size, self.batch_token_budget, self.batch_max_wait)
+        return self._batched_reviewer
 
     def _advanced_review_with_llm(self, shot: Dict[str, Any], segment: Dict[str, Any]) -> Dict[str, Any]:
         """使用LLM进行高级审查"""
@@ -289,8 +484,8 @@ class QAAgent:
                 segment_info=json.dumps(segment, ensure_ascii=False)
             )
 
-            # 调用LLM
-            response = self.llm.invoke(filled_prompt)
+            # 调用LLM（占用全局并发槽位）
+            response = invoke_llm(self.llm, filled_prompt)
 
             # 处理可能的响应对象
             response_text = response.content if hasattr(response, 'content') else response
@@ -318,160 +513,3 @@ class QAAgent:
         except Exception as e:
             warning(f"LLM高级审查失败: {str(e)}")
             return {"issues": [], "suggestions": []}
-
-    def _check_time_continuity(self, prev_shot: Dict[str, Any], current_shot: Dict[str, Any]) -> Dict[str, Any]:
-        """检查时间连续性"""
-        prev_end = prev_shot.get("time_range_sec", [0, 5])[1]
-        current_start = current_shot.get("time_range_sec", [5, 10])[0]
-
-        is_continuous = abs(prev_end - current_start) < 0.1
-
-        suggestions = []
-        if not is_continuous:
-            suggestions.append("修正时间范围以确保连续")
-
-        return {
-            "is_continuous": is_continuous,
-            "suggestions": suggestions
-        }
-
-    def _check_character_continuity(self, prev_shot: Dict[str, Any], current_shot: Dict[str, Any]) -> Dict[str, Any]:
-        """检查角色连续性"""
-        critical_issues = []
-        warnings = []
-        suggestions = []
-
-        # 获取前一个分镜的结束状态和当前分镜的初始状态
-        prev_final_state = {s.get("character_name"): s for s in prev_shot.get("final_state", [])}
-        current_initial_state = {s.get("character_name"): s for s in current_shot.get("initial_state", [])}
-
-        # 特殊处理电话场景
-        is_prev_phone = any("电话" in action.get("action", "") for action in prev_shot.get("actions", []))
-        is_current_phone = any("电话" in action.get("action", "") for action in current_shot.get("actions", []))
-        
-        # 检查共同角色
-        common_characters = set(prev_final_state.keys()) & set(current_initial_state.keys())
-
-        for character in common_characters:
-            prev_state = prev_final_state[character]
-            current_state = current_initial_state[character]
-
-            # 电话角色特殊处理
-            is_phone_character = "电话" in character or "对面" in character
-            
-            # 检查位置连续性（允许合理的位置变化）
-            prev_pos = prev_state.get("position")
-            current_pos = current_state.get("position")
-            
-            if is_phone_character:
-                # 电话角色位置应该始终为off-screen
-                if prev_pos != "off-screen" and current_pos != "off-screen":
-                    warnings.append(f"电话角色 {character} 位置应为 'off-screen'")
-                    suggestions.append(f"设置 {character} 的位置为 'off-screen'")
-            elif prev_pos and current_pos and prev_pos != current_pos:
-                # 允许合理的位置变化（例如：站立->坐下、门口->窗边等）
-                # 只有剧烈的位置变化才作为警告
-                剧烈变化 = [
-                    ("客厅", "卧室"), ("卧室", "客厅"),
-                    ("室内", "室外"), ("室外", "室内")
-                ]
-                if (prev_pos, current_pos) in 剧烈变化 or (current_pos, prev_pos) in 剧烈变化:
-                    warnings.append(f"角色 {character} 位置变化较大")
-                    suggestions.append(f"确保 {character} 的位置变化有合理过渡")
-
-            # 检查情绪连续性
-            prev_emotion = prev_state.get("emotion")
-            current_emotion = current_state.get("emotion")
-            if prev_emotion and current_emotion and prev_emotion != current_emotion:
-                # 检查是否是合理的情绪过渡
-                if not self._is_valid_emotion_transition(prev_emotion, current_emotion):
-                    warnings.append(f"角色 {character} 情绪过渡可能不合理")
-                    suggestions.append(f"建议添加 {character} 的情绪过渡描述")
-
-        # 检查角色突然出现或消失
-        prev_characters = set(prev_final_state.keys())
-        current_characters = set(current_initial_state.keys())
-        
-        new_characters = current_characters - prev_characters
-        if new_characters:
-            warnings.append(f"新角色突然出现: {', '.join(new_characters)}")
-            suggestions.append("建议添加角色入场的自然过渡")
-            
-        disappeared_characters = prev_characters - current_characters
-        if disappeared_characters:
-            warnings.append(f"角色突然消失: {', '.join(disappeared_characters)}")
-            suggestions.append("建议添加角色退场的自然过渡")
-
-        return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
-
-    def _check_scene_continuity(self, prev_shot: Dict[str, Any], current_shot: Dict[str, Any]) -> Dict[str, Any]:
-        """检查场景连续性"""
-        prev_scene = prev_shot.get("scene_context", {})
-        current_scene = current_shot.get("scene_context", {})
-
-        is_continuous = True
-        suggestions = []
-
-        # 检查位置、时间、氛围是否连续
-        if prev_scene.get("location") != current_scene.get("location"):
-            is_continuous = False
-            suggestions.append("场景位置发生变化，请确保有合理的转场")
-
-        if prev_scene.get("time") != current_scene.get("time"):
-            is_continuous = False
-            suggestions.append("场景时间发生变化，请添加时间过渡说明")
-
-        return {
-            "is_continuous": is_continuous,
-            "suggestions": suggestions
-        }
-
-    def _check_narrative_coherence(self, shots: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """检查叙事连贯性"""
-        issues = []
-        suggestions = []
-
-        # 简单的叙事连贯性检查
-        total_duration = len(shots) * 5
-        if total_duration > 300:  # 超过5分钟
-            issues.append("视频总时长过长，可能影响叙事连贯性")
-            suggestions.append("考虑精简内容或分章节制作")
-
-        # 检查角色出现频率
-        character_counts = {}
-        for shot in shots:
-            for character in shot.get("characters_in_frame", []):
-                character_counts[character] = character_counts.get(character, 0) + 1
-
-        # 检查是否有角色突然消失
-        for i in range(1, len(shots)):
-            prev_characters = set(shots[i - 1].get("characters_in_frame", []))
-            current_characters = set(shots[i].get("characters_in_frame", []))
-
-            disappeared_characters = prev_characters - current_characters
-            for character in disappeared_characters:
-                # 如果角色出现过多次但突然消失，可能是问题
-                if character_counts.get(character, 0) > 2:
-                    issues.append(f"角色 {character} 突然消失")
-                    suggestions.append(f"请添加 {character} 的离开场景")
-
-        return {"issues": issues, "suggestions": suggestions}
-
-    def _is_valid_emotion_transition(self, prev_emotion: str, current_emotion: str) -> bool:
-        """检查情绪过渡是否合理"""
-        # 定义有效的情绪过渡对
-        valid_transitions = {
-            "平静": ["惊讶", "注意", "思考", "微笑"],
-            "惊讶": ["震惊", "恐惧", "困惑", "平静"],
-            "震惊": ["恐惧", "悲伤", "愤怒", "平静"],
-            "愤怒": ["攻击", "冷静", "悲伤"],
-            "悲伤": ["哭泣", "平静", "接受"],
-            "快乐": ["大笑", "平静", "兴奋"],
-            "紧张": ["焦虑", "恐惧", "平静"],
-            "恐惧": ["逃跑", "震惊", "平静"],
-        }
-
-        if prev_emotion in valid_transitions:
-            return current_emotion in valid_transitions[prev_emotion] or current_emotion == prev_emotion
-
-        return True
@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+@FileName: qa_rules.py
+@Description: 声明式分镜审查规则引擎：单分镜规则与相邻分镜规则分别注册，编译为按顺序执行的规则元组，
+              每个分镜（每对相邻分镜）只预计算一次角色状态映射、电话场景等查找结果，规则可开关并各自统计耗时
+@Author: HengLine
+@Time: 2025/11
+"""
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from hengline.tools.emotion_transition_tool import EmotionTransitionMatrix, get_emotion_transition_matrix
+
+# 规则作用范围：shot 单个分镜，pair 相邻的两个分镜
+SCOPE_SHOT = "shot"
+SCOPE_PAIR = "pair"
+
+# 核心必填字段（缺少会导致功能错误）与推荐字段（缺少会影响质量但不阻止继续）
+CORE_REQUIRED_FIELDS = ("shot_id", "chinese_description")
+RECOMMENDED_FIELDS = ("ai_prompt", "camera", "characters_in_frame")
+
+# 提示词应包含的元素
+PROMPT_ESSENTIAL_ELEMENTS = ("shot", "lighting", "style")
+
+# 剧烈的位置变化（两个方向都收录）
+DRASTIC_POSITION_CHANGES: FrozenSet[Tuple[str, str]] = frozenset(
+    change for prev, current in (("客厅", "卧室"), ("室内", "室外")) for change in ((prev, current), (current, prev))
+)
+
+PHONE_KEYWORD = "电话"
+PHONE_COUNTERPART_KEYWORD = "对面"
+
+_NO_CHARACTERS: FrozenSet[str] = frozenset()
+
+
+def has_phone_action(shot: Dict[str, Any]) -> bool:
+    """分镜动作中是否包含打电话"""
+    for action in shot.get("actions", ()):
+        if PHONE_KEYWORD in action.get("action", ""):
+            return True
+    return False
+
+
+def is_phone_character(character: Any) -> bool:
+    """角色名是否表示电话那头的角色"""
+    return isinstance(character, str) and (PHONE_KEYWORD in character or PHONE_COUNTERPART_KEYWORD in character)
+
+
+class ShotFacts:
+    """单个分镜的预计算查找结果，所有单分镜规则共用"""
+    __slots__ = ("shot", "characters_in_frame", "initial_map", "final_map", "phone_characters")
+
+    def __init__(self, shot: Dict[str, Any]):
+        self.shot = shot
+        self.characters_in_frame = shot.get("characters_in_frame", [])
+        self.initial_map = {s.get("character_name"): s for s in shot.get("initial_state", [])}
+        self.final_map = {s.get("character_name"): s for s in shot.get("final_state", [])}
+        # 电话场景中，名字表示电话那头的角色标记为off-screen
+        self.phone_characters = frozenset(c for c in self.characters_in_frame if is_phone_character(c)) \
+            if has_phone_action(shot) else _NO_CHARACTERS
+
+
+class PairFacts:
+    """相邻两个分镜的预计算查找结果，所有相邻分镜规则共用"""
+    __slots__ = ("prev_shot", "shot", "shot_ids", "prev_scene", "scene", "same_scene",
+                 "prev_final_map", "initial_map")
+
+    def __init__(self, prev_shot: Dict[str, Any], shot: Dict[str, Any]):
+        self.prev_shot = prev_shot
+        self.shot = shot
+        self.shot_ids = [prev_shot.get("shot_id"), shot.get("shot_id")]
+        self.prev_scene = prev_shot.get("scene_context") or {}
+        self.scene = shot.get("scene_context") or {}
+        self.same_scene = self.prev_scene.get("location") == self.scene.get("location") and \
+            self.prev_scene.get("time") == self.scene.get("time")
+        self.prev_final_map = {s.get("character_name"): s for s in prev_shot.get("final_state", [])}
+        self.initial_map = {s.get("character_name"): s for s in shot.get("initial_state", [])}
+
+
+class ShotFindings:
+    """单分镜规则的审查结果累加器"""
+    __slots__ = ("critical_issues", "warnings", "suggestions")
+
+    def __init__(self):
+        self.critical_issues: List[str] = []
+        self.warnings: List[str] = []
+        self.suggestions: List[str] = []
+
+
+@dataclass(frozen=True)
+class QARule:
+    """
+    审查规则
+
+    Attributes:
+        name: 规则名（单分镜规则的名字同时是置信度扣减项的名字）
+        scope: 作用范围 shot / pair
+        check: 单分镜规则 check(engine, ShotFacts, ShotFindings)；相邻分镜规则 check(engine, PairFacts, issues)
+        description: 规则说明
+    """
+    name: str
+    scope: str
+    check: Callable[..., None]
+    description: str = ""
+
+
+# 规则注册表，按注册顺序执行
+_RULES: Dict[str, QARule] = {}
+
+
+def qa_rule(name: str, scope: str, description: str = "") -> Callable:
+    """注册审查规则的装饰器"""
+
+    def decorator(check: Callable[..., None]) -> Callable[..., None]:
+        if name in _RULES:
+            raise ValueError(f"审查规则重复注册: {name}")
+        _RULES[name] = QARule(name, scope, check, description)
+        return check
+
+    return decorator
+
+
+def registered_rules() -> List[QARule]:
+    """按执行顺序返回所有已注册的规则"""
+    return list(_RULES.values())
+
+
+def make_sequence_issue(issue_type: str, severity: str, shot_ids: List[Any], characters: List[str],
+                        message: str, suggestions: List[str]) -> Dict[str, Any]:
+    """构造结构化的序列问题"""
+    return {
+        "type": issue_type,
+        "severity": severity,
+        "shot_ids": shot_ids,
+        "characters": characters,
+        "message": message,
+        "suggestions": suggestions
+    }
+
+
+class QARuleEngine:
+    """
+    编译后的审查规则引擎
+    启用的规则编译为元组，每个分镜/每对相邻分镜只构建一次预计算结果并顺序执行；
+    统计值在多线程共享时为近似值
+    """
+
+    def __init__(self, max_shot_duration: float = 5.5, disabled_rules: Optional[Iterable[str]] = None,
+                 timing: bool = True, emotion_transitions: Optional[EmotionTransitionMatrix] = None):
+        """
+        Args:
+            max_shot_duration: 最大允许时长（秒）
+            disabled_rules: 禁用的规则名
+            timing: 是否统计每条规则的耗时
+            emotion_transitions: 情绪过渡矩阵，默认使用进程内共享的矩阵
+        """
+        self.max_shot_duration = max_shot_duration
+        self.emotion_transitions = emotion_transitions or get_emotion_transition_matrix()
+        self.timing = timing
+        self._disabled = set()
+        # 每条规则的 [执行次数, 累计耗时(纳秒)]
+        self._stats: Dict[str, List[int]] = {rule.name: [0, 0] for rule in _RULES.values()}
+        # 编译后的规则：(规则名, 检查函数, 统计列表)
+        self._shot_rules: Tuple[Tuple[str, Callable[..., None], List[int]], ...] = ()
+        self._pair_rules: Tuple[Tuple[str, Callable[..., None], List[int]], ...] = ()
+        for name in disabled_rules or ():
+            self._require_rule(name)
+            self._disabled.add(name)
+        self._compile()
+
+    def _require_rule(self, name: str):
+        if name not in _RULES:
+            raise ValueError(f"未知的审查规则: {name}")
+
+    def _compile(self):
+        enabled = [(rule.scope, (rule.name, rule.check, self._stats[rule.name]))
+                   for rule in _RULES.values() if rule.name not in self._disabled]
+        self._shot_rules = tuple(compiled for scope, compiled in enabled if scope == SCOPE_SHOT)
+        self._pair_rules = tuple(compiled for scope, compiled in enabled if scope == SCOPE_PAIR)
+
+    def set_rule_enabled(self, name: str, enabled: bool):
+        """
+        开启或关闭规则
+
+        Args:
+            name: 规则名
+            enabled: 是否启用
+        """
+        self._require_rule(name)
+        if enabled:
+            self._disabled.discard(name)
+        else:
+            self._disabled.add(name)
+        self._compile()
+
+    def is_rule_enabled(self, name: str) -> bool:
+        self._require_rule(name)
+        return name not in self._disabled
+
+    def run_shot(self, shot: Dict[str, Any]) -> Tuple[ShotFindings, Dict[str, Tuple[int, int]]]:
+        """
+        对单个分镜执行所有启用的单分镜规则
+
+        Args:
+            shot: 分镜对象
+
+        Returns:
+            (审查结果, 按规则名索引的 (警告数, 建议数)，用于计算规则审查置信度)
+        """
+        facts = ShotFacts(shot)
+        findings = ShotFindings()
+        counts = {}
+        warnings, suggestions = findings.warnings, findings.suggestions
+        timing = self.timing
+        for name, check, stats in self._shot_rules:
+            n_warnings, n_suggestions = len(warnings), len(suggestions)
+            if timing:
+                start = time.perf_counter_ns()
+                check(self, facts, findings)
+                stats[0] += 1
+                stats[1] += time.perf_counter_ns() - start
+            else:
+                check(self, facts, findings)
+            counts[name] = (len(warnings) - n_warnings, len(suggestions) - n_suggestions)
+        return findings, counts
+
+    def run_pair(self, prev_shot: Dict[str, Any], shot: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        对相邻两个分镜执行所有启用的相邻分镜规则
+
+        Args:
+            prev_shot: 前一个分镜（或其摘要）
+            shot: 当前分镜
+
+        Returns:
+            结构化的问题列表
+        """
+        facts = PairFacts(prev_shot, shot)
+        issues: List[Dict[str, Any]] = []
+        timing = self.timing
+        for name, check, stats in self._pair_rules:
+            if timing:
+                start = time.perf_counter_ns()
+                check(self, facts, issues)
+                stats[0] += 1
+                stats[1] += time.perf_counter_ns() - start
+            else:
+                check(self, facts, issues)
+        return issues
+
+    def rule_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取每条规则的执行统计
+
+        Returns:
+            按规则名索引：作用范围、是否启用、执行次数、累计耗时（毫秒）、平均耗时（微秒）
+        """
+        result = {}
+        for rule in _RULES.values():
+            calls, total_ns = self._stats[rule.name]
+            result[rule.name] = {
+                "scope": rule.scope,
+                "enabled": rule.name not in self._disabled,
+                "calls": calls,
+                "total_ms": round(total_ns / 1e6, 3),
+                "avg_us": round(total_ns / calls / 1e3, 3) if calls else 0.0
+            }
+        return result
+
+    def reset_stats(self):
+        """清空规则执行统计"""
+        for stats in self._stats.values():
+            stats[0] = stats[1] = 0
+
+
+# 缺少的字段：不存在，或为空字符串/空列表
+_ABSENT = object()
+
+
+@qa_rule("basic_fields", SCOPE_SHOT, "检查基本字段是否完整")
+def _rule_basic_fields(engine: QARuleEngine, facts: ShotFacts, out: ShotFindings):
+    shot = facts.shot
+    for field in CORE_REQUIRED_FIELDS:
+        value = shot.get(field, _ABSENT)
+        if value is _ABSENT or (not value and isinstance(value, (str, list))):
+            out.critical_issues.append(f"缺少必要字段: {field}")
+            out.suggestions.append(f"请添加 {field}")
+    for field in RECOMMENDED_FIELDS:
+        value = shot.get(field, _ABSENT)
+        if value is _ABSENT or (not value and isinstance(value, (str, list))):
+            out.warnings.append(f"缺少推荐字段: {field}")
+            out.suggestions.append(f"建议添加 {field}")
+
+
+@qa_rule("duration", SCOPE_SHOT, "检查分镜时长")
+def _rule_duration(engine: QARuleEngine, facts: ShotFacts, out: ShotFindings):
+    time_range = facts.shot.get("time_range_sec", [0, 5])
+    if not isinstance(time_range, list) or len(time_range) != 2:
+        out.critical_issues.append("时间范围格式错误")
+        out.suggestions.append("请设置正确的时间范围格式 [开始时间, 结束时间]")
+        return
+
+    duration = time_range[1] - time_range[0]
+    # 允许一定的容忍度，轻微超出范围只作为警告
+    if duration > engine.max_shot_duration + 0.5:
+        out.critical_issues.append(f"分镜时长长于允许的最大值 {engine.max_shot_duration} 秒")
+        out.suggestions.append("请缩短分镜时长或拆分为多个分镜")
+    elif duration > engine.max_shot_duration:
+        out.warnings.append(f"分镜时长略长于推荐值 {engine.max_shot_duration} 秒")
+        out.suggestions.append("建议适当缩短分镜时长")
+
+
+@qa_rule("character_states", SCOPE_SHOT, "检查角色状态是否合理")
+def _rule_character_states(engine: QARuleEngine, facts: ShotFacts, out: ShotFindings):
+    initial_map, final_map, phone_characters = facts.initial_map, facts.final_map, facts.phone_characters
+
+    # 检查画面内角色是否都有状态信息
+    for character in facts.characters_in_frame:
+        if character not in phone_characters and character not in initial_map and character not in final_map:
+            out.warnings.append(f"角色 {character} 缺少状态信息")
+            out.suggestions.append(f"建议添加 {character} 的状态信息")
+
+    # 检查角色状态的合理性（结束状态覆盖同名的初始状态）
+    for character_name, state in ({**initial_map, **final_map} if final_map else initial_map).items():
+        if character_name in phone_characters:
+            # 电话角色的特殊规则
+            if state.get("position") != "off-screen":
+                out.warnings.append(f"电话角色 {character_name} 位置应为 'off-screen'")
+                out.suggestions.append(f"设置 {character_name} 的位置为 'off-screen'")
+            continue
+        if "position" not in state:
+            out.critical_issues.append(f"角色 {character_name} 缺少位置信息")
+            out.suggestions.append(f"请添加 {character_name} 的位置信息")
+        # 姿势和情绪信息降级为警告
+        if "pose" not in state:
+            out.warnings.append(f"角色 {character_name} 缺少姿势信息")
+            out.suggestions.append(f"建议添加 {character_name} 的姿势信息")
+        if "emotion" not in state:
+            out.warnings.append(f"角色 {character_name} 缺少情绪信息")
+            out.suggestions.append(f"建议添加 {character_name} 的情绪信息")
+
+
+@qa_rule("prompt_quality", SCOPE_SHOT, "检查提示词质量")
+def _rule_prompt_quality(engine: QARuleEngine, facts: ShotFacts, out: ShotFindings):
+    ai_prompt = facts.shot.get("ai_prompt", "")
+    # 提示词为空是警告级别
+    if not ai_prompt:
+        out.warnings.append("AI提示词为空")
+        out.suggestions.append("请添加AI提示词以提高生成质量")
+        return
+
+    # 检查提示词长度，轻微过短只作为警告
+    if len(ai_prompt) < 10:
+        out.critical_issues.append("AI提示词过短")
+        out.suggestions.append("请添加更多细节到提示词")
+    elif len(ai_prompt) < 20:
+        out.warnings.append("AI提示词较短")
+        out.suggestions.append("建议添加更多细节到提示词")
+
+    # 检查是否包含必要元素
+    lowered = ai_prompt.lower()
+    for element in PROMPT_ESSENTIAL_ELEMENTS:
+        if element not in lowered:
+            out.suggestions.append(f"建议在提示词中添加 {element} 相关描述")
+
+
+@qa_rule("time_continuity", SCOPE_PAIR, "检查相邻分镜的时间连续性")
+def _rule_time_continuity(engine: QARuleEngine, facts: PairFacts, issues: List[Dict[str, Any]]):
+    prev_end = facts.prev_shot.get("time_range_sec", [0, 5])[1]
+    current_start = facts.shot.get("time_range_sec", [5, 10])[0]
+    if abs(prev_end - current_start) >= 0.1:
+        shot_ids = facts.shot_ids
+        issues.append(make_sequence_issue("time", "warning", shot_ids, [],
+                                          f"分镜 {shot_ids[0]} 和 {shot_ids[1]} 时间不连续",
+                                          ["修正时间范围以确保连续"]))
+
+
+@qa_rule("scene_continuity", SCOPE_PAIR, "检查相邻分镜的场景连续性")
+def _rule_scene_continuity(engine: QARuleEngine, facts: PairFacts, issues: List[Dict[str, Any]]):
+    if facts.same_scene:
+        return
+    suggestions = []
+    if facts.prev_scene.get("location") != facts.scene.get("location"):
+        suggestions.append("场景位置发生变化，请确保有合理的转场")
+    if facts.prev_scene.get("time") != facts.scene.get("time"):
+        suggestions.append("场景时间发生变化，请添加时间过渡说明")
+    shot_ids = facts.shot_ids
+    issues.append(make_sequence_issue("scene", "warning", shot_ids, [],
+                                      f"分镜 {shot_ids[0]} 和 {shot_ids[1]} 场景不连续", suggestions))
+
+
+@qa_rule("character_continuity", SCOPE_PAIR, "检查相邻分镜的角色位置、情绪连续性及角色出现/消失")
+def _rule_character_continuity(engine: QARuleEngine, facts: PairFacts, issues: List[Dict[str, Any]]):
+    shot_ids = facts.shot_ids
+    prev_final_map, initial_map = facts.prev_final_map, facts.initial_map
+    # 多数相邻分镜的角色不变，此时不需要计算角色集合的交集和差集
+    same_cast = prev_final_map.keys() == initial_map.keys()
+
+    # 检查共同角色
+    for character in sorted(initial_map if same_cast else prev_final_map.keys() & initial_map.keys(), key=str):
+        prev_state = prev_final_map[character]
+        current_state = initial_map[character]
+
+        # 检查位置连续性（允许合理的位置变化）
+        prev_pos = prev_state.get("position")
+        current_pos = current_state.get("position")
+        if is_phone_character(character):
+            # 电话角色位置应该始终为off-screen
+            if prev_pos != "off-screen" and current_pos != "off-screen":
+                issues.append(make_sequence_issue("character", "warning", shot_ids, [character],
+                                                  f"电话角色 {character} 位置应为 'off-screen'",
+                                                  [f"设置 {character} 的位置为 'off-screen'"]))
+        elif prev_pos and current_pos and prev_pos != current_pos:
+            if facts.same_scene:
+                # 同一场景中开始位置与上一分镜的结束位置不一致（包括客厅→卧室这样的剧烈变化），
+                # 后续分镜会基于错误的锚点继续生成
+                issues.append(make_sequence_issue("character", "critical", shot_ids, [character],
+                                                  f"角色 {character} 位置冲突: 上一分镜结束于 {prev_pos}，"
+                                                  f"本分镜开始于 {current_pos}",
+                                                  [f"{character} 应从 {prev_pos} 开始"]))
+            elif (prev_pos, current_pos) in DRASTIC_POSITION_CHANGES:
+                # 跨场景时只有剧烈的位置变化才作为警告
+                issues.append(make_sequence_issue("character", "warning", shot_ids, [character],
+                                                  f"角色 {character} 位置变化较大",
+                                                  [f"确保 {character} 的位置变化有合理过渡"]))
+
+        # 检查情绪连续性
+        prev_emotion = prev_state.get("emotion")
+        current_emotion = current_state.get("emotion")
+        if prev_emotion and current_emotion and not engine.emotion_transitions.is_valid(prev_emotion, current_emotion):
+            issues.append(make_sequence_issue("character", "warning", shot_ids, [character],
+                                              f"角色 {character} 情绪过渡可能不合理",
+                                              [f"建议添加 {character} 的情绪过渡描述"]))
+
+    if same_cast:
+        return
+
+    # 检查角色突然出现或消失
+    new_characters = sorted(initial_map.keys() - prev_final_map.keys(), key=str)
+    if new_characters:
+        issues.append(make_sequence_issue("character", "warning", shot_ids, new_characters,
+                                          f"新角色突然出现: {', '.join(new_characters)}",
+                                          ["建议添加角色入场的自然过渡"]))
+
+    disappeared_characters = sorted(prev_final_map.keys() - initial_map.keys(), key=str)
+    if disappeared_characters:
+        issues.append(make_sequence_issue("character", "warning", shot_ids, disappeared_characters,
+                                          f"角色突然消失: {', '.join(disappeared_characters)}",
+                                          ["建议添加角色退场的自然过渡"]))
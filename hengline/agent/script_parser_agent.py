@@ -5,25 +5,74 @@
 @Author: HengLine
 @Time: 2025/10 - 2025/11
 """
+import itertools
 import json
+import os
 import re
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterable, Iterator
 
 import jieba
 import yaml
 
+from hengline.client.llm_limiter import invoke_llm, map_llm_tasks
 from hengline.logger import debug, error, warning
 from hengline.tools.result_storage_tool import create_result_storage, save_script_parser_result
+from hengline.tools.script_format_tool import FORMAT_AUTO, FORMAT_CHINESE, FORMAT_SCREENPLAY, classify_script_format
 # 导入LlamaIndex相关工具
 from hengline.tools.script_intelligence_tool import create_script_intelligence
-from hengline.tools.script_parser_tool import ScriptParser
+from hengline.tools.script_parser_tool import ScriptParser, iter_mmap_lines
 from utils.log_utils import print_log_exception
 
 
+# 场景级并行解析的共享进程池（按配置文件和进程数复用，避免每个请求重复启动进程和加载jieba词典）
+_parse_pool_lock = threading.Lock()
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_key: Optional[tuple] = None
+
+# 工作进程内的规则解析器实例，由_init_parse_worker初始化
+_worker_parser: Optional["ScriptParserAgent"] = None
+
+
+def _init_parse_worker(config_path: str):
+    """进程池工作进程初始化：预加载jieba词典并编译解析模式"""
+    global _worker_parser
+    jieba.initialize()
+    _worker_parser = ScriptParserAgent.create_rule_parser(config_path)
+
+
+def _parse_scene_in_worker(scene_info: Dict[str, str]) -> Dict[str, Any]:
+    """在工作进程中解析单个场景"""
+    return _worker_parser._build_scene(scene_info)
+
+
+def _get_parse_pool(config_path: str, max_workers: int) -> ProcessPoolExecutor:
+    """获取（必要时创建）场景解析进程池"""
+    global _parse_pool, _parse_pool_key
+    key = (config_path, max_workers)
+    with _parse_pool_lock:
+        if _parse_pool is None or _parse_pool_key != key:
+            if _parse_pool is not None:
+                _parse_pool.shutdown(wait=False)
+            debug(f"创建场景解析进程池，进程数: {max_workers}")
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_parse_worker,
+                initargs=(config_path,)
+            )
+            _parse_pool_key = key
+        return _parse_pool
+
+
 class ScriptParserAgent:
     """优化版剧本解析智能体"""
 
+    # 流式解析时用于判断剧本格式的预读非空行数
+    STREAM_FORMAT_PROBE_LINES = 200
+
     def __init__(self,
                  llm=None,
                  embedding_model_name: str = "openai",
@@ -70,6 +119,26 @@ class ScriptParserAgent:
         # 中文NLP相关模式和关键词
         self.initialize_patterns()
 
+    @classmethod
+    def create_rule_parser(cls, config_path: Optional[str] = None) -> "ScriptParserAgent":
+        """
+        创建仅包含规则解析能力的轻量实例（不初始化LLM、知识库和结果存储），供工作进程和草稿模式使用
+        
+        Args:
+            config_path: 配置文件路径，如果为None则使用默认路径
+            
+        Returns:
+            只加载了解析模式和关键词的ScriptParserAgent
+        """
+        parser = cls.__new__(cls)
+        parser.llm = None
+        parser.script_intel = None
+        parser.output_dir = None
+        parser.script_parser = ScriptParser()
+        parser.config_path = config_path or str(Path(__file__).parent.parent / "config" / "script_parser_config.yaml")
+        parser.initialize_patterns()
+        return parser
+
     def initialize_patterns(self):
         """初始化中文剧本解析需要的模式和关键词，从配置文件加载"""
         # 默认配置
@@ -118,6 +187,21 @@ class ScriptParserAgent:
                 "悲伤": ["难过", "伤心", "悲伤", "痛苦"],
                 "愤怒": ["生气", "愤怒", "恼火", "激动"],
                 "惊讶": ["惊讶", "震惊", "意外", "突然"]
+            },
+            "parallel_parsing": {
+                "enabled": False,
+                "min_script_chars": 50000,
+                "max_workers": 0
+            },
+            "llm_enhancement": {
+                "chunk_max_actions": 40
+            },
+            "long_script": {
+                "max_scenes_per_chunk": 4,
+                "episode_patterns": [
+                    r'^\s*第[0-9一二三四五六七八九十百零两]+[集话幕]',
+                    r'^\s*(EPISODE|Episode|EP\.?)\s*\d+'
+                ]
             }
         }
 
@@ -179,14 +263,39 @@ class ScriptParserAgent:
         self.emotion_keywords = config_data.get('emotion_keywords', {})
         self.atmosphere_keywords = config_data.get('atmosphere_keywords', {})
 
-    def parse_script(self, script_text: str, task_id: Optional[str] = None) -> Dict[str, Any]:
+        # 场景级并行解析配置
+        parallel_config = {**default_config["parallel_parsing"], **(config_data.get('parallel_parsing') or {})}
+        self.parallel_parsing_enabled = bool(parallel_config["enabled"])
+        self.parallel_min_script_chars = int(parallel_config["min_script_chars"])
+        self.parallel_max_workers = int(parallel_config["max_workers"]) or (os.cpu_count() or 1)
+
+        # LLM分块增强配置
+        llm_enhancement_config = {**default_config["llm_enhancement"], **(config_data.get('llm_enhancement') or {})}
+        self.llm_chunk_max_actions = int(llm_enhancement_config["chunk_max_actions"])
+
+        # 长剧本分块配置
+        long_script_config = {**default_config["long_script"], **(config_data.get('long_script') or {})}
+        self.long_script_max_scenes = max(1, int(long_script_config["max_scenes_per_chunk"]))
+        self.episode_patterns = []
+        for pattern_str in long_script_config["episode_patterns"]:
+            try:
+                self.episode_patterns.append(re.compile(pattern_str))
+            except re.error as e:
+                warning(f"分集标记模式编译失败: {pattern_str}, 错误: {str(e)}")
+
+    def parse_script(self, script_text: str, task_id: Optional[str] = None,
+                     script_format: str = FORMAT_AUTO, save_result: bool = True) -> Dict[str, Any]:
         """
         优化版剧本解析函数
         将整段中文剧本转换为结构化动作序列
+        解析前先识别剧本格式，标准剧本格式交给ScriptParser，中文剧本直接走规则解析，
+        选择的解析路径记录在结果的 metadata 中
         
         Args:
             script_text: 原始剧本文本
             task_id: 请求的唯一标识符，如果提供将保存结果到对应路径
+            script_format: 剧本格式，auto为自动识别，screenplay / chinese 为强制指定
+            save_result: 是否保存解析结果（草稿模式不落盘）
             
         Returns:
             结构化的剧本动作序列
@@ -199,33 +308,50 @@ class ScriptParserAgent:
                 "scenes": []
             }
 
-            # 首先尝试使用高级解析器
-            if self.script_intel:
+            # 识别剧本格式，决定解析路径
+            if script_format in (FORMAT_SCREENPLAY, FORMAT_CHINESE):
+                metadata = {"script_format": script_format, "format_source": "override"}
+            else:
+                if script_format != FORMAT_AUTO:
+                    warning(f"不支持的剧本格式: {script_format}，使用自动识别")
+                detection = classify_script_format(script_text)
+                metadata = {
+                    "script_format": detection.pop("format"),
+                    "format_source": "auto",
+                    "format_features": detection
+                }
+            debug(f"剧本格式: {metadata['script_format']} ({metadata['format_source']})")
+
+            # 标准剧本格式使用ScriptParser解析（有ScriptIntelligence时同时写入知识库）
+            if metadata["script_format"] == FORMAT_SCREENPLAY:
+                parsed = None
+                if self.script_intel:
+                    try:
+                        parsed = self.script_intel.analyze_script_text(script_text).get("parsed_result", {})
+                        metadata["parser"] = "script_intelligence"
+                    except Exception as e:
+                        warning(f"ScriptIntelligence解析失败，直接使用ScriptParser: {str(e)}")
                 try:
-                    intel_result = self.script_intel.analyze_script_text(script_text)
-                    parsed = intel_result.get("parsed_result", {})
+                    if parsed is None:
+                        parsed = self.script_parser.parse(script_text)
+                        metadata["parser"] = "script_parser"
                     if parsed and parsed.get("scenes"):
-                        debug("使用ScriptIntelligence解析成功")
+                        debug("使用标准剧本解析器解析成功")
                         structured_result = self._convert_to_target_format(parsed)
+                        structured_result["metadata"] = metadata
                         return structured_result
+                    warning("标准剧本解析器未识别出场景，回退到基础解析")
                 except Exception as e:
-                    warning(f"ScriptIntelligence解析失败，回退到基础解析: {str(e)}")
+                    warning(f"标准剧本解析失败，回退到基础解析: {str(e)}")
 
-            # 回退到基础解析 + 增强逻辑
+            # 中文剧本（或标准剧本解析失败时）使用基础解析 + 增强逻辑
             debug("使用基础解析 + 增强逻辑")
 
             # 1. 首先检测是否有明确的场景划分
             scenes_data = self._detect_scenes(script_text)
 
-            # 2. 处理每个场景
-            for scene_info in scenes_data:
-                scene_actions = self._parse_scene_actions(scene_info["content"])
-                scene_entry = {
-                    "location": scene_info["location"],
-                    "time": scene_info["time"],
-                    "actions": scene_actions
-                }
-                result["scenes"].append(scene_entry)
+            # 2. 处理每个场景（长剧本可交给进程池并行解析）
+            result["scenes"].extend(self._parse_scenes(scenes_data, len(script_text)))
 
             # 3. 如果没有检测到场景，使用默认场景并解析整个文本
             if not result["scenes"]:
@@ -238,12 +364,15 @@ class ScriptParserAgent:
 
             # 4. 使用LLM增强结果（如果可用）
             enhanced_result = self.enhance_with_llm(result)
+            metadata["parser"] = "rule_parser"
+            enhanced_result["metadata"] = metadata
             
-            try:
-                save_script_parser_result(task_id, enhanced_result, self.output_dir)
-                debug(f"剧本解析结果已保存到: data/output/{task_id}/script_parser_result.json")
-            except Exception as e:
-                warning(f"保存结果失败 (UUID: {task_id}): {str(e)}")
+            if save_result:
+                try:
+                    save_script_parser_result(task_id, enhanced_result, self.output_dir)
+                    debug(f"剧本解析结果已保存到: data/output/{task_id}/script_parser_result.json")
+                except Exception as e:
+                    warning(f"保存结果失败 (UUID: {task_id}): {str(e)}")
 
             debug(f"剧本解析完成，提取了 {len(enhanced_result['scenes'])} 个场景")
             return enhanced_result
@@ -259,6 +388,219 @@ class ScriptParserAgent:
                 }]
             }
 
+    def split_script_chunks(self, script_text: str, script_format: str = FORMAT_AUTO) -> List[Dict[str, Any]]:
+        """
+        按分集/场景边界把长剧本切分为可独立解析的文本分块
+        分集标记行总是开始新的分块，同一集内每 long_script_max_scenes 个场景为一个分块；
+        第一个场景之前的内容（标题等）并入第一个分块
+        
+        Args:
+            script_text: 原始剧本文本
+            script_format: 剧本格式，auto时按全文识别一次，各分块沿用同一格式
+            
+        Returns:
+            分块列表，每个分块包含index、text、episode、scene_count和script_format
+        """
+        if script_format not in (FORMAT_SCREENPLAY, FORMAT_CHINESE):
+            script_format = classify_script_format(script_text)["format"]
+
+        if script_format == FORMAT_SCREENPLAY:
+            def is_scene_heading(line):
+                return bool(ScriptParser.SCENE_HEADING_PATTERN.match(line.strip()))
+        else:
+            def is_scene_heading(line):
+                return any(len(match.groups()) >= 2 for match in
+                           (pattern.search(line) for pattern in self.scene_patterns) if match)
+
+        chunks = []
+        current = {"lines": [], "episode": None, "scene_count": 0}
+
+        def close_chunk():
+            text = '\n'.join(current["lines"]).strip()
+            if text:
+                chunks.append({
+                    "index": len(chunks),
+                    "text": text,
+                    "episode": current["episode"],
+                    "scene_count": current["scene_count"],
+                    "script_format": script_format
+                })
+
+        for line in script_text.split('\n'):
+            if any(pattern.match(line) for pattern in self.episode_patterns):
+                close_chunk()
+                current = {"lines": [line], "episode": line.strip(), "scene_count": 0}
+                continue
+            if is_scene_heading(line):
+                if current["scene_count"] >= self.long_script_max_scenes:
+                    close_chunk()
+                    current = {"lines": [], "episode": current["episode"], "scene_count": 0}
+                current["scene_count"] += 1
+            current["lines"].append(line)
+        close_chunk()
+
+        debug(f"长剧本切分完成，共 {len(chunks)} 个分块")
+        return chunks
+
+    def iter_script_scenes(self, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """
+        流式解析剧本，逐个产出目标格式的场景（适用于整季长剧本）
+        标准剧本格式（INT./EXT.）交给ScriptParser流式解析，中文剧本按场景标记行切分；
+        每个场景完成后立即产出，可直接交给TemporalPlannerAgent.iter_timeline_segments
+        
+        Args:
+            lines: 剧本文本行的可迭代对象（文件对象、生成器或字符串）
+            
+        Returns:
+            场景字典生成器，每个场景包含location、time、atmosphere和actions
+        """
+        if isinstance(lines, str):
+            lines = lines.split('\n')
+        lines = iter(lines)
+
+        # 预读开头若干非空行识别剧本格式，预读内容会重新拼接回行流
+        head = []
+        content_lines = 0
+        for line in lines:
+            head.append(line)
+            if line.strip():
+                content_lines += 1
+                if content_lines >= self.STREAM_FORMAT_PROBE_LINES:
+                    break
+        lines = itertools.chain(head, lines)
+        is_screenplay = classify_script_format(head)["format"] == FORMAT_SCREENPLAY
+
+        if is_screenplay:
+            debug("流式解析：识别为标准剧本格式")
+            for scene in ScriptParser().iter_scenes(lines):
+                yield self._enhance_scene_with_rules(self._convert_scene(scene))
+        else:
+            debug("流式解析：识别为中文剧本格式")
+            yield from self._iter_text_scenes(lines)
+
+    def iter_script_file_scenes(self, file_path: str) -> Iterator[Dict[str, Any]]:
+        """
+        以内存映射方式流式解析剧本文件
+        
+        Args:
+            file_path: 剧本文件路径
+            
+        Returns:
+            场景字典生成器
+        """
+        debug(f"开始流式解析剧本文件: {file_path}")
+        yield from self.iter_script_scenes(iter_mmap_lines(file_path))
+
+    def _iter_text_scenes(self, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """
+        按场景标记行切分中文剧本，每遇到新的场景标记就产出上一个场景
+        
+        Args:
+            lines: 剧本文本行
+            
+        Returns:
+            场景字典生成器
+        """
+        location = None
+        time = None
+        content_lines = []
+
+        for line in lines:
+            line = line.rstrip('\r\n')
+
+            match = None
+            for pattern in self.scene_patterns:
+                match = pattern.search(line)
+                if match and len(match.groups()) >= 2:
+                    break
+                match = None
+
+            if not match:
+                content_lines.append(line)
+                continue
+
+            scene = self._build_text_scene(location, time, content_lines)
+            if scene:
+                yield scene
+
+            location = match.group(1).strip()
+            time = self._extract_time(match.group(2).strip())
+            content_lines = [line[match.end():]]
+
+        scene = self._build_text_scene(location, time, content_lines)
+        if scene:
+            yield scene
+
+    def _build_text_scene(self, location: Optional[str], time: Optional[str],
+                          content_lines: List[str]) -> Optional[Dict[str, Any]]:
+        """根据场景标记和场景内容构建场景，首个场景标记之前的空内容直接忽略"""
+        content = "\n".join(content_lines).strip()
+        if location is None:
+            if not content:
+                return None
+            # 首个场景标记之前的内容，尝试从文本中推断地点和时间
+            location = self._extract_location_from_text(content) or "城市咖啡馆"
+            time = self._extract_time_from_text(content) or "下午3点"
+
+        return self._enhance_scene_with_rules({
+            "location": location,
+            "time": time,
+            "actions": self._parse_scene_actions(content) if content else []
+        })
+
+    def _enhance_scene_with_rules(self, scene: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        按规则补全单个场景的动作情绪和场景氛围（原地修改）
+        只依赖场景自身内容，并行解析时在工作进程中随动作解析一起完成
+        """
+        for action in scene.get("actions", []):
+            if "emotion" not in action:
+                if "dialogue" in action:
+                    action["emotion"] = self._infer_emotion_from_dialogue(action["dialogue"])
+                elif "action" in action:
+                    action["emotion"] = self._infer_emotion_from_action(action["action"])
+                else:
+                    action["emotion"] = "平静"
+        if "atmosphere" not in scene:
+            scene["atmosphere"] = self._infer_atmosphere(scene)
+        return scene
+
+    def _parse_scenes(self, scenes_data: List[Dict[str, str]], script_size: int) -> List[Dict[str, Any]]:
+        """
+        解析所有场景的动作序列
+        开启并行解析且剧本超过阈值时，按场景分发到进程池，结果按原顺序合并
+        
+        Args:
+            scenes_data: _detect_scenes返回的场景信息列表
+            script_size: 剧本字符数，用于判断是否值得并行
+            
+        Returns:
+            场景列表
+        """
+        use_pool = (self.parallel_parsing_enabled
+                    and len(scenes_data) > 1
+                    and self.parallel_max_workers > 1
+                    and script_size >= self.parallel_min_script_chars)
+
+        if use_pool:
+            try:
+                pool = _get_parse_pool(self.config_path, self.parallel_max_workers)
+                debug(f"并行解析 {len(scenes_data)} 个场景，进程数: {self.parallel_max_workers}")
+                chunksize = max(1, len(scenes_data) // (self.parallel_max_workers * 4))
+                return list(pool.map(_parse_scene_in_worker, scenes_data, chunksize=chunksize))
+            except Exception as e:
+                warning(f"并行解析失败，回退到串行解析: {str(e)}")
+
+        return [self._build_scene(scene_info) for scene_info in scenes_data]
+
+    def _build_scene(self, scene_info: Dict[str, str]) -> Dict[str, Any]:
+        """解析单个场景的动作，并按规则补全情绪和氛围"""
+        return self._enhance_scene_with_rules({
+            "location": scene_info["location"],
+            "time": scene_info["time"],
+            "actions": self._parse_scene_actions(scene_info["content"])
+        })
+
     def _detect_scenes(self, script_text: str) -> List[Dict[str, str]]:
         """
         检测剧本中的场景信息
@@ -271,23 +613,23 @@ class ScriptParserAgent:
         """
         scenes = []
 
-        # 首先尝试通过正则模式匹配场景
+        # 首先尝试通过正则模式匹配场景，使用第一个能匹配的模式切分全部场景
         for pattern in self.scene_patterns:
-            matches = pattern.finditer(script_text)
-            for match in matches:
-                if len(match.groups()) >= 2:
-                    location = match.group(1).strip()
-                    time_hint = match.group(2).strip()
+            matches = [match for match in pattern.finditer(script_text) if len(match.groups()) >= 2]
+            for idx, match in enumerate(matches):
+                location = match.group(1).strip()
+                time_hint = match.group(2).strip()
 
-                    # 从时间提示中提取时间信息
-                    time = self._extract_time(time_hint)
+                # 从时间提示中提取时间信息
+                time = self._extract_time(time_hint)
 
-                    scenes.append({
-                        "location": location,
-                        "time": time,
-                        "content": script_text[match.end():]  # 简化处理，实际应该找到下一个场景前的内容
-                    })
-                    break  # 找到一个匹配就跳出当前模式的匹配
+                # 场景内容截止到下一个场景标记之前
+                content_end = matches[idx + 1].start() if idx + 1 < len(matches) else len(script_text)
+                scenes.append({
+                    "location": location,
+                    "time": time,
+                    "content": script_text[match.end():content_end]
+                })
 
             if scenes:  # 如果有场景匹配，跳出循环
                 break
@@ -709,65 +1051,79 @@ class ScriptParserAgent:
         }
 
         for scene in parsed_result.get("scenes", []):
-            # 提取场景信息
-            location = scene.get("location", "未知位置")
-
-            # 处理时间信息
-            time_of_day = scene.get("time_of_day", "")
-            if time_of_day:
-                time_mapping = {
-                    "DAY": "白天", "NIGHT": "夜晚", "MORNING": "早晨",
-                    "AFTERNOON": "下午", "EVENING": "傍晚", "DUSK": "黄昏",
-                    "DAWN": "黎明"
-                }
-                time = time_mapping.get(time_of_day, time_of_day)
-            else:
-                time = "下午3点"  # 默认时间
-
-            # 处理动作
-            actions = []
-            for element in scene.get("elements", []):
-                element_type = element.get("type")
-                content = element.get("content", "")
-                metadata = element.get("metadata", {})
-
-                if element_type == "dialogue":
-                    character = metadata.get("character", "未知角色")
-                    actions.append({
-                        "character": character,
-                        "dialogue": content,
-                        "emotion": self._infer_emotion_from_dialogue(content)
-                    })
-                elif element_type == "action":
-                    # 尝试从动作内容中提取角色
-                    character = self._extract_character_from_text(content)
-                    if not character and scene.get("characters"):
-                        character = scene["characters"][0]  # 使用场景中的第一个角色
-                    if not character:
-                        character = "未知角色"
-
-                    actions.append({
-                        "character": character,
-                        "action": content,
-                        "emotion": self._infer_emotion_from_action(content)
-                    })
+            result["scenes"].append(self._convert_scene(scene))
+
+        return result
+
+    def _convert_scene(self, scene: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        将ScriptParser解析出的单个场景转换为目标格式
+        
+        Args:
+            scene: ScriptParser输出的场景字典
+            
+        Returns:
+            包含location、time和actions的场景
+        """
+        # 提取场景信息
+        location = scene.get("location", "未知位置")
+
+        # 处理时间信息
+        time_of_day = scene.get("time_of_day", "")
+        if time_of_day:
+            time_mapping = {
+                "DAY": "白天", "NIGHT": "夜晚", "MORNING": "早晨",
+                "AFTERNOON": "下午", "EVENING": "傍晚", "DUSK": "黄昏",
+                "DAWN": "黎明"
+            }
+            time = time_mapping.get(time_of_day, time_of_day)
+        else:
+            time = "下午3点"  # 默认时间
 
-            # 如果没有提取到动作，尝试从场景文本中生成
-            if not actions:
-                actions = self._analyze_whole_content(str(scene))
+        # 处理动作
+        actions = []
+        for element in scene.get("elements", []):
+            element_type = element.get("type")
+            content = element.get("content", "")
+            metadata = element.get("metadata", {})
 
-            result["scenes"].append({
-                "location": location,
-                "time": time,
-                "actions": actions
-            })
+            if element_type == "dialogue":
+                character = metadata.get("character", "未知角色")
+                actions.append({
+                    "character": character,
+                    "dialogue": content,
+                    "emotion": self._infer_emotion_from_dialogue(content)
+                })
+            elif element_type == "action":
+                # 尝试从动作内容中提取角色
+                character = self._extract_character_from_text(content)
+                if not character and scene.get("characters"):
+                    character = scene["characters"][0]  # 使用场景中的第一个角色
+                if not character:
+                    character = "未知角色"
 
-        return result
+                actions.append({
+                    "character": character,
+                    "action": content,
+                    "emotion": self._infer_emotion_from_action(content)
+                })
+
+        # 如果没有提取到动作，尝试从场景文本中生成
+        if not actions:
+            actions = self._analyze_whole_content(str(scene))
+
+        return {
+            "location": location,
+            "time": time,
+            "actions": actions
+        }
 
     def enhance_with_llm(self, structured_script: Dict[str, Any]) -> Dict[str, Any]:
         """
         使用LLM增强解析结果
         添加情绪识别和角色外观推断
+        按场景（长场景再按动作数）切分为多个分块，在全局LLM并发限制下并行增强，
+        合并时按原顺序回填动作，并对各分块给出的角色外观做一致性归并
         
         Args:
             structured_script: 结构化的剧本数据
@@ -779,114 +1135,308 @@ class ScriptParserAgent:
             debug("未配置LLM，使用规则增强代替")
             return self._enhance_with_rules(structured_script)
 
+        # 规则增强结果作为基线，某个分块LLM增强失败时保留该分块的规则结果
+        enhanced_script = self._enhance_with_rules(structured_script)
+        chunks = self._split_enhancement_chunks(structured_script)
+        if not chunks:
+            return enhanced_script
+
+        debug(f"开始调用LLM分块增强剧本解析结果，共 {len(chunks)} 个分块")
+        chunk_results = map_llm_tasks(self._enhance_chunk_with_llm, chunks)
+        success_count = sum(1 for result in chunk_results if result is not None)
+        if success_count < len(chunks):
+            warning(f"LLM增强部分失败：{len(chunks) - success_count}/{len(chunks)} 个分块使用规则增强结果")
+        else:
+            debug("LLM增强成功，合并各分块结果")
+
+        return self._merge_enhanced_chunks(enhanced_script, chunks, chunk_results)
+
+    def _split_enhancement_chunks(self, structured_script: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        将结构化剧本切分为LLM增强分块，每个场景至少一个分块，
+        动作数超过 llm_chunk_max_actions 的场景按动作数继续切分
+        
+        Args:
+            structured_script: 结构化的剧本数据
+            
+        Returns:
+            分块列表，包含场景索引、动作区间和分块内容
+        """
+        chunks = []
+        max_actions = max(1, self.llm_chunk_max_actions)
+        for scene_index, scene in enumerate(structured_script.get("scenes", [])):
+            if not isinstance(scene, dict):
+                continue
+            actions = scene.get("actions", [])
+            for start in range(0, max(len(actions), 1), max_actions):
+                end = min(start + max_actions, len(actions))
+                chunks.append({
+                    "scene_index": scene_index,
+                    "start": start,
+                    "end": end,
+                    "scene": {
+                        "location": scene.get("location", ""),
+                        "time": scene.get("time", ""),
+                        "actions": actions[start:end]
+                    }
+                })
+
+        total = len(chunks)
+        for number, chunk in enumerate(chunks, 1):
+            chunk["number"] = number
+            chunk["total"] = total
+        return chunks
+
+    def _enhance_chunk_with_llm(self, chunk: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        调用LLM增强单个分块
+        
+        Args:
+            chunk: 由_split_enhancement_chunks生成的分块
+            
+        Returns:
+            增强后的场景字典，失败时返回None
+        """
         try:
             # 准备增强提示
             prompt_template = """
-            请作为一个专业的中文剧本分析专家，对以下结构化剧本进行增强处理：
+            请作为一个专业的中文剧本分析专家，对以下结构化剧本片段进行增强处理：
             1. 确保每个动作都有合适的情绪标签
-            2. 为每个角色推断合理的外观描述（年龄、穿着、外貌特征等）
+            2. 为每个角色推断合理的外观描述（年龄、穿着、外貌特征等），放在场景的characters_info字段中
             3. 优化场景信息（地点和时间）
-            4. 保持原始动作序列的顺序和内容
+            4. 保持原始动作序列的顺序、数量和内容
             
-            请返回增强后的JSON格式结果，不要添加额外说明。
+            这是完整剧本的第 {number}/{total} 个片段，只需处理该片段。
+            请返回增强后的JSON格式结果，结构为 {{"scenes": [场景]}}，不要添加额外说明。
             
-            原始剧本：
+            剧本片段：
             {script_json}
             """
 
             # 填充提示词模板
             filled_prompt = prompt_template.format(
-                script_json=json.dumps(structured_script, ensure_ascii=False)
+                number=chunk["number"],
+                total=chunk["total"],
+                script_json=json.dumps({"scenes": [chunk["scene"]]}, ensure_ascii=False)
             )
 
-            # 调用LLM
-            debug("开始调用LLM增强剧本解析结果")
-            response = self.llm.invoke(filled_prompt)
+            # 在全局并发限制下调用LLM
+            response = invoke_llm(self.llm, filled_prompt)
 
             # 尝试解析JSON响应
-            enhanced_script = json.loads(response)
-            debug("LLM增强成功，返回增强后的剧本结构")
-
-            # 确保返回格式正确
-            return self._ensure_correct_format(enhanced_script)
+            enhanced = self._parse_llm_json(response)
+            scenes = enhanced.get("scenes") if isinstance(enhanced, dict) else None
+            if not scenes or not isinstance(scenes[0], dict):
+                warning(f"LLM增强分块 {chunk['number']} 返回结构不正确，使用规则增强结果")
+                return None
+
+            scene = scenes[0]
+            # 兼容LLM把角色信息放在顶层的情况
+            if isinstance(enhanced.get("characters_info"), dict) and "characters_info" not in scene:
+                scene["characters_info"] = enhanced["characters_info"]
+            return scene
         except json.JSONDecodeError as e:
-            warning(f"LLM增强失败：响应不是有效的JSON格式: {str(e)}")
+            warning(f"LLM增强分块 {chunk['number']} 失败：响应不是有效的JSON格式: {str(e)}")
         except Exception as e:
             print_log_exception()
             # 检查是否是API密钥错误
             if "API key" in str(e) or "401" in str(e):
                 warning(f"LLM增强失败：API密钥错误或权限不足: {str(e)}")
             else:
-                warning(f"LLM增强失败，使用规则增强代替: {str(e)}")
+                warning(f"LLM增强分块 {chunk['number']} 失败，使用规则增强代替: {str(e)}")
+        return None
+
+    def _parse_llm_json(self, response: Any) -> Any:
+        """
+        解析LLM返回的JSON，兼容消息对象和```json代码块包裹的情况
+        
+        Args:
+            response: LLM原始响应
+            
+        Returns:
+            解析后的JSON对象
+        """
+        content = getattr(response, "content", response)
+        if not isinstance(content, str):
+            return content
 
-        # 使用规则增强作为后备
-        return self._enhance_with_rules(structured_script)
+        content = content.strip()
+        if content.startswith("```"):
+            content = re.sub(r'^```(?:json)?\s*|\s*```$', '', content)
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            # 截取第一个完整的JSON对象后重试
+            start, end = content.find("{"), content.rfind("}")
+            if start == -1 or end <= start:
+                raise
+            return json.loads(content[start:end + 1])
+
+    def _merge_enhanced_chunks(self, enhanced_script: Dict[str, Any],
+                               chunks: List[Dict[str, Any]],
+                               chunk_results: List[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        将各分块的LLM增强结果按原顺序合并回规则增强基线
+        
+        Args:
+            enhanced_script: 规则增强后的完整剧本（将被原地更新）
+            chunks: 分块列表
+            chunk_results: 与chunks一一对应的增强结果，失败为None
+            
+        Returns:
+            合并后的结构化剧本数据
+        """
+        scenes = enhanced_script.get("scenes", [])
+        # 角色 -> 各分块给出的外观描述列表
+        profile_candidates: Dict[str, List[Dict[str, Any]]] = {}
 
-    def _enhance_with_rules(self, structured_script: Dict[str, Any]) -> Dict[str, Any]:
+        for chunk, result in zip(chunks, chunk_results):
+            if result is None:
+                continue
+            scene = scenes[chunk["scene_index"]]
+            baseline_actions = scene.get("actions", [])[chunk["start"]:chunk["end"]]
+            llm_actions = result.get("actions")
+
+            # 动作数量一致时才回填，避免LLM增删动作打乱序列
+            if isinstance(llm_actions, list) and len(llm_actions) == len(baseline_actions) \
+                    and all(isinstance(action, dict) for action in llm_actions):
+                merged_actions = []
+                for baseline_action, llm_action in zip(baseline_actions, llm_actions):
+                    merged_action = {**baseline_action, **llm_action}
+                    if not merged_action.get("emotion"):
+                        merged_action["emotion"] = baseline_action.get("emotion", "平静")
+                    merged_actions.append(merged_action)
+                scene["actions"][chunk["start"]:chunk["end"]] = merged_actions
+            else:
+                warning(f"LLM增强分块 {chunk['number']} 动作数量不一致，保留规则增强的动作")
+
+            # 场景信息以场景第一个分块为准
+            if chunk["start"] == 0:
+                for key in ("location", "time", "atmosphere"):
+                    value = result.get(key)
+                    if isinstance(value, str) and value.strip():
+                        scene[key] = value.strip()
+
+            characters_info = result.get("characters_info")
+            if isinstance(characters_info, dict):
+                for character, profile in characters_info.items():
+                    if isinstance(profile, dict):
+                        profile_candidates.setdefault(character, []).append(profile)
+
+        # 角色外观跨分块归并后，统一写回每个场景
+        profiles = self._reconcile_character_profiles(scenes, profile_candidates)
+        for scene in scenes:
+            scene_characters = {action.get("character") for action in scene.get("actions", [])
+                                if action.get("character")}
+            characters_info = scene.setdefault("characters_info", {})
+            for character in scene_characters:
+                if character in profiles:
+                    characters_info[character] = profiles[character]
+
+        return self._ensure_correct_format(enhanced_script)
+
+    def _reconcile_character_profiles(self, scenes: List[Dict[str, Any]],
+                                      profile_candidates: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
         """
-        使用规则增强解析结果
+        归并同一角色在不同分块中的外观描述，保证全剧角色外观一致
+        每个属性取各分块中出现次数最多的有效值（并列时取先出现的），没有有效值时保留规则推断结果
+        
+        Args:
+            scenes: 规则增强后的场景列表，提供规则推断的外观作为基线
+            profile_candidates: 角色 -> 各分块给出的外观描述列表
+            
+        Returns:
+            角色 -> 归并后的外观描述
+        """
+        profiles: Dict[str, Dict[str, Any]] = {}
+        for scene in scenes:
+            for character, profile in scene.get("characters_info", {}).items():
+                profiles.setdefault(character, dict(profile))
+
+        for character, candidates in profile_candidates.items():
+            reconciled = dict(profiles.get(character, {}))
+            attributes = []
+            for candidate in candidates:
+                attributes.extend(key for key in candidate if key not in attributes)
+            for attribute in attributes:
+                values = Counter(
+                    json.dumps(candidate[attribute], ensure_ascii=False, sort_keys=True)
+                    for candidate in candidates
+                    if candidate.get(attribute) not in (None, "", "未知")
+                )
+                if values:
+                    reconciled[attribute] = json.loads(values.most_common(1)[0][0])
+            profiles[character] = reconciled
+
+        return profiles
+
+    def build_character_index(self, structured_script: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        一次遍历建立角色索引：角色 -> 相关动作、对话/动作文本、出现的场景
         
         Args:
             structured_script: 结构化的剧本数据
             
         Returns:
-            增强后的结构化剧本数据
+            角色索引，每个角色包含 actions（动作字典列表）、text（按出现顺序拼接的对话和动作文本）、
+            scenes（出现的场景索引列表）
         """
-        enhanced_script = json.loads(json.dumps(structured_script))  # 深拷贝
+        index: Dict[str, Dict[str, Any]] = {}
+        text_parts: Dict[str, List[str]] = {}
+        for scene_index, scene in enumerate(structured_script.get("scenes", [])):
+            for action in scene.get("actions", []):
+                character = action.get("character")
+                if not character:
+                    continue
 
-        # 为所有角色添加外观推断
-        character_appearances = {}
+                entry = index.get(character)
+                if entry is None:
+                    entry = index[character] = {"actions": [], "text": "", "scenes": []}
+                    text_parts[character] = []
+                entry["actions"].append(action)
+                if not entry["scenes"] or entry["scenes"][-1] != scene_index:
+                    entry["scenes"].append(scene_index)
 
-        # 遍历所有场景和动作
-        for scene in enhanced_script.get("scenes", []):
-            # 优化场景信息
-            if "atmosphere" not in scene:
-                scene["atmosphere"] = self._infer_atmosphere(scene)
+                parts = text_parts[character]
+                if "dialogue" in action:
+                    parts.append(action["dialogue"])
+                if "action" in action:
+                    parts.append(action["action"])
 
-            # 增强每个动作
-            for action in scene.get("actions", []):
-                character = action.get("character", "")
+        for character, parts in text_parts.items():
+            index[character]["text"] = "".join(" " + part for part in parts)
+        return index
 
-                # 确保有情绪
-                if "emotion" not in action:
-                    if "dialogue" in action:
-                        action["emotion"] = self._infer_emotion_from_dialogue(action["dialogue"])
-                    elif "action" in action:
-                        action["emotion"] = self._infer_emotion_from_action(action["action"])
-                    else:
-                        action["emotion"] = "平静"
-
-                # 推断角色外观（如果还没有）
-                if character and character not in character_appearances:
-                    # 收集所有与该角色相关的文本
-                    character_text = ""
-                    for s in enhanced_script.get("scenes", []):
-                        for a in s.get("actions", []):
-                            if a.get("character") == character:
-                                if "dialogue" in a:
-                                    character_text += " " + a["dialogue"]
-                                if "action" in a:
-                                    character_text += " " + a["action"]
-
-                    # 基于文本推断外观
-                    appearance = self._infer_character_appearance(character, character_text)
-                    character_appearances[character] = appearance
-
-            # 添加角色外观信息到场景
-            if "characters_info" not in scene:
-                scene["characters_info"] = {}
-
-            # 收集场景中出现的角色
-            scene_characters = set()
-            for action in scene.get("actions", []):
-                char = action.get("character")
-                if char:
-                    scene_characters.add(char)
-
-            # 添加外观信息
-            for char in scene_characters:
-                if char in character_appearances:
-                    scene["characters_info"][char] = character_appearances[char]
+    def _enhance_with_rules(self, structured_script: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        使用规则增强解析结果
+        逐场景补全情绪和氛围（与工作进程中的场景增强相同，_parse_scenes 的结果已补全，这里只做检查），
+        再一次遍历建立角色索引推断外观；外观推断需要角色在全部场景中的文本，始终在主进程串行执行。
+        整体为线性复杂度；只浅拷贝场景和动作字典，不修改输入数据
+        
+        Args:
+            structured_script: 结构化的剧本数据
+            
+        Returns:
+            增强后的结构化剧本数据
+        """
+        enhanced_script = dict(structured_script)
+        enhanced_scenes = []
+
+        # 遍历所有场景，补全动作情绪和场景氛围
+        for scene in structured_script.get("scenes", []):
+            enhanced_scene = dict(scene)
+            enhanced_scene["characters_info"] = dict(scene.get("characters_info", {}))
+            enhanced_scene["actions"] = [dict(action) for action in scene.get("actions", [])]
+            enhanced_scenes.append(self._enhance_scene_with_rules(enhanced_scene))
+        enhanced_script["scenes"] = enhanced_scenes
+
+        # 基于角色的全部相关文本推断外观，并添加到角色出现的场景
+        character_index = self.build_character_index(enhanced_script)
+        for character, entry in character_index.items():
+            appearance = self._infer_character_appearance(character, entry["text"])
+            for scene_index in entry["scenes"]:
+                enhanced_scenes[scene_index]["characters_info"][character] = appearance
 
         return enhanced_script
 
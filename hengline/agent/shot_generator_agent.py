@@ -6,27 +6,62 @@
 @Time: 2025/10 - 2025/11
 """
 import json
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 
 # LLMChain在langchain 1.0+中已更改，我们将直接使用模型和提示词
 from langchain_core.prompts import ChatPromptTemplate
 
+from config.config import get_storyboard_config
+from hengline.client.llm_limiter import llm_slot
 from hengline.logger import debug, error, warning
 from hengline.prompts.prompts_manager import PromptManager
+from .continuity_state import CharacterState, index_states
+
+# 连续性约束在提示词中的呈现方式：full 每个分镜给出所有角色的完整约束；
+# delta 在提示词开头给出稳定的角色设定表，每个分镜只给出与设定表不同的属性
+CONSTRAINT_PROMPT_FULL = "full"
+CONSTRAINT_PROMPT_DELTA = "delta"
+
+# 分镜的生成方式（meta_data.generated_by）：LLM生成、规则生成（未配置LLM或LLM失败后回退）、默认分镜
+GENERATED_BY_LLM = "llm"
+GENERATED_BY_RULES = "rules"
+GENERATED_BY_DEFAULT = "default"
+
+# 角色设定表的列：约束字段 → 显示名
+CHARACTER_SHEET_FIELDS = (
+    ("must_start_with_pose", "姿势"),
+    ("must_start_with_position", "位置"),
+    ("must_start_with_gaze", "视线"),
+    ("must_start_with_emotion", "情绪"),
+    ("must_start_with_holding", "手持"),
+)
+
+
+@dataclass
+class ConstraintPromptContext:
+    """
+    单个请求已写入提示词的角色设定表（角色名 → 基准约束），由调用方（工作流状态）持有并在分镜之间传递
+    设定表只追加不修改，同一任务各分镜提示词的开头保持一致，可被服务端的提示词缓存复用
+    """
+    character_sheet: Dict[str, Dict[str, Any]] = field(default_factory=dict)
 
 
 class ShotGeneratorAgent:
     """分镜生成智能体"""
 
-    def __init__(self, llm=None):
+    def __init__(self, llm=None, constraint_prompt_mode: Optional[str] = None):
         """
         初始化分镜生成智能体
         
         Args:
             llm: 语言模型实例
+            constraint_prompt_mode: 连续性约束的呈现方式（full / delta），默认读取配置项 storyboard.continuity_prompt
         """
         self.llm = llm
+        self.constraint_prompt_mode = constraint_prompt_mode or \
+            get_storyboard_config().get("continuity_prompt", {}).get("mode", CONSTRAINT_PROMPT_FULL)
         self._init_prompts()
 
     def _init_prompts(self):
@@ -63,7 +98,7 @@ class ShotGeneratorAgent:
             # 如果加载失败，使用默认模板作为备份
             default_template = """
 你是一位顶尖的电影分镜师和AI视频提示词工程师。请为一段5秒的短视频生成专业分镜：
-
+{character_sheet_text}
 ## 场景信息
 场景位置: {location}
 时间: {time}
@@ -107,7 +142,8 @@ class ShotGeneratorAgent:
                       continuity_constraints: Dict[str, Any],
                       scene_context: Dict[str, Any],
                       style: str = "realistic",
-                      shot_id: int = 1) -> Dict[str, Any]:
+                      shot_id: int = 1,
+                      prompt_context: Optional[ConstraintPromptContext] = None) -> Dict[str, Any]:
         """
         生成单个分镜，使用YAML配置的提示词模板，增强错误处理和字段验证
         
@@ -117,28 +153,18 @@ class ShotGeneratorAgent:
             scene_context: 场景上下文
             style: 视频风格
             shot_id: 分镜ID
+            prompt_context: 已写入提示词的角色设定表，原地更新；delta模式下提供时只给出与设定表不同的约束
             
         Returns:
             分镜对象
         """
         debug(f"生成分镜，ID: {shot_id}")
 
-        # 准备输入数据
-        actions_text = self._format_actions_text(segment.get("actions", []))
-        continuity_constraints_text = self._format_continuity_constraints(continuity_constraints)
-
-        # 构建提示词输入，确保所有变量与YAML模板匹配
-        prompt_input = {
-            "location": scene_context.get("location", "未知位置"),
-            "time": scene_context.get("time", "未知时间"),
-            "atmosphere": scene_context.get("atmosphere", "未知氛围"),
-            "actions_text": actions_text,
-            "continuity_constraints_text": continuity_constraints_text,
-            "style": style,
-            "shot_id": shot_id
-        }
+        prompt_input = self.build_prompt_input(segment, continuity_constraints, scene_context, style, shot_id,
+                                               prompt_context)
 
         try:
+            generated_by = GENERATED_BY_RULES
             if self.llm:
                 debug("使用LLM和YAML配置的提示词模板生成分镜")
                 try:
@@ -149,15 +175,17 @@ class ShotGeneratorAgent:
                         # 如果是字符串，则创建模板
                         current_template = ChatPromptTemplate.from_template(self.shot_generation_template)
 
-                    # 使用LLM生成
+                    # 使用LLM生成（占用全局并发槽位，并发的分块、精修、修复任务合计不超过上限）
                     chain = current_template | self.llm
-                    response = chain.invoke(prompt_input)
+                    with llm_slot():
+                        response = chain.invoke(prompt_input)
                     # 确保获取到content
                     if hasattr(response, 'content'):
                         response = response.content
 
                     # 解析响应
                     shot_data = json.loads(response)
+                    generated_by = GENERATED_BY_LLM
                     debug(f"成功解析LLM响应，生成了包含{len(shot_data)}个字段的分镜数据")
                 except json.JSONDecodeError as jde:
                     error(f"LLM响应JSON解析失败: {str(jde)}")
@@ -219,7 +247,8 @@ class ShotGeneratorAgent:
                 "continuity_anchor": self._generate_continuity_anchor(shot_data),
                 "continuity_anchors": [],  # 添加必要的连续性锚点字段
                 # 确保final_continuity_state字段为字典类型
-                "final_continuity_state": {}
+                "final_continuity_state": {},
+                "meta_data": {"generated_by": generated_by}
             }
 
             debug(f"分镜生成完成: {shot.get('chinese_description', '')[:100]}...")
@@ -234,6 +263,49 @@ class ShotGeneratorAgent:
                 default_shot["final_continuity_state"] = {}
             return default_shot
 
+    def build_prompt_input(self,
+                           segment: Dict[str, Any],
+                           continuity_constraints: Dict[str, Any],
+                           scene_context: Dict[str, Any],
+                           style: str = "realistic",
+                           shot_id: int = 1,
+                           prompt_context: Optional[ConstraintPromptContext] = None) -> Dict[str, Any]:
+        """
+        构建分镜生成提示词的输入变量
+
+        Args:
+            segment: 分段信息
+            continuity_constraints: 连续性约束
+            scene_context: 场景上下文
+            style: 视频风格
+            shot_id: 分镜ID
+            prompt_context: 已写入提示词的角色设定表，原地更新
+
+        Returns:
+            提示词模板变量
+        """
+        # 准备输入数据
+        actions_text = self._format_actions_text(segment.get("actions", []))
+        if self.constraint_prompt_mode == CONSTRAINT_PROMPT_DELTA and prompt_context is not None:
+            character_sheet_text, continuity_constraints_text = self._format_continuity_constraints_delta(
+                continuity_constraints, prompt_context)
+        else:
+            character_sheet_text = ""
+            continuity_constraints_text = self._format_continuity_constraints(continuity_constraints)
+
+        # 构建提示词输入，确保所有变量与YAML模板匹配
+        prompt_input = {
+            "location": scene_context.get("location", "未知位置"),
+            "time": scene_context.get("time", "未知时间"),
+            "atmosphere": scene_context.get("atmosphere", "未知氛围"),
+            "character_sheet_text": character_sheet_text,
+            "actions_text": actions_text,
+            "continuity_constraints_text": continuity_constraints_text,
+            "style": style,
+            "shot_id": shot_id
+        }
+        return prompt_input
+
     def _format_actions_text(self, actions: List[Dict[str, Any]]) -> str:
         """格式化动作文本，确保动作序列合理"""
         lines = []
@@ -293,13 +365,71 @@ class ShotGeneratorAgent:
                 elif key == "character_description":
                     lines.append(f"  - 描述: {value}")
         
-        # 添加电话那头角色的特殊约束
-        for character_name, char_constraints in phone_characters.items():
+        # 添加电话那头角色的特殊约束和相机约束
+        self._append_phone_and_camera_constraints(lines, phone_characters, constraints)
+
+        return "\n".join(lines)
+
+    def _format_continuity_constraints_delta(self, constraints: Dict[str, Any],
+                                             prompt_context: ConstraintPromptContext) -> Tuple[str, str]:
+        """
+        增量格式化连续性约束
+        首次出现的角色追加到角色设定表，之后的分镜只给出与设定表不同的属性；
+        角色描述由姿势和情绪生成，不再重复
+
+        Args:
+            constraints: 连续性约束
+            prompt_context: 已写入提示词的角色设定表，原地更新
+
+        Returns:
+            (角色设定表文本, 本分镜的约束文本)
+        """
+        sheet = prompt_context.character_sheet
+        lines = []
+        unchanged = []
+
+        characters = constraints.get("characters", {})
+        phone_characters = {k: v for k, v in characters.items() if "电话那头" in k or "off-screen" in k}
+        for character_name, char_constraints in characters.items():
+            if character_name in phone_characters:
+                continue
+            baseline = sheet.get(character_name)
+            if baseline is None:
+                baseline = {key: char_constraints.get(key, "unknown") for key, _ in CHARACTER_SHEET_FIELDS}
+                sheet[character_name] = baseline
+            changes = [f"{label} {char_constraints.get(key, 'unknown')}" for key, label in CHARACTER_SHEET_FIELDS
+                       if char_constraints.get(key, "unknown") != baseline[key]]
+            if changes:
+                lines.append(f"  - {character_name}: {'，'.join(changes)}")
+            else:
+                unchanged.append(character_name)
+        if lines:
+            lines.insert(0, "以下角色必须以与角色设定不同的状态开始（未列出的属性同角色设定）：")
+        if unchanged:
+            lines.append(f"按角色设定开始: {'、'.join(unchanged)}")
+
+        self._append_phone_and_camera_constraints(lines, phone_characters, constraints)
+        return self._format_character_sheet(sheet), "\n".join(lines)
+
+    @staticmethod
+    def _format_character_sheet(sheet: Dict[str, Dict[str, Any]]) -> str:
+        """角色设定表（按角色首次出现的顺序，内容只追加）"""
+        if not sheet:
+            return ""
+        lines = ["", "## 角色设定（" + " / ".join(label for _, label in CHARACTER_SHEET_FIELDS) + "）"]
+        for character_name, baseline in sheet.items():
+            lines.append(f"- {character_name}: " + " / ".join(str(baseline[key]) for key, _ in CHARACTER_SHEET_FIELDS))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _append_phone_and_camera_constraints(lines: List[str], phone_characters: Dict[str, Any],
+                                             constraints: Dict[str, Any]):
+        """添加电话那头角色的特殊约束和相机约束"""
+        for character_name in phone_characters:
             lines.append(f"角色 {character_name} 的约束（不在画面中）：")
             lines.append(f"  - 位置: off-screen")
             lines.append(f"  - 仅通过声音参与场景")
 
-        # 添加相机约束
         if "camera" in constraints:
             lines.append("相机约束：")
             camera_constraints = constraints["camera"]
@@ -308,8 +438,6 @@ class ShotGeneratorAgent:
             if "recommended_angle" in camera_constraints:
                 lines.append(f"  - 推荐角度: {camera_constraints['recommended_angle']}")
 
-        return "\n".join(lines)
-
     def _generate_shot_with_rules(self,
                                   segment: Dict[str, Any],
                                   continuity_constraints: Dict[str, Any],
@@ -500,60 +628,21 @@ class ShotGeneratorAgent:
         return list(characters)
 
     def _generate_continuity_anchor(self, shot_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """生成连续性锚点，确保锚点数据完整一致"""
+        """生成连续性锚点，确保锚点数据完整一致（分镜是输出数据，锚点在这里转换为JSON）"""
+        final_states = index_states(shot_data.get("final_state", []))
+        initial_states = index_states(shot_data.get("initial_state", []))
+
+        # 获取所有角色（从final_state和initial_state），优先使用结束状态生成锚点
         anchors = []
+        for character_name in {**final_states, **initial_states}:
+            character_state = final_states.get(character_name) or initial_states[character_name]
+            anchor = CharacterState.from_dict(character_state, character_name)
 
-        # 获取所有角色（从final_state和initial_state）
-        all_characters = set()
-        for state in shot_data.get("final_state", []):
-            if "character_name" in state:
-                all_characters.add(state["character_name"])
-        for state in shot_data.get("initial_state", []):
-            if "character_name" in state:
-                all_characters.add(state["character_name"])
-                
-        # 从结束状态生成锚点
-        for character_name in all_characters:
-            # 查找该角色的final_state
-            character_state = None
-            for state in shot_data.get("final_state", []):
-                if state.get("character_name") == character_name:
-                    character_state = state
-                    break
-            
-            # 如果没有找到，使用initial_state
-            if not character_state:
-                for state in shot_data.get("initial_state", []):
-                    if state.get("character_name") == character_name:
-                        character_state = state
-                        break
-            
-            # 创建锚点
-            anchor = {
-                "character_name": character_name,
-                "pose": "unknown",
-                "position": "unknown",
-                "gaze_direction": "unknown",
-                "emotion": "unknown",
-                "holding": "unknown"
-            }
-            
-            # 如果找到状态，更新锚点
-            if character_state:
-                anchor.update({
-                    "pose": character_state.get("pose", "unknown"),
-                    "position": character_state.get("position", "unknown"),
-                    "gaze_direction": character_state.get("gaze_direction", "unknown"),
-                    "emotion": character_state.get("emotion", "unknown"),
-                    "holding": character_state.get("holding", "unknown")
-                })
-                
-                # 确保电话那头角色的位置正确
-                if "电话那头" in character_name or "off-screen" in character_name:
-                    anchor["position"] = "off-screen"
-                    anchor["pose"] = "off-screen"
-            
-            anchors.append(anchor)
+            # 确保电话那头角色的位置正确
+            if "电话那头" in character_name or "off-screen" in character_name:
+                anchor = anchor.off_screen()
+
+            anchors.append(anchor.to_dict())
 
         return anchors
 
@@ -621,5 +710,6 @@ class ShotGeneratorAgent:
             "final_state": [],
             "continuity_anchor": [],
             "continuity_anchors": [],  # 添加必要的连续性锚点字段
-            "final_continuity_state": {}  # 确保包含final_continuity_state字段，为字典类型
+            "final_continuity_state": {},  # 确保包含final_continuity_state字段，为字典类型
+            "meta_data": {"generated_by": GENERATED_BY_DEFAULT}
         }
@@ -5,160 +5,90 @@
 @Author: HengLine
 @Time: 2025/10 - 2025/11
 """
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional
 
 from hengline.logger import debug, warning
 from hengline.prompts.prompts_manager import PromptManager
+from hengline.tools.action_duration_tool import get_action_duration_estimator
+
+
+@dataclass(frozen=True)
+class TimelinePlanningContext:
+    """单次时序规划请求的参数，由调用方按请求创建，智能体本身不保存请求状态"""
+    target_segment_duration: float  # 目标分段时长（秒）
+    max_duration_deviation: float  # 允许的最大时长偏差（秒）
 
 
 class TemporalPlannerAgent:
-    """时序规划智能体"""
+    """
+    时序规划智能体
+    初始化后不再修改自身属性，请求相关参数通过TimelinePlanningContext传递，可被多个请求并发共享
+    """
 
     def __init__(self):
         """初始化时序规划智能体"""
         # 初始化PromptManager，使用正确的提示词目录路径
         self.prompt_manager = PromptManager(prompt_dir=Path(__file__).parent.parent)
 
-        # 动作时长估算库（秒）
-        self.action_duration_library = {
-            # 基本动作
-            "坐在": 2.0,
-            "站在": 2.0,
-            "躺着": 2.0,
-            "低头": 1.0,
-            "抬头": 1.0,
-            "转身": 1.5,
-            "看向": 1.0,
-            "看见": 1.0,
-            "愣住": 2.0,
-            "发抖": 2.0,
-            # 移动动作
-            "走": 2.0,
-            "慢走": 3.0,
-            "快走": 1.5,
-            "跑": 1.0,
-            "进入": 3.0,
-            "离开": 3.0,
-            "靠近": 2.5,
-            "远离": 2.5,
-            # 交互动作
-            "说话": 3.0,  # 一句话的平均时长
-            "握手": 2.0,
-            "拥抱": 3.0,
-            "递东西": 2.0,
-            "接东西": 1.5,
-            "操作手机": 3.0,
-            "喝咖啡": 2.0,
-            "看书": 3.0,
-            # 情绪动作
-            "微笑": 1.5,
-            "皱眉": 1.0,
-            "哭泣": 4.0,
-            "大笑": 3.0,
-            "愤怒": 2.5,
-            "惊讶": 2.0,
-        }
+        # 共享的动作时长估算器（基于action_duration_config.yaml，进程内复用配置、词典和缓存）
+        self.duration_estimator = get_action_duration_estimator()
 
-        # 默认动作时长
+        # 没有动作描述和对话时的默认时长
         self.default_duration = 2.0
 
-        # 目标分段时长（秒）
+        # 默认目标分段时长（秒）
         self.target_segment_duration = 5.0
 
-        # 允许的最大时长偏差（秒）
+        # 默认允许的最大时长偏差（秒）
         self.max_duration_deviation = 0.5
 
-    def plan_timeline(self, structured_script: Dict[str, Any], target_duration: int = None) -> List[Dict[str, Any]]:
+        # 获取提示词模板（供后续扩展使用）
+        self.timeline_planning_template = None
+        try:
+            self.timeline_planning_template = self.prompt_manager.get_prompt("temporal_planner")
+        except Exception as e:
+            debug(f"未找到时序规划提示词模板: {e}")
+            # 使用默认处理逻辑
+
+    def create_context(self, target_duration: Optional[float] = None) -> TimelinePlanningContext:
+        """
+        创建单次规划请求的上下文
+        
+        Args:
+            target_duration: 目标分段时长（秒），为空时使用默认值
+            
+        Returns:
+            规划上下文
+        """
+        return TimelinePlanningContext(
+            target_segment_duration=target_duration or self.target_segment_duration,
+            max_duration_deviation=self.max_duration_deviation
+        )
+
+    def plan_timeline(self, structured_script: Dict[str, Any], target_duration: int = None,
+                      context: Optional[TimelinePlanningContext] = None) -> List[Dict[str, Any]]:
         """
         规划剧本的时序分段
         
         Args:
             structured_script: 结构化的剧本
-            target_duration: 目标分段时长（秒）
+            target_duration: 目标分段时长（秒），提供context时忽略
+            context: 规划上下文，为空时按target_duration创建
             
         Returns:
             分段计划列表
         """
         debug("开始时序规划")
+        context = context or self.create_context(target_duration)
 
-        if target_duration:
-            self.target_segment_duration = target_duration
-
-        # 获取提示词模板（供后续扩展使用）
-        try:
-            self.timeline_planning_template = self.prompt_manager.get_prompt("temporal_planner")
-        except Exception as e:
-            debug(f"未找到时序规划提示词模板: {e}")
-            # 使用默认处理逻辑
-
-        segments = []
-        current_segment = {
-            "id": 1,
-            "actions": [],
-            "est_duration": 0.0,
-            "scene_id": 0
-        }
-
-        # 遍历所有场景
         scenes = structured_script.get("scenes", [])
-        for scene_idx, scene in enumerate(scenes):
-            scene_actions = scene.get("actions", [])
-
-            # 确保场景有动作
-            if not scene_actions:
-                # 如果场景没有动作，创建一个默认动作
-                default_action = {
-                    "character": "默认角色",
-                    "action": "站立",
-                    "emotion": "平静"
-                }
-                scene_actions = [default_action]
-
-            for action in scene_actions:
-                action_duration = self._estimate_action_duration(action)
-
-                # 检查是否需要分段
-                if current_segment["est_duration"] + action_duration > self.target_segment_duration + self.max_duration_deviation:
-                    # 保存当前分段
-                    segments.append(current_segment)
-
-                    # 开始新分段
-                    current_segment = {
-                        "id": len(segments) + 1,
-                        "actions": [],
-                        "est_duration": 0.0,
-                        "scene_id": scene_idx
-                    }
-
-                # 添加动作到当前分段
-                current_segment["actions"].append(action)
-                current_segment["est_duration"] += action_duration
-                current_segment["scene_id"] = scene_idx
-
-        # 添加最后一个分段
-        if current_segment["actions"]:
-            segments.append(current_segment)
-        elif scenes:
-            # 如果没有任何动作，但有场景，创建一个默认分段
-            warning("未找到任何动作，创建默认分段")
-            segments.append({
-                "id": 1,
-                "actions": [{
-                    "character": "默认角色",
-                    "action": "站立",
-                    "emotion": "平静"
-                }],
-                "est_duration": self.target_segment_duration,
-                "scene_id": 0
-            })
-
-        # 优化分段
-        optimized_segments = self._optimize_segments(segments)
+        optimized_segments = list(self.iter_timeline_segments(scenes, context))
 
         # 确保至少有一个分段
         if not optimized_segments and scenes:
-            warning("分段优化后为空，创建保底分段")
+            warning("未找到任何动作，创建默认分段")
             optimized_segments = [{
                 "id": 1,
                 "actions": [{
@@ -166,173 +96,137 @@ class TemporalPlannerAgent:
                     "action": "站立",
                     "emotion": "平静"
                 }],
-                "est_duration": self.target_segment_duration,
+                "est_duration": context.target_segment_duration,
                 "scene_id": 0
             }]
 
         debug(f"时序规划完成，生成了 {len(optimized_segments)} 个分段")
         return optimized_segments
 
-    def _estimate_action_duration(self, action: Dict[str, Any]) -> float:
+    def iter_timeline_segments(self, scenes: Iterable[Dict[str, Any]],
+                               context: Optional[TimelinePlanningContext] = None) -> Iterator[Dict[str, Any]]:
         """
-        估算单个动作的时长
+        流式时序规划：逐个消费场景，每个场景分段完成后立即产出
+        可直接消费ScriptParserAgent.iter_script_scenes的生成器，解析未完成时即可开始分段
+        分段不跨越场景边界，场景内由_segment_scene做最优分段
         
         Args:
-            action: 动作字典
+            scenes: 场景的可迭代对象（列表或生成器）
+            context: 规划上下文，为空时使用默认参数
             
         Returns:
-            估算的时长（秒）
+            连续编号的分段生成器
         """
-        duration = 0.0
-
-        # 检查是否有对话
-        if "dialogue" in action:
-            dialogue = action["dialogue"]
-            # 基于对话长度估算时长
-            words_count = len(dialogue)
-            duration += max(2.0, words_count * 0.1)  # 至少2秒，每10个字增加1秒
-
-        # 检查动作描述
-        if "action" in action:
-            action_text = action["action"]
-            action_duration = self._match_action_duration(action_text)
-            duration = max(duration, action_duration)
-
-        # 如果没有估算出时长，使用默认值
-        if duration == 0.0:
-            duration = self.default_duration
+        context = context or self.create_context()
+        next_id = 1
 
-        # 根据情绪调整时长
-        if "emotion" in action:
-            emotion = action["emotion"]
-            duration = self._adjust_duration_by_emotion(duration, emotion)
-
-        return duration
-
-    def _match_action_duration(self, action_text: str) -> float:
-        """
-        匹配动作文本中的关键词，返回对应的时长
-        
-        Args:
-            action_text: 动作描述文本
-            
-        Returns:
-            估算的时长（秒）
-        """
-        max_duration = self.default_duration
-
-        # 查找匹配的最长关键词
-        for keyword, duration in sorted(self.action_duration_library.items(), key=lambda x: len(x[0]), reverse=True):
-            if keyword in action_text:
-                max_duration = max(max_duration, duration)
-
-        # 检查是否有复合动作
-        compound_actions = action_text.split('，')
-        if len(compound_actions) > 1:
-            # 复合动作，增加时长
-            max_duration *= 1.2
+        # 遍历所有场景
+        for scene_idx, scene in enumerate(scenes):
+            scene_actions = scene.get("actions", [])
 
-        return max_duration
+            # 确保场景有动作
+            if not scene_actions:
+                # 如果场景没有动作，创建一个默认动作
+                default_action = {
+                    "character": "默认角色",
+                    "action": "站立",
+                    "emotion": "平静"
+                }
+                scene_actions = [default_action]
 
-    def _adjust_duration_by_emotion(self, duration: float, emotion: str) -> float:
-        """
-        根据情绪调整动作时长
-        
-        Args:
-            duration: 原始时长
-            emotion: 情绪描述
-            
-        Returns:
-            调整后的时长
-        """
-        emotion_multipliers = {
-            "平静": 1.0,
-            "惊讶": 1.2,
-            "震惊": 1.5,
-            "愤怒": 1.3,
-            "悲伤": 1.4,
-            "快乐": 0.9,
-            "紧张": 1.2,
-            "恐惧": 1.3,
-            "厌恶": 1.1,
-            "困惑": 1.2,
-            "焦虑": 1.3,
-        }
+            # 整个场景的动作一次批量估算
+            scene_durations = self._estimate_scene_durations(scene_actions, scene)
 
-        multiplier = emotion_multipliers.get(emotion, 1.0)
-        return duration * multiplier
+            for start, end in self._segment_scene(scene_durations, context):
+                yield {
+                    "id": next_id,
+                    "actions": scene_actions[start:end],
+                    "est_duration": sum(scene_durations[start:end]),
+                    "scene_id": scene_idx
+                }
+                next_id += 1
 
-    def _optimize_segments(self, segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _segment_scene(self, durations: List[float], context: TimelinePlanningContext) -> List[tuple]:
         """
-        优化分段，确保时长合理
+        场景内最优分段（动态规划）
+        在"分段总时长不超过 目标时长 + 最大偏差"的约束下，使各分段与目标时长偏差的平方和最小，
+        偏差相同时分段数更少者优先；单个动作本身超过上限时单独成段。
+        （各分段都不足目标时长时，绝对偏差之和只取决于分段数，平方和则会进一步偏向时长均衡的分段；
+        能合并时合并的代价不超过 最大偏差²，总是小于拆分，因此不会多切分段）
+        每个分段最多容纳 上限/最短动作时长 个动作，因此复杂度为 O(动作数 × 分段内最大动作数)
         
         Args:
-            segments: 原始分段列表
+            durations: 场景中各动作的时长
+            context: 规划上下文
             
         Returns:
-            优化后的分段列表
+            分段的动作区间列表 [(start, end), ...]
         """
-        optimized_segments = []
-
-        for i, segment in enumerate(segments):
-            # 检查时长是否过短，最后一个分段允许时长过短
-            if segment["est_duration"] < self.target_segment_duration * 0.6 and i < len(segments) - 1:
-                warning(f"分段 {segment['id']} 时长过短: {segment['est_duration']}秒")
-                # 可以考虑合并到前一个分段，但这里暂时保留
-
-            # 检查时长是否过长
-            if segment["est_duration"] > self.target_segment_duration + self.max_duration_deviation:
-                warning(f"分段 {segment['id']} 时长过长: {segment['est_duration']}秒")
-                # 尝试拆分过长的分段
-                split_segments = self._split_long_segment(segment)
-                optimized_segments.extend(split_segments)
-            else:
-                optimized_segments.append(segment)
-
-        # 重新分配ID
-        for idx, segment in enumerate(optimized_segments):
-            segment["id"] = idx + 1
-
-        return optimized_segments
-
-    def _split_long_segment(self, segment: Dict[str, Any]) -> List[Dict[str, Any]]:
+        count = len(durations)
+        target = context.target_segment_duration
+        upper_bound = target + context.max_duration_deviation
+
+        # best[i]: 前i个动作的最优 (偏差平方和, 分段数)，prev[i]: 最后一个分段的起点
+        best = [(0.0, 0)] + [(float("inf"), 0)] * count
+        prev = [0] * (count + 1)
+        for end in range(1, count + 1):
+            total = 0.0
+            for start in range(end - 1, -1, -1):
+                total += durations[start]
+                # 超过上限的多动作分段不合法（单个动作除外），更早的起点只会更长
+                if total > upper_bound and start < end - 1:
+                    break
+                deviation, segment_count = best[start]
+                candidate = (round(deviation + (total - target) ** 2, 6), segment_count + 1)
+                if candidate < best[end]:
+                    best[end] = candidate
+                    prev[end] = start
+
+        ranges = []
+        end = count
+        while end > 0:
+            start = prev[end]
+            if end - start == 1 and durations[start] > upper_bound:
+                debug(f"单个动作时长 {durations[start]} 秒超过分段上限 {upper_bound} 秒，单独成段")
+            ranges.append((start, end))
+            end = start
+        ranges.reverse()
+        return ranges
+
+    def _estimate_scene_durations(self, actions: List[Dict[str, Any]], scene: Dict[str, Any]) -> List[float]:
         """
-        拆分过长的分段
+        批量估算场景中各动作的时长
+        动作描述和对话分别交给ActionDurationEstimator估算，取两者中的较大值；
+        角色类型取自场景characters_info中的type字段
         
         Args:
-            segment: 过长的分段
+            actions: 动作字典列表
+            scene: 所属场景（提供角色信息）
             
         Returns:
-            拆分后的分段列表
+            与actions顺序一致的时长列表（秒）
         """
-        split_segments = []
-        current_split = {
-            "id": segment["id"],
-            "actions": [],
-            "est_duration": 0.0,
-            "scene_id": segment["scene_id"]
-        }
-
-        for action in segment["actions"]:
-            action_duration = self._estimate_action_duration(action)
+        characters_info = scene.get("characters_info") or {}
+        texts, emotions, character_types, owners = [], [], [], []
+        for index, action in enumerate(actions):
+            emotion = action.get("emotion", "")
+            profile = characters_info.get(action.get("character"))
+            character_type = profile.get("type", "default") if isinstance(profile, dict) else "default"
+            if action.get("action"):
+                texts.append(action["action"])
+                emotions.append(emotion)
+                character_types.append(character_type)
+                owners.append(index)
+            if action.get("dialogue"):
+                # 转成"角色说：“台词”"形式，由估算器按对话模型计算
+                texts.append(f"{action.get('character', '')}说：“{action['dialogue']}”")
+                emotions.append(emotion)
+                character_types.append(character_type)
+                owners.append(index)
+
+        durations = [0.0] * len(actions)
+        for owner, duration in zip(owners, self.duration_estimator.estimate_batch(texts, emotions, character_types)):
+            durations[owner] = max(durations[owner], duration)
 
-            if current_split["est_duration"] + action_duration > self.target_segment_duration:
-                # 保存当前拆分
-                split_segments.append(current_split)
-
-                # 开始新的拆分
-                current_split = {
-                    "id": segment["id"],  # ID暂时保留原分段ID
-                    "actions": [],
-                    "est_duration": 0.0,
-                    "scene_id": segment["scene_id"]
-                }
-
-            current_split["actions"].append(action)
-            current_split["est_duration"] += action_duration
-
-        # 添加最后一个拆分
-        if current_split["actions"]:
-            split_segments.append(current_split)
-
-        return split_segments
+        # 如果没有估算出时长，使用默认值
+        return [duration or self.default_duration for duration in durations]
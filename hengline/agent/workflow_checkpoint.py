@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+@FileName: workflow_checkpoint.py
+@Description: 分镜工作流的精简检查点：不可变输入按内容寻址只保存一份，检查点中只保留引用；
+              只追加的列表（已生成的分镜）只保存相对上一版本新增的元素；可选只在分镜边界保存检查点
+@Author: HengLine
+@Time: 2025/11
+"""
+import hashlib
+import inspect
+import threading
+from typing import Any, Dict, Optional, Sequence, Set, Tuple
+
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.memory import MemorySaver
+
+from hengline.logger import debug, warning
+
+# 检查点保存时机：step每个节点执行后保存；shot只在分镜边界（完成一个分镜、进入下一个分段）及流程首尾保存
+CHECKPOINT_DURABILITY_STEP = "step"
+CHECKPOINT_DURABILITY_SHOT = "shot"
+
+# 规划完成后不再变化的输入字段
+IMMUTABLE_CHANNELS = ("script_text", "structured_script", "segments")
+
+# 分镜生成循环中处于分镜内部的节点，进入这些节点前的检查点不在分镜边界上
+MID_SHOT_NODES = ("review_shot", "check_retry", "extract_continuity")
+
+# 检查点数据块的自定义类型标记
+REF_TAG = "ref"
+APPEND_TAG = "append"
+INPUT_TAG = "input"
+
+
+class ShotCheckpointSaver(MemorySaver):
+    """
+    分镜工作流使用的内存检查点
+    - script_text / structured_script / segments 以序列化内容的sha256寻址保存在共享内容表中，多个线程的相同输入只存一份，
+      数据块（包括工作流输入__start__中的对应字段）只记录摘要
+    - 列表通道的新值以上一个已保存版本为前缀（元素为同一对象）时，只保存新增的元素，读取时沿版本链拼接，
+      使分镜列表的检查点总量随分镜数线性增长
+    - durability为shot时跳过分镜内部（生成/审查/重试检查之后）的检查点，被跳过步骤中变化的通道在下一个保存的检查点补齐
+    依赖MemorySaver的内部结构（blobs数据块表、_load_blobs、检查点的updated_channels和branch:to:<节点>通道名），
+    已验证版本见requirements.txt中的langgraph / langgraph-checkpoint，请通过 create_checkpoint_saver 创建。
+    若updated_channels或通道名发生变化，只会识别不出分镜内部的检查点，退化为每个节点后保存
+    """
+
+    def __init__(self, durability: str = CHECKPOINT_DURABILITY_SHOT):
+        """
+        初始化检查点
+
+        Args:
+            durability: 检查点保存时机（step / shot）
+        """
+        super().__init__()
+        if durability not in (CHECKPOINT_DURABILITY_STEP, CHECKPOINT_DURABILITY_SHOT):
+            warning(f"不支持的检查点保存时机: {durability}，在分镜边界保存")
+            durability = CHECKPOINT_DURABILITY_SHOT
+        self.durability = durability
+        # 内容表：摘要 -> 序列化后的值，以及引用它的线程
+        self.contents: Dict[str, Tuple[str, bytes]] = {}
+        self._content_threads: Dict[str, Set[str]] = {}
+        # 每个线程每个列表通道最近一次保存的版本和值，用于增量保存
+        self._last_lists: Dict[Tuple[str, str, str], Tuple[Any, list]] = {}
+        # 每个线程最近一次保存的检查点ID，以及最近一次被跳过的检查点ID（之后保存检查点时清除）
+        self._last_saved: Dict[Tuple[str, str], str] = {}
+        self._skipped: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            if self.durability == CHECKPOINT_DURABILITY_SHOT and self._is_mid_shot(checkpoint):
+                self._skipped[(thread_id, checkpoint_ns)] = checkpoint["id"]
+                return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                         "checkpoint_id": checkpoint["id"]}}
+
+            values = checkpoint["channel_values"]
+            # 被跳过的检查点中变化的通道没有保存，一并补齐
+            versions = dict(new_versions)
+            for channel, version in checkpoint["channel_versions"].items():
+                if (thread_id, checkpoint_ns, channel, version) not in self.blobs:
+                    versions[channel] = version
+            for channel, version in versions.items():
+                self.blobs[(thread_id, checkpoint_ns, channel, version)] = self._pack(
+                    thread_id, checkpoint_ns, channel, version, values)
+
+            # 数据块已保存，父检查点指向上一个实际保存的检查点
+            parent_config = {**config, "configurable": {**config["configurable"],
+                                                        "checkpoint_id": self._last_saved.get((thread_id, checkpoint_ns))}}
+            self._last_saved[(thread_id, checkpoint_ns)] = checkpoint["id"]
+            self._skipped.pop((thread_id, checkpoint_ns), None)
+            return super().put(parent_config, checkpoint, metadata, {})
+
+    def put_writes(self, config, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        # 被跳过的检查点不会被恢复，其待写入数据无需保存
+        configurable = config["configurable"]
+        skipped = self._skipped.get((configurable["thread_id"], configurable.get("checkpoint_ns", "")))
+        if skipped is not None and configurable.get("checkpoint_id") == skipped:
+            return
+        super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            for digest in [digest for digest, threads in self._content_threads.items() if thread_id in threads]:
+                threads = self._content_threads[digest]
+                threads.discard(thread_id)
+                if not threads:
+                    del self._content_threads[digest]
+                    del self.contents[digest]
+            for key in [key for key in self._last_lists if key[0] == thread_id]:
+                del self._last_lists[key]
+            for key in [key for key in self._last_saved if key[0] == thread_id]:
+                del self._last_saved[key]
+            for key in [key for key in self._skipped if key[0] == thread_id]:
+                del self._skipped[key]
+
+    def content_bytes(self) -> int:
+        """内容表中不可变输入的序列化总字节数"""
+        return sum(len(data) for _, data in self.contents.values())
+
+    def _is_mid_shot(self, checkpoint: Dict[str, Any]) -> bool:
+        """检查点是否位于分镜内部：下一步进入审查/重试检查/提取连续性节点，或重试时重新进入生成节点"""
+        updated = set(checkpoint.get("updated_channels") or [])
+        if any(f"branch:to:{node}" in updated for node in MID_SHOT_NODES):
+            return True
+        # 进入下一个分段时会更新current_segment_index，重试则不会
+        return "branch:to:generate_shot" in updated and "current_segment_index" not in updated
+
+    def _pack(self, thread_id: str, checkpoint_ns: str, channel: str, version: Any,
+              values: Dict[str, Any]) -> Tuple[str, bytes]:
+        """将通道值序列化为数据块"""
+        if channel not in values:
+            return "empty", b""
+        value = values[channel]
+        if channel in IMMUTABLE_CHANNELS and value is not None:
+            return REF_TAG, self._store_content(thread_id, value).encode()
+        if channel == "__start__" and isinstance(value, dict):
+            refs = {key: self._store_content(thread_id, value[key]) for key in IMMUTABLE_CHANNELS
+                    if value.get(key) is not None}
+            rest = {key: item for key, item in value.items() if key not in refs}
+            return self._tagged(INPUT_TAG, [rest, refs])
+        if isinstance(value, list):
+            key = (thread_id, checkpoint_ns, channel)
+            last = self._last_lists.get(key)
+            self._last_lists[key] = (version, value)
+            if last is not None and self._extends(last[1], value):
+                return self._tagged(APPEND_TAG, [last[0], value[len(last[1]):]])
+        return self.serde.dumps_typed(value)
+
+    def _tagged(self, tag: str, value: Any) -> Tuple[str, bytes]:
+        """序列化并在类型前加上自定义标记，如 append:msgpack"""
+        serde_type, data = self.serde.dumps_typed(value)
+        return f"{tag}:{serde_type}", data
+
+    def _untag(self, blob: Tuple[str, bytes]) -> Tuple[str, Any]:
+        tag, serde_type = blob[0].split(":", 1)
+        return tag, self.serde.loads_typed((serde_type, blob[1]))
+
+    @staticmethod
+    def _extends(base: list, value: list) -> bool:
+        """value是否以base中的同一批对象为前缀"""
+        return len(value) >= len(base) and all(a is b for a, b in zip(base, value))
+
+    def _store_content(self, thread_id: str, value: Any) -> str:
+        serialized = self.serde.dumps_typed(value)
+        digest = hashlib.sha256(serialized[1]).hexdigest()
+        if digest not in self.contents:
+            self.contents[digest] = serialized
+            debug(f"检查点内容表新增不可变输入: {digest[:12]}，{len(serialized[1])} 字节")
+        self._content_threads.setdefault(digest, set()).add(thread_id)
+        return digest
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions) -> Dict[str, Any]:
+        channel_values = {}
+        for channel, version in versions.items():
+            value = self._load_blob(thread_id, checkpoint_ns, channel, version)
+            if value is not _EMPTY:
+                channel_values[channel] = value
+        return channel_values
+
+    def _load_blob(self, thread_id: str, checkpoint_ns: str, channel: str, version: Any) -> Any:
+        """读取数据块，增量保存的列表沿版本链拼接"""
+        suffixes = []
+        blob: Optional[Tuple[str, bytes]] = self.blobs.get((thread_id, checkpoint_ns, channel, version))
+        while blob is not None and blob[0].startswith(APPEND_TAG + ":"):
+            base_version, suffix = self._untag(blob)[1]
+            suffixes.append(suffix)
+            blob = self.blobs.get((thread_id, checkpoint_ns, channel, base_version))
+        if blob is None or blob[0] == "empty":
+            return _EMPTY
+        if blob[0] == REF_TAG:
+            value = self.serde.loads_typed(self.contents[blob[1].decode()])
+        elif blob[0].startswith(INPUT_TAG + ":"):
+            rest, refs = self._untag(blob)[1]
+            value = {**rest, **{key: self.serde.loads_typed(self.contents[digest]) for key, digest in refs.items()}}
+        else:
+            value = self.serde.loads_typed(blob)
+        for suffix in reversed(suffixes):
+            value = value + suffix
+        return value
+
+
+_EMPTY = object()
+
+
+def is_memory_saver_compatible() -> bool:
+    """当前安装的langgraph-checkpoint是否提供ShotCheckpointSaver依赖的MemorySaver内部结构"""
+    try:
+        load_blobs = getattr(MemorySaver, "_load_blobs", None)
+        return (isinstance(MemorySaver().blobs, dict)
+                and load_blobs is not None
+                and list(inspect.signature(load_blobs).parameters) == ["self", "thread_id", "checkpoint_ns", "versions"]
+                and "updated_channels" in empty_checkpoint())
+    except Exception:
+        return False
+
+
+def create_checkpoint_saver(durability: str = CHECKPOINT_DURABILITY_SHOT) -> MemorySaver:
+    """
+    创建分镜工作流的检查点，langgraph-checkpoint内部结构不兼容时回退为默认的MemorySaver
+
+    Args:
+        durability: 检查点保存时机（step / shot）
+
+    Returns:
+        检查点实例
+    """
+    if is_memory_saver_compatible():
+        return ShotCheckpointSaver(durability)
+    warning("当前langgraph-checkpoint版本与ShotCheckpointSaver不兼容，使用默认的MemorySaver（每个节点后完整保存）")
+    return MemorySaver()
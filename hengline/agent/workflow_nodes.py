@@ -5,12 +5,17 @@
 @Author: HengLine
 @Time: 2025/10 - 2025/11
 """
+import copy
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 
+from hengline.client.llm_limiter import get_max_concurrency
 from hengline.logger import debug, info, warning, error
-from .workflow_states import StoryboardWorkflowState
+from .continuity_guardian_agent import ContinuityContext
+from .shot_generator_agent import ConstraintPromptContext
+from .workflow_states import StoryboardWorkflowState, Replace
 
 
 class WorkflowNodes:
@@ -39,7 +44,11 @@ class WorkflowNodes:
         """解析剧本文本节点"""
         debug("解析剧本文本节点执行中")
         try:
-            structured_script = self.script_parser.parse_script(state["script_text"], state["task_id"])
+            structured_script = self.script_parser.parse_script(
+                state["script_text"],
+                state["task_id"],
+                state.get("script_format", "auto")
+            )
 
             # 使用LLM增强解析结果（如果有）
             if self.llm:
@@ -59,9 +68,11 @@ class WorkflowNodes:
         """规划时间线节点"""
         debug("规划时间线节点执行中")
         try:
+            # 规划参数按请求创建，规划器实例可被多个请求共享
+            context = self.temporal_planner.create_context(state["duration_per_shot"])
             segments = self.temporal_planner.plan_timeline(
                 state["structured_script"],
-                state["duration_per_shot"]
+                context=context
             )
             debug(f"时序规划完成，分段数: {len(segments)}")
             return {
@@ -111,21 +122,36 @@ class WorkflowNodes:
             scenes = state.get("structured_script", {}).get("scenes", [])
             scene_context = scenes[scene_id] if scene_id < len(scenes) else {}
 
+            # 角色状态记忆保存在工作流状态中，复制后使用，避免修改检查点中的数据
+            continuity_context = ContinuityContext(character_states=dict(state.get("character_states") or {}))
+            prompt_context = ConstraintPromptContext(character_sheet=dict(state.get("character_sheet") or {}))
+
             try:
                 # 生成连续性约束
                 continuity_constraints = self.continuity_guardian.generate_continuity_constraints(
                     segment,
                     state.get("current_continuity_state"),
-                    scene_context
+                    scene_context,
+                    continuity_context
                 )
 
+                # 重试时按上一次审查发现的关键序列问题，让相关角色从上一分镜的结束状态开始
+                if state.get("retry_count", 0) > 0 and state.get("sequence_review"):
+                    qa_results = state.get("qa_results") or []
+                    self._apply_sequence_corrections(
+                        continuity_constraints,
+                        qa_results[-1].get("sequence_issues", []) if qa_results else [],
+                        state["sequence_review"].get("prev_shot")
+                    )
+
                 # 生成分镜
                 shot = self.shot_generator.generate_shot(
                     segment,
                     continuity_constraints,
                     scene_context,
                     state["style"],
-                    shot_id
+                    shot_id,
+                    prompt_context=prompt_context
                 )
             except Exception as shot_e:
                 error(f"生成自定义分镜失败: {str(shot_e)}")
@@ -139,6 +165,8 @@ class WorkflowNodes:
             return {
                 "current_segment": segment,
                 "current_shot": shot,
+                "character_states": continuity_context.character_states,
+                "character_sheet": prompt_context.character_sheet,
                 "retry_count": state.get("retry_count", 0)
             }
         except Exception as e:
@@ -168,6 +196,15 @@ class WorkflowNodes:
             # 审查分镜
             qa_result = self.qa_agent.review_single_shot(shot, segment)
 
+            # 与上一个已接受分镜做增量序列审查，关键问题（如位置冲突）立即触发重试，避免后续分镜继承错误的锚点
+            sequence_review = state.get("sequence_review") or self.qa_agent.create_sequence_review()
+            sequence_issues = self.qa_agent.review_sequence_step(sequence_review, shot)
+            sequence_critical = [issue["message"] for issue in sequence_issues if issue["severity"] == "critical"]
+            if sequence_critical:
+                qa_result["critical_issues"] = qa_result.get("critical_issues", []) + sequence_critical
+                qa_result["is_valid"] = False
+            qa_result["sequence_issues"] = sequence_issues
+
             # 记录不同级别的问题
             if qa_result.get("warnings"):
                 info(f"分镜有警告: {qa_result.get('warnings')}")
@@ -185,20 +222,16 @@ class WorkflowNodes:
                     qa_result["warnings"] = []
                 qa_result["warnings"].append("使用默认分镜生成器，放宽审查标准")
 
-            # 添加到qa_results列表
-            qa_results = state["qa_results"].copy()
-            qa_results.append(qa_result)
-
+            # 追加到qa_results列表（由reducer合并），LLM审查决定计入任务指标
             return {
-                "qa_results": qa_results
+                "qa_results": [qa_result],
+                "llm_review_metrics": self.qa_agent.llm_review_counts(qa_result.get("llm_review"))
             }
         except Exception as e:
             error(f"分镜审查失败: {str(e)}")
             # 添加失败的审查结果
-            qa_results = state["qa_results"].copy()
-            qa_results.append({"is_valid": False, "critical_issues": [str(e)], "warnings": [], "suggestions": []})
             return {
-                "qa_results": qa_results
+                "qa_results": [{"is_valid": False, "critical_issues": [str(e)], "warnings": [], "suggestions": []}]
             }
 
     def check_retry_node(self, state: StoryboardWorkflowState) -> Dict[str, Any]:
@@ -224,8 +257,7 @@ class WorkflowNodes:
         else:
             status_reason = '分镜达到最大重试次数' if retry_count >= max_retries else '分镜审查通过'
             warning(f"{status_reason}，添加到结果集")
-            # 将当前分镜添加到shots列表
-            shots = state["shots"].copy()
+            # 记录审查信息，分镜由提取连续性节点添加到shots列表
             current_shot = state.get("current_shot").copy()
             
             # 保留警告信息
@@ -244,9 +276,8 @@ class WorkflowNodes:
                 if all_warnings:
                     current_shot["warnings"] = list(set(all_warnings))  # 去重
             
-            shots.append(current_shot)
             return {
-                "shots": shots
+                "current_shot": current_shot
             }
 
     def extract_continuity_node(self, state: StoryboardWorkflowState) -> Dict[str, Any]:
@@ -257,20 +288,27 @@ class WorkflowNodes:
             segment = state.get("current_segment")
             shot = state.get("current_shot")
 
-            # 添加到shots列表
-            shots = state["shots"].copy()
-            shots.append(shot)
-
             # 提取连续性锚点
             continuity_anchor = self.continuity_guardian.extract_continuity_anchor(segment, shot)
-            debug(f"分镜 {len(shots)} 生成并通过审查")
+            debug(f"分镜 {len(state['shots']) + 1} 生成并通过审查")
+
+            # 将分镜加入增量序列审查，与上一分镜的衔接问题已由审查节点计算并记录在审查结果中
+            sequence_review = state.get("sequence_review") or self.qa_agent.create_sequence_review()
+            qa_results = state.get("qa_results") or []
+            sequence_issues = qa_results[-1].get("sequence_issues") if qa_results else None
+            if sequence_issues is None:
+                sequence_issues = self.qa_agent.review_sequence_step(sequence_review, shot)
+            sequence_review, accepted_issues = self.qa_agent.accept_sequence_shot(sequence_review, shot)
 
             # 移动到下一个分段
             current_segment_index = state["current_segment_index"] + 1
 
             return {
-                "shots": shots,
+                # 追加到shots列表（由reducer合并）
+                "shots": [shot],
                 "current_continuity_state": continuity_anchor,
+                "sequence_review": sequence_review,
+                "sequence_issues": sequence_issues + accepted_issues,
                 "current_segment_index": current_segment_index,
                 "retry_count": 0  # 重置重试计数
             }
@@ -284,7 +322,12 @@ class WorkflowNodes:
         """审查分镜序列节点，优化序列连续性审查"""
         debug("审查分镜序列连续性节点执行中")
         try:
-            sequence_qa = self.qa_agent.review_shot_sequence(state["shots"])
+            sequence_review = state.get("sequence_review")
+            if sequence_review and sequence_review["total_shots"] == len(state["shots"]):
+                # 生成过程中已逐个分镜增量审查，直接汇总
+                sequence_qa = self.qa_agent.finish_sequence_review(sequence_review, state.get("sequence_issues") or [])
+            else:
+                sequence_qa = self.qa_agent.review_shot_sequence(state["shots"])
             
             # 分类错误类型
             if sequence_qa.get("has_continuity_issues", False):
@@ -312,11 +355,14 @@ class WorkflowNodes:
                 # 更新序列审查结果
                 if critical_issues:
                     warning(f"分镜序列审查失败(关键问题): {critical_issues}")
-                    sequence_qa = {"has_continuity_issues": True, "critical_issues": critical_issues, "warnings": warnings}
+                    sequence_qa = {"has_continuity_issues": True, "critical_issues": critical_issues, "warnings": warnings,
+                                   "issues": sequence_qa.get("issues", []),
+                                   "repair_targets": sequence_qa.get("repair_targets", [])}
                 else:
                     # 只有警告的情况下，不认为存在连续性问题
                     info("分镜序列有警告但通过审查")
-                    sequence_qa = {"has_continuity_issues": False, "warnings": warnings}
+                    sequence_qa = {"has_continuity_issues": False, "warnings": warnings,
+                                   "issues": sequence_qa.get("issues", [])}
             
             return {
                 "sequence_qa": sequence_qa
@@ -332,11 +378,19 @@ class WorkflowNodes:
         """修复连续性问题节点"""
         debug("修复连续性问题节点执行中")
         try:
-            warning("分镜序列存在连续性问题，尝试修正")
-            fixed_shots = self._fix_continuity_issues(state["shots"], state["sequence_qa"])
+            sequence_qa = state["sequence_qa"]
+            repair_targets = sequence_qa.get("repair_targets")
+            if repair_targets and len(state.get("segments") or []) == len(state["shots"]):
+                # 只重新生成有关键问题的分镜，修复代价与问题数量相关而与分镜总数无关
+                warning(f"分镜序列存在连续性问题，重新生成 {len(repair_targets)} 个相关分镜")
+                fixed_shots, sequence_qa = self._repair_shots(state, repair_targets)
+            else:
+                warning("分镜序列存在连续性问题，尝试修正")
+                fixed_shots = self._fix_continuity_issues(state["shots"], sequence_qa)
+                sequence_qa = {"has_continuity_issues": False, "issues": []}  # 假设修复成功
             return {
-                "shots": fixed_shots,
-                "sequence_qa": {"has_continuity_issues": False, "issues": []}  # 假设修复成功
+                "shots": Replace(fixed_shots),
+                "sequence_qa": sequence_qa
             }
         except Exception as e:
             error(f"修复连续性问题失败: {str(e)}")
@@ -355,6 +409,13 @@ class WorkflowNodes:
                 state["duration_per_shot"],
                 state["sequence_qa"]
             )
+            # 记录剧本格式识别结果和实际使用的解析器
+            parse_metadata = (state.get("structured_script") or {}).get("metadata")
+            if parse_metadata:
+                result["metadata"]["script_parsing"] = parse_metadata
+            # 记录LLM审查的跳过和抽样情况
+            if state.get("llm_review_metrics"):
+                result["metadata"]["llm_review"] = self.qa_agent.summarize_llm_review(state["llm_review_metrics"])
             return {
                 "result": result
             }
@@ -446,9 +507,144 @@ class WorkflowNodes:
             "final_continuity_state": {}
         }
 
+    @staticmethod
+    def _apply_sequence_corrections(continuity_constraints: Dict[str, Any], sequence_issues: List[Dict[str, Any]],
+                                    prev_shot: Dict[str, Any]) -> None:
+        """
+        按关键序列问题修正连续性约束：涉及的角色从上一分镜的结束位置和姿势开始
+
+        Args:
+            continuity_constraints: 连续性约束，原地修改
+            sequence_issues: 序列审查问题
+            prev_shot: 上一分镜（至少包含final_state）
+        """
+        if not prev_shot:
+            return
+        prev_final_state = {s.get("character_name"): s for s in prev_shot.get("final_state", [])}
+        characters = continuity_constraints.get("characters", {})
+        for issue in sequence_issues:
+            if issue.get("severity") != "critical":
+                continue
+            for character in issue.get("characters", []):
+                if character in characters and character in prev_final_state:
+                    final_state = prev_final_state[character]
+                    characters[character]["must_start_with_position"] = final_state.get(
+                        "position", characters[character].get("must_start_with_position"))
+                    characters[character]["must_start_with_pose"] = final_state.get(
+                        "pose", characters[character].get("must_start_with_pose"))
+                    debug(f"角色 {character} 按上一分镜的结束状态修正开始约束")
+
+    def _repair_shots(self, state: StoryboardWorkflowState,
+                      repair_targets: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        并发重新生成有关键问题的分镜，再只校验修复分镜与其相邻分镜
+        重新生成的分镜未通过审查或与相邻分镜仍有关键问题时，改为让原分镜继承上一分镜的结束位置和姿势
+
+        Args:
+            state: 工作流状态（shots与segments一一对应）
+            repair_targets: 修复目标（QAAgent.repair_targets）
+
+        Returns:
+            (修复后的分镜列表, 修复后的序列审查结果)
+        """
+        original_shots = state["shots"]
+        shots = list(original_shots)
+        index_by_id = {str(shot.get("shot_id")): index for index, shot in enumerate(shots)}
+        # 第一个分镜没有上一分镜可衔接
+        targets = {index_by_id[str(target["shot_id"])]: target for target in repair_targets
+                   if index_by_id.get(str(target["shot_id"]), 0) > 0}
+
+        regenerated = {}
+        if targets:
+            workers = min(len(targets), get_max_concurrency())
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="repair") as executor:
+                futures = {executor.submit(self._regenerate_shot, state, index, target): index
+                           for index, target in targets.items()}
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        regenerated[index] = future.result()
+                    except Exception as e:
+                        warning(f"分镜 {shots[index].get('shot_id')} 重新生成失败: {str(e)}")
+                        regenerated[index] = None
+        for index, shot in regenerated.items():
+            if shot is not None:
+                shots[index] = shot
+
+        # 按分镜顺序确认修复结果，只校验与前后分镜的衔接
+        repaired, patched = [], []
+        for index in sorted(targets):
+            shot_id = shots[index].get("shot_id")
+            neighbours = [i for i in (index, index + 1) if i < len(shots)]
+            if regenerated.get(index) is not None and not any(
+                    issue["severity"] == "critical"
+                    for i in neighbours for issue in self.qa_agent.review_shot_pair(shots[i - 1], shots[i])):
+                repaired.append(shot_id)
+                continue
+            shots[index] = copy.deepcopy(original_shots[index])
+            self._inherit_prev_final_state(shots[index - 1], shots[index])
+            patched.append(shot_id)
+
+        affected = sorted({i for index in targets for i in (index, index + 1) if i < len(shots)})
+        remaining = [issue for i in affected for issue in self.qa_agent.review_shot_pair(shots[i - 1], shots[i])
+                     if issue["severity"] == "critical"]
+        sequence_qa = state["sequence_qa"]
+        info(f"连续性修复完成，重新生成 {len(repaired)} 个分镜，继承上一分镜状态 {len(patched)} 个，"
+             f"剩余关键问题 {len(remaining)} 个")
+        return shots, {
+            "has_continuity_issues": len(remaining) > 0,
+            "critical_issues": [issue["message"] for issue in remaining],
+            "warnings": sequence_qa.get("warnings", []),
+            "issues": [issue for issue in sequence_qa.get("issues", []) if issue["severity"] != "critical"] + remaining,
+            "repair": {"regenerated": repaired, "patched": patched}
+        }
+
+    def _regenerate_shot(self, state: StoryboardWorkflowState, index: int,
+                         target: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        以上一分镜的结束状态为锚点、按关键问题修正约束后重新生成分镜
+
+        Returns:
+            通过单分镜审查的新分镜；未通过时返回None
+        """
+        segments = state["segments"]
+        segment = segments[index]
+        prev_shot = state["shots"][index - 1]
+        scene_id = segment.get("scene_id", 0)
+        scenes = (state.get("structured_script") or {}).get("scenes", [])
+        scene_context = scenes[scene_id] if scene_id < len(scenes) else {}
+
+        anchor = self.continuity_guardian.extract_continuity_anchor(segments[index - 1], prev_shot)
+        continuity_constraints = self.continuity_guardian.generate_continuity_constraints(
+            segment, anchor, scene_context, ContinuityContext())
+        self._apply_sequence_corrections(continuity_constraints, target["issues"], prev_shot)
+        shot = self.shot_generator.generate_shot(segment, continuity_constraints, scene_context, state["style"], index + 1)
+
+        qa_result = self.qa_agent.review_single_shot(shot, segment)
+        if not qa_result.get("is_valid", False):
+            debug(f"分镜 {target['shot_id']} 重新生成后未通过审查: {qa_result.get('critical_issues')}")
+            return None
+        # 沿用原分镜的编号和时间信息（长剧本合并后为全局编号）
+        original = state["shots"][index]
+        for key in ("shot_id", "time_range_sec", "start_time", "end_time", "chunk_index"):
+            if key in original:
+                shot[key] = copy.deepcopy(original[key])
+        return shot
+
+    @staticmethod
+    def _inherit_prev_final_state(prev_shot: Dict[str, Any], current_shot: Dict[str, Any]) -> None:
+        """当前分镜中的角色继承上一帧的位置和姿势（原地修改当前分镜）"""
+        prev_final_state = {s.get("character_name"): s for s in prev_shot.get("final_state", [])}
+        for state in current_shot.get("initial_state", []):
+            character_name = state.get("character_name")
+            if character_name in prev_final_state:
+                state["position"] = prev_final_state[character_name].get("position", state.get("position"))
+                state["pose"] = prev_final_state[character_name].get("pose", state.get("pose"))
+
     def _fix_continuity_issues(self, shots: List[Dict[str, Any]], qa_result: Dict[str, Any]) -> List[Dict[str, Any]]:
         """修复连续性问题"""
-        fixed_shots = shots.copy()
+        # 修改副本，已保存的检查点可能仍引用原分镜
+        fixed_shots = copy.deepcopy(shots)
 
         # 简单的修复逻辑
         # 这里可以根据qa_result中的建议进行更复杂的修复
@@ -462,15 +658,7 @@ class WorkflowNodes:
             current_shot["time_range_sec"][1] = prev_end + 5
 
             # 修复角色状态连续性
-            prev_final_state = {s.get("character_name"): s for s in prev_shot.get("final_state", [])}
-            current_initial_state = current_shot.get("initial_state", [])
-
-            for state in current_initial_state:
-                character_name = state.get("character_name")
-                if character_name in prev_final_state:
-                    # 继承上一帧的位置和姿势
-                    state["position"] = prev_final_state[character_name].get("position", state["position"])
-                    state["pose"] = prev_final_state[character_name].get("pose", state["pose"])
+            self._inherit_prev_final_state(prev_shot, current_shot)
 
         return fixed_shots
 
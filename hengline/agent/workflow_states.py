@@ -5,7 +5,46 @@
 @Author: HengLine
 @Time: 2025/10 - 2025/11
 """
-from typing import Dict, List, Any, Optional, TypedDict
+from typing import Annotated, Dict, List, Any, Optional, TypedDict, Union, get_type_hints
+
+from .continuity_state import AnchorMap, CharacterState
+
+# qa_results只保留当前分段的审查结果（首次生成 + 最多2次重试），路由和重试检查只读取最后一个
+QA_RESULTS_WINDOW = 3
+
+
+class Replace(list):
+    """整体替换列表字段的更新值，追加型reducer遇到该类型时用它替换原列表（如修复连续性后改写全部分镜）"""
+
+
+def append_items(existing: Optional[List[Any]], new: Optional[List[Any]]) -> List[Any]:
+    """
+    追加型reducer：节点只返回新增的元素，由reducer追加到已有列表
+    返回新列表而不原地修改，后台异步保存的检查点可能仍在序列化旧列表
+
+    Args:
+        existing: 当前列表
+        new: 节点返回的新增元素（Replace时整体替换）
+
+    Returns:
+        更新后的列表
+    """
+    if isinstance(new, Replace):
+        return list(new)
+    return (existing or []) + (new or [])
+
+
+def append_recent_qa_results(existing: Optional[List[Any]], new: Optional[List[Any]]) -> List[Any]:
+    """追加审查结果，只保留最近 QA_RESULTS_WINDOW 条"""
+    return append_items(existing, new)[-QA_RESULTS_WINDOW:]
+
+
+def sum_counts(existing: Optional[Dict[str, int]], new: Optional[Dict[str, int]]) -> Dict[str, int]:
+    """计数型reducer：节点只返回本次的计数，按键累加"""
+    merged = dict(existing or {})
+    for key, value in (new or {}).items():
+        merged[key] = merged.get(key, 0) + value
+    return merged
 
 
 class InputState(TypedDict):
@@ -15,6 +54,7 @@ class InputState(TypedDict):
     duration_per_shot: int  # 每段时长
     prev_continuity_state: Optional[Dict[str, Any]]  # 上一段的连续性状态
     task_id: str  #唯一标识符
+    script_format: str  # 剧本格式（auto / screenplay / chinese）
 
 
 class ScriptParsingState(TypedDict):
@@ -30,8 +70,11 @@ class TimelinePlanningState(TypedDict):
 
 class ShotGenerationState(TypedDict):
     """分镜生成相关状态"""
-    shots: List[Dict[str, Any]]  # 已生成的分镜列表
-    current_continuity_state: Optional[Dict[str, Any]]  # 当前连续性状态
+    shots: Annotated[List[Dict[str, Any]], append_items]  # 已生成的分镜列表（节点只返回新增分镜）
+    # 当前连续性状态：上一分镜的锚点映射，首个分镜之前为调用方传入的 prev_continuity_state
+    current_continuity_state: Optional[Union[AnchorMap, List[Dict[str, Any]], Dict[str, Any]]]
+    character_states: Dict[str, CharacterState]  # 角色状态记忆（按角色名索引，状态不可变）
+    character_sheet: Dict[str, Dict[str, Any]]  # 已写入分镜提示词的角色设定表（delta模式，只追加）
     retry_count: int  # 重试次数
     max_retries: int  # 最大重试次数
     current_segment: Optional[Dict[str, Any]]  # 当前处理的分段
@@ -40,8 +83,11 @@ class ShotGenerationState(TypedDict):
 
 class ReviewState(TypedDict):
     """审查相关状态"""
-    qa_results: List[Dict[str, Any]]  # 单个分镜审查结果列表
+    qa_results: Annotated[List[Dict[str, Any]], append_recent_qa_results]  # 当前分段最近的审查结果（节点只返回新增结果）
     sequence_qa: Optional[Dict[str, Any]]  # 分镜序列审查结果
+    sequence_review: Optional[Dict[str, Any]]  # 增量序列审查状态（每接受一个分镜更新）
+    sequence_issues: Annotated[List[Dict[str, Any]], append_items]  # 增量审查累积的序列问题（节点只返回新增问题）
+    llm_review_metrics: Annotated[Dict[str, int], sum_counts]  # LLM审查决定的累计次数（节点只返回本次计数）
 
 
 class OutputState(TypedDict):
@@ -56,4 +102,28 @@ class StoryboardWorkflowState(InputState, ScriptParsingState, TimelinePlanningSt
     完整的分镜生成工作流状态
     通过继承多个特定功能的状态类来组合，实现高内聚低耦合
     """
-    pass
\ No newline at end of file
+    pass
+
+# 带reducer的状态字段
+STATE_REDUCERS = {
+    name: hint.__metadata__[0]
+    for name, hint in get_type_hints(StoryboardWorkflowState, include_extras=True).items()
+    if hasattr(hint, "__metadata__")
+}
+
+
+def apply_state_update(state: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    按字段的reducer将节点返回值合并到状态（不经过LangGraph直接调用节点时使用）
+
+    Args:
+        state: 当前状态，原地更新
+        update: 节点返回的更新
+
+    Returns:
+        更新后的状态
+    """
+    for key, value in update.items():
+        reducer = STATE_REDUCERS.get(key)
+        state[key] = reducer(state.get(key), value) if reducer else value
+    return state
@@ -0,0 +1,113 @@
+"""
+@FileName: llm_limiter.py
+@Description: 全局LLM并发限制器，所有智能体共享同一组并发槽位，避免分块并行调用时压垮上游服务
+@Author: HengLine
+@Time: 2025/11/10 10:20
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Sequence
+
+from config.config import get_ai_config
+from hengline.logger import debug
+
+# 默认最大并发数
+DEFAULT_MAX_CONCURRENCY = 4
+
+# 进程级共享的信号量
+_limiter_lock = threading.Lock()
+_llm_semaphore: Optional[threading.BoundedSemaphore] = None
+_max_concurrency: int = 0
+
+
+def get_max_concurrency() -> int:
+    """
+    获取LLM全局最大并发数（配置项 llm.max_concurrency）
+
+    Returns:
+        最大并发数，至少为1
+    """
+    try:
+        value = int(get_ai_config().get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+    except (TypeError, ValueError):
+        value = DEFAULT_MAX_CONCURRENCY
+    return max(1, value)
+
+
+def get_llm_semaphore() -> threading.BoundedSemaphore:
+    """
+    获取全局LLM信号量，首次调用时按配置创建
+
+    Returns:
+        进程内共享的BoundedSemaphore
+    """
+    global _llm_semaphore, _max_concurrency
+    if _llm_semaphore is None:
+        with _limiter_lock:
+            if _llm_semaphore is None:
+                _max_concurrency = get_max_concurrency()
+                _llm_semaphore = threading.BoundedSemaphore(_max_concurrency)
+                debug(f"初始化LLM全局并发限制器，最大并发数: {_max_concurrency}")
+    return _llm_semaphore
+
+
+@contextmanager
+def llm_slot() -> Iterator[None]:
+    """
+    占用一个LLM并发槽位，退出上下文时释放
+    """
+    semaphore = get_llm_semaphore()
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def invoke_llm(llm: Any, prompt: Any) -> Any:
+    """
+    在全局并发限制下调用LLM
+
+    Args:
+        llm: 语言模型实例
+        prompt: 提示词
+
+    Returns:
+        LLM原始响应
+    """
+    with llm_slot():
+        return llm.invoke(prompt)
+
+
+def map_llm_tasks(func: Callable[[Any], Any], items: Sequence[Any]) -> List[Any]:
+    """
+    并发执行一组LLM任务并按输入顺序返回结果
+    线程数不超过全局并发上限，真正的LLM调用仍需通过 invoke_llm 占用槽位，
+    因此多个请求同时分块调用时总并发也不会超过上限
+
+    Args:
+        func: 单个任务的处理函数，异常需由调用方在func内处理
+        items: 任务输入列表
+
+    Returns:
+        与items顺序一致的结果列表
+    """
+    if not items:
+        return []
+    workers = min(len(items), get_max_concurrency())
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm") as executor:
+        return list(executor.map(func, items))
+
+
+def reset_llm_limiter() -> None:
+    """
+    重置限制器，下次使用时按最新配置重新创建（用于配置热更新）
+    """
+    global _llm_semaphore, _max_concurrency
+    with _limiter_lock:
+        _llm_semaphore = None
+        _max_concurrency = 0
@@ -0,0 +1,63 @@
+"""
+@FileName: batched_review_benchmark.py
+@Description: 批量LLM审查基准：多个任务并发、各自逐个审查分镜时，对比逐个调用与批量合并调用的LLM调用次数和耗时，
+              校验两种方式每个分镜的审查结论一致，并查看token预算对批大小的影响
+@Author: HengLine
+@Time: 2025/11
+"""
+import copy
+import threading
+import time
+
+from hengline.agent import QAAgent
+from hengline.agent import batched_review
+from hengline.agent.draft_pipeline import get_draft_pipeline
+from hengline.example.llm_review_gating_benchmark import FakeReviewLLM, degrade
+from hengline.example.long_script_benchmark import build_script
+
+
+class NamedFakeReviewLLM(FakeReviewLLM):
+    """带模型名的模拟LLM，不同任务的实例共享同一个批量审查器"""
+    model_name = "fake-review"
+
+
+def run_jobs(shots: list, segments: list, jobs: int, batch_size: int, token_budget: int, latency: float):
+    """jobs个任务并发，每个任务使用自己的LLM和QAAgent实例逐个审查全部分镜"""
+    batched_review._reviewers.clear()
+    llms = [NamedFakeReviewLLM(latency) for _ in range(jobs)]
+    verdicts = [None] * jobs
+
+    def run_job(job: int):
+        qa_agent = QAAgent(llm=llms[job], confidence_threshold=1.01, audit_sample_rate=0.0)
+        qa_agent.batch_size = batch_size
+        qa_agent.batch_token_budget = token_budget
+        verdicts[job] = [qa_agent.review_single_shot(copy.deepcopy(shot), segment)["is_valid"]
+                         for shot, segment in zip(shots, segments)]
+
+    threads = [threading.Thread(target=run_job, args=(job,)) for job in range(jobs)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return verdicts, sum(llm.calls for llm in llms), elapsed
+
+
+def run_benchmark(jobs: int = 8, shot_count: int = 12, latency: float = 0.1):
+    state = get_draft_pipeline().generate_state(build_script(3, 5))
+    shots = degrade(state["shots"][:shot_count])
+    segments = state["segments"][:shot_count]
+
+    print(f"{'任务数':>6} {'每任务分镜':>10} {'批大小':>6} {'token预算':>10} {'LLM调用':>8} {'平均每批':>8} {'耗时(s)':>8}")
+    baseline = None
+    for batch_size, token_budget in ((1, 6000), (8, 6000), (8, 2000)):
+        verdicts, calls, elapsed = run_jobs(shots, segments, jobs, batch_size, token_budget, latency)
+        baseline = baseline or verdicts
+        assert verdicts == baseline, "批量审查与逐个审查的结论不一致"
+        print(f"{jobs:>6} {len(shots):>10} {batch_size:>6} {token_budget:>10} {calls:>8} "
+              f"{jobs * len(shots) / calls:>8.1f} {elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,94 @@
+"""
+@FileName: character_index_benchmark.py
+@Description: 规则增强基准测试，对比角色索引（线性）与逐动作全量扫描（平方）两种实现的耗时和结果一致性
+@Author: HengLine
+@Time: 2025/11
+"""
+import json
+import random
+import time
+
+from hengline.agent.script_parser_agent import ScriptParserAgent
+
+CHARACTERS = ["小明", "小红", "老王", "李医生", "张警官", "服务员", "年轻人", "老人"]
+ACTIONS = ["慢慢走向门口", "坐在窗边", "跑步穿过街道", "缓缓抬起头", "穿着西装站在门口", "微笑着看着他", "颤抖着后退"]
+DIALOGUES = ["你好", "哇塞，太酷了", "唉，想当年", "为什么会这样？", "别担心，一切都会好起来的", "好的"]
+
+
+def build_structured_script(action_count: int, actions_per_scene: int = 50, seed: int = 7) -> dict:
+    """生成包含指定动作数的结构化剧本"""
+    rng = random.Random(seed)
+    scenes = []
+    for start in range(0, action_count, actions_per_scene):
+        actions = []
+        for _ in range(min(actions_per_scene, action_count - start)):
+            action = {"character": rng.choice(CHARACTERS)}
+            if rng.random() < 0.5:
+                action["dialogue"] = rng.choice(DIALOGUES)
+            else:
+                action["action"] = rng.choice(ACTIONS)
+            actions.append(action)
+        scenes.append({"location": "咖啡馆", "time": "晚上", "actions": actions})
+    return {"scenes": scenes}
+
+
+def legacy_enhance_with_rules(parser: ScriptParserAgent, structured_script: dict) -> dict:
+    """优化前的规则增强实现（深拷贝 + 每个新角色全量扫描），仅用于对比"""
+    enhanced_script = json.loads(json.dumps(structured_script))
+    character_appearances = {}
+    for scene in enhanced_script.get("scenes", []):
+        if "atmosphere" not in scene:
+            scene["atmosphere"] = parser._infer_atmosphere(scene)
+        for action in scene.get("actions", []):
+            character = action.get("character", "")
+            if "emotion" not in action:
+                if "dialogue" in action:
+                    action["emotion"] = parser._infer_emotion_from_dialogue(action["dialogue"])
+                elif "action" in action:
+                    action["emotion"] = parser._infer_emotion_from_action(action["action"])
+                else:
+                    action["emotion"] = "平静"
+            if character and character not in character_appearances:
+                character_text = ""
+                for s in enhanced_script.get("scenes", []):
+                    for a in s.get("actions", []):
+                        if a.get("character") == character:
+                            if "dialogue" in a:
+                                character_text += " " + a["dialogue"]
+                            if "action" in a:
+                                character_text += " " + a["action"]
+                character_appearances[character] = parser._infer_character_appearance(character, character_text)
+        if "characters_info" not in scene:
+            scene["characters_info"] = {}
+        for char in {action.get("character") for action in scene.get("actions", []) if action.get("character")}:
+            scene["characters_info"][char] = character_appearances[char]
+    return enhanced_script
+
+
+def run_benchmark(action_counts=(500, 5000, 20000), character_counts=(8, 200)):
+    parser = ScriptParserAgent.create_rule_parser()
+
+    print(f"{'动作数':>8} {'角色数':>8} {'原实现(ms)':>12} {'索引(ms)':>10} {'加速比':>8}")
+    for character_count in character_counts:
+        # 角色越多，原实现的全量扫描次数越多
+        CHARACTERS[:] = CHARACTERS[:8] + [f"路人{i}" for i in range(character_count - 8)]
+        for action_count in action_counts:
+            script = build_structured_script(action_count)
+            snapshot = json.dumps(script, ensure_ascii=False, sort_keys=True)
+
+            start = time.perf_counter()
+            legacy_result = legacy_enhance_with_rules(parser, script)
+            legacy_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            result = parser._enhance_with_rules(script)
+            index_ms = (time.perf_counter() - start) * 1000
+
+            assert result == legacy_result, "角色索引实现与原实现结果不一致"
+            assert json.dumps(script, ensure_ascii=False, sort_keys=True) == snapshot, "规则增强修改了输入数据"
+            print(f"{action_count:>8} {character_count:>8} {legacy_ms:>12.1f} {index_ms:>10.1f} "
+                  f"{legacy_ms / index_ms:>8.2f}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,124 @@
+"""
+@FileName: checkpoint_scaling_benchmark.py
+@Description: 检查点规模基准：在10到1000个分镜的剧本上运行分镜生成工作流，
+              对比LangGraph默认的MemorySaver与ShotCheckpointSaver（每个节点保存 / 只在分镜边界保存），
+              统计该线程的检查点数量、序列化字节数（含待写入数据的总量及shots/qa_results通道）和每个节点的平均耗时，
+              观察它们随分镜数的增长趋势；并检查运行结束后各线程的检查点已释放
+@Author: HengLine
+@Time: 2025/11
+"""
+import logging
+import time
+import uuid
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from hengline.agent import MultiAgentPipeline
+from hengline.agent.workflow_checkpoint import CHECKPOINT_DURABILITY_STEP, CHECKPOINT_DURABILITY_SHOT
+from hengline.example.long_script_benchmark import build_script
+
+# 每个场景约产生2.5个分镜
+SCENE_COUNTS = (4, 40, 160, 400)
+SAVERS = ("MemorySaver", CHECKPOINT_DURABILITY_STEP, CHECKPOINT_DURABILITY_SHOT)
+
+
+def prepare_state(pipeline: MultiAgentPipeline, script: str) -> dict:
+    """解析并规划剧本，得到分镜生成工作流的初始状态"""
+    structured_script = pipeline.script_parser.parse_script(script)
+    segments = pipeline.temporal_planner.plan_timeline(structured_script)
+    return {
+        "script_text": script,
+        "style": "realistic",
+        "task_id": None,
+        "duration_per_shot": 5,
+        "prev_continuity_state": None,
+        "script_format": "auto",
+        "structured_script": structured_script,
+        "segments": segments,
+        "shots": [],
+        "current_continuity_state": None,
+        "character_states": {},
+        "current_segment_index": 0,
+        "retry_count": 0,
+        "max_retries": 2,
+        "qa_results": [],
+        "sequence_qa": None,
+        "sequence_review": None,
+        "sequence_issues": [],
+        "llm_review_metrics": {},
+        "result": None,
+        "error": None
+    }
+
+
+def checkpoint_stats(pipeline: MultiAgentPipeline, thread_id: str) -> dict:
+    memory = pipeline.memory
+    blobs = {key: blob for key, blob in memory.blobs.items() if key[0] == thread_id}
+    by_channel = {}
+    for (_, _, channel, _), (_, data) in blobs.items():
+        by_channel[channel] = by_channel.get(channel, 0) + len(data)
+    checkpoints = sum(len(checkpoints) for checkpoints in memory.storage[thread_id].values())
+    # 按内容寻址保存的不可变输入和各步骤的待写入数据计入总量
+    content_bytes = memory.content_bytes() if hasattr(memory, "content_bytes") else 0
+    writes_bytes = sum(len(write[2][1]) for key, writes in memory.writes.items() if key[0] == thread_id
+                       for write in writes.values())
+    return {"checkpoints": checkpoints, "bytes": sum(by_channel.values()) + content_bytes + writes_bytes,
+            "by_channel": by_channel}
+
+
+def build_pipeline(saver: str) -> MultiAgentPipeline:
+    if saver in (CHECKPOINT_DURABILITY_STEP, CHECKPOINT_DURABILITY_SHOT):
+        return MultiAgentPipeline(llm=None, checkpoint_durability=saver)
+    pipeline = MultiAgentPipeline(llm=None)
+    pipeline.memory = MemorySaver()
+    pipeline.generation_workflow = pipeline._init_generation_workflow()
+    return pipeline
+
+
+def run_benchmark():
+    logging.getLogger("hengline").setLevel(logging.WARNING)
+    print(f"{'检查点':>12} {'分镜数':>6} {'检查点数':>8} {'检查点总量(KB)':>14} {'shots(KB)':>10} {'qa_results(KB)':>14} "
+          f"{'每分镜(KB)':>10} {'节点均耗时(ms)':>14}")
+    for scenes in SCENE_COUNTS:
+        for saver in SAVERS:
+            # 每次使用新的流水线，内容表只包含本次运行的输入
+            pipeline = build_pipeline(saver)
+            state = prepare_state(pipeline, build_script(1, scenes))
+            thread_id = str(uuid.uuid4())
+            config = {"configurable": {"thread_id": thread_id}, "recursion_limit": len(state["segments"]) * 9 + 10}
+
+            start = time.perf_counter()
+            result = pipeline.generation_workflow.invoke(state, config)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            shots = len(result["shots"])
+            assert shots == len(state["segments"]), (shots, len(state["segments"]))
+            # 从最新检查点恢复的分镜与运行结果一致
+            assert pipeline.generation_workflow.get_state(config).values["shots"] == result["shots"]
+            stats = checkpoint_stats(pipeline, thread_id)
+            # 每个分镜经过 生成 → 审查 → 提取连续性 3个节点
+            node_ms = elapsed_ms / (shots * 3)
+            print(f"{saver:>12} {shots:>6} {stats['checkpoints']:>8} {stats['bytes'] / 1024:>14.1f} "
+                  f"{stats['by_channel'].get('shots', 0) / 1024:>10.1f} "
+                  f"{stats['by_channel'].get('qa_results', 0) / 1024:>14.1f} "
+                  f"{stats['bytes'] / 1024 / shots:>10.1f} {node_ms:>14.2f}")
+
+
+
+def run_cleanup_check():
+    """run_pipeline 和长剧本模式返回后不保留任何线程的检查点"""
+    logging.getLogger("hengline").setLevel(logging.WARNING)
+    pipeline = MultiAgentPipeline(llm=None)
+    pipeline.run_pipeline(build_script(1, 4))
+    pipeline.run_long_script(build_script(3, 4))
+    memory = pipeline.memory
+    leftover = len(memory.storage) + len(memory.blobs) + len(memory.writes)
+    if hasattr(memory, "content_bytes"):
+        leftover += len(memory.contents) + len(memory._last_lists) + len(memory._last_saved)
+    assert leftover == 0, f"运行结束后仍残留 {leftover} 项检查点数据"
+    print("运行结束后检查点已全部释放")
+
+
+if __name__ == '__main__':
+    run_benchmark()
+    run_cleanup_check()
@@ -0,0 +1,82 @@
+"""
+@FileName: constraint_prompt_benchmark.py
+@Description: 分镜提示词连续性约束基准：对不同角色数、分镜数的任务，对比每个分镜重复完整约束（full）与
+              角色设定表 + 增量约束（delta）两种呈现方式下，每个任务的提示词token数和相邻分镜可复用的提示词前缀
+@Author: HengLine
+@Time: 2025/11
+"""
+from os.path import commonprefix
+from pathlib import Path
+
+import yaml
+
+from hengline.agent.batched_review import estimate_tokens
+from hengline.agent.continuity_guardian_agent import ContinuityContext, ContinuityGuardianAgent
+from hengline.agent.shot_generator_agent import CONSTRAINT_PROMPT_DELTA, CONSTRAINT_PROMPT_FULL, \
+    ConstraintPromptContext, ShotGeneratorAgent
+from hengline.example.continuity_state_benchmark import make_segments, make_shot
+
+TEMPLATE_PATH = Path(__file__).parent.parent / "prompts" / "shot_generator.yaml"
+SCENE_CONTEXT = {"location": "咖啡馆", "time": "傍晚", "atmosphere": "紧张"}
+
+
+def make_job_constraints(shots: int, cast_size: int) -> list:
+    """按分镜顺序生成每个分镜的连续性约束（与工作流一致：上一分镜的锚点作为开始状态）"""
+    guardian = ContinuityGuardianAgent()
+    context, anchor, job = ContinuityContext(), None, []
+    for segment in make_segments(shots, cast_size):
+        constraints = guardian.generate_continuity_constraints(segment, anchor, SCENE_CONTEXT, context)
+        job.append((segment, constraints))
+        anchor = guardian.extract_continuity_anchor(segment, make_shot(constraints))
+    return job
+
+
+def render_prompts(job: list, mode: str, template: str) -> tuple:
+    """
+    按指定呈现方式渲染任务中每个分镜的提示词
+
+    Returns:
+        (提示词列表, 连续性约束部分（角色设定表 + 约束）的token数)
+    """
+    generator = ShotGeneratorAgent(llm=None, constraint_prompt_mode=mode)
+    prompt_context = ConstraintPromptContext()
+    prompts, constraint_tokens = [], 0
+    for shot_id, (segment, constraints) in enumerate(job, start=1):
+        prompt_input = generator.build_prompt_input(segment, constraints, SCENE_CONTEXT, "realistic", shot_id,
+                                                    prompt_context)
+        prompts.append(template.format(**prompt_input))
+        constraint_tokens += estimate_tokens(prompt_input["character_sheet_text"]) + \
+            estimate_tokens(prompt_input["continuity_constraints_text"])
+    return prompts, constraint_tokens
+
+
+def cached_prefix_tokens(prompts: list) -> int:
+    """相邻分镜提示词的公共前缀token数之和（服务端提示词缓存可复用的部分）"""
+    return sum(estimate_tokens(commonprefix([prev, prompt])) for prev, prompt in zip(prompts, prompts[1:]))
+
+
+def run_benchmark(configs=((20, 2), (40, 4), (60, 8), (100, 16))):
+    with open(TEMPLATE_PATH, "r", encoding="utf-8") as f:
+        template = yaml.safe_load(f)["template"]
+
+    # 每个任务的token数：约束部分、整个提示词、相邻分镜可复用的前缀、delta模式下不能复用的部分
+    print(f"{'分镜数':>6} {'角色数':>6} {'约束 full':>9} {'约束 delta':>10} {'节省':>6} "
+          f"{'提示词 full':>11} {'提示词 delta':>12} {'节省':>6} {'full 可缓存':>11} {'delta 可缓存':>12} "
+          f"{'delta 未缓存':>12}")
+    for shots, cast_size in configs:
+        job = make_job_constraints(shots, cast_size)
+        full_prompts, full_constraint_tokens = render_prompts(job, CONSTRAINT_PROMPT_FULL, template)
+        delta_prompts, delta_constraint_tokens = render_prompts(job, CONSTRAINT_PROMPT_DELTA, template)
+
+        full_tokens = sum(estimate_tokens(prompt) for prompt in full_prompts)
+        delta_tokens = sum(estimate_tokens(prompt) for prompt in delta_prompts)
+        full_cached = cached_prefix_tokens(full_prompts)
+        delta_cached = cached_prefix_tokens(delta_prompts)
+        print(f"{shots:>6} {cast_size:>6} {full_constraint_tokens:>9} {delta_constraint_tokens:>10} "
+              f"{1 - delta_constraint_tokens / full_constraint_tokens:>6.1%} {full_tokens:>11} {delta_tokens:>12} "
+              f"{1 - delta_tokens / full_tokens:>6.1%} {full_cached:>11} {delta_cached:>12} "
+              f"{delta_tokens - delta_cached:>12}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
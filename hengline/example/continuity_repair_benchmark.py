@@ -0,0 +1,82 @@
+"""
+@FileName: continuity_repair_benchmark.py
+@Description: 定向连续性修复基准：在不同长度的分镜序列中注入相同数量的位置冲突，
+              统计重新生成的分镜数和修复耗时（模拟LLM延迟、并发重新生成），校验修复后相邻分镜不再有关键问题
+@Author: HengLine
+@Time: 2025/11
+"""
+import copy
+import threading
+import time
+
+from hengline.agent import ShotGeneratorAgent
+from hengline.agent.draft_pipeline import get_draft_pipeline
+from hengline.agent.workflow_nodes import WorkflowNodes
+from hengline.example.long_script_benchmark import build_script
+
+
+class CountingShotGenerator(ShotGeneratorAgent):
+    """在规则生成前等待固定时长模拟LLM延迟，并统计生成次数"""
+
+    def __init__(self, latency: float):
+        super().__init__(llm=None)
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_shot(self, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return super().generate_shot(*args, **kwargs)
+
+
+def inject_conflicts(shots: list, count: int) -> list:
+    """让前count个与上一分镜同场景且有共同角色的分镜从错误的位置开始"""
+    shots = copy.deepcopy(shots)
+    injected = []
+    for index in range(1, len(shots)):
+        prev_shot, shot = shots[index - 1], shots[index]
+        prev_characters = {s["character_name"] for s in prev_shot["final_state"]}
+        same_scene = all(prev_shot["scene_context"].get(key) == shot["scene_context"].get(key)
+                         for key in ("location", "time"))
+        common = [s for s in shot["initial_state"] if s["character_name"] in prev_characters]
+        if same_scene and common:
+            for state in common:
+                state["position"] = "错误位置"
+            injected.append(shot["shot_id"])
+            if len(injected) == count:
+                break
+    return shots, injected
+
+
+def run_benchmark(episodes_list=(2, 8, 40), conflicts: int = 4, latency: float = 0.05):
+    draft = get_draft_pipeline()
+    print(f"{'分镜数':>6} {'注入问题':>8} {'重新生成':>8} {'继承修正':>8} {'剩余关键问题':>12} {'修复耗时(s)':>12}")
+    for episodes in episodes_list:
+        state = draft.generate_state(build_script(episodes, 5))
+        state["shots"], injected = inject_conflicts(state["shots"], conflicts)
+        # 注入后按整体审查重新得到序列审查结果
+        state["sequence_review"] = None
+
+        generator = CountingShotGenerator(latency)
+        nodes = WorkflowNodes(draft.script_parser, draft.temporal_planner, draft.continuity_guardian,
+                              generator, draft.qa_agent)
+        state.update(nodes.review_sequence_node(state))
+        targets = [target["shot_id"] for target in state["sequence_qa"]["repair_targets"]]
+        assert targets == injected, (targets, injected)
+
+        start = time.perf_counter()
+        update = nodes.fix_continuity_node(state)
+        elapsed = time.perf_counter() - start
+
+        shots, sequence_qa = update["shots"], update["sequence_qa"]
+        critical_issues = draft.qa_agent.review_shot_sequence(shots)["critical_issues"]
+        assert not critical_issues and not sequence_qa["has_continuity_issues"], critical_issues
+        assert generator.calls == len(injected)
+        print(f"{len(shots):>6} {len(injected):>8} {len(sequence_qa['repair']['regenerated']):>8} "
+              f"{len(sequence_qa['repair']['patched']):>8} {len(critical_issues):>12} {elapsed:>12.2f}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,112 @@
+"""
+@FileName: continuity_state_benchmark.py
+@Description: 连续性状态表示基准：模拟一个在途任务逐个分镜保存的连续性锚点和角色状态记忆（草稿模式的 shot_contexts），
+              对比优化前的字典列表表示与驻留状态值的 CharacterState 锚点映射的内存占用和逐分镜求差耗时
+@Author: HengLine
+@Time: 2025/11
+"""
+import random
+import time
+import tracemalloc
+
+from hengline.agent.continuity_guardian_agent import ContinuityContext, ContinuityGuardianAgent
+from hengline.agent.continuity_state import STATE_FIELDS
+
+ACTIONS = ["sitting at table", "standing by window", "look at phone", "holding coffee", "walks to door", "look up"]
+EMOTIONS = ["平静", "惊讶", "紧张", "恐惧", "愤怒", "快乐"]
+
+
+def make_segments(count: int, cast_size: int, seed: int = 5) -> list:
+    """每个分段中随机几个角色有动作"""
+    rng = random.Random(seed)
+    cast = [f"角色{i}" for i in range(cast_size)]
+    return [{"id": i, "actions": [{"character": name, "action": rng.choice(ACTIONS), "emotion": rng.choice(EMOTIONS)}
+                                  for name in rng.sample(cast, min(3, cast_size))] + [
+                                     {"character": name, "action": "listening"} for name in cast]}
+            for i in range(count)]
+
+
+def make_shot(constraints: dict) -> dict:
+    """按约束生成结束状态（与规则生成分镜一致）"""
+    return {"final_state": [{"character_name": name,
+                             "pose": c["must_start_with_pose"], "position": c["must_start_with_position"],
+                             "gaze_direction": c["must_start_with_gaze"], "emotion": c["must_start_with_emotion"],
+                             "holding": c["must_start_with_holding"]}
+                            for name, c in constraints["characters"].items()]}
+
+
+def run_job(segments: list):
+    """逐分镜生成约束、提取锚点，返回每个分镜保存的（锚点映射, 角色状态记忆）"""
+    guardian = ContinuityGuardianAgent()
+    context, anchor, contexts = ContinuityContext(), None, []
+    for segment in segments:
+        contexts.append((anchor, dict(context.character_states)))
+        constraints = guardian.generate_continuity_constraints(segment, anchor, {}, context)
+        anchor = guardian.extract_continuity_anchor(segment, make_shot(constraints))
+    return contexts
+
+
+def to_legacy(contexts: list) -> list:
+    """优化前的表示：锚点为字典列表，角色状态记忆为字典的字典（每个分镜复制一份）"""
+    return [([state.to_dict() for state in anchor.values()] if anchor else None,
+             {name: state.to_dict() for name, state in character_states.items()})
+            for anchor, character_states in contexts]
+
+
+def measure(build) -> int:
+    tracemalloc.start()
+    value = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del value
+    return size
+
+
+def legacy_diff(prev: list, current: list) -> int:
+    prev_map = {a["character_name"]: a for a in prev}
+    changed = 0
+    for anchor in current:
+        prev_anchor = prev_map.get(anchor["character_name"])
+        changed += sum(1 for field in STATE_FIELDS[1:] if prev_anchor is None or prev_anchor.get(field) != anchor.get(field))
+    return changed
+
+
+def compact_diff(prev: dict, current: dict) -> int:
+    return sum(len(state.diff(prev.get(name))) for name, state in current.items())
+
+
+def run_benchmark(configs=((50, 4), (200, 8), (500, 16)), rounds: int = 5):
+    print(f"{'分镜数':>6} {'角色数':>6} {'字典列表(KB)':>12} {'锚点映射(KB)':>12} {'字典求差(ms)':>12} {'驻留求差(ms)':>10}")
+    for shots, cast_size in configs:
+        segments = make_segments(shots, cast_size)
+        contexts = run_job(segments)
+        legacy_contexts = to_legacy(contexts)
+
+        # 两种表示逐字段一致
+        for (anchor, states), (legacy_anchor, legacy_states) in zip(contexts, legacy_contexts):
+            assert (legacy_anchor or []) == [state.to_dict() for state in (anchor or {}).values()]
+            assert legacy_states == {name: state.to_dict() for name, state in states.items()}
+
+        legacy_kb = measure(lambda: to_legacy(run_job(segments))) / 1024
+        compact_kb = measure(lambda: run_job(segments)) / 1024
+
+        anchors = [anchor for anchor, _ in contexts[1:]]
+        legacy_anchors = [anchor for anchor, _ in legacy_contexts[1:]]
+        assert [legacy_diff(a, b) for a, b in zip(legacy_anchors, legacy_anchors[1:])] == \
+               [compact_diff(a, b) for a, b in zip(anchors, anchors[1:])]
+
+        def best_of(fn, values):
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for a, b in zip(values, values[1:]):
+                    fn(a, b)
+                timings.append(time.perf_counter() - start)
+            return min(timings) * 1000
+
+        print(f"{shots:>6} {cast_size:>6} {legacy_kb:>12.1f} {compact_kb:>12.1f} "
+              f"{best_of(legacy_diff, legacy_anchors):>12.2f} {best_of(compact_diff, anchors):>10.2f}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
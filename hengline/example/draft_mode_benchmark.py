@@ -0,0 +1,80 @@
+"""
+@FileName: draft_mode_benchmark.py
+@Description: 草稿模式基准：对典型长度的剧本统计草稿模式的p50/p99延迟（要求p99 < 100ms），
+              与完整流程（规则模式的LangGraph工作流）对比耗时，并校验两者输出的分镜一致
+@Author: HengLine
+@Time: 2025/11
+"""
+import time
+
+from hengline.agent import MultiAgentPipeline, get_draft_pipeline
+
+SCRIPTS = {
+    "短剧本": """场景：咖啡馆内
+小明坐在窗边，看着窗外的雨。
+小红：你看起来心情不太好。
+小明：嗯，工作上遇到了一些问题。
+小红：别担心，一切都会好起来的。""",
+    "中等剧本": """场景：办公室，早上
+小明推开门走进办公室，把包放在桌上。
+老王：今天来得挺早啊。
+小明：项目明天就要交了，得抓紧时间。
+老王慢慢走到窗边，看着楼下的街道。
+老王：年轻人，别把自己逼得太紧。
+小明叹了口气，坐下打开电脑。
+场景：咖啡馆，晚上
+小红坐在角落里，手里握着一杯咖啡。
+小明匆匆走进来，四处张望。
+小红：这里！
+小明快步走过去坐下。
+小明：抱歉，加班到现在。
+小红微笑着点头，把菜单递给他。
+小红：先点点东西吧，你看起来很累。""",
+}
+# 与生成时间、请求标识相关的字段，不参与一致性比较
+VOLATILE_KEYS = {"job_id", "generated_at", "saved_at", "uuid", "mode"}
+
+
+def percentile(samples: list, ratio: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+def normalize(value):
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items() if key not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    return value
+
+
+def time_runs(func, runs: int) -> list:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - start) * 1000)
+        assert not result.get("error"), result.get("error")
+    return samples
+
+
+def run_benchmark(runs: int = 200, full_runs: int = 20):
+    draft = get_draft_pipeline()
+    full = MultiAgentPipeline(llm=None)
+    print(f"{'剧本':>6} {'分镜数':>6} {'草稿p50(ms)':>12} {'草稿p99(ms)':>12} {'完整流程p50(ms)':>16}")
+    for name, script in SCRIPTS.items():
+        draft_result = draft.run(script)
+        full_result = full.run_pipeline(script)
+        assert draft_result["metadata"]["mode"] == "draft"
+        assert normalize(draft_result) == normalize(full_result), f"{name}: 草稿模式与完整流程输出不一致"
+
+        draft_ms = time_runs(lambda: draft.run(script), runs)
+        full_ms = time_runs(lambda: full.run_pipeline(script), full_runs)
+        p99 = percentile(draft_ms, 0.99)
+        print(f"{name:>6} {draft_result['total_shots']:>6} {percentile(draft_ms, 0.5):>12.1f} {p99:>12.1f} "
+              f"{percentile(full_ms, 0.5):>16.1f}")
+        assert p99 < 100, f"{name}: 草稿模式p99 {p99:.1f}ms 超过100ms"
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,103 @@
+"""
+@FileName: duration_batch_benchmark.py
+@Description: 批量时长估算基准测试，校验 estimate_batch 与逐条 estimate 结果逐位一致，对比吞吐量，并检查缓存统计与重载失效
+@Author: HengLine
+@Time: 2025/11
+"""
+import random
+import struct
+import time
+
+from hengline.tools import action_duration_tool
+from hengline.tools.action_duration_tool import get_action_duration_estimator, DEFAULT_CONFIG_PATH
+
+SUBJECTS = ["小明", "小红", "老王", "他", "她"]
+FILLERS = ["", "在门口", "向窗外", "了", "着", "一下", "桌上的杯子"]
+DIALOGUES = ["你好", "别担心，一切都会好起来的！", "为什么会这样？", "嗯", "今天的雨下得真大，我们还是改天再去吧。", "OK"]
+EMOTIONS = ["", "平静", "紧张", "激动", "犹豫", "冷静", "大喊", "轻声", "结巴", "愤怒", "未知情绪"]
+CHARACTER_TYPES = ["default", "child", "elder", "injured", "athlete", "robot", "unknown"]
+
+
+def build_inputs(count: int, seed: int = 42):
+    """生成随机的动作/对话文本、情绪和角色类型"""
+    get_action_duration_estimator()
+    config = action_duration_tool._current_config
+    verbs = list(config["base_actions"])
+    modifiers = list(config["modifiers"])
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        roll = rng.random()
+        subject = rng.choice(SUBJECTS)
+        if roll < 0.4:
+            texts.append(f"{subject}说：“{rng.choice(DIALOGUES)}”")
+        elif roll < 0.45:
+            texts.append(rng.choice(["", "   ", f"{subject}说"]))
+        else:
+            parts = [subject, rng.choice(modifiers) if rng.random() < 0.5 else "", rng.choice(verbs),
+                     rng.choice(FILLERS), rng.choice(verbs) if rng.random() < 0.3 else ""]
+            texts.append("".join(parts))
+    emotions = [rng.choice(EMOTIONS) for _ in range(count)]
+    character_types = [rng.choice(CHARACTER_TYPES) for _ in range(count)]
+    return texts, emotions, character_types
+
+
+def check_parity(count: int = 50000):
+    """逐位比较批量结果与逐条结果（均绕过缓存）"""
+    estimator = get_action_duration_estimator()
+    texts, emotions, character_types = build_inputs(count)
+    batch = estimator._estimate_batch_uncached(texts, emotions, character_types)
+    scalar = [estimator._estimate_uncached(text, emotion, character_type)
+              for text, emotion, character_type in zip(texts, emotions, character_types)]
+    assert estimator.estimate_batch(texts, emotions, character_types) == batch, "缓存批量结果不一致"
+    for index, (left, right) in enumerate(zip(batch, scalar)):
+        assert struct.pack("d", left) == struct.pack("d", right), \
+            f"结果不一致: {texts[index]!r} {emotions[index]!r} {character_types[index]!r} {left} != {right}"
+    print(f"逐位一致性校验通过: {count} 条")
+
+
+def run_benchmark(sizes=(100, 1000, 10000, 100000), repeat: int = 3):
+    estimator = get_action_duration_estimator()
+
+    print(f"{'条数':>8} {'逐条(ms)':>10} {'批量(ms)':>10} {'加速比':>8}")
+    for size in sizes:
+        texts, emotions, character_types = build_inputs(size, seed=size)
+        scalar_times, batch_times = [], []
+        for _ in range(repeat):
+            # 逐条调用与批量调用均绕过缓存，模拟缓存未命中
+            start = time.perf_counter()
+            for text, emotion, character_type in zip(texts, emotions, character_types):
+                estimator._estimate_uncached(text, emotion, character_type)
+            scalar_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            estimator._estimate_batch_uncached(texts, emotions, character_types)
+            batch_times.append(time.perf_counter() - start)
+
+        scalar_ms = min(scalar_times) * 1000
+        batch_ms = min(batch_times) * 1000
+        print(f"{size:>8} {scalar_ms:>10.1f} {batch_ms:>10.1f} {scalar_ms / batch_ms:>8.2f}")
+
+
+def check_cache():
+    """检查缓存统计以及配置重载后的失效"""
+    estimator = get_action_duration_estimator()
+    estimator.clear_cache()
+    before = estimator.cache_stats()
+    estimator.estimate("慢慢走向门口", "平静")
+    estimator.estimate("慢慢走向门口", "平静")
+    stats = estimator.cache_stats()
+    assert stats["hits"] - before["hits"] == 1 and stats["misses"] - before["misses"] == 1, stats
+
+    type(estimator).reload_config(str(DEFAULT_CONFIG_PATH))
+    reloaded = estimator.cache_stats()
+    assert reloaded["config_version"] == stats["config_version"] + 1 and reloaded["size"] == 0, reloaded
+    estimator.estimate("慢慢走向门口", "平静")
+    assert estimator.cache_stats()["misses"] == reloaded["misses"] + 1, "重载后命中了旧版本缓存"
+    print(f"缓存统计: {estimator.cache_stats()}")
+
+
+if __name__ == '__main__':
+    check_parity()
+    run_benchmark()
+    check_cache()
@@ -0,0 +1,133 @@
+"""
+@FileName: duration_calibration_benchmark.py
+@Description: 时长模型校准基准：用"真实时长"系统性偏离当前配置的模拟历史结果做校准，
+              报告估算误差与分段数（分镜生成调用次数）的变化，并确认校准后估算仍为查表、耗时不变
+@Author: HengLine
+@Time: 2025/11
+"""
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from hengline.tools import action_duration_tool
+from hengline.tools.action_duration_tool import ActionDurationEstimator, get_action_duration_estimator, \
+    DEFAULT_CONFIG_PATH
+from hengline.tools.duration_calibration_tool import calibrate_duration_model
+from hengline.tools.result_storage_tool import create_result_storage
+
+CHARACTERS = {"小明": "default", "小红": "default", "老王": "elder", "小宝": "child"}
+DIALOGUES = ["你好", "别担心，一切都会好起来的！", "为什么会这样？", "今天的雨下得真大，我们还是改天再去吧。"]
+EMOTIONS = ["", "平静", "紧张", "激动", "犹豫", "愤怒"]
+
+
+def build_true_config(config: dict, seed: int = 11) -> dict:
+    """构造"真实"时长表：动作整体比配置快约25%，部分修饰词和情绪系数与配置不同"""
+    rng = random.Random(seed)
+    true_config = json.loads(json.dumps(config))
+    for verb in true_config["base_actions"]:
+        true_config["base_actions"][verb] *= 0.75 * rng.uniform(0.9, 1.1)
+    for modifier in true_config["modifiers"]:
+        true_config["modifiers"][modifier] *= rng.uniform(0.85, 1.15)
+    true_config["action_emotion_multipliers"] = {"紧张": 0.95, "激动": 0.9, "犹豫": 1.3, "平静": 1.0, "愤怒": 0.85}
+    true_config["dialogue"]["base_per_char"] = 0.28
+    return true_config
+
+
+def build_history(storage, config: dict, true_config: dict, script_count: int = 120, seed: int = 5) -> list:
+    """生成带实际时长（duration字段，模拟人工修订）的历史结构化剧本并保存到ResultStorage"""
+    rng = random.Random(seed)
+    truth = ActionDurationEstimator.with_config(true_config)
+    verbs = list(config["base_actions"])
+    modifiers = list(config["modifiers"])
+    overrides = []
+    for script_index in range(script_count):
+        scenes = []
+        for _ in range(rng.randint(1, 4)):
+            actions = []
+            for _ in range(rng.randint(3, 12)):
+                character = rng.choice(list(CHARACTERS))
+                action = {"character": character, "emotion": rng.choice(EMOTIONS)}
+                if rng.random() < 0.35:
+                    action["dialogue"] = rng.choice(DIALOGUES)
+                    text = f"{character}说：“{action['dialogue']}”"
+                else:
+                    action["action"] = (rng.choice(modifiers) if rng.random() < 0.4 else "") + rng.choice(verbs)
+                    text = action["action"]
+                # 真实时长带约10%的随机波动
+                observed = truth.estimate(text, action["emotion"], CHARACTERS[character]) * rng.lognormvariate(0, 0.1)
+                action["duration"] = round(observed, 2)
+                actions.append(action)
+            characters_info = {name: {"type": character_type} for name, character_type in CHARACTERS.items()}
+            scenes.append({"location": "咖啡馆", "time": "晚上", "actions": actions, "characters_info": characters_info})
+        uuid = f"history-{script_index:04d}"
+        storage.save_result(uuid, {"scenes": scenes})
+        # 少量人工修订时长以单独文件提供，覆盖结果文件中的值
+        if script_index % 10 == 0:
+            overrides.append({"uuid": uuid, "scene_index": 0, "action_index": 0,
+                              "duration": scenes[0]["actions"][0]["duration"]})
+    return overrides
+
+
+def check_table_parity(config: dict, count: int = 20000):
+    """绑定配置字典的估算器（校准时使用）与共享估算器在当前配置下逐条一致"""
+    estimator = get_action_duration_estimator()
+    bound = ActionDurationEstimator.with_config(config)
+    rng = random.Random(1)
+    verbs, modifiers = list(config["base_actions"]), list(config["modifiers"])
+    for _ in range(count):
+        if rng.random() < 0.4:
+            text = f"小明说：“{rng.choice(DIALOGUES)}”"
+        else:
+            text = (rng.choice(modifiers) if rng.random() < 0.5 else "") + rng.choice(verbs) + rng.choice(["", "了", "向门口"])
+        emotion = rng.choice(EMOTIONS + ["大喊", "结巴"])
+        character_type = rng.choice(list(CHARACTERS.values()) + ["robot"])
+        assert bound.estimate(text, emotion, character_type) == estimator.estimate(text, emotion, character_type), \
+            f"估算不一致: {text!r} {emotion!r} {character_type!r}"
+    print(f"绑定配置的估算器与共享估算器一致: {count} 条")
+
+
+def time_estimates(texts: list) -> float:
+    estimator = get_action_duration_estimator()
+    start = time.perf_counter()
+    for text in texts:
+        estimator._estimate_uncached(text, "紧张", "default")
+    return (time.perf_counter() - start) * 1000
+
+
+def run_benchmark():
+    get_action_duration_estimator()
+    config = action_duration_tool._current_config
+    check_table_parity(config)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = create_result_storage(str(Path(workdir) / "output"))
+        overrides = build_history(storage, config, build_true_config(config))
+        timings_path = Path(workdir) / "timings.json"
+        timings_path.write_text(json.dumps(overrides, ensure_ascii=False), encoding="utf-8")
+
+        report = calibrate_duration_model(storage, timings_path=str(timings_path), output_dir=workdir)
+        segments = report["segments"]
+        print(f"新配置: {Path(report['output_path']).name} (版本 {report['version']})，样本 {report['samples']} 条")
+        print(f"平均绝对误差(秒): {report['mean_abs_error']['before']} → {report['mean_abs_error']['after']}")
+        print(f"{'':>10} {'分段数':>8} {'与实际差异':>10}")
+        print(f"{'校准前':>10} {segments['before']:>8} {segments['excess_before']:>10}")
+        print(f"{'校准后':>10} {segments['after']:>8} {segments['excess_after']:>10}")
+        print(f"{'实际时长':>10} {segments['observed']:>8} {0:>10}")
+        print(f"分段数减少: {segments['before'] - segments['after']} "
+              f"({(segments['before'] - segments['after']) / segments['before']:.1%})")
+        assert report["mean_abs_error"]["after"] < report["mean_abs_error"]["before"]
+        assert segments["excess_after"] < segments["excess_before"]
+
+        # 校准只改变表中的数值，估算耗时不变
+        texts = [f"慢慢{verb}" for verb in config["base_actions"]] * 200
+        before_ms = time_estimates(texts)
+        type(get_action_duration_estimator()).reload_config(report["output_path"])
+        after_ms = time_estimates(texts)
+        type(get_action_duration_estimator()).reload_config(str(DEFAULT_CONFIG_PATH))
+        print(f"{len(texts)} 次估算耗时(ms): 校准前 {before_ms:.1f}，校准后 {after_ms:.1f}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
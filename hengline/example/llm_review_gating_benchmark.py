@@ -0,0 +1,92 @@
+"""
+@FileName: llm_review_gating_benchmark.py
+@Description: LLM审查门控基准：对一批质量参差的分镜，对比每个分镜都调用LLM审查与按规则审查置信度门控 + 抽样审查的
+              LLM调用次数，并通过工作流输出的任务指标查看跳过次数和抽样审查结果
+@Author: HengLine
+@Time: 2025/11
+"""
+import copy
+import json
+import random
+import threading
+import time
+
+from hengline.agent import MultiAgentPipeline, QAAgent
+from hengline.agent.draft_pipeline import get_draft_pipeline
+from hengline.example.long_script_benchmark import build_script
+
+
+class FakeReviewLLM:
+    """模拟LLM审查：统计调用次数，提示词过短的分镜判定为关键问题，其余通过（支持单个和批量审查提示词）"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if "分镜信息：" in prompt:
+            # 单个审查提示词（qa_review）的返回格式为 is_valid / issues
+            shot = json.loads(prompt.split("分镜信息：", 1)[-1].split("\n", 1)[0])
+            verdict = self.verdict(shot)
+            return json.dumps({"is_valid": not verdict["critical_issues"], "issues": verdict["critical_issues"],
+                               "suggestions": verdict["suggestions"]}, ensure_ascii=False)
+        reviews = []
+        for line in prompt.splitlines():
+            if line.startswith("[r"):
+                review_id, item = line[1:].split("] ", 1)
+                reviews.append({"id": review_id, **self.verdict(json.loads(item)["shot"])})
+        return json.dumps({"reviews": reviews}, ensure_ascii=False)
+
+    @staticmethod
+    def verdict(shot: dict) -> dict:
+        if len(shot.get("ai_prompt", "")) < 30:
+            return {"critical_issues": ["提示词缺少画面细节"], "warnings": [], "suggestions": []}
+        return {"critical_issues": [], "warnings": [], "suggestions": []}
+
+
+def degrade(shots: list, every: int = 4) -> list:
+    """每隔every个分镜删去推荐字段和姿势信息，模拟质量较差的生成结果"""
+    shots = copy.deepcopy(shots)
+    for shot in shots[::every]:
+        shot.pop("camera", None)
+        for state in shot.get("initial_state", []):
+            state.pop("pose", None)
+    return shots
+
+
+def run_review_calls(shots: list, segments: list):
+    print(f"{'模式':>10} {'分镜数':>6} {'LLM调用':>8} {'跳过':>6} {'低置信度':>8} {'抽样':>6}")
+    for name, threshold, sample_rate in (("全部审查", 1.01, 0.0), ("门控", 0.8, 0.0), ("门控+抽样", 0.8, 0.1)):
+        random.seed(7)
+        llm = FakeReviewLLM()
+        qa_agent = QAAgent(llm=llm, confidence_threshold=threshold, audit_sample_rate=sample_rate)
+        counts = {}
+        for shot, segment in zip(shots, segments):
+            result = qa_agent.review_single_shot(shot, segment)
+            for key, value in qa_agent.llm_review_counts(result["llm_review"]).items():
+                counts[key] = counts.get(key, 0) + value
+        summary = qa_agent.summarize_llm_review(counts)
+        assert llm.calls == summary["llm_reviews"]
+        print(f"{name:>10} {len(shots):>6} {llm.calls:>8} {summary['llm_reviews_skipped']:>6} "
+              f"{summary['low_confidence']:>8} {summary['audits']:>6}")
+
+
+def run_pipeline_metrics():
+    """工作流结果的 metadata.llm_review 记录本任务的跳过次数和抽样审查结果"""
+    random.seed(7)
+    pipeline = MultiAgentPipeline(llm=None)
+    pipeline.qa_agent = QAAgent(llm=FakeReviewLLM(), audit_sample_rate=0.2)
+    pipeline.workflow_nodes.qa_agent = pipeline.qa_agent
+    result = pipeline.run_pipeline(build_script(2, 5))
+    assert not result.get("error"), result.get("error")
+    print("任务LLM审查指标:", json.dumps(result["metadata"]["llm_review"], ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    state = get_draft_pipeline().generate_state(build_script(8, 5))
+    run_review_calls(degrade(state["shots"]), state["segments"])
+    run_pipeline_metrics()
@@ -0,0 +1,136 @@
+"""
+@FileName: long_script_benchmark.py
+@Description: 长剧本模式基准：对比手动切分串行续生成与 run_long_script（提前解析规划，以及实验性的首分镜推测生成），
+              校验全局编号连续、每个分段恰好一个分镜，并统计推测命中率和耗时；
+              另以按比例改写结束状态措辞的生成器模拟LLM，统计LLM模式下的推测命中率
+@Author: HengLine
+@Time: 2025/11
+"""
+import random
+import time
+
+from hengline.agent import LongScriptPipeline, MultiAgentPipeline, ShotGeneratorAgent
+from hengline.agent.long_script_pipeline import SPECULATION_OFF, SPECULATION_ON
+
+SCENE_TEMPLATE = """场景：{location}，{time}
+小明坐在窗边，看着窗外的雨。
+小红：你看起来心情不太好。
+小明：嗯，工作上遇到了一些问题。
+老王慢慢走向门口。
+小红：别担心，一切都会好起来的。
+{extra}"""
+LOCATIONS = ["咖啡馆", "办公室", "医院走廊", "公园", "地铁站"]
+TIMES = ["早上", "下午", "晚上", "深夜"]
+EXTRAS = ["", "小明站起来，拿起手机。", "老王：年轻人，别灰心。", "小红微笑着点头。"]
+
+
+class LatencyShotGenerator(ShotGeneratorAgent):
+    """在规则生成前等待固定时长，模拟LLM生成单个分镜的延迟"""
+
+    def __init__(self, latency: float):
+        super().__init__(llm=None)
+        self.latency = latency
+
+    def generate_shot(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().generate_shot(*args, **kwargs)
+
+
+class RewordingShotGenerator(LatencyShotGenerator):
+    """
+    模拟LLM：结束状态的每个字段按给定比例改写措辞（如 sitting → sitting, leaning forward），
+    与规则推演的结束状态不再逐字一致
+    """
+
+    def __init__(self, latency: float, reword_rate: float, seed: int = 1):
+        super().__init__(latency)
+        self.reword_rate = reword_rate
+        self.rng = random.Random(seed)
+
+    def generate_shot(self, *args, **kwargs):
+        shot = super().generate_shot(*args, **kwargs)
+        for state in shot.get("final_state", []):
+            for field in ("pose", "position", "gaze_direction", "emotion", "holding"):
+                if self.rng.random() < self.reword_rate:
+                    state[field] = f"{state.get(field)}, variant {self.rng.randint(0, 3)}"
+        return shot
+
+
+def build_script(episodes: int, scenes_per_episode: int) -> str:
+    lines = []
+    for episode in range(1, episodes + 1):
+        lines.append(f"第{episode}集")
+        for scene in range(scenes_per_episode):
+            index = episode * scenes_per_episode + scene
+            lines.append(SCENE_TEMPLATE.format(location=LOCATIONS[index % len(LOCATIONS)],
+                                               time=TIMES[index % len(TIMES)],
+                                               extra=EXTRAS[index % len(EXTRAS)]).strip())
+    return "\n".join(lines)
+
+
+def build_pipeline(latency: float, shot_generator: ShotGeneratorAgent = None) -> MultiAgentPipeline:
+    pipeline = MultiAgentPipeline(llm=None)
+    pipeline.shot_generator = shot_generator or LatencyShotGenerator(latency)
+    pipeline.workflow_nodes.shot_generator = pipeline.shot_generator
+    return pipeline
+
+
+def run_manual_chaining(pipeline: MultiAgentPipeline, script: str) -> tuple:
+    """调用方手动切分并串行续生成（原有用法）"""
+    shots = []
+    state = None
+    for chunk in pipeline.script_parser.split_script_chunks(script):
+        result = pipeline.run_pipeline(chunk["text"], prev_continuity_state=state, script_format=chunk["script_format"])
+        shots.extend(result.get("shots", []))
+        state = result.get("final_continuity_state")
+    return shots
+
+
+def run_benchmark(configs=((2, 5), (4, 5), (8, 5)), latency: float = 0.05):
+    print(f"{'集数':>4} {'场景数':>6} {'分块数':>6} {'分镜数':>6} {'手动串行(s)':>12} {'长剧本模式(s)':>14} "
+          f"{'开启推测(s)':>12} {'推测命中':>8}")
+    for episodes, scenes_per_episode in configs:
+        script = build_script(episodes, scenes_per_episode)
+        pipeline = build_pipeline(latency)
+
+        start = time.perf_counter()
+        manual_shots = run_manual_chaining(pipeline, script)
+        manual_s = time.perf_counter() - start
+
+        timings = {}
+        for speculation in (SPECULATION_OFF, SPECULATION_ON):
+            pipeline._long_script_pipeline = LongScriptPipeline(pipeline, speculation=speculation)
+            start = time.perf_counter()
+            result = pipeline.run_long_script(script)
+            timings[speculation] = time.perf_counter() - start
+
+            assert not result.get("error"), result.get("error")
+            shots = result["shots"]
+            long_script = result["metadata"]["long_script"]
+            # 全局编号连续，且每个分块的分镜数与其分段数一致
+            assert [shot["shot_id"] for shot in shots] == [str(i) for i in range(1, len(shots) + 1)]
+            assert len(shots) == sum(chunk["shot_count"] for chunk in long_script["chunks"])
+            assert len(shots) == len(manual_shots), (len(shots), len(manual_shots))
+        hits = f"{long_script['speculation_hits']}/{long_script['speculative_first_shots']}"
+        print(f"{episodes:>4} {episodes * scenes_per_episode:>6} {len(long_script['chunks']):>6} {len(shots):>6} "
+              f"{manual_s:>12.2f} {timings[SPECULATION_OFF]:>14.2f} {timings[SPECULATION_ON]:>12.2f} {hits:>8}")
+
+
+def run_speculation_benchmark(episodes: int = 8, scenes_per_episode: int = 5,
+                              reword_rates=(0.0, 0.05, 0.1, 0.3), latency: float = 0.0):
+    """模拟LLM模式：强制开启推测，统计不同改写比例下的推测命中率"""
+    print(f"{'改写比例':>8} {'推测命中':>8} {'命中率':>6}")
+    script = build_script(episodes, scenes_per_episode)
+    for reword_rate in reword_rates:
+        pipeline = build_pipeline(latency, RewordingShotGenerator(latency, reword_rate))
+        pipeline._long_script_pipeline = LongScriptPipeline(pipeline, speculation=SPECULATION_ON)
+        result = pipeline.run_long_script(script)
+        assert not result.get("error"), result.get("error")
+        long_script = result["metadata"]["long_script"]
+        hits, count = long_script["speculation_hits"], long_script["speculative_first_shots"]
+        print(f"{reword_rate:>8.2f} {f'{hits}/{count}':>8} {hits / max(count, 1):>6.1%}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
+    run_speculation_benchmark()
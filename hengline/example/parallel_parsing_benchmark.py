@@ -0,0 +1,71 @@
+"""
+@FileName: parallel_parsing_benchmark.py
+@Description: 场景级并行解析基准测试，用于确定 parallel_parsing.min_script_chars 的临界点
+@Author: HengLine
+@Time: 2025/11
+"""
+import os
+import time
+
+from hengline.agent.script_parser_agent import ScriptParserAgent, _get_parse_pool
+
+SCENE_TEMPLATE = """场景：咖啡馆{idx}号，晚上8点
+小明坐在窗边，看着窗外的雨，慢慢喝了一口咖啡。
+小红：你看起来心情不太好，是不是工作上遇到了什么问题？
+小明：嗯，项目又延期了，老板很生气。
+小红轻轻拍了拍他的肩膀，微笑着看着他。
+小红：别担心，一切都会好起来的！
+小明抬头看向小红，露出了笑容。
+"""
+
+
+def build_script(scene_count: int) -> str:
+    """生成包含指定场景数的测试剧本"""
+    return "".join(SCENE_TEMPLATE.format(idx=i) for i in range(scene_count))
+
+
+def run_benchmark(scene_counts=(5, 20, 100, 500, 2000), repeat: int = 3):
+    parser = ScriptParserAgent.create_rule_parser()
+    parser.parallel_parsing_enabled = True
+    parser.parallel_min_script_chars = 0
+    # 至少两个进程，单核机器上也能测出进程池本身的开销
+    parser.parallel_max_workers = max(2, os.cpu_count() or 1)
+
+    # 预热进程池（启动进程并加载jieba词典只发生一次）
+    _get_parse_pool(parser.config_path, parser.parallel_max_workers).submit(int).result()
+
+    print(f"进程数: {parser.parallel_max_workers}")
+    print("场景解析: 只计 _parse_scenes；全流程: parse_script，含主进程串行的规则增强（角色外观推断）")
+    print(f"{'场景数':>8} {'字符数':>10} {'串行解析(ms)':>12} {'并行解析(ms)':>12} "
+          f"{'串行全流程(ms)':>14} {'并行全流程(ms)':>14} {'全流程加速比':>12}")
+    for scene_count in scene_counts:
+        script_text = build_script(scene_count)
+        scenes_data = parser._detect_scenes(script_text)
+
+        timings = {"parse_serial": [], "parse_parallel": [], "full_serial": [], "full_parallel": []}
+        for _ in range(repeat):
+            for parallel in (False, True):
+                mode = "parallel" if parallel else "serial"
+                parser.parallel_parsing_enabled = parallel
+
+                start = time.perf_counter()
+                scenes = parser._parse_scenes(scenes_data, len(script_text))
+                timings[f"parse_{mode}"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                result = parser.parse_script(script_text, save_result=False)
+                timings[f"full_{mode}"].append(time.perf_counter() - start)
+
+                if parallel:
+                    assert scenes == serial_scenes, "并行解析结果与串行不一致"
+                    assert result == serial_result, "并行全流程结果与串行不一致"
+                else:
+                    serial_scenes, serial_result = scenes, result
+
+        best = {key: min(values) * 1000 for key, values in timings.items()}
+        print(f"{scene_count:>8} {len(script_text):>10} {best['parse_serial']:>12.1f} {best['parse_parallel']:>12.1f} "
+              f"{best['full_serial']:>14.1f} {best['full_parallel']:>14.1f} "
+              f"{best['full_serial'] / best['full_parallel']:>12.2f}")
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,109 @@
+"""
+@FileName: pipeline_concurrency_stress.py
+@Description: 并发压力测试，在同一个 MultiAgentPipeline 实例上交错运行数百个任务，
+              校验每个任务的结果与顺序执行的结果完全一致（检验各智能体无跨请求状态）
+@Author: HengLine
+@Time: 2025/11
+"""
+import copy
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hengline.agent.multi_agent_pipeline import MultiAgentPipeline
+from hengline.tools.result_storage_tool import create_result_storage
+
+SCRIPTS = [
+    """场景：咖啡馆内，下午3点
+小明坐在窗边，看着窗外的雨。
+小红：你看起来心情不太好。
+小明：嗯，工作上遇到了一些问题。
+小红：别担心，一切都会好起来的。
+小明慢慢站起来，走向门口。
+""",
+    """场景：医院走廊，深夜
+李医生快步走过走廊，手里拿着病历。
+张警官：医生，他的情况怎么样？
+李医生：还在抢救，请您耐心等待。
+张警官靠在墙边，低头看着手机。
+""",
+    """INT. OFFICE - NIGHT
+JOHN sits at the desk, staring at the phone.
+JOHN
+Why would she call now?
+MARY enters the room, holding a coffee cup.
+MARY
+You should go home.
+""",
+]
+DURATIONS = [3, 5, 8]
+STYLES = ["realistic", "anime"]
+# 与具体执行相关、每次运行都会变化的字段
+VOLATILE_KEYS = {"task_id", "job_id", "generated_at", "saved_at", "uuid", "created_at"}
+
+
+def build_jobs(job_count: int) -> list:
+    """生成交错的任务参数（剧本、分段时长、风格轮换组合）"""
+    jobs = []
+    for index in range(job_count):
+        jobs.append({
+            "script_text": SCRIPTS[index % len(SCRIPTS)],
+            "duration_per_shot": DURATIONS[(index // len(SCRIPTS)) % len(DURATIONS)],
+            "style": STYLES[(index // (len(SCRIPTS) * len(DURATIONS))) % len(STYLES)],
+        })
+    return jobs
+
+
+def job_key(job: dict) -> tuple:
+    return job["script_text"], job["duration_per_shot"], job["style"]
+
+
+def normalize(value):
+    """去掉每次运行都会变化的字段，得到可比较的结果"""
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items() if key not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    return value
+
+
+def fingerprint(result: dict) -> str:
+    return json.dumps(normalize(copy.deepcopy(result)), ensure_ascii=False, sort_keys=True, default=str)
+
+
+def run_stress(job_count: int = 300, workers: int = 16):
+    # 解析结果写到临时目录，不污染 data/output
+    with tempfile.TemporaryDirectory() as output_dir:
+        pipeline = MultiAgentPipeline(llm=None)
+        pipeline.script_parser.result_storage = create_result_storage(output_dir)
+        _run_stress(pipeline, job_count, workers)
+
+
+def _run_stress(pipeline: MultiAgentPipeline, job_count: int, workers: int):
+    jobs = build_jobs(job_count)
+
+    # 顺序执行每种组合一次，作为基准结果
+    baseline = {}
+    for job in jobs:
+        key = job_key(job)
+        if key not in baseline:
+            baseline[key] = fingerprint(pipeline.run_pipeline(task_id=f"baseline-{len(baseline)}", **job))
+
+    def run_job(indexed_job):
+        index, job = indexed_job
+        return index, fingerprint(pipeline.run_pipeline(task_id=f"stress-{index}", **job))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_job, enumerate(jobs)))
+    elapsed = time.perf_counter() - start
+
+    mismatches = [index for index, result in results if result != baseline[job_key(jobs[index])]]
+    print(f"任务数: {job_count}, 线程数: {workers}, 组合数: {len(baseline)}, 耗时: {elapsed:.2f}s")
+    assert not mismatches, f"{len(mismatches)} 个并发任务的结果与顺序执行不一致: {mismatches[:10]}"
+    print("并发结果与顺序执行结果完全一致")
+
+
+if __name__ == '__main__':
+    run_stress()
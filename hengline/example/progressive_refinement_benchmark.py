@@ -0,0 +1,90 @@
+"""
+@FileName: progressive_refinement_benchmark.py
+@Description: 渐进式精修基准：用带固定延迟的分镜生成智能体模拟LLM，对比完整流程的首次可展示时间
+              与渐进式精修的草稿返回时间、首个升级分镜时间和全部升级完成时间，
+              并校验升级以相同shot_id原位替换、任意时刻快照都是完整分镜
+@Author: HengLine
+@Time: 2025/11
+"""
+import time
+
+from hengline.agent import MultiAgentPipeline, QAAgent, ShotGeneratorAgent, get_draft_pipeline
+from hengline.agent.progressive_refinement import RefinementJob, PRIORITY_ORDER, PRIORITY_QA
+from hengline.agent.shot_generator_agent import GENERATED_BY_LLM
+from hengline.example.long_script_benchmark import build_script
+
+REFINED_MARK = "[refined] "
+
+
+class LatencyLLMShotGenerator(ShotGeneratorAgent):
+    """等待固定时长后在规则结果上做标记，模拟LLM生成的分镜"""
+
+    def __init__(self, latency: float):
+        super().__init__(llm=None)
+        self.latency = latency
+
+    def generate_shot(self, *args, **kwargs):
+        time.sleep(self.latency)
+        shot = super().generate_shot(*args, **kwargs)
+        shot["ai_prompt"] = REFINED_MARK + shot["ai_prompt"]
+        shot["meta_data"]["generated_by"] = GENERATED_BY_LLM
+        return shot
+
+
+def run_full_pipeline(script: str, latency: float) -> float:
+    pipeline = MultiAgentPipeline(llm=None)
+    pipeline.shot_generator = LatencyLLMShotGenerator(latency)
+    pipeline.workflow_nodes.shot_generator = pipeline.shot_generator
+    start = time.perf_counter()
+    result = pipeline.run_pipeline(script)
+    assert not result.get("error"), result.get("error")
+    return time.perf_counter() - start
+
+
+def run_progressive(script: str, latency: float, priority: str) -> dict:
+    start = time.perf_counter()
+    draft_state = get_draft_pipeline().generate_state(script)
+    job = RefinementJob(draft_state["result"]["job_id"], draft_state, LatencyLLMShotGenerator(latency),
+                        QAAgent(llm=None), priority)
+    draft = job.snapshot()
+    draft_s = time.perf_counter() - start
+    draft_ids = [shot["shot_id"] for shot in draft["shots"]]
+
+    job.start()
+    first_s = None
+    upgraded_ids = []
+    for event in job.iter_updates(timeout=60):
+        if event["event"] != "shot_upgraded":
+            assert event["event"] == "completed", event
+            break
+        first_s = first_s or time.perf_counter() - start
+        upgraded_ids.append(event["shot_id"])
+        assert event["shot"]["shot_id"] == event["shot_id"] == draft_ids[event["index"]]
+        # 任意时刻的快照都是完整分镜，且编号不变
+        assert [shot["shot_id"] for shot in job.snapshot()["shots"]] == draft_ids
+    total_s = time.perf_counter() - start
+
+    final = job.snapshot()
+    assert final["metadata"]["refinement"]["upgraded"] == len(draft_ids)
+    assert all(shot["ai_prompt"].startswith(REFINED_MARK) for shot in final["shots"])
+    return {"shots": len(draft_ids), "draft": draft_s, "first": first_s, "total": total_s,
+            "first_upgraded": upgraded_ids[0], "order": job._order}
+
+
+def run_benchmark(latency: float = 0.05):
+    print(f"{'场景数':>6} {'分镜数':>6} {'完整流程(s)':>12} {'草稿返回(s)':>12} {'首个升级(s)':>12} {'全部升级(s)':>12}")
+    for scenes in (2, 5, 10):
+        script = build_script(1, scenes)
+        full_s = run_full_pipeline(script, latency)
+        stats = run_progressive(script, latency, PRIORITY_ORDER)
+        print(f"{scenes:>6} {stats['shots']:>6} {full_s:>12.2f} {stats['draft']:>12.3f} "
+              f"{stats['first']:>12.2f} {stats['total']:>12.2f}")
+        assert stats["draft"] < full_s
+
+    # qa优先级：规则审查最差的分镜最先精修
+    stats = run_progressive(build_script(1, 5), latency, PRIORITY_QA)
+    print(f"qa优先级精修顺序(分镜下标): {stats['order']}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,244 @@
+"""
+@FileName: qa_rule_engine_benchmark.py
+@Description: 审查规则引擎基准：对一批质量参差的分镜，对比优化前逐项检查方法（每项构建中间字典）与编译后的规则引擎的
+              单分镜审查、相邻分镜审查耗时，校验结果一致，并输出每条规则的耗时统计和关闭规则后的效果
+@Author: HengLine
+@Time: 2025/11
+"""
+import random
+import time
+
+from hengline.agent import QAAgent
+from hengline.example.sequence_review_benchmark import make_shots
+from hengline.tools.emotion_transition_tool import get_emotion_transition_matrix
+
+EMOTIONS = ["平静", "惊讶", "紧张", "恐惧", "愤怒", "快乐"]
+
+
+def make_mixed_shots(count: int, seed: int = 11) -> list:
+    """在连续分镜上随机制造缺失字段、超长时长、情绪跳变、电话角色等问题"""
+    rng = random.Random(seed)
+    shots = make_shots(count)
+    for shot in shots:
+        shot["chinese_description"] = "角色在咖啡馆中交谈"
+        shot["camera"] = {"shot_type": "medium shot"}
+        shot["ai_prompt"] = rng.choice(["", "short", "medium shot of two people, soft lighting, realistic style",
+                                        "two people talking in a cafe"])
+        for state in shot["initial_state"] + shot["final_state"]:
+            state["emotion"] = rng.choice(EMOTIONS)
+            if rng.random() < 0.1:
+                del state["pose"]
+        if rng.random() < 0.1:
+            shot["time_range_sec"] = [shot["time_range_sec"][0], shot["time_range_sec"][0] + 7]
+        if rng.random() < 0.1:
+            shot["actions"] = [{"action": "接电话"}]
+            shot["characters_in_frame"] = shot["characters_in_frame"] + ["电话那头"]
+        if rng.random() < 0.05:
+            del shot["chinese_description"]
+    return shots
+
+
+class LegacyQAChecks:
+    """优化前的逐项检查实现（每项检查单独遍历分镜并构建中间字典），仅用于对比"""
+
+    max_shot_duration = 5.5
+
+    def review_shot(self, shot):
+        critical_issues, warnings, suggestions = [], [], []
+        for check in (self._check_basic_fields(shot), self._check_duration(shot),
+                      self._check_character_states(shot), self._check_prompt_quality(shot)):
+            critical_issues.extend(check["critical_issues"])
+            warnings.extend(check["warnings"])
+            suggestions.extend(check["suggestions"])
+        return critical_issues, warnings, suggestions
+
+    def review_pair(self, prev_shot, shot):
+        issues = []
+        shot_ids = [prev_shot.get("shot_id"), shot.get("shot_id")]
+        prev_end = prev_shot.get("time_range_sec", [0, 5])[1]
+        if abs(prev_end - shot.get("time_range_sec", [5, 10])[0]) >= 0.1:
+            issues.append(self._issue("time", "warning", shot_ids, [],
+                                      f"分镜 {shot_ids[0]} 和 {shot_ids[1]} 时间不连续", ["修正时间范围以确保连续"]))
+        prev_scene, scene = prev_shot.get("scene_context", {}), shot.get("scene_context", {})
+        suggestions = []
+        if prev_scene.get("location") != scene.get("location"):
+            suggestions.append("场景位置发生变化，请确保有合理的转场")
+        if prev_scene.get("time") != scene.get("time"):
+            suggestions.append("场景时间发生变化，请添加时间过渡说明")
+        if suggestions:
+            issues.append(self._issue("scene", "warning", shot_ids, [],
+                                      f"分镜 {shot_ids[0]} 和 {shot_ids[1]} 场景不连续", suggestions))
+        issues.extend(self._check_character_continuity(prev_shot, shot, not suggestions))
+        return issues
+
+    @staticmethod
+    def _issue(issue_type, severity, shot_ids, characters, message, suggestions):
+        return {"type": issue_type, "severity": severity, "shot_ids": shot_ids, "characters": characters,
+                "message": message, "suggestions": suggestions}
+
+    def _check_basic_fields(self, shot):
+        critical_issues, warnings, suggestions = [], [], []
+        for field in ["shot_id", "chinese_description"]:
+            if field not in shot or (isinstance(shot[field], (str, list)) and not shot[field]):
+                critical_issues.append(f"缺少必要字段: {field}")
+                suggestions.append(f"请添加 {field}")
+        for field in ["ai_prompt", "camera", "characters_in_frame"]:
+            if field not in shot or (isinstance(shot[field], (str, list)) and not shot[field]):
+                warnings.append(f"缺少推荐字段: {field}")
+                suggestions.append(f"建议添加 {field}")
+        return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
+
+    def _check_duration(self, shot):
+        critical_issues, warnings, suggestions = [], [], []
+        time_range = shot.get("time_range_sec", [0, 5])
+        duration = time_range[1] - time_range[0]
+        if duration > self.max_shot_duration + 0.5:
+            critical_issues.append(f"分镜时长长于允许的最大值 {self.max_shot_duration} 秒")
+            suggestions.append("请缩短分镜时长或拆分为多个分镜")
+        elif duration > self.max_shot_duration:
+            warnings.append(f"分镜时长略长于推荐值 {self.max_shot_duration} 秒")
+            suggestions.append("建议适当缩短分镜时长")
+        return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
+
+    def _check_character_states(self, shot):
+        critical_issues, warnings, suggestions = [], [], []
+        characters_in_frame = shot.get("characters_in_frame", [])
+        is_phone_scene = any("电话" in action.get("action", "") for action in shot.get("actions", []))
+        phone_characters = [c for c in characters_in_frame if "电话" in c or "对面" in c] if is_phone_scene else []
+        initial_char_map = {s.get("character_name"): s for s in shot.get("initial_state", [])}
+        final_char_map = {s.get("character_name"): s for s in shot.get("final_state", [])}
+        all_state_characters = set(initial_char_map.keys()) | set(final_char_map.keys())
+        for character in characters_in_frame:
+            if character not in phone_characters and character not in all_state_characters:
+                warnings.append(f"角色 {character} 缺少状态信息")
+                suggestions.append(f"建议添加 {character} 的状态信息")
+        for character_name, state in {**initial_char_map, **final_char_map}.items():
+            if character_name in phone_characters:
+                if state.get("position") != "off-screen":
+                    warnings.append(f"电话角色 {character_name} 位置应为 'off-screen'")
+                    suggestions.append(f"设置 {character_name} 的位置为 'off-screen'")
+            else:
+                if "position" not in state:
+                    critical_issues.append(f"角色 {character_name} 缺少位置信息")
+                    suggestions.append(f"请添加 {character_name} 的位置信息")
+                if "pose" not in state:
+                    warnings.append(f"角色 {character_name} 缺少姿势信息")
+                    suggestions.append(f"建议添加 {character_name} 的姿势信息")
+                if "emotion" not in state:
+                    warnings.append(f"角色 {character_name} 缺少情绪信息")
+                    suggestions.append(f"建议添加 {character_name} 的情绪信息")
+        return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
+
+    def _check_prompt_quality(self, shot):
+        critical_issues, warnings, suggestions = [], [], []
+        ai_prompt = shot.get("ai_prompt", "")
+        if not ai_prompt:
+            warnings.append("AI提示词为空")
+            suggestions.append("请添加AI提示词以提高生成质量")
+        else:
+            if len(ai_prompt) < 10:
+                critical_issues.append("AI提示词过短")
+                suggestions.append("请添加更多细节到提示词")
+            elif len(ai_prompt) < 20:
+                warnings.append("AI提示词较短")
+                suggestions.append("建议添加更多细节到提示词")
+            for element in ["shot", "lighting", "style"]:
+                if element not in ai_prompt.lower():
+                    suggestions.append(f"建议在提示词中添加 {element} 相关描述")
+        return {"critical_issues": critical_issues, "warnings": warnings, "suggestions": suggestions}
+
+    def _check_character_continuity(self, prev_shot, current_shot, same_scene):
+        issues = []
+        shot_ids = [prev_shot.get("shot_id"), current_shot.get("shot_id")]
+        prev_final_state = {s.get("character_name"): s for s in prev_shot.get("final_state", [])}
+        current_initial_state = {s.get("character_name"): s for s in current_shot.get("initial_state", [])}
+        for character in sorted(set(prev_final_state.keys()) & set(current_initial_state.keys()), key=str):
+            prev_state, current_state = prev_final_state[character], current_initial_state[character]
+            prev_pos, current_pos = prev_state.get("position"), current_state.get("position")
+            if "电话" in character or "对面" in character:
+                if prev_pos != "off-screen" and current_pos != "off-screen":
+                    issues.append(self._issue("character", "warning", shot_ids, [character],
+                                              f"电话角色 {character} 位置应为 'off-screen'",
+                                              [f"设置 {character} 的位置为 'off-screen'"]))
+            elif prev_pos and current_pos and prev_pos != current_pos:
+                drastic = [("客厅", "卧室"), ("卧室", "客厅"), ("室内", "室外"), ("室外", "室内")]
+                if (prev_pos, current_pos) in drastic:
+                    issues.append(self._issue("character", "warning", shot_ids, [character],
+                                              f"角色 {character} 位置变化较大",
+                                              [f"确保 {character} 的位置变化有合理过渡"]))
+                elif same_scene:
+                    issues.append(self._issue("character", "critical", shot_ids, [character],
+                                              f"角色 {character} 位置冲突: 上一分镜结束于 {prev_pos}，"
+                                              f"本分镜开始于 {current_pos}", [f"{character} 应从 {prev_pos} 开始"]))
+            prev_emotion, current_emotion = prev_state.get("emotion"), current_state.get("emotion")
+            if prev_emotion and current_emotion and prev_emotion != current_emotion \
+                    and not self._is_valid_emotion_transition(prev_emotion, current_emotion):
+                issues.append(self._issue("character", "warning", shot_ids, [character],
+                                          f"角色 {character} 情绪过渡可能不合理",
+                                          [f"建议添加 {character} 的情绪过渡描述"]))
+        new_characters = sorted(set(current_initial_state) - set(prev_final_state), key=str)
+        if new_characters:
+            issues.append(self._issue("character", "warning", shot_ids, new_characters,
+                                      f"新角色突然出现: {', '.join(new_characters)}", ["建议添加角色入场的自然过渡"]))
+        disappeared_characters = sorted(set(prev_final_state) - set(current_initial_state), key=str)
+        if disappeared_characters:
+            issues.append(self._issue("character", "warning", shot_ids, disappeared_characters,
+                                      f"角色突然消失: {', '.join(disappeared_characters)}", ["建议添加角色退场的自然过渡"]))
+        return issues
+
+    @staticmethod
+    def _is_valid_emotion_transition(prev_emotion, current_emotion):
+        # 情绪过渡表已移到配置中，两种实现使用同一个情绪过渡矩阵，只对比检查方式
+        return get_emotion_transition_matrix().is_valid(prev_emotion, current_emotion)
+
+
+def run_parity_and_timing(count: int = 5000, rounds: int = 5):
+    shots = make_mixed_shots(count)
+    legacy, qa_agent = LegacyQAChecks(), QAAgent(llm=None)
+    engine = qa_agent.rule_engine
+
+    for shot in shots:
+        findings, _ = engine.run_shot(shot)
+        assert legacy.review_shot(shot) == (findings.critical_issues, findings.warnings, findings.suggestions)
+    for prev_shot, shot in zip(shots, shots[1:]):
+        assert legacy.review_pair(prev_shot, shot) == engine.run_pair(prev_shot, shot)
+
+    def best_of(fn):
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings) / count * 1e6
+
+    pairs = list(zip(shots, shots[1:]))
+    legacy_shot = best_of(lambda: [legacy.review_shot(shot) for shot in shots])
+    engine.timing = False
+    engine_shot = best_of(lambda: [engine.run_shot(shot) for shot in shots])
+    legacy_pair = best_of(lambda: [legacy.review_pair(p, s) for p, s in pairs])
+    engine_pair = best_of(lambda: [engine.run_pair(p, s) for p, s in pairs])
+    engine.timing = True
+    print(f"{count} 个分镜，结果一致")
+    print(f"单分镜审查 (us/分镜): 逐项检查 {legacy_shot:.1f} -> 规则引擎 {engine_shot:.1f}")
+    print(f"相邻分镜审查 (us/对): 逐项检查 {legacy_pair:.1f} -> 规则引擎 {engine_pair:.1f}")
+
+
+def run_rule_stats(count: int = 2000):
+    """每条规则的耗时统计，以及关闭规则后对审查结果的影响"""
+    shots = make_mixed_shots(count)
+    qa_agent = QAAgent(llm=None)
+    for shot in shots:
+        qa_agent.review_single_shot(shot, {})
+    qa_agent.review_shot_sequence(shots)
+    print(f"{'规则':<22} {'次数':>6} {'累计(ms)':>10} {'平均(us)':>10}")
+    for name, stats in qa_agent.rule_stats().items():
+        print(f"{name:<22} {stats['calls']:>6} {stats['total_ms']:>10.2f} {stats['avg_us']:>10.2f}")
+
+    qa_agent.set_rule_enabled("prompt_quality", False)
+    suggestions = sum(len(qa_agent.review_single_shot(shot, {})["suggestions"]) for shot in shots)
+    print(f"关闭 prompt_quality 后的建议数: {suggestions}")
+
+
+if __name__ == '__main__':
+    run_parity_and_timing()
+    run_rule_stats()
@@ -0,0 +1,120 @@
+"""
+@FileName: sequence_review_benchmark.py
+@Description: 增量序列审查基准：对比每接受一个分镜都整体重新审查与增量审查的单分镜耗时，
+              校验工作流中增量审查的汇总结果与对最终分镜整体审查一致，
+              并注入位置冲突，验证关键问题在审查当前分镜时即被发现并通过重试修正
+@Author: HengLine
+@Time: 2025/11
+"""
+import time
+
+from hengline.agent import MultiAgentPipeline, QAAgent, ShotGeneratorAgent
+from hengline.agent.draft_pipeline import get_draft_pipeline
+from hengline.example.long_script_benchmark import build_script
+
+CHARACTERS = ["小明", "小红", "老王"]
+POSITIONS = ["窗边", "桌旁", "门口", "吧台"]
+LOCATIONS = ["咖啡馆", "办公室", "公园"]
+
+
+def make_shots(count: int) -> list:
+    """构造连续的分镜：每10个分镜换一个场景，角色从上一分镜的结束位置开始"""
+    shots = []
+    positions = {}
+    for i in range(count):
+        characters = CHARACTERS[:2 + i % 2]
+        initial_state, final_state = [], []
+        for character in characters:
+            start = positions.get(character, POSITIONS[0])
+            end = POSITIONS[(i + len(character)) % len(POSITIONS)]
+            positions[character] = end
+            initial_state.append({"character_name": character, "position": start, "pose": "站立", "emotion": "平静"})
+            final_state.append({"character_name": character, "position": end, "pose": "站立", "emotion": "平静"})
+        shots.append({
+            "shot_id": str(i + 1),
+            "time_range_sec": [i * 5, (i + 1) * 5],
+            "scene_context": {"location": LOCATIONS[i // 10 % len(LOCATIONS)], "time": "下午"},
+            "characters_in_frame": characters,
+            "initial_state": initial_state,
+            "final_state": final_state,
+            "actions": []
+        })
+    return shots
+
+
+class ConflictShotGenerator(ShotGeneratorAgent):
+    """在指定分镜的首次生成中把角色的开始位置改为与约束不一致，模拟LLM偏离锚点"""
+
+    def __init__(self, conflict_shot_id: int):
+        super().__init__(llm=None)
+        self.conflict_shot_id = conflict_shot_id
+        self.attempts = 0
+
+    def generate_shot(self, segment, continuity_constraints, scene_context, style, shot_id, **kwargs):
+        shot = super().generate_shot(segment, continuity_constraints, scene_context, style, shot_id, **kwargs)
+        if shot_id == self.conflict_shot_id:
+            self.attempts += 1
+            if self.attempts == 1:
+                for state in shot.get("initial_state", []):
+                    state["position"] = "错误位置"
+        return shot
+
+
+def run_scaling(sizes=(10, 100, 1000)):
+    qa_agent = QAAgent(llm=None)
+    print(f"{'分镜数':>6} {'整体重审(us/分镜)':>18} {'增量审查(us/分镜)':>18}")
+    for size in sizes:
+        shots = make_shots(size)
+
+        start = time.perf_counter()
+        for i in range(1, size + 1):
+            rescan = qa_agent.review_shot_sequence(shots[:i])
+        rescan_us = (time.perf_counter() - start) / size * 1e6
+
+        start = time.perf_counter()
+        review, issues = qa_agent.create_sequence_review(), []
+        for shot in shots:
+            issues.extend(qa_agent.review_sequence_step(review, shot))
+            review, accepted_issues = qa_agent.accept_sequence_shot(review, shot)
+            issues.extend(accepted_issues)
+        incremental = qa_agent.finish_sequence_review(review, issues)
+        incremental_us = (time.perf_counter() - start) / size * 1e6
+
+        assert incremental == rescan, "增量审查与整体审查结果不一致"
+        print(f"{size:>6} {rescan_us:>18.1f} {incremental_us:>18.1f}")
+
+
+def run_parity():
+    """工作流逐个分镜累积的增量审查结果与对最终分镜整体审查一致"""
+    state = get_draft_pipeline().generate_state(build_script(4, 5))
+    qa_agent = get_draft_pipeline().qa_agent
+    incremental = qa_agent.finish_sequence_review(state["sequence_review"], state["sequence_issues"])
+    batch = qa_agent.review_shot_sequence(state["shots"])
+    assert incremental == batch, "工作流增量审查与整体审查结果不一致"
+    print(f"工作流增量审查一致: {len(state['shots'])} 个分镜，{len(batch['issues'])} 个问题")
+
+
+def run_early_detection(conflict_shot_id: int = 2):
+    """注入的位置冲突在审查当前分镜时发现，重试按上一分镜的结束状态修正"""
+    pipeline = MultiAgentPipeline(llm=None)
+    generator = ConflictShotGenerator(conflict_shot_id)
+    pipeline.shot_generator = generator
+    pipeline.workflow_nodes.shot_generator = generator
+    result = pipeline.run_pipeline(build_script(1, 5))
+
+    assert not result.get("error"), result.get("error")
+    shots = result["shots"]
+    prev_final = {s["character_name"]: s["position"] for s in shots[conflict_shot_id - 2]["final_state"]}
+    current_initial = {s["character_name"]: s["position"] for s in shots[conflict_shot_id - 1]["initial_state"]}
+    assert generator.attempts > 1, "位置冲突未在审查当前分镜时发现"
+    assert all(current_initial[name] == prev_final[name] for name in current_initial if name in prev_final)
+    critical_issues = pipeline.qa_agent.review_shot_sequence(shots)["critical_issues"]
+    assert not critical_issues, critical_issues
+    print(f"注入位置冲突的分镜 {conflict_shot_id}: 生成 {generator.attempts} 次，重试后与上一分镜衔接，"
+          f"最终序列无关键问题，continuity_verified: {result['metadata']['continuity_verified']}")
+
+
+if __name__ == '__main__':
+    run_scaling()
+    run_parity()
+    run_early_detection()
@@ -0,0 +1,113 @@
+"""
+@FileName: timeline_segmentation_benchmark.py
+@Description: 时序分段对比：原贪心分段（跨场景 / 场景内）与动态规划分段的分段数、时长偏差、过短分段数和跨场景分段数
+@Author: HengLine
+@Time: 2025/11
+"""
+import random
+import time
+
+from hengline.agent.temporal_planner_agent import TemporalPlannerAgent
+from hengline.tools import action_duration_tool
+
+DIALOGUES = ["你好", "别担心，一切都会好起来的！", "为什么会这样？", "嗯", "今天的雨下得真大，我们还是改天再去吧。"]
+EMOTIONS = ["平静", "紧张", "激动", "悲伤", "愤怒"]
+
+
+def build_scenes(scene_count: int, seed: int = 3) -> list:
+    """生成随机场景，每个场景包含若干动作和对话"""
+    config = action_duration_tool._current_config
+    verbs = list(config["base_actions"])
+    modifiers = list(config["modifiers"])
+    rng = random.Random(seed)
+    scenes = []
+    for _ in range(scene_count):
+        actions = []
+        for _ in range(rng.randint(1, 12)):
+            action = {"character": rng.choice(["小明", "小红", "老王"]), "emotion": rng.choice(EMOTIONS)}
+            if rng.random() < 0.4:
+                action["dialogue"] = rng.choice(DIALOGUES)
+            else:
+                action["action"] = (rng.choice(modifiers) if rng.random() < 0.4 else "") + rng.choice(verbs)
+            actions.append(action)
+        scenes.append({"location": "咖啡馆", "time": "晚上", "actions": actions})
+    return scenes
+
+
+def legacy_greedy_segments(planner: TemporalPlannerAgent, scenes: list, scene_boundaries: bool = False) -> list:
+    """优化前的贪心分段（装箱，超长分段再按目标时长拆分），仅用于对比；scene_boundaries为True时在场景边界强制分段"""
+    target = planner.target_segment_duration
+    upper_bound = target + planner.max_duration_deviation
+    segments = []
+    current = {"actions": [], "durations": [], "scenes": set()}
+
+    def close(segment):
+        total = sum(segment["durations"])
+        if total <= upper_bound:
+            segments.append(segment)
+            return
+        part = {"actions": [], "durations": [], "scenes": segment["scenes"]}
+        for action, duration in zip(segment["actions"], segment["durations"]):
+            if sum(part["durations"]) + duration > target:
+                segments.append(part)
+                part = {"actions": [], "durations": [], "scenes": segment["scenes"]}
+            part["actions"].append(action)
+            part["durations"].append(duration)
+        if part["actions"]:
+            segments.append(part)
+
+    for scene_idx, scene in enumerate(scenes):
+        durations = planner._estimate_scene_durations(scene["actions"], scene)
+        if scene_boundaries and current["actions"]:
+            close(current)
+            current = {"actions": [], "durations": [], "scenes": set()}
+        for action, duration in zip(scene["actions"], durations):
+            if sum(current["durations"]) + duration > upper_bound:
+                close(current)
+                current = {"actions": [], "durations": [], "scenes": set()}
+            current["actions"].append(action)
+            current["durations"].append(duration)
+            current["scenes"].add(scene_idx)
+    if current["actions"]:
+        close(current)
+    return [{"est_duration": sum(s["durations"]), "scene_count": len(s["scenes"])} for s in segments if s["actions"]]
+
+
+def summarize(segments: list, target: float) -> str:
+    deviation = sum(abs(segment["est_duration"] - target) for segment in segments) / len(segments)
+    # 与原实现的"时长过短"警告阈值一致
+    short = sum(1 for segment in segments if segment["est_duration"] < target * 0.6)
+    crossing = sum(1 for segment in segments if segment.get("scene_count", 1) > 1)
+    return f"{len(segments):>8} {deviation:>10.2f} {short:>10} {crossing:>10}"
+
+
+def run_benchmark(scene_counts=(10, 100, 1000)):
+    planner = TemporalPlannerAgent()
+    target = planner.target_segment_duration
+
+    print(f"{'场景数':>6} {'算法':>6} {'分段数':>8} {'平均偏差':>10} {'过短分段':>10} {'跨场景':>10} {'耗时(ms)':>10}")
+    for scene_count in scene_counts:
+        scenes = build_scenes(scene_count)
+        planner._estimate_scene_durations([], {})  # 预热
+
+        start = time.perf_counter()
+        greedy = legacy_greedy_segments(planner, scenes)
+        greedy_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        bounded_greedy = legacy_greedy_segments(planner, scenes, scene_boundaries=True)
+        bounded_greedy_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        optimal = planner.plan_timeline({"scenes": scenes}, target)
+        optimal_ms = (time.perf_counter() - start) * 1000
+
+        upper_bound = target + planner.max_duration_deviation
+        assert all(segment["est_duration"] <= upper_bound or len(segment["actions"]) == 1 for segment in optimal)
+        print(f"{scene_count:>6} {'贪心':>6} {summarize(greedy, target)} {greedy_ms:>10.1f}")
+        print(f"{scene_count:>6} {'场景内贪心':>6} {summarize(bounded_greedy, target)} {bounded_greedy_ms:>10.1f}")
+        print(f"{scene_count:>6} {'DP':>6} {summarize(optimal, target)} {optimal_ms:>10.1f}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -7,6 +7,8 @@
 from typing import Dict, Any, Optional
 
 from hengline.agent import MultiAgentPipeline
+from hengline.agent.draft_pipeline import get_draft_pipeline
+from hengline.agent.progressive_refinement import start_refinement_job
 from hengline.logger import warning, info
 
 
@@ -16,7 +18,11 @@ def generate_storyboard(
         style: str = "realistic",
         duration_per_shot: int = 5,
         prev_continuity_state: Optional[Dict[str, Any]] = None,
-        task_id: Optional[str] = None
+        task_id: Optional[str] = None,
+        script_format: str = "auto",
+        long_script: bool = False,
+        mode: str = "full",
+        refine_priority: str = "order"
 ) -> Dict[str, Any]:
     """
     剧本分镜生成主接口（可嵌入 LangGraph 或 A2A 调用）
@@ -26,11 +32,63 @@ def generate_storyboard(
         style: 视频风格（realistic / anime / cinematic）
         duration_per_shot: 每段目标时长（秒）
         prev_continuity_state: 上一段的 continuity_anchor（用于长剧本续生成）
+        script_format: 剧本格式（auto / screenplay / chinese），auto为自动识别
+        long_script: 长剧本模式，按分集/场景边界自动切分并衔接连续性状态，无需手动分段续生成
+        mode: 生成模式，full为完整流程；draft为纯规则草稿（不调用LLM和嵌入模型，不经过工作流检查点），用于即时预览；
+              progressive为渐进式精修，立即返回草稿，后台用LLM按优先级原位升级分镜（通过 metadata.refinement.job_id 查询/订阅）
+        refine_priority: 渐进式精修的优先级，order按分镜顺序，qa按规则审查结果从差到好
 
     Returns:
         包含分镜列表的完整结果
     """
-    # 尝试初始化LLM（从配置中获取AI提供商）
+    # 草稿模式：使用共享的纯规则流水线，跳过LLM初始化
+    if mode == "draft":
+        return get_draft_pipeline().run(
+            script_text=script_text,
+            style=style,
+            duration_per_shot=duration_per_shot,
+            task_id=task_id,
+            prev_continuity_state=prev_continuity_state,
+            script_format=script_format
+        )
+    if mode not in ("full", "progressive"):
+        warning(f"不支持的生成模式: {mode}，使用完整流程")
+
+    llm = _create_llm()
+
+    # 渐进式精修：立即返回规则草稿，后台按优先级用LLM原位升级分镜
+    if mode == "progressive":
+        return start_refinement_job(
+            llm,
+            script_text=script_text,
+            style=style,
+            duration_per_shot=duration_per_shot,
+            task_id=task_id,
+            prev_continuity_state=prev_continuity_state,
+            script_format=script_format,
+            priority=refine_priority
+        ).snapshot()
+
+    # 创建并运行多智能体管道
+    pipeline = MultiAgentPipeline(llm=llm)
+    run = pipeline.run_long_script if long_script else pipeline.run_pipeline
+    return run(
+        script_text=script_text,
+        style=style,
+        duration_per_shot=duration_per_shot,
+        task_id=task_id,
+        prev_continuity_state=prev_continuity_state,
+        script_format=script_format
+    )
+
+
+def _create_llm():
+    """
+    尝试初始化LLM（从配置中获取AI提供商）
+
+    Returns:
+        LangChain LLM实例，初始化失败时返回None（使用规则引擎模式）
+    """
     llm = None
     try:
         from config.config import get_ai_config
@@ -58,13 +116,4 @@ def generate_storyboard(
             warning(f"AI模型初始化失败（未能获取 {provider} 的LLM实例），系统将自动使用规则引擎模式继续工作")
     except Exception as e:
         warning(f"AI模型初始化失败（错误: {str(e)}），系统将自动使用规则引擎模式继续工作")
-
-    # 创建并运行多智能体管道
-    pipeline = MultiAgentPipeline(llm=llm)
-    return pipeline.run_pipeline(
-        script_text=script_text,
-        style=style,
-        duration_per_shot=duration_per_shot,
-        task_id=task_id,
-        prev_continuity_state=prev_continuity_state
-    )
+    return llm
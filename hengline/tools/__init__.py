@@ -37,6 +37,10 @@ from .script_parser_tool import (
     Character,
     SceneElement
 )
+# 剧本格式识别功能
+from .script_format_tool import classify_script_format
+# 动作时长校准功能
+from .duration_calibration_tool import calibrate_duration_model
 
 __all__ = [
     # LlamaIndex 核心功能
@@ -52,6 +56,7 @@ __all__ = [
     "Scene",
     "Character",
     "SceneElement",
+    "classify_script_format",
 
     # 剧本知识库
     "ScriptKnowledgeBase",
@@ -67,5 +72,8 @@ __all__ = [
     "ResultStorage",
     "create_result_storage",
     "save_script_parser_result",
-    "load_script_parser_result"
+    "load_script_parser_result",
+
+    # 动作时长校准
+    "calibrate_duration_model"
 ]
@@ -6,17 +6,256 @@
 """
 import re
 import threading
-from functools import lru_cache
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Sequence, Iterable
 
-import jieba
+import numpy as np
 import yaml
 
 # 全局配置锁
 _config_lock = threading.RLock()
 _current_config: Optional[Dict[str, Any]] = None
 _config_path: Optional[Path] = None
+# 由配置编译的动词/修饰词前缀树（配置加载/重载时更新）
+_verb_trie: Optional["KeywordTrie"] = None
+_modifier_trie: Optional["KeywordTrie"] = None
+# 配置版本号，每次加载/重载配置递增，作为缓存键的一部分
+_config_version: int = 0
+
+# 默认缓存容量（可在配置文件 cache.max_size 中调整）
+DEFAULT_CACHE_SIZE = 4096
+
+# 默认配置文件路径
+DEFAULT_CONFIG_PATH = Path(__file__).parent.parent / "config" / "action_duration_config.yaml"
+
+# 默认动作情绪修正系数，配置中缺少action_emotion_multipliers时使用（对话情绪使用配置中的dialogue.emotion_multipliers）
+ACTION_EMOTION_FACTORS = {"紧张": 1.1, "激动": 1.1, "犹豫": 1.1, "平静": 0.95, "冷静": 0.95}
+
+# 未匹配到动词时的基础时长（秒）
+UNMATCHED_ACTION_DURATION = 1.5
+
+# estimate_batch 中的文本类别
+_KIND_EMPTY, _KIND_DIALOGUE, _KIND_ACTION = 0, 1, 2
+
+# 进程内共享的估算器实例
+_shared_estimator: Optional["ActionDurationEstimator"] = None
+
+
+class KeywordTrie:
+    """
+    关键词前缀树
+    从左到右扫描一遍文本即可找出其中的关键词，代替"逐个关键词 in 文本"的线性扫描
+    """
+
+    # 节点中标记关键词结束的键（不会与单个字符冲突）
+    _END = ""
+
+    def __init__(self, keywords: Iterable[str]):
+        """
+        Args:
+            keywords: 关键词列表，顺序即优先级（等长匹配时靠前的优先）
+        """
+        self._root: Dict[str, Any] = {}
+        for order, keyword in enumerate(keywords):
+            if not keyword:
+                continue
+            node = self._root
+            for char in keyword:
+                node = node.setdefault(char, {})
+            # 重复关键词保留第一次出现的顺序
+            node.setdefault(self._END, (order, keyword))
+
+    def _matches_at(self, text: str, start: int) -> Optional[tuple]:
+        """返回从start开始的最长关键词 (order, keyword)"""
+        node = self._root
+        match = None
+        for index in range(start, len(text)):
+            node = node.get(text[index])
+            if node is None:
+                break
+            if self._END in node:
+                match = node[self._END]
+        return match
+
+    def longest_match(self, text: str) -> Optional[str]:
+        """
+        查找文本中出现的最长关键词，等长时取优先级高（顺序靠前）的
+
+        Args:
+            text: 待匹配文本
+
+        Returns:
+            匹配到的关键词，没有则返回None
+        """
+        root = self._root
+        best = None
+        for start in range(len(text)):
+            if text[start] not in root:
+                continue
+            match = self._matches_at(text, start)
+            if match and (best is None or len(match[1]) > len(best[1])
+                          or (len(match[1]) == len(best[1]) and match[0] < best[0])):
+                best = match
+        return best[1] if best else None
+
+    def first_match(self, text: str) -> Optional[str]:
+        """
+        查找文本中最靠左的关键词（同一位置取最长的）
+
+        Args:
+            text: 待匹配文本
+
+        Returns:
+            匹配到的关键词，没有则返回None
+        """
+        root = self._root
+        for start in range(len(text)):
+            if text[start] in root:
+                match = self._matches_at(text, start)
+                if match:
+                    return match[1]
+        return None
+
+
+class DurationCache:
+    """
+    线程安全的有界LRU时长缓存
+    键为 (配置版本, 文本, 情绪, 角色类型)，配置重载后旧版本的条目不会再被命中；
+    记录命中、未命中和淘汰次数，便于按实际流量调整容量
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[tuple, float]" = OrderedDict()
+        self.max_size = max(1, max_size)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[float]:
+        """查询缓存，未命中返回None"""
+        with self._lock:
+            value = self._data.get(key, self._MISSING)
+            if value is self._MISSING:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_many(self, keys: Sequence[tuple]) -> List[Optional[float]]:
+        """批量查询缓存（只加一次锁），未命中的位置为None"""
+        results = []
+        with self._lock:
+            for key in keys:
+                value = self._data.get(key, self._MISSING)
+                if value is self._MISSING:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    results.append(value)
+        return results
+
+    def put(self, key: tuple, value: float):
+        """写入缓存"""
+        self.put_many([(key, value)])
+
+    def put_many(self, items: Iterable[tuple]):
+        """批量写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            for key, value in items:
+                self._data[key] = value
+                self._data.move_to_end(key)
+            self._evict()
+
+    def resize(self, max_size: int):
+        """调整容量"""
+        with self._lock:
+            self.max_size = max(1, max_size)
+            self._evict()
+
+    def clear(self):
+        """清空缓存条目（保留统计）"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+
+        Returns:
+            包含 hits、misses、evictions、hit_rate、size、max_size、config_version 的字典
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "config_version": _config_version
+            }
+
+    def _evict(self):
+        """淘汰超出容量的条目（调用方需持有锁）"""
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+
+# 进程内共享的时长缓存
+_duration_cache = DurationCache()
+
+
+def get_duration_cache_stats() -> Dict[str, Any]:
+    """获取进程内共享时长缓存的统计信息"""
+    return _duration_cache.stats()
+
+
+def _lookup_factors(keys: Sequence[str], factor_of) -> np.ndarray:
+    """对每个取值只查一次因子，返回与keys等长的因子数组"""
+    positions: Dict[str, int] = {}
+    indices = np.fromiter((positions.setdefault(key, len(positions)) for key in keys),
+                          dtype=np.intp, count=len(keys))
+    table = np.array([factor_of(key) for key in positions], dtype=np.float64)
+    return table[indices]
+
+
+def _set_config(config: Dict[str, Any]):
+    """更新全局配置、编译动词/修饰词前缀树并使缓存失效（调用方需持有_config_lock）"""
+    global _current_config, _verb_trie, _modifier_trie, _config_version
+    _current_config = config
+    _verb_trie = KeywordTrie(config.get("base_actions", {}))
+    _modifier_trie = KeywordTrie(config.get("modifiers", {}))
+    _duration_cache.resize(int((config.get("cache") or {}).get("max_size", DEFAULT_CACHE_SIZE)))
+    # 版本号最后更新：读到新版本号时配置一定已是新配置；旧版本号下写入的条目不会再被命中
+    _config_version += 1
+    _duration_cache.clear()
+
+
+def get_action_duration_estimator(config_path: Optional[str] = None) -> "ActionDurationEstimator":
+    """
+    获取进程内共享的动作时长估算器（首次调用时加载配置并编译动词/修饰词前缀树）
+
+    Args:
+        config_path: 配置文件路径，如果为None则使用默认配置
+
+    Returns:
+        共享的ActionDurationEstimator实例
+    """
+    global _shared_estimator
+    path = Path(config_path) if config_path else DEFAULT_CONFIG_PATH
+    with _config_lock:
+        if _shared_estimator is None or _shared_estimator.config_path != path:
+            _shared_estimator = ActionDurationEstimator(str(path))
+        return _shared_estimator
 
 
 class ActionDurationEstimator:
@@ -30,30 +269,46 @@ class ActionDurationEstimator:
     def __init__(self, config_path: str = "../config/action_duration_config.yaml"):
         global _current_config, _config_path
         self.config_path = Path(config_path)
+        # 为None时使用进程内共享的全局配置和前缀树，with_config创建的估算器使用自己的配置
+        self._config: Optional[Dict[str, Any]] = None
+        self._verb_trie: Optional[KeywordTrie] = None
+        self._modifier_trie: Optional[KeywordTrie] = None
 
         with _config_lock:
             if _current_config is None or _config_path != self.config_path:
                 self._load_config()
                 _config_path = self.config_path
 
-        self._init_jieba()
+    @classmethod
+    def with_config(cls, config: Dict[str, Any]) -> "ActionDurationEstimator":
+        """
+        创建使用给定配置的独立估算器，不读写全局配置，也不经过共享缓存
+        用于离线比较不同的时长表（如校准前后的配置），估算公式与共享估算器完全相同
+
+        Args:
+            config: 时长配置（与action_duration_config.yaml结构一致）
+
+        Returns:
+            绑定该配置的估算器
+        """
+        estimator = cls.__new__(cls)
+        estimator.config_path = None
+        estimator._config = config
+        estimator._verb_trie = KeywordTrie(config.get("base_actions", {}))
+        estimator._modifier_trie = KeywordTrie(config.get("modifiers", {}))
+        return estimator
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """估算使用的时长配置"""
+        return self._config if self._config is not None else _current_config
 
     def _load_config(self):
         """加载 YAML 配置（深拷贝防污染）"""
-        global _current_config
         with open(self.config_path, "r", encoding="utf-8") as f:
             import copy
-            _current_config = copy.deepcopy(yaml.safe_load(f))
+            _set_config(copy.deepcopy(yaml.safe_load(f)))
 
-    def _init_jieba(self):
-        """优化中文分词"""
-        if _current_config:
-            for verb in _current_config.get("base_actions", {}):
-                jieba.add_word(verb, freq=2000, tag='v')
-            for mod in _current_config.get("modifiers", {}):
-                jieba.add_word(mod, freq=2000, tag='d')
-
-    @lru_cache(maxsize=1024)
     def estimate(
             self,
             action_text: str,
@@ -61,13 +316,31 @@ class ActionDurationEstimator:
             character_type: str = "default"
     ) -> float:
         """
-        估算动作时长（秒）
+        估算动作时长（秒），结果缓存在进程内共享的DurationCache中
+        """
+        if self._config is not None:
+            return self._estimate_uncached(action_text, emotion, character_type)
+        key = (_config_version, action_text, emotion, character_type)
+        duration = _duration_cache.get(key)
+        if duration is None:
+            duration = self._estimate_uncached(action_text, emotion, character_type)
+            _duration_cache.put(key, duration)
+        return duration
+
+    def _estimate_uncached(
+            self,
+            action_text: str,
+            emotion: str = "",
+            character_type: str = "default"
+    ) -> float:
+        """
+        估算动作时长（秒，不经过缓存）
         角色因子仅在此处应用一次！
         """
         if not action_text.strip():
             return 0.0
 
-        config = _current_config
+        config = self.config
 
         # 1. 分支：对话 vs 动作
         if self._is_dialogue(action_text):
@@ -87,7 +360,6 @@ class ActionDurationEstimator:
         duration *= char_factor
 
         # 3. 全局约束   区分对话和动作的最小值
-        config = _current_config
         if self._is_dialogue(action_text):
             min_dur = config["dialogue"]["min_duration"]  # 1.5
             max_dur = config["dialogue"]["max_duration"]  # 6.0
@@ -98,6 +370,131 @@ class ActionDurationEstimator:
         duration = max(min_dur, min(duration, max_dur))
         return round(duration, 2)
 
+    def estimate_batch(
+            self,
+            texts: Sequence[str],
+            emotions: Optional[Sequence[str]] = None,
+            character_types: Optional[Sequence[str]] = None
+    ) -> List[float]:
+        """
+        批量估算动作时长，结果与逐条调用estimate逐位一致
+        先批量查询共享缓存，未命中的条目交给向量化计算后写回缓存
+
+        Args:
+            texts: 动作/对话文本列表
+            emotions: 与texts等长的情绪列表，None表示全部无情绪
+            character_types: 与texts等长的角色类型列表，None表示全部为default
+
+        Returns:
+            与texts顺序一致的时长列表（秒）
+        """
+        count = len(texts)
+        if count == 0:
+            return []
+        emotions = [emotion or "" for emotion in emotions] if emotions is not None else [""] * count
+        character_types = [character_type or "default" for character_type in character_types] \
+            if character_types is not None else ["default"] * count
+        if self._config is not None:
+            return self._estimate_batch_uncached(texts, emotions, character_types)
+
+        version = _config_version
+        keys = list(zip([version] * count, texts, emotions, character_types))
+        durations = _duration_cache.get_many(keys)
+        missing = [index for index, duration in enumerate(durations) if duration is None]
+        if missing:
+            computed = self._estimate_batch_uncached(
+                [texts[index] for index in missing],
+                [emotions[index] for index in missing],
+                [character_types[index] for index in missing]
+            )
+            _duration_cache.put_many((keys[index], duration) for index, duration in zip(missing, computed))
+            for index, duration in zip(missing, computed):
+                durations[index] = duration
+        return durations
+
+    def _estimate_batch_uncached(
+            self,
+            texts: Sequence[str],
+            emotions: Sequence[str],
+            character_types: Sequence[str]
+    ) -> List[float]:
+        """
+        向量化批量估算（不经过缓存）
+        文本特征（对话/动作、字数、动词和修饰词）按去重后的文本逐条提取，
+        情绪、修饰词、角色速度因子和上下限约束以NumPy数组运算统一计算
+        """
+        count = len(texts)
+        config = self.config
+
+        # 1. 提取文本特征（相同文本只分析一次）
+        features: Dict[str, tuple] = {}
+        kinds = np.empty(count, dtype=np.int8)
+        char_counts = np.empty(count, dtype=np.int64)
+        base_durations = np.empty(count, dtype=np.float64)
+        modifier_factors = np.empty(count, dtype=np.float64)
+        for index, text in enumerate(texts):
+            feature = features.get(text)
+            if feature is None:
+                feature = features[text] = self._text_features(text, config)
+            kinds[index], char_counts[index], base_durations[index], modifier_factors[index] = feature
+
+        # 2. 查表得到各条目的情绪/角色因子（按去重后的取值查表）
+        dialogue_config = config["dialogue"]
+        emo_multipliers = dialogue_config["emotion_multipliers"]
+        speed_factors = config["character_speed_factors"]
+        dialogue_emotion = _lookup_factors(
+            emotions, lambda emotion: emo_multipliers.get(emotion or "默认", emo_multipliers["默认"]))
+        action_emotion = _lookup_factors(emotions, self._action_emotion_factor)
+        char_factor = _lookup_factors(
+            character_types, lambda character_type: speed_factors.get(character_type or "default", speed_factors["default"]))
+
+        # 3. 对话：字数 × 每字时长 × 情绪因子，限制在[min_duration, max_duration]
+        dialogue = np.where(char_counts > 0,
+                            char_counts * dialogue_config["base_per_char"] * dialogue_emotion,
+                            dialogue_config["min_duration"])
+        dialogue = np.maximum(dialogue_config["min_duration"], np.minimum(dialogue, dialogue_config["max_duration"]))
+
+        # 4. 动作：基础时长 × 修饰词因子 × 情绪因子 × 角色因子，不低于min_action_duration
+        action = base_durations * modifier_factors * action_emotion * char_factor
+        action = np.maximum(config["segmentation"]["min_action_duration"], action)
+
+        durations = np.select([kinds == _KIND_DIALOGUE, kinds == _KIND_ACTION], [dialogue, action], 0.0)
+        # Python内置round与estimate一致（np.round的二进制舍入在.xx5附近会有差异）
+        return [round(duration, 2) for duration in durations.tolist()]
+
+    def _text_features(self, text: str, config: dict) -> tuple:
+        """
+        提取单条文本的估算特征
+
+        Returns:
+            (类别, 对话字数, 动作基础时长, 修饰词因子)
+        """
+        if not text.strip():
+            return _KIND_EMPTY, 0, 0.0, 1.0
+        if self._is_dialogue(text):
+            return _KIND_DIALOGUE, self._count_dialogue_chars(text), 0.0, 1.0
+        base_duration, modifier_factor = self._match_action_factors(text, config)
+        return _KIND_ACTION, 0, base_duration, modifier_factor
+
+    def match_text(self, text: str) -> tuple:
+        """
+        识别文本类别并匹配估算用到的配置项
+
+        Args:
+            text: 动作/对话文本
+
+        Returns:
+            ("dialogue", 对话字数)、("action", 动词, 修饰词)（未匹配时为None），空文本返回 ("empty",)
+        """
+        if not text.strip():
+            return ("empty",)
+        if self._is_dialogue(text):
+            return "dialogue", self._count_dialogue_chars(text)
+        verb_trie, modifier_trie = (self._verb_trie, self._modifier_trie) if self._config is not None \
+            else (_verb_trie, _modifier_trie)
+        # 匹配最长动词（前缀树一次扫描，等长时按配置顺序），修饰词取最先出现的
+        return "action", verb_trie.longest_match(text), modifier_trie.first_match(text)
+
     def _is_dialogue(self, text: str) -> bool:
         """强化对话检测（支持中英文标点）"""
         if "说" not in text:
@@ -111,20 +508,7 @@ class ActionDurationEstimator:
 
     def _estimate_dialogue(self, text: str, emotion: str, config: dict) -> float:
         """估算对话时长（与角色完全无关）"""
-        # 提取对话内容
-        quote_match = re.search(r'[“”"\'`](.*?)[“”"\'`]', text)
-        if quote_match:
-            dialogue = quote_match.group(1)
-        else:
-            parts = re.split(r'[：:]', text, maxsplit=1)
-            if len(parts) > 1:
-                dialogue = re.sub(r'^说\s*', '', parts[1]).strip()
-            else:
-                dialogue = text.replace("说", "").strip()
-
-        # 统计中文字符
-        chinese_chars = [c for c in dialogue if '\u4e00' <= c <= '\u9fff' or c in "，。！？；：“”‘’、"]
-        char_count = len(chinese_chars)
+        char_count = self._count_dialogue_chars(text)
 
         if char_count == 0:
             return config["dialogue"]["min_duration"]
@@ -140,49 +524,60 @@ class ActionDurationEstimator:
         # 注意：min/max 限制在 estimate() 中统一应用
         return raw_duration
 
+    def _count_dialogue_chars(self, text: str) -> int:
+        """提取对话内容并统计中文字符（含中文标点）数"""
+        # 提取对话内容
+        quote_match = re.search(r'[“”"\'`](.*?)[“”"\'`]', text)
+        if quote_match:
+            dialogue = quote_match.group(1)
+        else:
+            parts = re.split(r'[：:]', text, maxsplit=1)
+            if len(parts) > 1:
+                dialogue = re.sub(r'^说\s*', '', parts[1]).strip()
+            else:
+                dialogue = text.replace("说", "").strip()
+
+        # 统计中文字符
+        chinese_chars = [c for c in dialogue if '\u4e00' <= c <= '\u9fff' or c in "，。！？；：“”‘’、"]
+        return len(chinese_chars)
+
     def _estimate_action(self, text: str, emotion: str, config: dict) -> float:
         """估算动作基础时长（不含角色因子！）"""
-        words = list(jieba.cut(text, cut_all=False))
-        base_actions = config["base_actions"]
-
-        # 匹配最长动词
-        base_duration = 1.5
-        sorted_verbs = sorted(base_actions.keys(), key=len, reverse=True)
-        for verb in sorted_verbs:
-            if verb in text:
-                base_duration = base_actions[verb]
-                break
+        base_duration, modifier_factor = self._match_action_factors(text, config)
+        return base_duration * modifier_factor * self._action_emotion_factor(emotion)
 
-        # 修饰词修正
-        modifier_factor = 1.0
-        modifiers = config["modifiers"]
-        for word in words:
-            if word in modifiers:
-                modifier_factor = modifiers[word]
-                break
+    def _match_action_factors(self, text: str, config: dict) -> tuple:
+        """匹配动作文本的基础时长和修饰词因子"""
+        _, verb, modifier = self.match_text(text)
+        base_duration = config["base_actions"][verb] if verb else UNMATCHED_ACTION_DURATION
+        modifier_factor = config["modifiers"][modifier] if modifier else 1.0
+        return base_duration, modifier_factor
 
-        # 情绪修正（简单映射）
-        emotion_factor = 1.0
-        if emotion:
-            if emotion in ["紧张", "激动", "犹豫"]:
-                emotion_factor = 1.1
-            elif emotion in ["平静", "冷静"]:
-                emotion_factor = 0.95
+    def action_emotion_factors(self) -> Dict[str, float]:
+        """动作情绪修正系数表（配置中的action_emotion_multipliers，缺少时使用默认值）"""
+        return (self.config or {}).get("action_emotion_multipliers") or ACTION_EMOTION_FACTORS
 
-        return base_duration * modifier_factor * emotion_factor
+    def _action_emotion_factor(self, emotion: str) -> float:
+        """动作情绪修正（查配置中的action_emotion_multipliers）"""
+        if not emotion:
+            return 1.0
+        return self.action_emotion_factors().get(emotion, 1.0)
 
     def clear_cache(self):
         """清空缓存"""
-        self.estimate.cache_clear()
+        _duration_cache.clear()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """获取缓存命中/未命中/淘汰统计"""
+        return _duration_cache.stats()
 
     @classmethod
     def reload_config(cls, config_path: str = "../config/action_duration_config.yaml"):
         """热重载配置"""
-        global _current_config, _config_path
+        global _config_path
         with _config_lock:
             with open(config_path, "r", encoding="utf-8") as f:
                 import copy
-                _current_config = copy.deepcopy(yaml.safe_load(f))
+                _set_config(copy.deepcopy(yaml.safe_load(f)))
             _config_path = Path(config_path)
-        # 此处建议由调用方管理实例生命周期
-        # cls.clear_cache()
+        # 配置版本号已递增，缓存随之失效
@@ -0,0 +1,466 @@
+"""
+@FileName: duration_calibration_tool.py
+@Description: 动作时长模型离线校准工具，按人工修订的时长文件，从ResultStorage保存的历史结果中取对应动作，
+              拟合动词、修饰词、情绪系数，输出带版本号的新YAML配置；线上估算仍是查表，不增加开销
+@Author: HengLine
+@Time: 2025/11
+"""
+import copy
+import math
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import yaml
+
+from hengline.logger import debug, info, warning
+from hengline.tools.action_duration_tool import (
+    ACTION_EMOTION_FACTORS,
+    DEFAULT_CONFIG_PATH,
+    UNMATCHED_ACTION_DURATION,
+    ActionDurationEstimator
+)
+from hengline.tools.result_storage_tool import ResultStorage, create_result_storage
+
+# 历史结果中动作的实际时长字段（人工修订后的时长优先）
+# 流水线保存结果时不写入这些字段，只有手工编辑过的结果文件才会带有；实际时长的主要来源是人工修订的时长文件
+OBSERVED_DURATION_KEYS = ("actual_duration", "duration")
+# 对话情绪的参照类别，固定为1.0，其余情绪相对它拟合
+DIALOGUE_REFERENCE_EMOTION = "默认"
+
+
+@dataclass
+class DurationSample:
+    """一条带实际时长的动作/对话样本"""
+    text: str  # 与TemporalPlannerAgent一致的估算文本（对话为"角色说：“台词”"）
+    emotion: str
+    character_type: str
+    observed: float  # 实际时长（秒）
+
+
+def load_timing_overrides(timings_path: str) -> Dict[Tuple[str, int, int], float]:
+    """
+    加载人工修订的时长文件（YAML或JSON）
+
+    文件内容为记录列表，每条记录包含 uuid、scene_index、action_index、duration
+
+    Args:
+        timings_path: 时长文件路径
+
+    Returns:
+        (uuid, 场景序号, 动作序号) → 实际时长
+    """
+    with open(timings_path, "r", encoding="utf-8") as f:
+        records = yaml.safe_load(f) or []
+    if isinstance(records, dict):
+        records = records.get("timings", [])
+
+    overrides = {}
+    for record in records:
+        try:
+            key = (str(record["uuid"]), int(record["scene_index"]), int(record["action_index"]))
+            overrides[key] = float(record["duration"])
+        except (KeyError, TypeError, ValueError):
+            warning(f"忽略无效的时长记录: {record}")
+    debug(f"加载人工修订时长 {len(overrides)} 条")
+    return overrides
+
+
+def iter_stored_scripts(storage: ResultStorage) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    遍历ResultStorage中保存的结构化剧本
+
+    Args:
+        storage: 结果存储实例
+
+    Returns:
+        (uuid, 结构化剧本) 的生成器
+    """
+    for uuid in sorted(storage.list_available_results()):
+        try:
+            result = storage.load_result(uuid)
+        except IOError as e:
+            warning(f"跳过无法加载的结果 (UUID: {uuid}): {str(e)}")
+            continue
+        if result and result.get("scenes"):
+            yield uuid, result
+
+
+def _action_texts(action: Dict[str, Any]) -> List[str]:
+    """按TemporalPlannerAgent的方式生成动作的估算文本（动作描述、对话各一条）"""
+    texts = []
+    if action.get("action"):
+        texts.append(action["action"])
+    if action.get("dialogue"):
+        texts.append(f"{action.get('character', '')}说：“{action['dialogue']}”")
+    return texts
+
+
+def _character_type(action: Dict[str, Any], scene: Dict[str, Any]) -> str:
+    profile = (scene.get("characters_info") or {}).get(action.get("character"))
+    return profile.get("type", "default") if isinstance(profile, dict) else "default"
+
+
+def _observed_duration(action: Dict[str, Any], key: Tuple[str, int, int],
+                       overrides: Dict[Tuple[str, int, int], float]) -> Optional[float]:
+    """获取动作的实际时长，人工修订时长优先"""
+    if key in overrides:
+        return overrides[key]
+    for field_name in OBSERVED_DURATION_KEYS:
+        value = action.get(field_name)
+        if isinstance(value, (int, float)) and value > 0:
+            return float(value)
+    return None
+
+
+def collect_samples(scripts: Iterable[Tuple[str, Dict[str, Any]]],
+                    overrides: Optional[Dict[Tuple[str, int, int], float]] = None) -> List[DurationSample]:
+    """
+    从历史剧本中收集带实际时长的样本
+    同时包含动作描述和对话的动作只有两者的最大时长，无法拆分，不参与拟合
+
+    Args:
+        scripts: (uuid, 结构化剧本) 的可迭代对象
+        overrides: 人工修订的时长
+
+    Returns:
+        样本列表
+    """
+    overrides = overrides or {}
+    samples = []
+    for uuid, structured_script in scripts:
+        for scene_index, scene in enumerate(structured_script.get("scenes", [])):
+            for action_index, action in enumerate(scene.get("actions", [])):
+                texts = _action_texts(action)
+                if len(texts) != 1:
+                    continue
+                observed = _observed_duration(action, (uuid, scene_index, action_index), overrides)
+                if observed is None:
+                    continue
+                samples.append(DurationSample(texts[0], action.get("emotion", "") or "",
+                                              _character_type(action, scene), observed))
+    return samples
+
+
+def _ridge_log_fit(rows: List[List[int]], targets: List[float], prior: List[float], prior_weight: float) -> np.ndarray:
+    """
+    对数空间岭回归：最小化 Σ(y - Σθ)² + λ·||θ - θ0||²，θ0为当前配置的对数值
+    样本少的参数被拉向原配置，避免少量噪声样本把系数拟偏
+
+    Args:
+        rows: 每个样本涉及的参数下标
+        targets: 每个样本的对数目标值（已扣除固定因子）
+        prior: 各参数的先验（原配置的对数值）
+        prior_weight: 先验权重λ，约等于"相当于多少条样本"
+
+    Returns:
+        拟合后的参数（对数值）
+    """
+    size = len(prior)
+    design = np.zeros((len(rows), size))
+    for row, indices in enumerate(rows):
+        design[row, indices] = 1.0
+    theta0 = np.array(prior)
+    lhs = design.T @ design + prior_weight * np.eye(size)
+    rhs = design.T @ np.array(targets) + prior_weight * theta0
+    return np.linalg.solve(lhs, rhs)
+
+
+def _fit_actions(estimator: ActionDurationEstimator, samples: List[DurationSample], new_config: Dict[str, Any],
+                 min_samples: int, prior_weight: float) -> Dict[str, Dict[str, Any]]:
+    """拟合动词基础时长、修饰词系数和动作情绪系数（角色速度因子保持不变）"""
+    config = estimator.config
+    min_duration = config["segmentation"]["min_action_duration"]
+    speed_factors = config["character_speed_factors"]
+    emotion_factors = dict(estimator.action_emotion_factors())
+
+    observations = []
+    for sample in samples:
+        feature = estimator.match_text(sample.text)
+        # 被下限截断的样本不反映真实速度
+        if feature[0] != "action" or sample.observed <= min_duration:
+            continue
+        char_factor = speed_factors.get(sample.character_type, speed_factors["default"])
+        terms = [("base_actions", feature[1]), ("modifiers", feature[2]),
+                 ("action_emotion_multipliers", sample.emotion or None)]
+        observations.append((terms, math.log(sample.observed / char_factor)))
+
+    current = {
+        "base_actions": config["base_actions"],
+        "modifiers": config["modifiers"],
+        "action_emotion_multipliers": emotion_factors
+    }
+    counts = Counter(term for terms, _ in observations for term in terms if term[1])
+    return _solve_tables(observations, current, counts, min_samples, prior_weight, new_config,
+                         fixed={("base_actions", None): UNMATCHED_ACTION_DURATION}, decimals=2)
+
+
+def _fit_dialogue(estimator: ActionDurationEstimator, samples: List[DurationSample], new_config: Dict[str, Any],
+                  min_samples: int, prior_weight: float) -> Dict[str, Dict[str, Any]]:
+    """拟合对话每字时长和对话情绪系数（"默认"情绪作为参照固定为1.0）"""
+    dialogue = estimator.config["dialogue"]
+    observations = []
+    for sample in samples:
+        feature = estimator.match_text(sample.text)
+        # 被上下限截断的样本不反映真实语速
+        if feature[0] != "dialogue" or not feature[1] \
+                or not dialogue["min_duration"] < sample.observed < dialogue["max_duration"]:
+            continue
+        emotion = sample.emotion or DIALOGUE_REFERENCE_EMOTION
+        terms = [("dialogue", "base_per_char"), ("emotion_multipliers", emotion)]
+        observations.append((terms, math.log(sample.observed / feature[1])))
+
+    current = {
+        "dialogue": {"base_per_char": dialogue["base_per_char"]},
+        "emotion_multipliers": dialogue["emotion_multipliers"]
+    }
+    counts = Counter(term for terms, _ in observations for term in terms)
+    targets = {"dialogue": new_config["dialogue"], "emotion_multipliers": new_config["dialogue"]["emotion_multipliers"]}
+    changes = _solve_tables(observations, current, counts, min_samples, prior_weight, targets,
+                            fixed={("emotion_multipliers", DIALOGUE_REFERENCE_EMOTION): 1.0}, decimals=3)
+    return {("dialogue." + table if table == "emotion_multipliers" else table): values
+            for table, values in changes.items()}
+
+
+def _solve_tables(observations: List[Tuple[list, float]], current: Dict[str, Dict[str, float]], counts: Counter,
+                  min_samples: int, prior_weight: float, target: Dict[str, Any],
+                  fixed: Dict[tuple, float], decimals: int) -> Dict[str, Dict[str, Any]]:
+    """
+    求解各表的系数并写入target
+
+    样本数不少于min_samples的 (表, 键) 作为参数拟合，其余保持原值作为固定因子
+    """
+    params = [term for term, count in sorted(counts.items(), key=lambda item: (item[0][0], str(item[0][1])))
+              if count >= min_samples and term not in fixed]
+    if not params:
+        return {}
+    index = {term: position for position, term in enumerate(params)}
+
+    def current_value(term):
+        table, key = term
+        if term in fixed:
+            return fixed[term]
+        if key is None:
+            return 1.0
+        return current[table].get(key, 1.0)
+
+    rows, targets = [], []
+    for terms, value in observations:
+        indices = [index[term] for term in terms if term in index]
+        if not indices:
+            continue
+        rows.append(indices)
+        targets.append(value - sum(math.log(current_value(term)) for term in terms if term not in index))
+    if not rows:
+        return {}
+
+    theta = _ridge_log_fit(rows, targets, [math.log(current_value(term)) for term in params], prior_weight)
+    changes: Dict[str, Dict[str, Any]] = {}
+    for term, value in zip(params, theta):
+        table, key = term
+        fitted = round(math.exp(value), decimals)
+        target.setdefault(table, {})[key] = fitted
+        changes.setdefault(table, {})[key] = {
+            "before": current[table].get(key),
+            "after": fitted,
+            "samples": counts[term]
+        }
+    return changes
+
+
+def _mean_abs_error(estimator: ActionDurationEstimator, samples: List[DurationSample]) -> float:
+    if not samples:
+        return 0.0
+    return sum(abs(estimator.estimate(s.text, s.emotion, s.character_type) - s.observed)
+               for s in samples) / len(samples)
+
+
+def fit_duration_config(samples: List[DurationSample], config: Dict[str, Any],
+                        min_samples: int = 3, prior_weight: float = 2.0) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    根据样本拟合新的时长配置
+
+    Args:
+        samples: 带实际时长的样本
+        config: 当前时长配置
+        min_samples: 某个动词/修饰词/情绪至少出现多少次才重新拟合
+        prior_weight: 向原配置收缩的强度
+
+    Returns:
+        (新配置, 拟合统计)
+    """
+    estimator = ActionDurationEstimator.with_config(config)
+    new_config = copy.deepcopy(config)
+    new_config.setdefault("action_emotion_multipliers", dict(ACTION_EMOTION_FACTORS))
+
+    changes = _fit_actions(estimator, samples, new_config, min_samples, prior_weight)
+    changes.update(_fit_dialogue(estimator, samples, new_config, min_samples, prior_weight))
+
+    calibrated = ActionDurationEstimator.with_config(new_config)
+    stats = {
+        "samples": len(samples),
+        "mean_abs_error": {
+            "before": round(_mean_abs_error(estimator, samples), 4),
+            "after": round(_mean_abs_error(calibrated, samples), 4)
+        },
+        "changes": changes
+    }
+    return new_config, stats
+
+
+def _scene_durations(estimator: ActionDurationEstimator, scene: Dict[str, Any], observed: Optional[List[Optional[float]]] = None,
+                     default_duration: float = 2.0) -> List[float]:
+    """按TemporalPlannerAgent的方式计算场景中各动作时长，observed中非空的值优先"""
+    durations = []
+    for index, action in enumerate(scene.get("actions", [])):
+        if observed and observed[index] is not None:
+            durations.append(observed[index])
+            continue
+        character_type = _character_type(action, scene)
+        estimates = [estimator.estimate(text, action.get("emotion", "") or "", character_type)
+                     for text in _action_texts(action)]
+        durations.append(max(estimates, default=0.0) or default_duration)
+    return durations
+
+
+def compare_segment_counts(scripts: List[Tuple[str, Dict[str, Any]]], config: Dict[str, Any],
+                           calibrated_config: Dict[str, Any],
+                           overrides: Optional[Dict[Tuple[str, int, int], float]] = None,
+                           target_duration: Optional[float] = None) -> Dict[str, Any]:
+    """
+    比较校准前后时序规划的分段数（每个分段对应一次分镜生成调用）
+    参考分段数按实际时长规划（无实际时长的动作使用校准后的估算）
+
+    Returns:
+        总分段数统计以及逐剧本明细
+    """
+    # 延迟导入，避免工具模块与智能体模块循环导入
+    from hengline.agent.temporal_planner_agent import TemporalPlannerAgent
+
+    planner = TemporalPlannerAgent()
+    context = planner.create_context(target_duration)
+    before_estimator = ActionDurationEstimator.with_config(config)
+    after_estimator = ActionDurationEstimator.with_config(calibrated_config)
+    overrides = overrides or {}
+
+    def count(scene_durations):
+        return sum(len(planner._segment_scene(durations, context)) for durations in scene_durations if durations)
+
+    details = []
+    for uuid, structured_script in scripts:
+        before, after, observed = [], [], []
+        for scene_index, scene in enumerate(structured_script.get("scenes", [])):
+            actions = scene.get("actions", [])
+            actual = [_observed_duration(action, (uuid, scene_index, action_index), overrides)
+                      for action_index, action in enumerate(actions)]
+            before.append(_scene_durations(before_estimator, scene))
+            after.append(_scene_durations(after_estimator, scene))
+            observed.append(_scene_durations(after_estimator, scene, actual))
+        details.append({"uuid": uuid, "before": count(before), "after": count(after), "observed": count(observed)})
+
+    totals = {name: sum(detail[name] for detail in details) for name in ("before", "after", "observed")}
+    return {
+        **totals,
+        "excess_before": sum(abs(d["before"] - d["observed"]) for d in details),
+        "excess_after": sum(abs(d["after"] - d["observed"]) for d in details),
+        "details": details
+    }
+
+
+def next_config_version(version: Any) -> str:
+    """递增配置版本号的最后一段，如 1.2 → 1.3"""
+    parts = str(version or "1.0").split(".")
+    if parts[-1].isdigit():
+        parts[-1] = str(int(parts[-1]) + 1)
+    else:
+        parts.append("1")
+    return ".".join(parts)
+
+
+def write_calibrated_config(config: Dict[str, Any], output_dir: Optional[str] = None) -> str:
+    """
+    写出带版本号的时长配置文件 action_duration_config_v<版本>.yaml
+
+    Returns:
+        写出的文件路径
+    """
+    output_path = Path(output_dir or DEFAULT_CONFIG_PATH.parent) / f"action_duration_config_v{config['version']}.yaml"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    header = (
+        "# =============================================================================\n"
+        "# 剧本分镜智能体 - 动作时长估算配置（由 duration_calibration_tool 根据历史结果校准生成）\n"
+        f"# 版本：{config['version']}（基于 {config['calibration']['base_version']}）\n"
+        "# 使用：ActionDurationEstimator.reload_config(<本文件路径>)\n"
+        "# =============================================================================\n\n"
+    )
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(header)
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+    return str(output_path)
+
+
+def calibrate_duration_model(storage: Optional[ResultStorage] = None,
+                             timings_path: Optional[str] = None,
+                             config_path: Optional[str] = None,
+                             output_dir: Optional[str] = None,
+                             min_samples: int = 3,
+                             prior_weight: float = 2.0,
+                             target_duration: Optional[float] = None) -> Dict[str, Any]:
+    """
+    从历史结果校准动作时长模型并写出新版本配置
+    流水线保存的结果不含实际时长，实际时长来自人工修订的时长文件（或手工在结果文件的动作上填写的
+    actual_duration / duration）；没有样本或没有可拟合的系数时不写出新配置
+
+    Args:
+        storage: 结果存储实例，默认使用配置的data_output目录
+        timings_path: 人工修订时长文件
+        config_path: 作为起点的时长配置，默认使用当前配置文件
+        output_dir: 新配置输出目录，默认与当前配置文件同目录
+        min_samples: 某个动词/修饰词/情绪至少出现多少次才重新拟合
+        prior_weight: 向原配置收缩的强度
+        target_duration: 分段数对比使用的目标分段时长
+
+    Returns:
+        校准报告，包含新配置路径、版本、拟合统计和分段数对比；未校准时 output_path 为None
+    """
+    if not timings_path:
+        warning("未提供人工修订时长文件，只能使用结果文件中手工填写的实际时长")
+    storage = storage or create_result_storage()
+    with open(config_path or DEFAULT_CONFIG_PATH, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    overrides = load_timing_overrides(timings_path) if timings_path else {}
+    scripts = list(iter_stored_scripts(storage))
+
+    samples = collect_samples(scripts, overrides)
+    if not samples:
+        warning(f"历史结果（{len(scripts)} 个）中没有带实际时长的样本，请提供人工修订时长文件，跳过校准")
+        return {"samples": 0, "output_path": None}
+
+    new_config, stats = fit_duration_config(samples, config, min_samples, prior_weight)
+    if not stats["changes"]:
+        warning(f"样本 {len(samples)} 条中没有出现至少 {min_samples} 次的动词、修饰词或情绪，配置不变，跳过校准")
+        return {**stats, "output_path": None}
+    new_config.pop("calibration", None)
+    new_config["version"] = next_config_version(config.get("version"))
+    new_config["calibration"] = {
+        "base_version": str(config.get("version")),
+        "calibrated_at": datetime.now().isoformat(timespec="seconds"),
+        "scripts": len(scripts),
+        "samples": len(samples),
+        "mean_abs_error": stats["mean_abs_error"]
+    }
+    output_path = write_calibrated_config(new_config, output_dir)
+    segments = compare_segment_counts(scripts, config, new_config, overrides, target_duration)
+
+    info(f"时长模型校准完成: {output_path}，样本 {len(samples)} 条，"
+         f"平均误差 {stats['mean_abs_error']['before']} → {stats['mean_abs_error']['after']}，"
+         f"分段数 {segments['before']} → {segments['after']}（实际 {segments['observed']}）")
+    return {
+        "output_path": output_path,
+        "version": new_config["version"],
+        **stats,
+        "segments": segments
+    }
@@ -0,0 +1,221 @@
+"""
+@FileName: emotion_transition_tool.py
+@Description: 情绪过渡矩阵：从YAML配置加载情绪词表（中英文别名共用一个情绪ID）和过渡代价，
+              预计算 ID×ID 的代价矩阵和合理性矩阵，连续性守护和分镜审查通过O(1)查表判断情绪过渡是否合理
+@Author: HengLine
+@Time: 2025/11
+"""
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from hengline.logger import debug, warning
+
+# 默认配置文件路径
+DEFAULT_CONFIG_PATH = Path(__file__).parent.parent / "config" / "emotion_transition_config.yaml"
+
+# 默认严格程度（配置中缺少 strictness 时使用）
+DEFAULT_MAX_VALID_COST = 1.0
+DEFAULT_UNDEFINED_COST = 2.0
+# 过渡规则写成列表（未写代价）时的代价，保持不变的情绪、不限制过渡的情绪的代价
+DEFAULT_TRANSITION_COST = 1.0
+SAME_EMOTION_COST = 0.0
+UNRESTRICTED_COST = 0.0
+
+_shared_lock = threading.Lock()
+_shared_matrix: Optional["EmotionTransitionMatrix"] = None
+
+
+class _MatrixTables:
+    """一次加载生成的全部查找表，重载时整体替换"""
+    __slots__ = ("ids", "names", "costs", "valid", "restricted", "undefined_cost", "max_valid_cost")
+
+    def __init__(self, ids: Dict[str, int], names: List[str], costs: List[float], valid: bytearray,
+                 restricted: bytearray, undefined_cost: float, max_valid_cost: float):
+        self.ids = ids
+        self.names = names
+        self.costs = costs
+        self.valid = valid
+        self.restricted = restricted
+        self.undefined_cost = undefined_cost
+        self.max_valid_cost = max_valid_cost
+
+
+class EmotionTransitionMatrix:
+    """
+    情绪过渡矩阵
+    - 情绪名（含别名）驻留后映射为连续的情绪ID
+    - 代价矩阵 costs[prev_id * n + current_id]，合理性矩阵 valid 同样按ID索引
+    - 有过渡规则的情绪只能过渡到规则内的情绪或保持不变；没有规则的情绪、词表外的情绪不限制过渡
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, config_path: Optional[str] = None):
+        """
+        Args:
+            config: 配置字典（优先使用）
+            config_path: 配置文件路径，默认 hengline/config/emotion_transition_config.yaml
+        """
+        self.config_path = Path(config_path) if config_path else DEFAULT_CONFIG_PATH
+        self._tables = self._build(config if config is not None else self._load_config(self.config_path))
+
+    @staticmethod
+    def _load_config(config_path: Path) -> Dict[str, Any]:
+        try:
+            with open(config_path, "r", encoding="utf-8") as f:
+                return yaml.safe_load(f) or {}
+        except Exception as e:
+            warning(f"加载情绪过渡配置失败: {config_path}, {str(e)}，不限制情绪过渡")
+            return {}
+
+    @staticmethod
+    def _build(config: Dict[str, Any]) -> _MatrixTables:
+        ids: Dict[str, int] = {}
+        names: List[str] = []
+
+        def intern(name: str) -> int:
+            name = sys.intern(str(name))
+            if name not in ids:
+                ids[name] = len(names)
+                names.append(name)
+            return ids[name]
+
+        # 标准情绪名和别名共用同一个ID
+        for name, aliases in (config.get("emotions") or {}).items():
+            emotion_id = intern(name)
+            for alias in aliases or []:
+                ids.setdefault(sys.intern(str(alias)), emotion_id)
+
+        transitions = config.get("transitions") or {}
+        rules: List[Tuple[int, int, float]] = []
+        restricted_ids = set()
+        for prev, nexts in transitions.items():
+            prev_id = intern(prev)
+            restricted_ids.add(prev_id)
+            if isinstance(nexts, dict):
+                items = nexts.items()
+            else:
+                items = ((current, DEFAULT_TRANSITION_COST) for current in nexts or [])
+            for current, cost in items:
+                current_id = intern(current)
+                rules.append((prev_id, current_id, float(cost)))
+
+        strictness = config.get("strictness") or {}
+        max_valid_cost = float(strictness.get("max_valid_cost", DEFAULT_MAX_VALID_COST))
+        undefined_cost = float(strictness.get("undefined_cost", DEFAULT_UNDEFINED_COST))
+
+        size = len(names)
+        restricted = bytearray(size)
+        costs = [UNRESTRICTED_COST] * (size * size)
+        for prev_id in restricted_ids:
+            restricted[prev_id] = 1
+            row = prev_id * size
+            costs[row:row + size] = [undefined_cost] * size
+        for prev_id, current_id, cost in rules:
+            costs[prev_id * size + current_id] = cost
+        for emotion_id in range(size):
+            costs[emotion_id * size + emotion_id] = SAME_EMOTION_COST
+        valid = bytearray(cost <= max_valid_cost for cost in costs)
+
+        debug(f"情绪过渡矩阵加载完成: {size} 种情绪，{len(ids)} 个名称，{len(rules)} 条过渡规则")
+        return _MatrixTables(ids, names, costs, valid, restricted, undefined_cost, max_valid_cost)
+
+    def reload(self, config: Optional[Dict[str, Any]] = None, config_path: Optional[str] = None):
+        """
+        热重载配置，查找表整体替换，并发的查询要么看到旧表要么看到新表
+
+        Args:
+            config: 配置字典（优先使用）
+            config_path: 配置文件路径，默认沿用当前路径
+        """
+        if config_path:
+            self.config_path = Path(config_path)
+        self._tables = self._build(config if config is not None else self._load_config(self.config_path))
+
+    @property
+    def size(self) -> int:
+        """情绪ID数量"""
+        return len(self._tables.names)
+
+    @property
+    def max_valid_cost(self) -> float:
+        return self._tables.max_valid_cost
+
+    def emotion_id(self, emotion: Optional[str]) -> Optional[int]:
+        """情绪名（或别名）对应的情绪ID，不在词表中返回None"""
+        return self._tables.ids.get(emotion)
+
+    def emotion_name(self, emotion_id: int) -> str:
+        """情绪ID对应的标准情绪名"""
+        return self._tables.names[emotion_id]
+
+    def canonical(self, emotion: Optional[str]) -> Optional[str]:
+        """情绪名（或别名）对应的标准情绪名，不在词表中原样返回"""
+        tables = self._tables
+        emotion_id = tables.ids.get(emotion)
+        return emotion if emotion_id is None else tables.names[emotion_id]
+
+    def cost(self, prev_emotion: Optional[str], current_emotion: Optional[str]) -> float:
+        """
+        情绪过渡代价
+
+        Args:
+            prev_emotion: 前一情绪
+            current_emotion: 后一情绪
+
+        Returns:
+            代价，不限制过渡时为0
+        """
+        tables = self._tables
+        prev_id = tables.ids.get(prev_emotion)
+        if prev_id is None or not tables.restricted[prev_id]:
+            return UNRESTRICTED_COST
+        current_id = tables.ids.get(current_emotion)
+        if current_id is None:
+            return tables.undefined_cost
+        return tables.costs[prev_id * len(tables.names) + current_id]
+
+    def is_valid(self, prev_emotion: Optional[str], current_emotion: Optional[str]) -> bool:
+        """
+        情绪过渡是否合理（代价不超过 strictness.max_valid_cost）
+
+        Args:
+            prev_emotion: 前一情绪
+            current_emotion: 后一情绪
+
+        Returns:
+            是否合理
+        """
+        tables = self._tables
+        prev_id = tables.ids.get(prev_emotion)
+        if prev_id is None or not tables.restricted[prev_id]:
+            return True
+        current_id = tables.ids.get(current_emotion)
+        if current_id is None:
+            return tables.undefined_cost <= tables.max_valid_cost
+        return bool(tables.valid[prev_id * len(tables.names) + current_id])
+
+    def is_valid_id(self, prev_id: int, current_id: int) -> bool:
+        """按情绪ID判断过渡是否合理"""
+        tables = self._tables
+        return bool(tables.valid[prev_id * len(tables.names) + current_id])
+
+
+def get_emotion_transition_matrix(config_path: Optional[str] = None) -> EmotionTransitionMatrix:
+    """
+    获取进程内共享的情绪过渡矩阵（首次调用时加载配置）
+
+    Args:
+        config_path: 配置文件路径，如果为None则使用默认配置
+
+    Returns:
+        共享的EmotionTransitionMatrix实例
+    """
+    global _shared_matrix
+    path = Path(config_path) if config_path else DEFAULT_CONFIG_PATH
+    with _shared_lock:
+        if _shared_matrix is None or _shared_matrix.config_path != path:
+            _shared_matrix = EmotionTransitionMatrix(config_path=str(path))
+        return _shared_matrix
@@ -76,7 +76,7 @@ class ResultStorage:
             
             # 添加时间戳信息
             if add_timestamp:
-                save_data["metadata"] = save_data.get("metadata", {})
+                save_data["metadata"] = dict(save_data.get("metadata", {}))
                 save_data["metadata"]["saved_at"] = datetime.now().isoformat()
                 save_data["metadata"]["uuid"] = uuid
             
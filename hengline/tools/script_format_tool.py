@@ -0,0 +1,82 @@
+"""
+@FileName: script_format_tool.py
+@Description: 剧本格式识别工具，在解析前根据场景标题密度、中文字符占比、冒号对话占比判断剧本格式，
+              使每个剧本只需走一次对应的解析器
+@Author: HengLine
+@Time: 2025/11
+"""
+import re
+from typing import Any, Dict, Iterable, Union
+
+from hengline.tools.script_parser_tool import ScriptParser
+
+# 剧本格式
+FORMAT_AUTO = "auto"
+FORMAT_SCREENPLAY = "screenplay"  # 标准剧本格式（INT./EXT. 场景标题），交给ScriptParser
+FORMAT_CHINESE = "chinese"  # 中文自然语言剧本，交给规则解析器（正则 + jieba）
+SUPPORTED_FORMATS = (FORMAT_AUTO, FORMAT_SCREENPLAY, FORMAT_CHINESE)
+
+# 中文字符占比超过该值时视为中文为主的剧本
+CJK_DOMINANT_RATIO = 0.5
+# 中文为主的剧本中，场景标题行占比低于该值时视为偶然匹配（如正文以"INT"开头）
+MIN_HEADING_DENSITY = 0.02
+
+CJK_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+WHITESPACE_PATTERN = re.compile(r'\s')
+# 中文剧本常见的"角色：台词"形式
+COLON_DIALOGUE_PATTERN = re.compile(r'^[^\s：:]{1,20}[：:]\s*\S')
+
+
+def classify_script_format(script: Union[str, Iterable[str]], max_lines: int = 0) -> Dict[str, Any]:
+    """
+    识别剧本格式
+
+    Args:
+        script: 剧本文本或文本行的可迭代对象
+        max_lines: 最多统计的非空行数，0表示统计全部（流式解析时只需预读开头若干行）
+
+    Returns:
+        识别结果，包含 format（screenplay / chinese）以及
+        heading_density、cjk_ratio、dialogue_ratio 三个特征值
+    """
+    if isinstance(script, str):
+        script = script.split('\n')
+
+    content_lines = 0
+    heading_lines = 0
+    dialogue_lines = 0
+    cjk_chars = 0
+    total_chars = 0
+    for line in script:
+        stripped = line.strip()
+        if not stripped:
+            continue
+        content_lines += 1
+        if ScriptParser.SCENE_HEADING_PATTERN.match(stripped):
+            heading_lines += 1
+        elif COLON_DIALOGUE_PATTERN.match(stripped):
+            dialogue_lines += 1
+        cjk_chars += len(CJK_PATTERN.findall(stripped))
+        total_chars += len(stripped) - len(WHITESPACE_PATTERN.findall(stripped))
+        if max_lines and content_lines >= max_lines:
+            break
+
+    heading_density = heading_lines / content_lines if content_lines else 0.0
+    cjk_ratio = cjk_chars / total_chars if total_chars else 0.0
+    dialogue_ratio = dialogue_lines / content_lines if content_lines else 0.0
+
+    # 没有场景标题时ScriptParser识别不出场景；中文为主、标题稀疏且以冒号对话为主时，标题多半是偶然匹配
+    if heading_lines == 0:
+        script_format = FORMAT_CHINESE
+    elif cjk_ratio >= CJK_DOMINANT_RATIO and heading_density < MIN_HEADING_DENSITY \
+            and dialogue_ratio > heading_density:
+        script_format = FORMAT_CHINESE
+    else:
+        script_format = FORMAT_SCREENPLAY
+
+    return {
+        "format": script_format,
+        "heading_density": round(heading_density, 4),
+        "cjk_ratio": round(cjk_ratio, 4),
+        "dialogue_ratio": round(dialogue_ratio, 4)
+    }
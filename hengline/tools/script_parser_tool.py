@@ -5,9 +5,13 @@
 提供自定义剧本格式的解析功能，支持场景、角色、对话、动作等元素的提取
 """
 
+import io
+import mmap
+import os
 import re
+from collections import deque
 from dataclasses import dataclass, asdict
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Iterable, Iterator
 
 from llama_index.core.schema import Document
 
@@ -63,6 +67,82 @@ class Scene:
             self.characters = []
 
 
+class _LineReader:
+    """
+    带前瞻缓冲的行读取器
+    跳过开头的空白行，并按strip后的文本重新编号，与一次性split解析的行号保持一致
+    """
+
+    def __init__(self, lines: Iterable[str]):
+        self._source = iter(lines)
+        self._buffer = deque()
+        self._line_num = 0
+        self._started = False
+        self.last_content_line = 0  # 最后一个非空行的行号
+
+    def _fill(self, count: int) -> bool:
+        """向缓冲区读入行，直到缓冲区至少有count行；源数据耗尽时返回False"""
+        while len(self._buffer) < count:
+            try:
+                line = next(self._source)
+            except StopIteration:
+                return False
+            if not self._started:
+                if not line.strip():
+                    continue
+                self._started = True
+            self._buffer.append(line)
+        return True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Tuple[int, str]:
+        if not self._fill(1):
+            raise StopIteration
+        line = self._buffer.popleft()
+        self._line_num += 1
+        if line.strip():
+            self.last_content_line = self._line_num
+        return self._line_num, line
+
+    def peek(self, offset: int = 0) -> Optional[str]:
+        """查看当前行之后第offset+1行，不消费"""
+        if not self._fill(offset + 1):
+            return None
+        return self._buffer[offset]
+
+    def has_content_ahead(self) -> bool:
+        """后续是否还有非空行（等价于strip后的文本中当前行不是最后一行）"""
+        offset = 0
+        while True:
+            line = self.peek(offset)
+            if line is None:
+                return False
+            if line.strip():
+                return True
+            offset += 1
+
+
+def iter_mmap_lines(file_path: str) -> Iterator[str]:
+    """
+    通过mmap逐行读取UTF-8文本文件，避免一次性读入整个文件
+    
+    Args:
+        file_path: 文件路径
+        
+    Returns:
+        文本行生成器
+    """
+    with open(file_path, 'rb') as f:
+        # 空文件无法映射
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for raw_line in iter(mm.readline, b''):
+                yield raw_line.decode('utf-8')
+
+
 class ScriptParser:
     """
     自定义剧本语法解析器
@@ -73,6 +153,7 @@ class ScriptParser:
     SCENE_HEADING_PATTERN = re.compile(r'^(INT|EXT|INT\.|EXT\.|I/E)\.?\s+(.+)$', re.IGNORECASE)
     CHARACTER_PATTERN = re.compile(r'^[A-Z0-9\s\-]+(?::\s*[A-Z0-9\s\-]+)?$')
     TRANSITION_PATTERN = re.compile(r'^(CUT TO:|DISSOLVE TO:|FADE OUT:|FADE IN:|SMASH CUT TO:)$', re.IGNORECASE)
+    TIME_OF_DAY_PATTERN = re.compile(r'(?:\s|\()(DAY|NIGHT|DUSK|DAWN|MORNING|AFTERNOON|EVENING)(?:\)|\s|$)', re.IGNORECASE)
 
     def __init__(self, custom_patterns: Optional[Dict[str, re.Pattern]] = None):
         """
@@ -105,214 +186,263 @@ class ScriptParser:
             self.elements = []
 
             lines = script_text.strip().split('\n')
-            current_scene = None
-            current_element = None
-            scene_number = 0
+            for scene in self._iter_parse(lines, keep_elements=True):
+                self.scenes.append(scene)
+
+            debug(f"剧本解析完成: {len(self.scenes)}个场景, {len(self.characters)}个角色, {len(self.elements)}个元素")
+
+            return {
+                "scenes": [asdict(scene) for scene in self.scenes],
+                "characters": {name: asdict(char) for name, char in self.characters.items()},
+                "elements": [asdict(element) for element in self.elements],
+                "total_lines": len(lines),
+                "stats": {
+                    "scene_count": len(self.scenes),
+                    "character_count": len(self.characters),
+                    "element_count": len(self.elements)
+                }
+            }
+
+        except Exception as e:
+            error(f"剧本解析失败: {str(e)}")
+            raise
+
+    def iter_scenes(self, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """
+        流式解析剧本，每个场景结束后立即产出
+        仅保留当前场景和角色表，内存占用与单个场景成正比，适用于整季长剧本
+        
+        Args:
+            lines: 剧本文本行的可迭代对象（文件对象、生成器或字符串）
+            
+        Returns:
+            场景字典的生成器，格式与parse结果中的scenes一致
+        """
+        if isinstance(lines, str):
+            lines = io.StringIO(lines)
+
+        # 重置解析状态（流式模式下不保留场景和元素列表）
+        self.scenes = []
+        self.characters = {}
+        self.elements = []
+
+        scene_count = 0
+        for scene in self._iter_parse(lines, keep_elements=False):
+            scene_count += 1
+            yield asdict(scene)
+
+        debug(f"流式解析完成: {scene_count}个场景, {len(self.characters)}个角色")
+
+    def iter_file_scenes(self, file_path: str) -> Iterator[Dict[str, Any]]:
+        """
+        以内存映射方式流式解析剧本文件
+        
+        Args:
+            file_path: 文件路径
+            
+        Returns:
+            场景字典的生成器
+        """
+        debug(f"开始流式解析剧本文件: {file_path}")
+        yield from self.iter_scenes(iter_mmap_lines(file_path))
+
+    def _iter_parse(self, lines: Iterable[str], keep_elements: bool = True) -> Iterator[Scene]:
+        """
+        逐行解析剧本的核心状态机，场景结束时产出Scene对象
+        
+        Args:
+            lines: 剧本文本行
+            keep_elements: 是否在self.elements中保留全部元素（流式模式下关闭）
+            
+        Returns:
+            Scene对象的生成器
+        """
+        reader = _LineReader(lines)
+        current_scene = None
+        current_element = None
+        scene_number = 0
 
-            # 逐行解析
-            for line_num, line in enumerate(lines, 1):
-                line = line.strip()
+        def close_element(element: SceneElement):
+            if current_scene:
+                current_scene.elements.append(element)
+            if keep_elements:
+                self.elements.append(element)
 
-                # 跳过空行
-                if not line:
-                    # 如果有正在进行的元素，结束它
+        def finish_scene(scene: Scene) -> Scene:
+            # 更新角色的场景信息
+            for character_name in scene.characters:
+                if character_name in self.characters and scene.heading not in self.characters[character_name].scenes:
+                    self.characters[character_name].scenes.append(scene.heading)
+            return scene
+
+        # 逐行解析
+        for line_num, line in reader:
+            line = line.strip()
+
+            # 跳过空行
+            if not line:
+                # 如果有正在进行的元素，结束它
+                if current_element:
+                    current_element.end_line = line_num - 1
+                    close_element(current_element)
+                    current_element = None
+                continue
+
+            # 检查是否是场景标题
+            scene_heading_match = self.SCENE_HEADING_PATTERN.match(line)
+            if scene_heading_match:
+                # 结束前一个场景
+                if current_scene:
+                    current_scene.end_line = line_num - 1
                     if current_element:
                         current_element.end_line = line_num - 1
-                        if current_scene:
-                            current_scene.elements.append(current_element)
-                        self.elements.append(current_element)
+                        close_element(current_element)
                         current_element = None
-                    continue
+                    yield finish_scene(current_scene)
+
+                # 开始新场景
+                scene_number += 1
+                heading_text = line
+
+                # 解析场景信息
+                location_type = scene_heading_match.group(1)
+                location_info = scene_heading_match.group(2)
+
+                # 尝试提取时间信息
+                time_of_day = None
+                time_match = self.TIME_OF_DAY_PATTERN.search(location_info)
+                if time_match:
+                    time_of_day = time_match.group(1).upper()
+
+                current_scene = Scene(
+                    heading=heading_text,
+                    number=scene_number,
+                    location=f"{location_type}. {location_info}",
+                    time_of_day=time_of_day,
+                    start_line=line_num
+                )
 
-                # 检查是否是场景标题
-                scene_heading_match = self.SCENE_HEADING_PATTERN.match(line)
-                if scene_heading_match:
-                    # 结束前一个场景
-                    if current_scene:
-                        current_scene.end_line = line_num - 1
-                        if current_element:
-                            current_element.end_line = line_num - 1
-                            current_scene.elements.append(current_element)
-                            self.elements.append(current_element)
-                            current_element = None
-
-                    # 开始新场景
-                    scene_number += 1
-                    heading_text = line
-
-                    # 解析场景信息
-                    location_type = scene_heading_match.group(1)
-                    location_info = scene_heading_match.group(2)
-
-                    # 尝试提取时间信息
-                    time_of_day = None
-                    time_match = re.search(r'(?:\s|\()(DAY|NIGHT|DUSK|DAWN|MORNING|AFTERNOON|EVENING)(?:\)|\s|$)', location_info, re.IGNORECASE)
-                    if time_match:
-                        time_of_day = time_match.group(1).upper()
-
-                    current_scene = Scene(
-                        heading=heading_text,
-                        number=scene_number,
-                        location=f"{location_type}. {location_info}",
-                        time_of_day=time_of_day,
-                        start_line=line_num
-                    )
-                    self.scenes.append(current_scene)
+                debug(f"识别到场景: {heading_text} (行号: {line_num})")
+                continue
 
-                    debug(f"识别到场景: {heading_text} (行号: {line_num})")
-                    continue
+            # 检查是否是角色对话
+            if self._is_character_line(line) and reader.has_content_ahead():
+                # 检查下一行是否是对话内容或括号说明
+                next_line = (reader.peek(0) or "").strip()
 
-                # 检查是否是角色对话
-                if self._is_character_line(line) and line_num < len(lines):
-                    # 检查下一行是否是对话内容或括号说明
-                    next_line = lines[line_num].strip() if line_num < len(lines) else ""
-
-                    # 如果下一行以括号开头，这可能是对话前的说明
-                    if next_line.startswith('(') and ')' in next_line:
-                        # 这是角色名称和括号说明
-                        character_name = line.strip()
-                        self._add_character(character_name, line_num)
-                        if current_scene and character_name not in current_scene.characters:
-                            current_scene.characters.append(character_name)
-
-                        # 创建括号说明元素
-                        current_element = SceneElement(
-                            type="parenthetical",
-                            content=next_line,
-                            start_line=line_num + 1,
-                            end_line=line_num + 1,
-                            metadata={"character": character_name}
-                        )
-                        continue
-
-                    # 这可能是角色名称，接下来是对话
+                # 如果下一行以括号开头，这可能是对话前的说明
+                if next_line.startswith('(') and ')' in next_line:
+                    # 这是角色名称和括号说明
                     character_name = line.strip()
                     self._add_character(character_name, line_num)
                     if current_scene and character_name not in current_scene.characters:
                         current_scene.characters.append(character_name)
 
-                    # 检查下一行是否是对话
-                    dialogue_lines = []
-                    dialogue_start = line_num + 1
-                    dialogue_end = line_num + 1
-
-                    while dialogue_end <= len(lines):
-                        if dialogue_end > len(lines):
-                            break
-                        next_content_line = lines[dialogue_end - 1].strip()
-                        # 如果下一行是空行、场景标题、角色名称或转场，结束对话
-                        if not next_content_line or \
-                                self.SCENE_HEADING_PATTERN.match(next_content_line) or \
-                                self._is_character_line(next_content_line) or \
-                                self.TRANSITION_PATTERN.match(next_content_line):
-                            break
-                        dialogue_lines.append(next_content_line)
-                        dialogue_end += 1
-
-                    if dialogue_lines:
-                        # 创建对话元素
-                        dialogue_content = '\n'.join(dialogue_lines)
-                        current_element = SceneElement(
-                            type="dialogue",
-                            content=dialogue_content,
-                            start_line=dialogue_start,
-                            end_line=dialogue_end - 1,
-                            metadata={"character": character_name}
-                        )
-
-                        # 更新角色对话计数
-                        if character_name in self.characters:
-                            self.characters[character_name].dialogue_count += 1
-
-                        # 跳过已处理的对话行
-                        line_num = dialogue_end - 1
-                    continue
-
-                # 检查是否是转场
-                if self.TRANSITION_PATTERN.match(line):
-                    if current_element:
-                        current_element.end_line = line_num - 1
-                        if current_scene:
-                            current_scene.elements.append(current_element)
-                        self.elements.append(current_element)
-
-                    current_element = SceneElement(
-                        type="transition",
-                        content=line,
-                        start_line=line_num,
-                        end_line=line_num
-                    )
-                    continue
-
-                # 检查是否是括号说明
-                if line.startswith('(') and ')' in line:
-                    if current_element:
-                        current_element.end_line = line_num - 1
-                        if current_scene:
-                            current_scene.elements.append(current_element)
-                        self.elements.append(current_element)
-
+                    # 创建括号说明元素
                     current_element = SceneElement(
                         type="parenthetical",
-                        content=line,
-                        start_line=line_num,
-                        end_line=line_num
+                        content=next_line,
+                        start_line=line_num + 1,
+                        end_line=line_num + 1,
+                        metadata={"character": character_name}
                     )
                     continue
 
-                # 否则视为动作描述
-                if not current_element or current_element.type != "action":
-                    if current_element:
-                        current_element.end_line = line_num - 1
-                        if current_scene:
-                            current_scene.elements.append(current_element)
-                        self.elements.append(current_element)
-
+                # 这可能是角色名称，接下来是对话
+                character_name = line.strip()
+                self._add_character(character_name, line_num)
+                if current_scene and character_name not in current_scene.characters:
+                    current_scene.characters.append(character_name)
+
+                # 检查下一行是否是对话（向前查看，不消费行）
+                dialogue_lines = []
+                dialogue_start = line_num + 1
+                dialogue_end = line_num + 1
+
+                while True:
+                    next_content_line = reader.peek(dialogue_end - line_num - 1)
+                    if next_content_line is None:
+                        break
+                    next_content_line = next_content_line.strip()
+                    # 如果下一行是空行、场景标题、角色名称或转场，结束对话
+                    if not next_content_line or \
+                            self.SCENE_HEADING_PATTERN.match(next_content_line) or \
+                            self._is_character_line(next_content_line) or \
+                            self.TRANSITION_PATTERN.match(next_content_line):
+                        break
+                    dialogue_lines.append(next_content_line)
+                    dialogue_end += 1
+
+                if dialogue_lines:
+                    # 创建对话元素
+                    dialogue_content = '\n'.join(dialogue_lines)
                     current_element = SceneElement(
-                        type="action",
-                        content=line,
-                        start_line=line_num,
-                        end_line=line_num
+                        type="dialogue",
+                        content=dialogue_content,
+                        start_line=dialogue_start,
+                        end_line=dialogue_end - 1,
+                        metadata={"character": character_name}
                     )
-                else:
-                    # 继续上一个动作描述
-                    current_element.content += '\n' + line
-                    current_element.end_line = line_num
-
-            # 处理最后一个元素
-            if current_element:
-                current_element.end_line = len(lines)
-                if current_scene:
-                    current_scene.elements.append(current_element)
-                self.elements.append(current_element)
-
-            # 处理最后一个场景
-            if current_scene:
-                current_scene.end_line = len(lines)
-
-            # 更新角色的场景信息
-            for scene in self.scenes:
-                for character_name in scene.characters:
-                    if character_name in self.characters and scene.heading not in self.characters[character_name].scenes:
-                        self.characters[character_name].scenes.append(scene.heading)
 
-            debug(f"剧本解析完成: {len(self.scenes)}个场景, {len(self.characters)}个角色, {len(self.elements)}个元素")
-
-            return {
-                "scenes": [asdict(scene) for scene in self.scenes],
-                "characters": {name: asdict(char) for name, char in self.characters.items()},
-                "elements": [asdict(element) for element in self.elements],
-                "total_lines": len(lines),
-                "stats": {
-                    "scene_count": len(self.scenes),
-                    "character_count": len(self.characters),
-                    "element_count": len(self.elements)
-                }
-            }
-
-        except Exception as e:
-            error(f"剧本解析失败: {str(e)}")
-            raise
+                    # 更新角色对话计数
+                    if character_name in self.characters:
+                        self.characters[character_name].dialogue_count += 1
+                continue
+
+            # 检查是否是转场
+            if self.TRANSITION_PATTERN.match(line):
+                if current_element:
+                    current_element.end_line = line_num - 1
+                    close_element(current_element)
+
+                current_element = SceneElement(
+                    type="transition",
+                    content=line,
+                    start_line=line_num,
+                    end_line=line_num
+                )
+                continue
+
+            # 检查是否是括号说明
+            if line.startswith('(') and ')' in line:
+                if current_element:
+                    current_element.end_line = line_num - 1
+                    close_element(current_element)
+
+                current_element = SceneElement(
+                    type="parenthetical",
+                    content=line,
+                    start_line=line_num,
+                    end_line=line_num
+                )
+                continue
+
+            # 否则视为动作描述
+            if not current_element or current_element.type != "action":
+                if current_element:
+                    current_element.end_line = line_num - 1
+                    close_element(current_element)
+
+                current_element = SceneElement(
+                    type="action",
+                    content=line,
+                    start_line=line_num,
+                    end_line=line_num
+                )
+            else:
+                # 继续上一个动作描述
+                current_element.content += '\n' + line
+                current_element.end_line = line_num
+
+        # 处理最后一个元素
+        if current_element:
+            current_element.end_line = reader.last_content_line
+            close_element(current_element)
+
+        # 处理最后一个场景
+        if current_scene:
+            current_scene.end_line = reader.last_content_line
+            yield finish_scene(current_scene)
 
     def _is_character_line(self, line: str) -> bool:
         """